@@ -23,6 +23,8 @@ added..
 import warnings
 warnings.filterwarnings('ignore', 'Not using MPI as mpi4py not found')
 from os import remove
+from os.path import join
+from cPickle import dump, load, HIGHEST_PROTOCOL
 from numpy import median
 
 import brokit
@@ -33,12 +35,13 @@ import brokit.mafft
 
 from cogent import DNA as DNA_cogent
 from cogent.parse.rfam import MinimalRfamParser, ChangedSequence
+from cogent.util.misc import safe_md5
 from skbio.app.util import ApplicationNotFoundError
 from skbio.core.exception import RecordError
 from skbio.parse.sequences import parse_fasta
 
 from qiime.util import (FunctionWithParams,
-                        get_qiime_temp_dir)
+                        get_qiime_temp_dir, get_reference_db_cache)
 
 from skbio.core.alignment import SequenceCollection, Alignment
 from skbio.core.sequence import DNASequence
@@ -47,7 +50,8 @@ from skbio.parse.sequences import parse_fasta
 # Load PyNAST if it's available. If it's not, skip it if not but set up
 # to raise errors if the user tries to use it.
 try:
-    from pynast.util import pynast_seqs, pairwise_alignment_methods
+    from pynast.util import (pynast_seqs, ipynast_seqs,
+                             pairwise_alignment_methods)
     from pynast.logger import NastLogger
 
 except ImportError:
@@ -55,7 +59,7 @@ except ImportError:
         raise ApplicationNotFoundError("PyNAST cannot be found.\nIs PyNAST installed? Is it in your $PYTHONPATH?" +
                                        "\nYou can obtain PyNAST from http://qiime.org/pynast/.")
     # set functions which cannot be imported to raise_pynast_not_found_error
-    pynast_seqs = NastLogger = raise_pynast_not_found_error
+    pynast_seqs = ipynast_seqs = NastLogger = raise_pynast_not_found_error
     pairwise_alignment_methods = {}
 
 
@@ -246,13 +250,8 @@ class PyNastAligner(Aligner):
         candidate_sequences = parse_fasta(seq_file)
 
         # load template sequences
-        template_alignment = []
-        template_alignment_fp = self.Params['template_filepath']
-        for seq_id, seq in parse_fasta(open(template_alignment_fp)):
-            # replace '.' characters with '-' characters
-            template_alignment.append((seq_id, seq.replace('.', '-').upper()))
-        template_alignment = Alignment.from_fasta_records(
-                    template_alignment, DNASequence, validate=True)
+        template_alignment = load_pynast_template(
+            self.Params['template_filepath'])
 
         # initialize_logger
         logger = NastLogger(log_path)
@@ -261,39 +260,89 @@ class PyNastAligner(Aligner):
         pairwise_alignment_f = pairwise_alignment_methods[
             self.Params['pairwise_alignment_method']]
 
-        pynast_aligned, pynast_failed = pynast_seqs(
-            candidate_sequences,
-            template_alignment,
-            min_pct=self.Params['min_pct'],
-            min_len=self.Params['min_len'],
-            align_unaligned_seqs_f=pairwise_alignment_f,
-            logger=logger,
-            temp_dir=get_qiime_temp_dir())
+        # each sequence is written as soon as it's aligned (or fails), so
+        # the results are only held in memory if they're to be returned
+        if result_path is not None:
+            result_file = open(result_path, 'w')
+        else:
+            pynast_aligned = []
+        if failure_path is not None:
+            fail_file = open(failure_path, 'w')
 
+        for seq, status in ipynast_seqs(
+                candidate_sequences,
+                template_alignment,
+                min_pct=self.Params['min_pct'],
+                min_len=self.Params['min_len'],
+                align_unaligned_seqs_f=pairwise_alignment_f,
+                logger=logger,
+                temp_dir=get_qiime_temp_dir()):
+            if status == 0:
+                if result_path is not None:
+                    result_file.write('>%s\n%s\n' % (seq.Name, str(seq)))
+                else:
+                    pynast_aligned.append(
+                        DNASequence(str(seq), identifier=seq.Name))
+            elif failure_path is not None:
+                fail_file.write('>%s\n%s\n' % (seq.Name, str(seq)))
+
+        seq_file.close()
         logger.record(str(self))
 
-        for i, seq in enumerate(pynast_failed):
-            skb_seq = DNASequence(str(seq), identifier=seq.Name)
-            pynast_failed[i] = skb_seq
-        pynast_failed = SequenceCollection(pynast_failed)
-
-        for i, seq in enumerate(pynast_aligned):
-            skb_seq = DNASequence(str(seq), identifier=seq.Name)
-            pynast_aligned[i] = skb_seq
-        pynast_aligned = Alignment(pynast_aligned)
-
         if failure_path is not None:
-            fail_file = open(failure_path, 'w')
-            fail_file.write(pynast_failed.to_fasta())
             fail_file.close()
 
         if result_path is not None:
-            result_file = open(result_path, 'w')
-            result_file.write(pynast_aligned.to_fasta())
             result_file.close()
             return None
         else:
-            return pynast_aligned
+            return Alignment(pynast_aligned)
+
+
+def _parse_pynast_template(template_fp):
+    """Returns the template alignment in template_fp as a list of records
+
+    Each record is (seq_id, seq), with '.' characters in seq replaced by
+    '-' characters and seq in upper case.
+    """
+    template_alignment = []
+    for seq_id, seq in parse_fasta(open(template_fp, 'U')):
+        # replace '.' characters with '-' characters
+        template_alignment.append((seq_id, seq.replace('.', '-').upper()))
+    return template_alignment
+
+
+def load_pynast_template(template_fp, qiime_config=None):
+    """Returns the PyNAST template alignment in template_fp
+
+    If reference_db_cache_dir is set in qiime_config (by default, the loaded
+    qiime_config) the parsed and validated template is kept there in binary
+    form, keyed on the md5 of template_fp, so each template is only parsed
+    and validated once rather than on every call (and by every parallel
+    job). Raises a SequenceCollectionError if the template isn't a valid
+    DNA alignment.
+    """
+    cache = get_reference_db_cache(qiime_config)
+    if cache is None:
+        return Alignment.from_fasta_records(
+            _parse_pynast_template(template_fp), DNASequence, validate=True)
+
+    template_f = open(template_fp, 'rb')
+    key = safe_md5(template_f).hexdigest() + '_pynast_template'
+    template_f.close()
+
+    def build_f(output_dir):
+        template_alignment = _parse_pynast_template(template_fp)
+        Alignment.from_fasta_records(template_alignment, DNASequence,
+                                     validate=True)
+        records_f = open(join(output_dir, 'template.pkl'), 'wb')
+        dump(template_alignment, records_f, HIGHEST_PROTOCOL)
+        records_f.close()
+        return 'template.pkl'
+    records_f = open(cache.getDb(key, build_f), 'rb')
+    template_alignment = load(records_f)
+    records_f.close()
+    return Alignment.from_fasta_records(template_alignment, DNASequence)
 
 
 def compute_min_alignment_length(seqs_f, fraction=0.75):
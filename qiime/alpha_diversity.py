@@ -34,17 +34,28 @@ tax1    [or here]
 """
 
 # note: might want to use make_safe_f to strip out additional params passed on.
-from numpy import array, zeros
+from numpy import (array, zeros, inf, arange, bincount, column_stack,
+                   concatenate, diff, e, errstate, exp, log, maximum, sqrt,
+                   where)
 import os.path
 from optparse import OptionParser
+from scipy.sparse import csr_matrix
+from scipy.special import gammaln
+from skbio.math.subsample import subsample
+from cogent.core.tree import PhyloNode
 
 import warnings
 warnings.filterwarnings('ignore', 'Not using MPI as mpi4py not found')
 import qiime.pycogent_backports.alpha_diversity as alph  # relying on backports
 
 from qiime.parse import make_envs_dict
-from qiime.util import FunctionWithParams, make_safe_f
+from qiime.util import FunctionWithParams, TreeMissingError, make_safe_f
 from qiime.format import format_matrix
+from qiime.filter import filter_otus_from_otu_table
+from qiime.rarefaction import iter_rare_tables
+from qiime.collate_alpha import make_output_row, write_output_file
+from qiime.unifrac import (FlatTree, faith_pd, get_flat_tree,
+                           get_flat_tree_from_fp)
 from sys import exit, stderr
 import sys
 import os.path
@@ -97,7 +108,7 @@ class AlphaDiversityCalc(FunctionWithParams):
         self.Params = params or {}
 
     def getResult(self, data_path, taxon_names=None, sample_names=None,
-                  tree_path=None):
+                  tree_path=None, sample_counts=None):
         """Returns per-sample diversity from incidence matrix and optional tree.
 
         Parameters:
@@ -111,7 +122,12 @@ class AlphaDiversityCalc(FunctionWithParams):
         taxon_names: list of names of taxa, same order as in row (required for
         phylogenetic methods)
 
-        tree: cogent.tree.PhyloNode object, or file path
+        tree: cogent.tree.PhyloNode object, or file path (for metrics in
+        tree_metrics, also a qiime.unifrac.FlatTree or flattened tree file)
+
+        sample_counts: the table's counts as returned by get_sample_counts,
+        if already computed (only used for metrics in matrix_metrics and
+        tree_metrics)
 
         output:
         1d/2d array containing diversity of each sample, preserving order from
@@ -122,7 +138,24 @@ class AlphaDiversityCalc(FunctionWithParams):
         """
         otu_table = self.getBiomData(data_path)
         data = otu_table.iterSampleData()
-        if self.IsPhylogenetic:
+        if self.Metric in tree_metrics:
+            flat_tree = self.getFlatTree(tree_path)
+            if sample_counts is None:
+                sample_counts = get_sample_counts(otu_table)
+            result = tree_metrics[self.Metric](sample_counts,
+                                               otu_table.ObservationIds,
+                                               flat_tree,
+                                               otu_table.SampleIds,
+                                               **self.Params)
+            if sample_names is None:
+                return result
+            sample_indices = dict([(sample_id, i) for i, sample_id in
+                                   enumerate(otu_table.SampleIds)])
+            return array([result[sample_indices[sample]]
+                          if sample in sample_indices else 0.0
+                          for sample in sample_names])
+
+        elif self.IsPhylogenetic:
             tree = self.getTree(tree_path)
             # build envs dict: envs = {otu_id:{sample_id:count}}
             envs = {}
@@ -143,6 +176,29 @@ class AlphaDiversityCalc(FunctionWithParams):
                     pass  # already is zero
             return array(ordered_res)
 
+        elif self.Metric in matrix_metrics:
+            if sample_counts is None:
+                sample_counts = get_sample_counts(otu_table)
+            # samples with no counts are left to the metric itself, which
+            # returns e.g. nan rather than 0 for some of them (or raises,
+            # depending on numpy's error settings), so the matrix form is
+            # only applied to the samples with counts
+            has_counts = diff(sample_counts.indptr) > 0
+            if has_counts.all():
+                return array(matrix_metrics[self.Metric](sample_counts,
+                                                         **self.Params))
+            result = [None] * sample_counts.shape[0]
+            nonempty = has_counts.nonzero()[0]
+            if len(nonempty):
+                nonempty_result = matrix_metrics[self.Metric](
+                    sample_counts[nonempty], **self.Params)
+                for i, value in zip(nonempty, nonempty_result):
+                    result[i] = value
+            no_counts = zeros(sample_counts.shape[1])
+            for i in (~has_counts).nonzero()[0]:
+                result[i] = self.Metric(no_counts, **self.Params)
+            return array(result)
+
         else:
             def metric(row):
                 return self.Metric(row, **self.Params)
@@ -150,6 +206,28 @@ class AlphaDiversityCalc(FunctionWithParams):
 
             return array(result)
 
+    def getFlatTree(self, tree_source):
+        """Returns the qiime.unifrac.FlatTree of a putative tree source
+
+        tree_source can be a FlatTree, a PhyloNode, or the path to a newick
+        tree or to a tree written by qiime.unifrac.write_flat_tree. The last
+        tree file used is cached, so it is only read once for many tables.
+        """
+        if isinstance(tree_source, FlatTree):
+            return tree_source
+        elif isinstance(tree_source, PhyloNode):
+            return get_flat_tree(tree_source)
+        elif tree_source:
+            try:
+                return get_flat_tree_from_fp(tree_source)
+            except (TypeError, IOError, OSError):
+                raise TreeMissingError(
+                    "Couldn't read tree file at path: %s" %
+                    tree_source)
+        else:
+            raise TreeMissingError(str(self.Name) +
+                                   " is a phylogenetic metric, but no tree was supplied.")
+
     def formatResult(self, result):
         """Generate formatted vector, here just tab-delimited text.
         WARNING: does this work on metrics with multiple return values?
@@ -191,19 +269,26 @@ class AlphaDiversityCalcs(FunctionWithParams):
             # add either calc's multiple return value names, or fn name
             calc_names.extend(getattr(calc.Metric, 'return_names',
                                       (calc.Metric.__name__,)))
-        needs_tree = max([c.IsPhylogenetic for c in self.Calcs])
-        if needs_tree:
+        if [c for c in self.Calcs
+                if c.IsPhylogenetic and c.Metric not in tree_metrics]:
             tree = self.getTree(tree_path)
         else:
-            tree = None
+            # tree_metrics get their (cached) FlatTree from tree_path
+            tree = tree_path
+        if [c for c in self.Calcs
+                if c.Metric in matrix_metrics or c.Metric in tree_metrics]:
+            sample_counts = get_sample_counts(otu_table)
+        else:
+            sample_counts = None
         # calculations
         res = []
         for c in self.Calcs:
             # add either calc's multiple return value names, or fn name
-            metric_res = c(data_path=data_path,
+            metric_res = c(data_path=otu_table,
                            taxon_names=otu_table.ObservationIds,
                            tree_path=tree,
-                           sample_names=otu_table.SampleIds)
+                           sample_names=otu_table.SampleIds,
+                           sample_counts=sample_counts)
             if len(metric_res.shape) == 1:
                 res.append(metric_res)
             elif len(metric_res.shape) == 2:
@@ -294,6 +379,220 @@ cup_metrics = [
 # starr, not yet needs tests]
 
 
+def get_sample_counts(otu_table):
+    """Returns the counts of otu_table as a sparse samples x otus matrix
+
+    The matrix is a scipy.sparse.csr_matrix, so each sample's row holds only
+    its nonzero counts, in otu order. This is the input of matrix_metrics.
+    """
+    data = []
+    indices = []
+    indptr = [0]
+    for values in otu_table.iterSampleData():
+        nonzero = values.nonzero()[0]
+        indices.append(nonzero)
+        data.append(values[nonzero])
+        indptr.append(indptr[-1] + len(nonzero))
+    shape = (len(otu_table.SampleIds), len(otu_table.ObservationIds))
+    if indptr[-1] == 0:
+        return csr_matrix(shape)
+    return csr_matrix((concatenate(data), concatenate(indices), indptr),
+                      shape=shape)
+
+# Matrix forms of the metrics above: each takes the sparse matrix from
+# get_sample_counts and returns the metric of every sample (row) at once,
+# calculated as the metric calculates it from a sample's count vector.
+# Samples with no counts are not passed to these (see AlphaDiversityCalc).
+
+
+def _sample_index(counts):
+    """Returns the sample (row) of each of the stored counts"""
+    return arange(counts.shape[0]).repeat(diff(counts.indptr))
+
+
+def _sample_sums(counts, values):
+    """Returns the sum over each sample of values, one per stored count"""
+    return bincount(_sample_index(counts), weights=values,
+                    minlength=counts.shape[0])
+
+
+def _num_where(counts, mask):
+    """Returns the number of the stored counts in each sample where mask"""
+    return bincount(_sample_index(counts)[mask], minlength=counts.shape[0])
+
+
+def _sample_freqs(counts):
+    """Returns each stored count as a fraction of its sample's total"""
+    totals = _sample_sums(counts, counts.data)
+    return counts.data / totals[_sample_index(counts)]
+
+
+def matrix_observed_species(counts):
+    return diff(counts.indptr)
+
+
+def matrix_singles(counts):
+    return _num_where(counts, counts.data == 1)
+
+
+def matrix_doubles(counts):
+    return _num_where(counts, counts.data == 2)
+
+
+def matrix_osd(counts):
+    return column_stack([matrix_observed_species(counts),
+                         matrix_singles(counts),
+                         matrix_doubles(counts)])
+
+
+def matrix_margalef(counts):
+    return ((matrix_observed_species(counts) - 1) /
+            log(_sample_sums(counts, counts.data)))
+
+
+def matrix_menhinick(counts):
+    return (matrix_observed_species(counts) /
+            sqrt(_sample_sums(counts, counts.data)))
+
+
+def matrix_dominance(counts):
+    freqs = _sample_freqs(counts)
+    return _sample_sums(counts, freqs * freqs)
+
+
+def matrix_simpson(counts):
+    return 1 - matrix_dominance(counts)
+
+
+def matrix_simpson_reciprocal(counts):
+    return 1.0 / matrix_dominance(counts)
+
+
+def matrix_enspie(counts):
+    return 1. / matrix_dominance(counts)
+
+
+def matrix_simpson_e(counts):
+    return (1. / matrix_dominance(counts)) / matrix_observed_species(counts)
+
+
+def matrix_shannon(counts, base=2):
+    freqs = _sample_freqs(counts)
+    return -_sample_sums(counts, freqs * log(freqs)) / log(base)
+
+
+def matrix_equitability(counts, base=2):
+    return (matrix_shannon(counts, base) /
+            (log(matrix_observed_species(counts)) / log(base)))
+
+
+def matrix_heip_e(counts):
+    return (exp(matrix_shannon(counts, base=e) - 1) /
+            (matrix_observed_species(counts) - 1))
+
+
+def matrix_berger_parker_d(counts):
+    maxima = zeros(counts.shape[0])
+    has_counts = diff(counts.indptr) > 0
+    if has_counts.any():
+        maxima[has_counts] = maximum.reduceat(
+            counts.data, counts.indptr[:-1][has_counts])
+    return maxima / _sample_sums(counts, counts.data)
+
+
+def matrix_mcintosh_d(counts):
+    u = sqrt(_sample_sums(counts, counts.data * counts.data))
+    n = _sample_sums(counts, counts.data)
+    return (n - u) / (n - sqrt(n))
+
+
+def matrix_mcintosh_e(counts):
+    numerator = sqrt(_sample_sums(counts, counts.data * counts.data))
+    n = _sample_sums(counts, counts.data)
+    s = matrix_observed_species(counts)
+    denominator = sqrt((n - s + 1) ** 2 + s - 1)
+    return numerator / denominator
+
+
+def matrix_brillouin_d(counts):
+    n = _sample_sums(counts, counts.data)
+    return (gammaln(n + 1) -
+            _sample_sums(counts, gammaln(counts.data + 1))) / n
+
+
+def matrix_robbins(counts):
+    return matrix_singles(counts) / _sample_sums(counts, counts.data)
+
+
+def matrix_goods_coverage(counts):
+    return 1 - (matrix_singles(counts) / _sample_sums(counts, counts.data))
+
+
+def matrix_chao1(counts, bias_corrected=True):
+    o = matrix_observed_species(counts)
+    s = matrix_singles(counts)
+    d = matrix_doubles(counts)
+    result = o + s * (s - 1) / (2.0 * (d + 1))
+    if not bias_corrected:
+        uncorrected = (s > 0) & (d > 0)
+        with errstate(divide='ignore', invalid='ignore'):
+            result = where(uncorrected, o + s ** 2 / (d * 2.0), result)
+    return result
+
+
+def matrix_ACE(counts, rare_threshold=10):
+    data = counts.data
+    rare = data <= rare_threshold
+    # numbers of species with 1 to rare_threshold - 1 individuals, with one
+    # and with rare_threshold or fewer (the s_rare of ACE)
+    below_threshold = _num_where(counts, data < rare_threshold)
+    singletons = _num_where(counts, data == 1)
+    s_rare = _num_where(counts, rare)
+    s_abun = _num_where(counts, data > rare_threshold).astype(float)
+
+    if ((below_threshold > 0) & (singletons == below_threshold)).any():
+        raise ValueError("only rare species are singletons, ACE " +
+                         "metric is undefined. EstimateS suggests using bias corrected Chao1")
+
+    n_rare = _sample_sums(counts, where(rare, data, 0))
+    n_rare_gamma = _sample_sums(counts, where(rare, data * (data - 1), 0))
+    with errstate(divide='ignore', invalid='ignore'):
+        c_ace = 1 - singletons / n_rare
+        top = s_rare * n_rare_gamma
+        bottom = c_ace * n_rare * (n_rare - 1.0)
+        gamma_ace = maximum((top / bottom) - 1.0, 0)
+        result = s_abun + (s_rare / c_ace) + ((singletons / c_ace) * gamma_ace)
+    return where(below_threshold == 0, s_abun, result)
+
+matrix_metrics = {
+    alph.ACE: matrix_ACE,
+    alph.berger_parker_d: matrix_berger_parker_d,
+    alph.brillouin_d: matrix_brillouin_d,
+    alph.chao1: matrix_chao1,
+    alph.dominance: matrix_dominance,
+    alph.doubles: matrix_doubles,
+    alph.enspie: matrix_enspie,
+    alph.equitability: matrix_equitability,
+    alph.goods_coverage: matrix_goods_coverage,
+    alph.heip_e: matrix_heip_e,
+    alph.margalef: matrix_margalef,
+    alph.mcintosh_d: matrix_mcintosh_d,
+    alph.mcintosh_e: matrix_mcintosh_e,
+    alph.menhinick: matrix_menhinick,
+    alph.observed_species: matrix_observed_species,
+    alph.osd: matrix_osd,
+    alph.simpson_reciprocal: matrix_simpson_reciprocal,
+    alph.robbins: matrix_robbins,
+    alph.shannon: matrix_shannon,
+    alph.simpson: matrix_simpson,
+    alph.simpson_e: matrix_simpson_e,
+    alph.singles: matrix_singles}
+
+# phylogenetic metrics which are calculated from a qiime.unifrac.FlatTree for
+# all samples at once, with the same arguments as qiime.unifrac.faith_pd
+tree_metrics = {fast_unifrac.PD_whole_tree: faith_pd}
+
+
 def single_file_alpha(infilepath, metrics, outfilepath, tree_path):
     metrics_list = metrics
     try:
@@ -378,6 +677,88 @@ def multiple_file_alpha(input_path, output_path, metrics, tree_path=None):
                           output_fp, tree_path)
 
 
+def rarefaction_alpha(otu_table, depths, num_reps, metrics, output_dir,
+                      tree=None, small_included=False,
+                      empty_otus_removed=True, subsample_f=subsample):
+    """ computes and collates alpha diversity of rarefied otu tables
+
+    This fuses multiple_rarefactions.py, alpha_diversity.py and
+    collate_alpha.py: each rarefied otu table (see
+    qiime.rarefaction.iter_rare_tables) is made in memory, all of the metrics
+    are calculated on it immediately, and the collated results are written
+    to output_dir as one file per metric, exactly as collate_alpha.py writes
+    them from the files of the separate steps.
+
+    inputs:
+     otu_table -- a biom table, or path to one
+     depths -- rarefaction depths (seqs/sample)
+     num_reps -- number of rarefied tables at each depth
+     metrics (str, comma delimited if more than 1 metric; or list)
+     output_dir (str)
+     tree -- a PhyloNode or path to a newick tree, if needed by the metrics
+     small_included, empty_otus_removed, subsample_f -- as for
+      qiime.rarefaction.RarefactionMaker.rarefy_to_files
+    """
+    metrics_list = metrics
+    try:
+        metrics_list = metrics_list.split(',')
+    except AttributeError:
+        pass
+
+    calcs = []
+    for metric in metrics_list:
+        try:
+            metric_f = get_nonphylogenetic_metric(metric)
+            is_phylogenetic = False
+        except AttributeError:
+            try:
+                metric_f = get_phylogenetic_metric(metric)
+                is_phylogenetic = True
+            except AttributeError:
+                raise ValueError(
+                    "could not find metric.  %s.\n Known metrics are: %s\n"
+                    % (metric, ', '.join(list_known_metrics())))
+        calcs.append(AlphaDiversityCalc(metric_f, is_phylogenetic))
+    all_calcs = AlphaDiversityCalcs(calcs)
+    otu_table = all_calcs.getBiomData(otu_table)
+    if [c for c in calcs if c.IsPhylogenetic and c.Metric not in tree_metrics]:
+        tree = all_calcs.getTree(tree)
+
+    # (fname, seqs/sample, alpha diversity result) of each rarefied table,
+    # named as alpha_diversity.py names the result for the table's file
+    results = []
+    for depth, rep, sub_otu_table in iter_rare_tables(
+            otu_table, depths, num_reps, small_included,
+            subsample_f=subsample_f):
+        if empty_otus_removed:
+            sub_otu_table = filter_otus_from_otu_table(
+                sub_otu_table,
+                sub_otu_table.ObservationIds, 1, inf, 0, inf)
+        if sub_otu_table.isEmpty():
+            # multiple_rarefactions.py doesn't write empty tables
+            continue
+        fname = 'alpha_rarefaction_%s_%s.txt' % (depth, rep)
+        results.append((fname, depth,
+                        all_calcs.getResult(sub_otu_table, tree)))
+    if not results:
+        return
+
+    # collate_alpha.py's columns are the samples of the shallowest table
+    all_data, all_samples, all_metrics = min(results,
+                                             key=lambda r: r[1])[2]
+    all_samples = list(all_samples)
+    for metric in all_metrics:
+        metric_file_data = []
+        for fname, depth, (data, sample_ids, calc_names) in results:
+            # the values are formatted as floats, as when collate_alpha.py
+            # parses them from alpha_diversity.py's output
+            metric_file_data.append(
+                make_output_row(calc_names, metric, sample_ids,
+                                data.astype(float), fname,
+                                len(all_samples), all_samples))
+        write_output_file(metric_file_data, output_dir, metric, all_samples)
+
+
 def single_file_cup(otu_filepath, metrics, outfilepath, r, alpha, f, ci_type):
     """Compute variations of the conditional uncovered probability.
 
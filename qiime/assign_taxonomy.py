@@ -16,24 +16,34 @@ import logging
 import os
 import re
 from os import remove
+from os.path import exists, join
 from itertools import count
 from string import strip
-from shutil import copy as copy_file
-from tempfile import NamedTemporaryFile
+from shutil import copy as copy_file, rmtree
+from tempfile import NamedTemporaryFile, mkdtemp
 from cStringIO import StringIO
 from collections import Counter, defaultdict
+from multiprocessing import Pool
+
+from numpy import (arange, array, asarray, concatenate, float32, fromstring,
+                   int64, load, log, newaxis, ones, repeat, save, uint8,
+                   unique, zeros)
+from numpy.lib.format import open_memmap
+from numpy.random import RandomState, randint
+from scipy.sparse import coo_matrix, csr_matrix
 
 from skbio.app.util import ApplicationNotFoundError
 from skbio.parse.sequences import parse_fasta
 
 from brokit.blast import blast_seqs, Blastall, BlastResult
-from brokit.formatdb import build_blast_db_from_fasta_path
 from brokit.uclust import Uclust
 from brokit import rdp_classifier
 from brokit import mothur
 from brokit import rtax
 
-from qiime.util import FunctionWithParams, get_rdp_jarpath, get_qiime_temp_dir
+from qiime.util import (FunctionWithParams, get_rdp_jarpath,
+                        get_qiime_temp_dir, create_dir,
+                        get_blast_db_from_fasta_path)
 
 # Load Tax2Tree if it's available. If it's not, skip it, but set up
 # to raise errors if the user tries to use it.
@@ -169,7 +179,7 @@ class BlastTaxonAssigner(TaxonAssigner):
             reference_seqs_path = self.Params['reference_seqs_filepath']
             refseqs_dir, refseqs_name = os.path.split(reference_seqs_path)
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(reference_seqs_path)
+                get_blast_db_from_fasta_path(reference_seqs_path)
 
         # build the mapping of sequence identifier
         # (wrt to the blast db seqs) to taxonomy
@@ -892,6 +902,14 @@ uclust-based consensus taxonomy assigner by Greg Caporaso, citation: QIIME allow
         id_to_taxonomy_f = open(self.Params['id_to_taxonomy_fp'], 'U')
         self.id_to_taxonomy = self._parse_id_to_taxonomy_file(id_to_taxonomy_f)
 
+        # the lineages of the reference sequences are interned the first
+        # time that they're hit, as tuples of taxon ids, where each taxon is
+        # a name under a parent taxon (so a taxon id identifies the lineage
+        # down to that taxon). _taxon_names maps the ids back to names.
+        self._lineage_ids = {}
+        self._taxon_ids = {}
+        self._taxon_names = []
+
     def __call__(self,
                  seq_path,
                  result_path=None,
@@ -960,12 +978,12 @@ uclust-based consensus taxonomy assigner by Greg Caporaso, citation: QIIME allow
 
         app_result = app({'--input': seq_path,
                           '--uc': uc_path})
-        result = self._uc_to_assignment(app_result['ClusterFile'])
+        assignments = self._iter_uc_assignments(app_result['ClusterFile'])
         if result_path is not None:
             # if the user provided a result_path, write the
-            # results to file
+            # results to file as each query's consensus is computed
             of = open(result_path, 'w')
-            for seq_id, (assignment, consensus_fraction, n) in result.items():
+            for seq_id, (assignment, consensus_fraction, n) in assignments:
                 assignment_str = ';'.join(assignment)
                 of.write('%s\t%s\t%1.2f\t%d\n' %
                          (seq_id, assignment_str, consensus_fraction, n))
@@ -974,7 +992,8 @@ uclust-based consensus taxonomy assigner by Greg Caporaso, citation: QIIME allow
             logger.info('Result path: %s' % result_path)
         else:
             # If no result_path was provided, the result dict is
-            # returned as-is.
+            # returned.
+            result = dict(assignments)
             logger.info('Result path: None, returned as dict.')
 
         if store_uc_in_log:
@@ -1095,9 +1114,478 @@ uclust-based consensus taxonomy assigner by Greg Caporaso, citation: QIIME allow
     def _uc_to_assignment(self, uc):
         """ return dict mapping query id to consensus assignment
         """
-        # get map of query id to all assignments
-        results = self._uc_to_assignments(uc)
-        # for each query id, compute the consensus taxonomy assignment
-        for query_id, all_assignments in results.items():
-            results[query_id] = self._get_consensus_assignment(all_assignments)
-        return results
+        return dict(self._iter_uc_assignments(uc))
+
+    def _iter_uc_assignments(self, uc):
+        """ yield (query id, consensus assignment) for each query in uc
+
+        uclust writes the lines of each query together, so each query's
+        consensus assignment is computed as soon as its last line is read,
+        and only the hits of one query are held in memory at a time. The
+        queries are yielded in the order of uc.
+        """
+        current_query_id = None
+        current_assignments = []
+        for line in uc:
+            if line.startswith('H'):
+                fields = line.split('\t')
+                query_id = fields[8].split()[0]
+                assignment = self._get_lineage_ids(fields[9].split()[0])
+            elif line.startswith('N'):
+                fields = line.split('\t')
+                query_id = fields[8].split()[0]
+                assignment = ()
+            else:
+                continue
+
+            if query_id != current_query_id:
+                if current_query_id is not None:
+                    yield current_query_id, \
+                        self._get_consensus_assignment_from_ids(
+                            current_assignments)
+                current_query_id = query_id
+                current_assignments = []
+            current_assignments.append(assignment)
+
+        if current_query_id is not None:
+            yield current_query_id, \
+                self._get_consensus_assignment_from_ids(current_assignments)
+
+    def _get_lineage_ids(self, subject_id):
+        """ return the taxon ids of the lineage of a reference sequence
+        """
+        try:
+            return self._lineage_ids[subject_id]
+        except KeyError:
+            pass
+
+        lineage_ids = []
+        parent_id = None
+        for name in self.id_to_taxonomy[subject_id].split(';'):
+            taxon = (parent_id, name)
+            try:
+                taxon_id = self._taxon_ids[taxon]
+            except KeyError:
+                taxon_id = len(self._taxon_names)
+                self._taxon_ids[taxon] = taxon_id
+                self._taxon_names.append(name)
+            lineage_ids.append(taxon_id)
+            parent_id = taxon_id
+        lineage_ids = tuple(lineage_ids)
+        self._lineage_ids[subject_id] = lineage_ids
+        return lineage_ids
+
+    def _get_consensus_assignment_from_ids(self, assignments):
+        """ compute the consensus assignment from a list of lineage ids
+
+        This is _get_consensus_assignment for lineages interned by
+        _get_lineage_ids. As a taxon id identifies the lineage down to that
+        taxon, the assignments at each level are counted as integers.
+        """
+        num_input_assignments = len(assignments)
+        consensus_assignment = []
+        consensus_fraction_result = 1.0
+        num_levels = min([len(a) for a in assignments])
+        for level in range(num_levels):
+            taxon_id, max_count = \
+                Counter([a[level] for a in assignments]).most_common(1)[0]
+            max_consensus_fraction = max_count / num_input_assignments
+            if max_consensus_fraction >= self.Params['min_consensus_fraction']:
+                consensus_assignment.append(self._taxon_names[taxon_id])
+                consensus_fraction_result = max_consensus_fraction
+            else:
+                break
+
+        if not consensus_assignment:
+            # as in _get_consensus_assignment, there is no assignment, and
+            # the consensus fraction is 1.0
+            consensus_assignment = [self.Params['unassignable_label']]
+        return (
+            consensus_assignment, consensus_fraction_result,
+            num_input_assignments
+        )
+
+
+# the number of bytes of scores to hold in memory at once when training or
+# running the naive Bayes classifier
+DEFAULT_NAIVE_BAYES_MEMORY = 100000000
+
+# the files of a trained naive Bayes model. The taxa file is written last, so
+# a model is complete if it exists.
+_naive_bayes_log_probs_fn = 'log_word_probs.npy'
+_naive_bayes_ranks_fn = 'taxon_ranks.npy'
+_naive_bayes_taxa_fn = 'taxa.txt'
+
+# the index of each nucleotide in the words of a sequence, with 4 for
+# characters which can't be part of a word
+_nucleotide_indices = zeros(256, dtype=uint8) + 4
+for _i, _bases in enumerate(['Aa', 'Cc', 'Gg', 'TtUu']):
+    for _base in _bases:
+        _nucleotide_indices[ord(_base)] = _i
+
+
+def _get_words(seq, word_size=8):
+    """Returns the sorted, unique indices of the words of length word_size in seq
+
+    Each word of A, C, G and T (or U) is indexed as a base 4 number, and
+    words containing any other characters are skipped.
+    """
+    indices = _nucleotide_indices[fromstring(seq, dtype=uint8)]
+    num_words = len(indices) - word_size + 1
+    if num_words < 1:
+        return array([], dtype=int64)
+    words = zeros(num_words, dtype=int64)
+    invalid = zeros(num_words, dtype=bool)
+    for i in range(word_size):
+        window = indices[i:i + num_words]
+        words = words * 4 + (window & 3)
+        invalid |= window == 4
+    return unique(words[~invalid])
+
+
+def naive_bayes_model_exists(model_dir):
+    """Returns True if model_dir holds a trained naive Bayes model"""
+    return exists(join(model_dir, _naive_bayes_taxa_fn))
+
+
+def train_naive_bayes_model(reference_seqs_fp, id_to_taxonomy_fp, model_dir,
+                            word_size=8, memory=DEFAULT_NAIVE_BAYES_MEMORY):
+    """Trains a naive Bayes taxonomy classifier, and saves it to model_dir
+
+    The model is that of the RDP classifier (Wang et al. 2007), with one
+    taxon for each distinct lineage in id_to_taxonomy_fp. The probability of
+    word w in taxon G is (m + P) / (M + 1), where m is the number of G's
+    reference sequences containing w, M is the number of G's reference
+    sequences and P = (n + 0.5) / (N + 1), where n is the number of
+    reference sequences containing w and N is the number of reference
+    sequences.
+
+    The log probabilities are saved as a (number of words x number of taxa)
+    float32 .npy array, so that it can be memory-mapped and the rows of a
+    sequence's words read without loading the rest. The array is filled in
+    blocks of words, using about memory bytes for each block.
+    """
+    create_dir(model_dir)
+    id_to_taxonomy = TaxonAssigner._parse_id_to_taxonomy_file(
+        open(id_to_taxonomy_fp, 'U'))
+    num_words = 4 ** word_size
+    # the words (rows) of each reference sequence and its taxon (columns),
+    # counted once all sequences have been read
+    rows = []
+    cols = []
+    taxa = []
+    taxon_indices = {}
+    taxon_seq_counts = []
+    for seq_id, seq in parse_fasta(open(reference_seqs_fp, 'U')):
+        seq_id = seq_id.split()[0]
+        try:
+            lineage = tuple(map(strip, id_to_taxonomy[seq_id].split(';')))
+        except KeyError:
+            raise ValueError("Reference sequence %s is not in the id to "
+                             "taxonomy map." % seq_id)
+        taxon = taxon_indices.setdefault(lineage, len(taxa))
+        if taxon == len(taxa):
+            taxa.append(lineage)
+            taxon_seq_counts.append(0)
+        taxon_seq_counts[taxon] += 1
+
+        words = _get_words(seq, word_size)
+        rows.append(words)
+        cols.append(repeat(taxon, len(words)))
+    if not taxa:
+        raise ValueError("No reference sequences in %s." % reference_seqs_fp)
+
+    num_taxa = len(taxa)
+    # the counts of the reference sequences containing each word in each
+    # taxon
+    counts = _get_word_counts(rows, cols, (num_words, num_taxa))
+    del rows, cols
+    word_priors = (asarray(counts.sum(1)).ravel() + 0.5) / \
+        (sum(taxon_seq_counts) + 1)
+    denominators = array(taxon_seq_counts) + 1.
+    log_word_probs = open_memmap(join(model_dir, _naive_bayes_log_probs_fn),
+                                 mode='w+', dtype=float32,
+                                 shape=(num_words, num_taxa))
+    block_size = max(1, memory // (8 * num_taxa))
+    for start in range(0, num_words, block_size):
+        stop = min(start + block_size, num_words)
+        log_word_probs[start:stop] = log(
+            (counts[start:stop].toarray() + word_priors[start:stop, newaxis]) /
+            denominators)
+    log_word_probs.flush()
+    del log_word_probs
+
+    # the id of each taxon's lineage down to each rank (-1 past the end of
+    # the lineage), so that lineages can be compared at a rank as integers
+    max_depth = max(map(len, taxa))
+    taxon_ranks = zeros((num_taxa, max_depth), dtype=int64) - 1
+    prefix_ids = {}
+    for i, lineage in enumerate(taxa):
+        for rank in range(len(lineage)):
+            taxon_ranks[i, rank] = prefix_ids.setdefault(lineage[:rank + 1],
+                                                         len(prefix_ids))
+    save(join(model_dir, _naive_bayes_ranks_fn), taxon_ranks)
+
+    taxa_f = open(join(model_dir, _naive_bayes_taxa_fn), 'w')
+    for lineage in taxa:
+        taxa_f.write('%s\n' % ';'.join(lineage))
+    taxa_f.close()
+
+
+def _get_word_counts(rows, cols, shape):
+    """Returns a sparse matrix of the counts of the (row, col) indices
+
+    rows, cols: lists of arrays of the row and column indices, which are
+     concatenated and summed into one matrix
+    """
+    rows = concatenate(rows)
+    counts = coo_matrix((ones(len(rows), dtype=int64),
+                         (rows, concatenate(cols))), shape=shape)
+    counts.sum_duplicates()
+    return counts.tocsr()
+
+
+def load_naive_bayes_model(model_dir):
+    """Loads a model saved by train_naive_bayes_model
+
+    Returns the memory-mapped log word probabilities, the ids of the taxa's
+    lineages at each rank, and the list of each taxon's lineage.
+    """
+    if not naive_bayes_model_exists(model_dir):
+        raise ValueError("There is no trained naive Bayes model in %s."
+                         % model_dir)
+    log_word_probs = load(join(model_dir, _naive_bayes_log_probs_fn),
+                          mmap_mode='r')
+    taxon_ranks = load(join(model_dir, _naive_bayes_ranks_fn))
+    taxa = [l.strip().split(';')
+            for l in open(join(model_dir, _naive_bayes_taxa_fn), 'U')]
+    return log_word_probs, taxon_ranks, taxa
+
+
+def _classify_naive_bayes_batch(log_word_probs, taxon_ranks, num_bootstraps,
+                                seq_ids, words, seed):
+    """Classifies a batch of sequences with a naive Bayes model
+
+    Each sequence is assigned the taxon that gives the highest total log
+    probability for its words. Each bootstrap is a random eighth of the
+    sequence's words (drawn with replacement, as in the RDP classifier), and
+    the confidence of the assignment at each rank is the fraction of the
+    bootstraps whose taxon has the same lineage down to that rank. The
+    scores of all of the sequences and bootstraps are computed at once, as
+    products of a sparse matrix of word counts with log_word_probs.
+
+    Returns seq_ids, the index of the taxon of each sequence (-1 for
+    sequences with no words), and a (number of sequences x number of ranks)
+    array of the confidences.
+    """
+    random_state = RandomState(seed)
+    num_seqs = len(words)
+    num_words = log_word_probs.shape[0]
+    seq_sizes = array(map(len, words))
+    query_rows = repeat(arange(num_seqs), seq_sizes)
+    queries = csr_matrix((ones(len(query_rows), dtype=float32),
+                          (query_rows, concatenate(words))),
+                         shape=(num_seqs, num_words))
+    taxa = asarray(queries * log_word_probs).argmax(1)
+
+    boot_rows = []
+    boot_cols = []
+    for i, seq_words in enumerate(words):
+        sample_size = min(len(seq_words), max(1, len(seq_words) // 8))
+        sampled = random_state.randint(max(1, len(seq_words)),
+                                       size=(num_bootstraps, sample_size))
+        boot_rows.append(repeat(arange(i * num_bootstraps,
+                                       (i + 1) * num_bootstraps),
+                                sample_size))
+        boot_cols.append(seq_words[sampled].ravel())
+    boot_rows = concatenate(boot_rows)
+    # words drawn more than once in a bootstrap are summed
+    bootstraps = csr_matrix((ones(len(boot_rows), dtype=float32),
+                             (boot_rows, concatenate(boot_cols))),
+                            shape=(num_seqs * num_bootstraps, num_words))
+    boot_taxa = asarray(bootstraps * log_word_probs).argmax(1).reshape(
+        num_seqs, num_bootstraps)
+
+    ranks = taxon_ranks[taxa]
+    confidences = (taxon_ranks[boot_taxa] == ranks[:, newaxis, :]).mean(1)
+    taxa[seq_sizes == 0] = -1
+    return seq_ids, taxa, confidences
+
+
+_naive_bayes_worker_state = []
+
+
+def _init_naive_bayes_worker(model_dir, num_bootstraps):
+    """Sets up a worker process of NaiveBayesTaxonAssigner"""
+    log_word_probs, taxon_ranks, taxa = load_naive_bayes_model(model_dir)
+    _naive_bayes_worker_state[:] = [log_word_probs, taxon_ranks,
+                                    num_bootstraps]
+
+
+def _naive_bayes_worker(batch):
+    """Classifies a batch of sequences in a worker"""
+    return _classify_naive_bayes_batch(*(_naive_bayes_worker_state +
+                                         list(batch)))
+
+
+class NaiveBayesTaxonAssigner(TaxonAssigner):
+
+    """Assign taxonomy with QIIME's naive Bayes classifier
+
+    This is the RDP classifier's method, without a Java runtime. The
+    classifier is trained from the reference sequences and id to taxonomy
+    map (see train_naive_bayes_model), and if model_dir is passed, the
+    trained model is kept there and reused by later runs, which then don't
+    need the reference files. The sequences are classified in batches,
+    which are spread across jobs_to_start processes that share the
+    memory-mapped model.
+    """
+    Name = "NaiveBayesTaxonAssigner"
+    Application = "QIIME naive Bayes classifier"
+    Citation = "Wang, Q, G. M. Garrity, J. M. Tiedje, and J. R. Cole. 2007. Naive Bayesian Classifier for Rapid Assignment of rRNA Sequences into the New Bacterial Taxonomy. Appl Environ Microbiol. 73(16):5261-7."
+    _tracked_properties = ['Application', 'Citation']
+
+    def __init__(self, params):
+        """Return new NaiveBayesTaxonAssigner object with specified params.
+        """
+        _params = {
+            'Confidence': 0.80,
+            'id_to_taxonomy_fp': None,
+            'reference_sequences_fp': None,
+            # directory of the trained model, which is trained from the
+            # reference files if it doesn't hold one yet. If None, the model
+            # is trained in a temporary directory for this run only.
+            'model_dir': None,
+            'word_size': 8,
+            'num_bootstraps': 100,
+            'jobs_to_start': 1,
+            'memory': DEFAULT_NAIVE_BAYES_MEMORY,
+            # label to apply for queries that cannot be assigned
+            'unassignable_label': 'Unassigned'
+        }
+        _params.update(params)
+        TaxonAssigner.__init__(self, _params)
+
+    def __call__(self, seq_path, result_path=None, log_path=None):
+        """Returns dict mapping {seq_id:(taxonomy, confidence)} for
+        each seq.
+
+        The taxonomy is truncated at the deepest rank whose confidence is
+        at least Confidence, and the confidence is that of the deepest rank
+        kept. Sequences that aren't confidently assigned at the first rank,
+        or that have no words, are given unassignable_label (with the
+        confidence of the first rank).
+
+        Parameters:
+        seq_path: path to file of sequences
+        result_path: path to file of results. If specified, dumps the
+            result to the desired path instead of returning it.
+        log_path: path to log, which should include dump of params.
+        """
+        model_dir = self.Params['model_dir']
+        tmp_model_dir = None
+        if model_dir is None or not naive_bayes_model_exists(model_dir):
+            if (self.Params['reference_sequences_fp'] is None or
+                    self.Params['id_to_taxonomy_fp'] is None):
+                raise ValueError(
+                    "reference_sequences_fp and id_to_taxonomy_fp must be "
+                    "provided to train a NaiveBayesTaxonAssigner model.")
+            if model_dir is None:
+                model_dir = tmp_model_dir = mkdtemp(
+                    prefix='NaiveBayesTaxonAssigner_',
+                    dir=get_qiime_temp_dir())
+            train_naive_bayes_model(self.Params['reference_sequences_fp'],
+                                    self.Params['id_to_taxonomy_fp'],
+                                    model_dir,
+                                    word_size=self.Params['word_size'],
+                                    memory=self.Params['memory'])
+
+        try:
+            if result_path is None:
+                result = {}
+                for seq_id, assignment in self._classify(seq_path,
+                                                         model_dir):
+                    result[seq_id] = assignment
+            else:
+                result = None
+                of = open(result_path, 'w')
+                for seq_id, (lineage, confidence) in \
+                        self._classify(seq_path, model_dir):
+                    of.write('%s\t%s\t%1.2f\n' % (seq_id, lineage,
+                                                  confidence))
+                of.close()
+        finally:
+            if tmp_model_dir is not None:
+                rmtree(tmp_model_dir)
+
+        if log_path:
+            self.writeLog(log_path)
+
+        return result
+
+    def _classify(self, seq_path, model_dir):
+        """Yields (seq_id, (taxonomy, confidence)) for each seq, in order
+        """
+        log_word_probs, taxon_ranks, taxa = load_naive_bayes_model(model_dir)
+        word_size = self.Params['word_size']
+        if log_word_probs.shape[0] != 4 ** word_size:
+            raise ValueError("The naive Bayes model in %s was not trained "
+                             "with a word size of %d." % (model_dir,
+                                                          word_size))
+        num_bootstraps = self.Params['num_bootstraps']
+        jobs_to_start = self.Params['jobs_to_start']
+        min_conf = self.Params['Confidence']
+        unassignable_label = self.Params['unassignable_label']
+
+        # the scores of a batch hold a float32 for each taxon, for each
+        # sequence and each of its bootstraps
+        batch_size = max(1, self.Params['memory'] //
+                         (4 * len(taxa) * (num_bootstraps + 1)))
+        batches = self._get_batches(open(seq_path, 'U'), word_size,
+                                    batch_size)
+        if jobs_to_start > 1:
+            pool = Pool(jobs_to_start, _init_naive_bayes_worker,
+                        (model_dir, num_bootstraps))
+            batch_results = pool.imap(_naive_bayes_worker, batches)
+        else:
+            pool = None
+            batch_results = (_classify_naive_bayes_batch(
+                log_word_probs, taxon_ranks, num_bootstraps, *batch)
+                for batch in batches)
+
+        for seq_ids, seq_taxa, confidences in batch_results:
+            for seq_id, taxon, seq_confidences in zip(seq_ids, seq_taxa,
+                                                      confidences):
+                if taxon < 0:
+                    yield seq_id, (unassignable_label, 0.0)
+                    continue
+                lineage = taxa[taxon]
+                # the confidences can only decrease with depth
+                depth = (seq_confidences[:len(lineage)] >= min_conf).sum()
+                if depth == 0:
+                    yield seq_id, (unassignable_label, seq_confidences[0])
+                else:
+                    yield seq_id, (';'.join(lineage[:depth]),
+                                   seq_confidences[depth - 1])
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    def _get_batches(self, seq_file, word_size, batch_size):
+        """Yields (seq_ids, words, seed) for each batch of sequences
+
+        The random seed of each batch's bootstraps is drawn here, so the
+        results are the same for any number of processes.
+        """
+        seq_ids = []
+        words = []
+        for seq_id, seq in parse_fasta(seq_file):
+            seq_ids.append(seq_id)
+            words.append(_get_words(seq, word_size))
+            if len(seq_ids) == batch_size:
+                yield seq_ids, words, randint(2 ** 31 - 1)
+                seq_ids = []
+                words = []
+        if seq_ids:
+            yield seq_ids, words, randint(2 ** 31 - 1)
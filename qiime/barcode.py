@@ -14,6 +14,11 @@ provides functions, used to assign a possibly error-fraught DNA
 barcode to a list of original barcodes.  correct_barcode uses edit distance
 of the DNA, not the bit encoding of the DNA.  correct_barcode_bitwise
 uses bit encoding to determine closest match
+
+BarcodeCorrector gives the same results as correct_barcode and
+correct_barcode_bitwise, but precomputes an index of every sequence within a
+small distance of the barcodes, so it can be used to correct large numbers of
+reads against the same barcodes.
 """
 DEFAULT_GOLAY_NT_TO_BITS = {"A": "11", "C": "00", "T": "10", "G": "01"}
 DEFAULT_HAMMING_NT_TO_BITS = {"A": "11", "C": "10", "T": "00", "G": "01"}
@@ -107,3 +112,166 @@ def seq_to_bits(seq, nt_to_bits):
         bitstring += nt_to_bits[nt]
     bits = numpy.array(map(int, bitstring))
     return bits
+
+
+class BarcodeCorrector(object):
+
+    """ finds the closest match to a query among a fixed set of barcodes
+
+    calling a BarcodeCorrector on query_seq returns the same (best_hit,
+    min_dist) as correct_barcode(query_seq, barcodes), or, if nt_to_bits is
+    passed, as correct_barcode_bitwise(query_seq, barcodes, nt_to_bits).
+
+    every sequence within max_dist of a barcode is precomputed and mapped to
+    its closest barcode (or None if there is a tie), so queries with few
+    errors are answered with a single lookup. other queries are compared to
+    all barcodes at once using numpy arrays.
+
+    as correct_barcode compares a query with the first len(query_seq)
+    positions of each barcode, a separate index is built for each query
+    length the first time a query of that length is seen. queries which
+    the original functions would not handle in the same way (i.e., barcodes
+    shorter than the query, or containing characters outside the alphabet,
+    or, for bitwise correction, barcodes of other lengths than the query)
+    are passed to correct_barcode or correct_barcode_bitwise.
+    """
+
+    def __init__(self, barcodes, max_dist=2, nt_to_bits=None):
+        self.barcodes = list(barcodes)
+        self.max_dist = max_dist
+        self.nt_to_bits = nt_to_bits
+        # maps query length to (neighbors, barcode_array), or to None if
+        # queries of that length are handled by the original functions
+        self._indices = {}
+
+        if self.nt_to_bits is None:
+            self._alphabet = set('ACGT')
+            self._substitution_costs = dict(
+                [(nt, [(other, 1) for other in self._alphabet if other != nt])
+                 for nt in self._alphabet])
+        else:
+            self._alphabet = set(nt_to_bits.keys())
+            self._substitution_costs = dict(
+                [(nt, [(other, _edit_dist(nt_to_bits[nt], nt_to_bits[other]))
+                       for other in self._alphabet if other != nt])
+                 for nt in self._alphabet])
+
+        barcode_lengths = set(map(len, self.barcodes))
+        if len(barcode_lengths) == 1:
+            self.barcode_length = barcode_lengths.pop()
+            # the common case: build the index up front
+            self._get_index(self.barcode_length)
+        else:
+            self.barcode_length = None
+
+    def _get_index(self, length):
+        """ returns (neighbors, barcode_array) for queries of length
+
+        returns None if these queries must be passed to the original
+        functions"""
+        try:
+            return self._indices[length]
+        except KeyError:
+            pass
+
+        prefixes = [bc[:length] for bc in self.barcodes]
+        if self.nt_to_bits is None:
+            usable = min(map(len, self.barcodes)) >= length
+        else:
+            usable = set(map(len, self.barcodes)) == set([length])
+        if not usable or set(''.join(prefixes)) - self._alphabet:
+            self._indices[length] = None
+            return None
+
+        if self.nt_to_bits is None:
+            barcode_array = numpy.array(
+                [numpy.fromstring(prefix, dtype=numpy.uint8)
+                 for prefix in prefixes])
+        else:
+            barcode_array = numpy.array(
+                [seq_to_bits(prefix, self.nt_to_bits) for prefix in prefixes])
+
+        neighbors = {}
+        for barcode, prefix in zip(self.barcodes, prefixes):
+            for variant, dist in _barcode_neighborhood(
+                    prefix, self.max_dist, self._substitution_costs):
+                try:
+                    best_hit, min_dist = neighbors[variant]
+                except KeyError:
+                    neighbors[variant] = (barcode, dist)
+                else:
+                    if dist < min_dist:
+                        neighbors[variant] = (barcode, dist)
+                    elif dist == min_dist:
+                        neighbors[variant] = (None, dist)
+
+        self._indices[length] = neighbors, barcode_array
+        return neighbors, barcode_array
+
+    def __call__(self, query_seq):
+        """ returns (best_hit, min_dist), as correct_barcode """
+        index = self._get_index(len(query_seq))
+        if index is None:
+            if self.nt_to_bits is None:
+                return correct_barcode(query_seq, self.barcodes)
+            else:
+                return correct_barcode_bitwise(query_seq, self.barcodes,
+                                               self.nt_to_bits)
+
+        neighbors, barcode_array = index
+        try:
+            return neighbors[query_seq]
+        except KeyError:
+            pass
+
+        if self.nt_to_bits is None:
+            query = numpy.fromstring(query_seq, dtype=numpy.uint8)
+        else:
+            query = seq_to_bits(query_seq, self.nt_to_bits)
+        dists = (barcode_array != query).sum(axis=1)
+        min_dist = dists.min()
+        if (dists == min_dist).sum() > 1:
+            return None, min_dist
+        else:
+            return self.barcodes[dists.argmin()], min_dist
+
+
+def _barcode_neighborhood(barcode, max_dist, substitution_costs):
+    """ yields (variant, dist) for every variant within max_dist of barcode
+
+    substitution_costs maps each nucleotide to a list of (other nt, cost)
+    each variant is yielded once, with the barcode itself at distance 0"""
+    # each entry is (variant, dist, first position that may still change)
+    variants = [(barcode, 0, 0)]
+    for variant, dist, start in variants:
+        yield variant, dist
+        for i in range(start, len(barcode)):
+            for nt, cost in substitution_costs[barcode[i]]:
+                if dist + cost <= max_dist:
+                    variants.append(
+                        (variant[:i] + nt + variant[i + 1:], dist + cost, i + 1))
+
+
+def get_barcode_corrector(barcodes, max_dist=2, nt_to_bits=None):
+    """ returns a BarcodeCorrector for barcodes
+
+    the most recently built corrector is reused if it was built for the same
+    barcodes and parameters, so this can be called once per read. pass the
+    barcodes as a tuple to make this a constant time check: the tuple the
+    last corrector was built for is recognised without comparing barcodes"""
+    cached_barcodes, cached_params, corrector = _LAST_BARCODE_CORRECTOR
+    if corrector is not None and barcodes is cached_barcodes and \
+       cached_params == (max_dist, nt_to_bits):
+        return corrector
+    # tuple() returns a tuple itself, so it is kept for the check above
+    barcodes = tuple(barcodes)
+    params = (max_dist, nt_to_bits)
+    if corrector is None or cached_params != params or \
+       cached_barcodes != barcodes:
+        corrector = BarcodeCorrector(barcodes, max_dist, nt_to_bits)
+    _LAST_BARCODE_CORRECTOR[:] = [barcodes, params, corrector]
+    return corrector
+
+# tuple of barcodes, (max_dist, nt_to_bits) and BarcodeCorrector from the last
+# call to get_barcode_corrector
+_LAST_BARCODE_CORRECTOR = [None, None, None]
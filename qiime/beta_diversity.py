@@ -33,16 +33,23 @@ from sys import exit, stderr
 import os.path
 import warnings
 warnings.filterwarnings('ignore', 'Not using MPI as mpi4py not found')
-from numpy import asarray
+from numpy import asarray, zeros
+from scipy.sparse import issparse
 import cogent.maths.distance_transform as distance_transform
 from biom.parse import parse_biom_table
 from biom.table import DenseTable
 from qiime.util import (FunctionWithParams, TreeMissingError,
                         OtuMissingError)
-from qiime.format import format_matrix, format_distance_matrix
+from qiime.format import (format_matrix, format_distance_matrix,
+                          write_distance_matrix)
 from qiime.parse import parse_newick, PhyloNode
+from qiime.alpha_diversity import get_sample_counts
 import qiime.beta_metrics
 
+# the default number of bytes of distances and intermediate values to hold
+# at a time when the distance matrix is calculated in tiles
+DEFAULT_TILE_MEMORY = 100000000
+
 
 def get_nonphylogenetic_metric(name):
     """Gets metric by name from distance_transform.
@@ -91,6 +98,22 @@ def get_phylogenetic_row_metric(name):
     return getattr(qiime.beta_metrics, 'one_sample_' + name.lower())
 
 
+def get_nonphylogenetic_row_metric(name):
+    """Gets row metric by name from qiime.beta_metrics
+
+    Metrics should be f(matrix, rowidxs) -> distances from each of rowidxs
+    to each row of matrix.
+    """
+    # looks up the distance_transform function, so names are accepted in
+    # the same forms as by get_nonphylogenetic_metric
+    metric_name = get_nonphylogenetic_metric(name).__name__
+    if metric_name.startswith('binary_dist_'):
+        metric_name = 'binary_' + metric_name[len('binary_dist_'):]
+    elif metric_name.startswith('dist_'):
+        metric_name = metric_name[len('dist_'):]
+    return getattr(qiime.beta_metrics, 'rows_' + metric_name)
+
+
 def list_known_nonphylogenetic_metrics():
     """Lists known metrics by name from distance_transform.
 
@@ -173,10 +196,7 @@ class BetaDiversityCalc(FunctionWithParams):
             tree = None
 
         otu_table = parse_biom_table(open(data_path, 'U'))
-        if isinstance(otu_table, DenseTable):
-            otumtx = otu_table._data.T
-        else:
-            otumtx = asarray([v for v in otu_table.iterSampleData()])
+        otumtx = get_sample_matrix(otu_table)
 
         # get the 2d dist matrix from beta diversity analysis
         if self.IsPhylogenetic:
@@ -192,8 +212,122 @@ class BetaDiversityCalc(FunctionWithParams):
         return format_distance_matrix(sample_names, data)
 
 
+def get_sample_matrix(otu_table, sparse=False):
+    """ returns the samples x otus array of counts in otu_table
+
+    sparse tables are densified one sample at a time into a preallocated
+    array, rather than through a list of all of the sample vectors. If
+    sparse is True, they are instead returned as a scipy.sparse.csr_matrix
+    (the row metrics of get_row_dissims only densify blocks of it).
+    """
+    if isinstance(otu_table, DenseTable):
+        return otu_table._data.T
+    if sparse:
+        return get_sample_counts(otu_table)
+    otumtx = zeros((len(otu_table.SampleIds), len(otu_table.ObservationIds)))
+    for i, values in enumerate(otu_table.iterSampleData()):
+        otumtx[i] = values
+    return otumtx
+
+
+def get_row_dissims(metric, metric_f, is_phylogenetic, otumtx, otu_table,
+                    tree, rowids_list, full_tree=False, cache=None,
+                    block_memory=None):
+    """ returns d(rowid, *) for each rowid in rowids_list
+
+    inputs:
+     metric (str)
+     metric_f -- the function for metric
+     is_phylogenetic (bool)
+     otumtx -- samples x otus array, or scipy.sparse matrix
+     otu_table -- the biom table otumtx was created from
+     tree -- a phylonode tree, if needed by the metric
+     rowids_list (list of str)
+     full_tree (bool)
+     cache -- dict to share the values calculated from the whole of otumtx
+      (and tree) between calls for the same metric
+     block_memory -- passed to the row metrics if not None
+    """
+    rowidxs = [otu_table.getSampleIndex(rowid) for rowid in rowids_list]
+    if not is_phylogenetic:
+        try:
+            row_metric = get_nonphylogenetic_row_metric(metric)
+        except AttributeError:
+            # do element by element
+            return [[metric_f(_get_dense_rows(otumtx, [rowidx, i]))[0, 1]
+                     for i in range(len(otu_table.SampleIds))]
+                    for rowidx in rowidxs]
+        else:
+            # do all rows at once
+            if block_memory is None:
+                return row_metric(otumtx, rowidxs, cache)
+            return row_metric(otumtx, rowidxs, cache, block_memory)
+
+    try:
+        row_metric = get_phylogenetic_row_metric(metric)
+    except AttributeError:
+        # do element by element
+        row_dissims = []  # same order as rowids_list
+        for rowidx in rowidxs:
+            dissims = []
+            for i in range(len(otu_table.SampleIds)):
+                dissim = metric_f(_get_dense_rows(otumtx, [rowidx, i]),
+                                  otu_table.ObservationIds, tree,
+                                  [otu_table.SampleIds[rowidx],
+                                   otu_table.SampleIds[i]],
+                                  make_subtree=(not full_tree))[0, 1]
+                dissims.append(dissim)
+            row_dissims.append(dissims)
+        return row_dissims
+
+    # do whole rows at once, preparing the tree and otumtx only once for
+    # all of the calls that share cache
+    if cache is not None and 'phylogenetic_rows_f' in cache:
+        rows_f = cache['phylogenetic_rows_f']
+    else:
+        kwargs = {'make_subtree': not full_tree}
+        if block_memory is not None:
+            kwargs['block_memory'] = block_memory
+        rows_f = row_metric.getRowsF(otumtx, otu_table.ObservationIds, tree,
+                                     otu_table.SampleIds, **kwargs)
+        if cache is not None:
+            cache['phylogenetic_rows_f'] = rows_f
+    return rows_f(rowids_list)
+
+
+def _get_dense_rows(otumtx, rowidxs):
+    """ returns the rows rowidxs of otumtx as a dense array"""
+    rows = otumtx[rowidxs]
+    if issparse(rows):
+        return rows.toarray()
+    return rows
+
+
+def iter_tiled_dissims(metric, metric_f, is_phylogenetic, otumtx, otu_table,
+                       tree, full_tree=False,
+                       memory_budget=DEFAULT_TILE_MEMORY):
+    """ yields the distance matrix in blocks of consecutive rows
+
+    The number of rows in each block is chosen so that the block and the
+    intermediate values of the row metrics take about memory_budget bytes.
+    Other inputs are as for get_row_dissims.
+    """
+    sample_ids = otu_table.SampleIds
+    # half of the budget for the block of distances, half for the row
+    # metric's intermediate values
+    block_memory = max(1, memory_budget // 2)
+    block_size = max(1, int(block_memory // (8 * max(len(sample_ids), 1))))
+    cache = {}
+    for start in range(0, len(sample_ids), block_size):
+        yield asarray(get_row_dissims(metric, metric_f, is_phylogenetic,
+                                      otumtx, otu_table, tree,
+                                      sample_ids[start:start + block_size],
+                                      full_tree, cache, block_memory))
+
+
 def single_file_beta(input_path, metrics, tree_path, output_dir,
-                     rowids=None, full_tree=False):
+                     rowids=None, full_tree=False, memory_budget=None,
+                     output_format='text'):
     """ does beta diversity calc on a single otu table
 
     uses name in metrics to name output beta diversity files
@@ -205,6 +339,12 @@ def single_file_beta(input_path, metrics, tree_path, output_dir,
      tree_path (str)
      output_dir (str)
      rowids (comma separated str)
+     memory_budget (int) -- if not None, the full matrix is calculated in
+      tiles of rows which take about this many bytes, and each tile is
+      written as it is calculated
+     output_format (str) -- 'text', or 'float32' or 'float64' to write a
+      binary distance matrix (see qiime.format.write_distance_matrix).
+      Binary files are always written in tiles.
     """
     metrics_list = metrics
     try:
@@ -213,11 +353,11 @@ def single_file_beta(input_path, metrics, tree_path, output_dir,
         pass
 
     otu_table = parse_biom_table(open(input_path, 'U'))
-
-    if isinstance(otu_table, DenseTable):
-        otumtx = otu_table._data.T
-    else:
-        otumtx = asarray([v for v in otu_table.iterSampleData()])
+    # tiles and rows are calculated from the table as it is stored, so a
+    # sparse table is only densified a block at a time (the full matrix
+    # metrics need the whole dense table)
+    otumtx = get_sample_matrix(otu_table, sparse=True)
+    dense_otumtx = None
 
     if tree_path:
         tree = parse_newick(open(tree_path, 'U'),
@@ -229,7 +369,9 @@ def single_file_beta(input_path, metrics, tree_path, output_dir,
     input_basename, input_ext = os.path.splitext(input_filename)
     for metric in metrics_list:
         outfilepath = os.path.join(output_dir, metric + '_' +
-                                   input_basename + '.txt')
+                                   input_basename +
+                                   ('.txt' if output_format == 'text'
+                                    else '.bdm'))
         try:
             metric_f = get_nonphylogenetic_metric(metric)
             is_phylogenetic = False
@@ -245,56 +387,36 @@ def single_file_beta(input_path, metrics, tree_path, output_dir,
                 stderr.write("Could not find metric %s.\n\nKnown metrics are: %s\n"
                              % (metric, ', '.join(list_known_metrics())))
                 exit(1)
-        if rowids is None:
+        if rowids is None and (memory_budget is not None or
+                               output_format != 'text'):
+            # full matrix, calculated and written a tile at a time
+            row_blocks = iter_tiled_dissims(
+                metric, metric_f, is_phylogenetic, otumtx, otu_table, tree,
+                full_tree, memory_budget or DEFAULT_TILE_MEMORY)
+            f = open(outfilepath, 'w' if output_format == 'text' else 'wb')
+            try:
+                write_distance_matrix(f, otu_table.SampleIds, row_blocks,
+                                      output_format)
+            finally:
+                f.close()
+        elif rowids is None:
             # standard, full way
+            if dense_otumtx is None:
+                dense_otumtx = get_sample_matrix(otu_table)
             if is_phylogenetic:
-                dissims = metric_f(otumtx, otu_table.ObservationIds,
+                dissims = metric_f(dense_otumtx, otu_table.ObservationIds,
                                    tree, otu_table.SampleIds, make_subtree=(not full_tree))
             else:
-                dissims = metric_f(otumtx)
+                dissims = metric_f(dense_otumtx)
             f = open(outfilepath, 'w')
             f.write(format_distance_matrix(otu_table.SampleIds, dissims))
             f.close()
         else:
             # only calc d(rowid1, *) for each rowid
             rowids_list = rowids.split(',')
-            row_dissims = []  # same order as rowids_list
-            for rowid in rowids_list:
-                rowidx = otu_table.SampleIds.index(rowid)
-
-                # first test if we can the dissim is a fn of only the pair
-                # if not, just calc the whole matrix
-                if metric_f.__name__ == 'dist_chisq' or \
-                        metric_f.__name__ == 'dist_gower' or \
-                        metric_f.__name__ == 'dist_hellinger' or\
-                        metric_f.__name__ == 'binary_dist_chisq':
-                    warnings.warn('dissimilarity ' + metric_f.__name__ +
-                                  ' is not parallelized, calculating the whole matrix...')
-                    row_dissims.append(metric_f(otumtx)[rowidx])
-                else:
-                    try:
-                        row_metric = get_phylogenetic_row_metric(metric)
-                    except AttributeError:
-                        # do element by element
-                        dissims = []
-                        for i in range(len(otu_table.SampleIds)):
-                            if is_phylogenetic:
-                                dissim = metric_f(otumtx[[rowidx, i], :],
-                                                  otu_table.ObservationIds, tree,
-                                                  [otu_table.SampleIds[rowidx],
-                                                   otu_table.SampleIds[i]],
-                                                  make_subtree=(not full_tree))[0, 1]
-                            else:
-                                dissim = metric_f(otumtx[[rowidx, i], :])[0, 1]
-                            dissims.append(dissim)
-                        row_dissims.append(dissims)
-                    else:
-                        # do whole row at once
-                        dissims = row_metric(otumtx,
-                                             otu_table.ObservationIds, tree,
-                                             otu_table.SampleIds, rowid,
-                                             make_subtree=(not full_tree))
-                        row_dissims.append(dissims)
+            row_dissims = get_row_dissims(metric, metric_f, is_phylogenetic,
+                                          otumtx, otu_table, tree,
+                                          rowids_list, full_tree)
 
             # rows_outfilepath = os.path.join(output_dir, metric + '_' +\
             #     '_'.join(rowids_list) + '_' + os.path.split(input_path)[1])
@@ -321,10 +443,7 @@ def single_object_beta(otu_table, metrics, tr, rowids=None,
                                         diversity metric
                 rowids -- comma seperated string
     """
-    if isinstance(otu_table, DenseTable):
-        otumtx = otu_table._data.T
-    else:
-        otumtx = asarray([v for v in otu_table.iterSampleData()])
+    otumtx = get_sample_matrix(otu_table)
 
     if tr:
         tree = tr
@@ -366,49 +485,16 @@ def single_object_beta(otu_table, metrics, tr, rowids=None,
         else:
             # only calc d(rowid1, *) for each rowid
             rowids_list = rowids.split(',')
-            row_dissims = []  # same order as rowids_list
-            for rowid in rowids_list:
-                rowidx = otu_table.SampleIds.index(rowid)
-
-                # first test if we can the dissim is a fn of only the pair
-                # if not, just calc the whole matrix
-                if metric_f.__name__ == 'dist_chisq' or \
-                        metric_f.__name__ == 'dist_gower' or \
-                        metric_f.__name__ == 'dist_hellinger' or\
-                        metric_f.__name__ == 'binary_dist_chisq':
-                    warnings.warn('dissimilarity ' + metric_f.__name__ +
-                                  ' is not parallelized, calculating the whole matrix...')
-                    row_dissims.append(metric_f(otumtx)[rowidx])
-                else:
-                    try:
-                        row_metric = get_phylogenetic_row_metric(metric)
-                    except AttributeError:
-                        # do element by element
-                        dissims = []
-                        for i in range(len(otu_table.SampleIds)):
-                            if is_phylogenetic:
-                                dissim = metric_f(otumtx[[rowidx, i], :],
-                                                  otu_table.ObservationIds, tree,
-                                                  [otu_table.SampleIds[rowidx],
-                                                   otu_table.SampleIds[i]],
-                                                  make_subtree=(not full_tree))[0, 1]
-                            else:
-                                dissim = metric_f(otumtx[[rowidx, i], :])[0, 1]
-                            dissims.append(dissim)
-                        row_dissims.append(dissims)
-                    else:
-                        # do whole row at once
-                        dissims = row_metric(otumtx,
-                                             otu_table.ObservationIds, tree,
-                                             otu_table.SampleIds, rowid,
-                                             make_subtree=(not full_tree))
-                        row_dissims.append(dissims)
+            row_dissims = get_row_dissims(metric, metric_f, is_phylogenetic,
+                                          otumtx, otu_table, tree,
+                                          rowids_list, full_tree)
 
             return format_matrix(row_dissims, rowids_list, otu_table.SampleIds)
 
 
 def multiple_file_beta(input_path, output_dir, metrics, tree_path,
-                       rowids=None, full_tree=False):
+                       rowids=None, full_tree=False, memory_budget=None,
+                       output_format='text'):
     """ runs beta diversity for each input file in the input directory
 
     performs minimal error checking on input args, then calls single_file_beta
@@ -448,4 +534,5 @@ def multiple_file_beta(input_path, output_dir, metrics, tree_path,
 
     for fname in file_names:
         single_file_beta(os.path.join(input_path, fname),
-                         metrics, tree_path, output_dir, rowids, full_tree)
+                         metrics, tree_path, output_dir, rowids, full_tree,
+                         memory_budget, output_format)
@@ -18,9 +18,37 @@ import cogent.maths.unifrac.fast_tree as fast_tree
  #    G, unnormalized_G, weighted_unifrac)
 from cogent.maths.unifrac.fast_unifrac import fast_unifrac, fast_unifrac_one_sample
 from qiime.parse import make_envs_dict
+from qiime.unifrac import unifrac_matrix, unifrac_row, get_unifrac_rows_f
+from scipy.sparse import csr_matrix, issparse
+from scipy.stats import rankdata
 import numpy
 import warnings
 
+# the cogent metrics which are calculated with qiime.unifrac, and the names of
+# the qiime.unifrac metrics
+_unweighted_unifrac_metrics = {
+    fast_tree.unifrac: 'unweighted_unifrac',
+    fast_tree.unnormalized_unifrac: 'unweighted_unifrac_full_tree',
+    fast_tree.G: 'unifrac_g',
+    fast_tree.unnormalized_G: 'unifrac_g_full_tree'}
+
+
+def _get_unifrac_metric_name(weighted, metric, kwargs):
+    """Return the qiime.unifrac name of a unifrac-like metric
+
+    Returns None if the metric must be calculated with cogent's fast_unifrac,
+    i.e. if it is not one of the known metrics or kwargs other than
+    make_subtree and block_memory are passed.
+    """
+    if set(kwargs) - set(['make_subtree', 'block_memory']):
+        return None
+    if weighted == 'correct':
+        return 'weighted_normalized_unifrac'
+    elif weighted:
+        return 'weighted_unifrac'
+    else:
+        return _unweighted_unifrac_metrics.get(metric)
+
 
 def make_unifrac_metric(weighted, metric, is_symmetric):
     """Make a unifrac-like metric.
@@ -31,13 +59,25 @@ def make_unifrac_metric(weighted, metric, is_symmetric):
     metric: f(branch_lengths, i, j) -> distance
     is_symmetric: saves calc time if metric is symmetric.
     kwargs passed to fast_unifrac
+
+    The known metrics are calculated directly from the data matrix by
+    qiime.unifrac.unifrac_matrix, and others with cogent's fast_unifrac.
     """
     def result(data, taxon_names, tree, sample_names, **kwargs):
         """ wraps the fast_unifrac fn to return just a matrix, in correct order
 
             sample_names: list of unique strings
         """
+        metric_name = _get_unifrac_metric_name(weighted, metric, kwargs)
+        # fast_unifrac only calculates half of the matrix for symmetric
+        # metrics, so asymmetric metrics flagged as symmetric are left to it
+        if metric_name is not None and \
+                is_symmetric == (not metric_name.startswith('unifrac_g')):
+            return unifrac_matrix(data, taxon_names, tree, sample_names,
+                                  metric_name, **kwargs)
 
+        # block_memory only applies to qiime.unifrac
+        kwargs.pop('block_memory', None)
         envs = make_envs_dict(data, sample_names, taxon_names)
         unifrac_res = fast_unifrac(
             tree, envs, weighted=weighted, metric=metric,
@@ -75,6 +115,10 @@ def make_unifrac_row_metric(weighted, metric, is_symmetric):
     metric: f(branch_lengths, i, j) -> distance
     is_symmetric: ignored
     sample_name: of the sample corresponding to the row of the dissim mtx
+
+    The known metrics are calculated directly from the data matrix by
+    qiime.unifrac.unifrac_row, and others with cogent's
+    fast_unifrac_one_sample.
     """
     def result(data, taxon_names, tree, sample_names,
                one_sample_name, **kwargs):
@@ -82,6 +126,11 @@ def make_unifrac_row_metric(weighted, metric, is_symmetric):
 
             sample_names: list of unique strings
         """
+        metric_name = _get_unifrac_metric_name(weighted, metric, kwargs)
+        if metric_name is not None:
+            return unifrac_row(data, taxon_names, tree, sample_names,
+                               one_sample_name, metric_name, **kwargs)
+        kwargs.pop('block_memory', None)
         envs = make_envs_dict(data, sample_names, taxon_names)
         try:
             unifrac_res = fast_unifrac_one_sample(one_sample_name,
@@ -99,6 +148,22 @@ def make_unifrac_row_metric(weighted, metric, is_symmetric):
         dist_mtx = _reorder_unifrac_res_one_sample(unifrac_res,
                                                    sample_names)
         return dist_mtx
+
+    def get_rows_f(data, taxon_names, tree, sample_names, **kwargs):
+        """ returns f(row_sample_names) -> array of the rows of those samples
+
+            The known metrics prepare the tree and data once for all of
+            the rows, and calculate them in blocks, with
+            qiime.unifrac.get_unifrac_rows_f.
+        """
+        metric_name = _get_unifrac_metric_name(weighted, metric, kwargs)
+        if metric_name is not None:
+            return get_unifrac_rows_f(data, taxon_names, tree, sample_names,
+                                      metric_name, **kwargs)
+        return lambda row_sample_names: numpy.array(
+            [result(data, taxon_names, tree, sample_names, one_sample_name,
+                    **kwargs) for one_sample_name in row_sample_names])
+    result.getRowsF = get_rows_f
     return result
 
 one_sample_unweighted_unifrac = make_unifrac_row_metric(
@@ -192,3 +257,470 @@ def _reorder_unifrac_res_one_sample(
                 unifrac_i = unifrac_sample_names_idx[sam_i]
                 dist_arry[i] = unifrac_dist_arry[unifrac_i]
     return dist_arry
+
+
+# Row metrics for the nonphylogenetic metrics in
+# cogent.maths.distance_transform. These calculate the distances from a set of
+# rows (samples) to all rows of the data matrix in one vectorized call, and
+# should start with rows_ to be discoverable by beta_diversity.py. Values
+# which depend on the whole matrix (e.g., the column sums used by chisq) are
+# stored in the optional cache dict, so they are only calculated once when a
+# matrix is processed in several sets of rows. The data can also be a
+# scipy.sparse matrix, in which case only blocks of it are made dense as they
+# are compared (except by pearson and spearman_approx, whose transformed data
+# is dense anyway).
+
+# the number of bytes of elementwise terms to create at a time (larger
+# blocks are slower, as they no longer fit in the CPU caches)
+DEFAULT_ROW_BLOCK_MEMORY = 10000000
+
+
+def make_row_metric(f, binary=False, nonnegative=True, finite=True):
+    """Make a row metric from f(data, rowidxs, cache, block_memory)
+
+    f returns the len(rowidxs) x num rows distances from each of rowidxs
+    binary: if True, f is passed the data as a float array of 0.0 (for zero
+     counts) and 1.0
+    nonnegative, finite: raise a ValueError if the data contains negative or
+     non-finite values, as the corresponding distance_transform function
+     does
+    """
+    def result(datamtx, rowidxs, cache=None,
+               block_memory=DEFAULT_ROW_BLOCK_MEMORY):
+        """ returns the distances from each of rowidxs to each row of datamtx
+
+            datamtx: samples x taxa array, or scipy.sparse matrix
+            rowidxs: list of row indices
+            cache: dict in which values calculated from the whole of
+             datamtx are stored, to be passed in each call for datamtx
+        """
+        if cache is None:
+            cache = {}
+        cache = cache.setdefault(binary, {})
+        data = _get_cached(cache, 'data',
+                           lambda: _get_row_metric_data(datamtx, binary))
+        values = _get_values(data)
+        if finite and not _get_cached(cache, 'finite',
+                                      lambda: numpy.isfinite(values).all()):
+            raise ValueError("non finite number in input matrix")
+        if nonnegative and _get_cached(cache, 'negative',
+                                       lambda: (values < 0.0).any()):
+            raise ValueError("negative value in input matrix")
+        rowidxs = numpy.asarray(rowidxs, int)
+        if 0 in data.shape:
+            return numpy.zeros((len(rowidxs), data.shape[0]))
+        old_settings = numpy.seterr(divide='ignore', invalid='ignore')
+        try:
+            dists = f(data, rowidxs, cache, block_memory)
+        finally:
+            numpy.seterr(**old_settings)
+        dists[numpy.arange(len(rowidxs)), rowidxs] = 0.0
+        return dists
+    return result
+
+
+def _get_row_metric_data(datamtx, binary):
+    """Return datamtx as a 2D float array, converted to 0/1 if binary
+
+    A scipy.sparse datamtx is returned as a scipy.sparse.csr_matrix copy.
+    """
+    if issparse(datamtx):
+        data = csr_matrix(datamtx, dtype=float, copy=True)
+        data.eliminate_zeros()
+        if binary:
+            data.data = data.data.astype(bool).astype(float)
+        return data
+    datamtx = numpy.asarray(datamtx)
+    if datamtx.ndim != 2:
+        raise ValueError("input matrix not 2D")
+    if binary:
+        return datamtx.astype(bool).astype(float)
+    return datamtx.astype(float)
+
+
+def _get_cached(cache, key, f):
+    """Return cache[key], setting it to f() if it isn't set"""
+    try:
+        return cache[key]
+    except KeyError:
+        result = cache[key] = f()
+        return result
+
+
+def _get_values(data):
+    """Return the stored values of data (all of them if it isn't sparse)"""
+    if issparse(data):
+        return data.data
+    return data
+
+
+def _to_dense(data):
+    """Return data as a dense array"""
+    if issparse(data):
+        return data.toarray()
+    return data
+
+
+def _map_values(data, f):
+    """Return f applied to each value of data, where f(0) == 0"""
+    if issparse(data):
+        result = data.copy()
+        result.data = f(result.data)
+        return result
+    return f(data)
+
+
+def _sums(data, axis):
+    """Return the sums of data along axis as a 1D array"""
+    return numpy.asarray(data.sum(axis=axis)).ravel()
+
+
+def _divide_rows(data, divisors):
+    """Return each row of data divided by the corresponding divisor"""
+    if issparse(data):
+        result = data.copy()
+        result.data /= divisors[numpy.arange(data.shape[0]).repeat(
+            numpy.diff(data.indptr))]
+        return result
+    return data / divisors[:, None]
+
+
+def _divide_columns(data, divisors):
+    """Return each column of data divided by the corresponding divisor"""
+    if issparse(data):
+        result = data.copy()
+        result.data /= divisors[result.indices]
+        return result
+    return data / divisors
+
+
+def _dot_rows(a, rowidxs, b):
+    """Return the dot product of each of the rows rowidxs of a with each row
+    of b (both dense or both sparse)
+    """
+    if issparse(a):
+        return a[rowidxs].dot(b.T).toarray()
+    return numpy.dot(a[rowidxs], b.T)
+
+
+def _sum_pair_terms(data, rowidxs, terms_f, block_memory):
+    """Return the sums over columns of terms_f for each pair of rows
+
+    terms_f: f(a, b) -> elementwise terms, where a is a slice of columns of
+     the rows in rowidxs and b is the same slice of all rows, shaped so that
+     they broadcast to rows x all rows x columns
+    block_memory: approximate number of bytes of terms to create at a time
+    """
+    rows = data[rowidxs]
+    num_rows, num_all, num_cols = len(rowidxs), data.shape[0], data.shape[1]
+    result = numpy.zeros((num_rows, num_all))
+    # split the rows, all rows and columns so that each block of terms
+    # holds about block_memory bytes
+    terms_budget = max(1, int(block_memory // 8))
+    row_block = max(1, min(num_rows, terms_budget // max(num_all, 1)))
+    all_block = max(1, min(num_all, terms_budget // row_block))
+    col_block = max(1, terms_budget // (row_block * all_block))
+    if issparse(data):
+        # sparse blocks of columns are only made dense as they are used
+        rows = rows.tocsc()
+    # (the ends of the blocks are clamped, as older scipy.sparse matrices
+    # reject slices past their end)
+    for j in range(0, num_all, all_block):
+        j_end = min(j + all_block, num_all)
+        all_rows = data[j:j_end]
+        if issparse(all_rows):
+            all_rows = all_rows.tocsc()
+        for i in range(0, num_rows, row_block):
+            i_end = min(i + row_block, num_rows)
+            for k in range(0, num_cols, col_block):
+                k_end = min(k + col_block, num_cols)
+                a = _to_dense(rows[i:i_end, k:k_end])
+                b = _to_dense(all_rows[:, k:k_end])
+                result[i:i_end, j:j_end] += terms_f(
+                    a[:, None], b[None]).sum(axis=2)
+    return result
+
+
+def _absolute_difference(a, b):
+    return numpy.absolute(a - b)
+
+
+def _squared_difference(a, b):
+    return numpy.square(a - b)
+
+
+def _set_empty_row_distances(dists, rowidxs, empty):
+    """Set distances between empty rows to 0.0, and to others to 1.0
+
+    empty: bool array, True for each row of the data which is all zeros
+    """
+    row_empty = empty[rowidxs][:, None]
+    dists[row_empty | empty] = 1.0
+    dists[row_empty & empty] = 0.0
+    return dists
+
+
+def _get_row_sums(data, cache):
+    return _get_cached(cache, 'row_sums', lambda: _sums(data, 1))
+
+
+def _get_profiles(data, cache):
+    """Return each row divided by its sum (all zero rows are left as zeros)
+    """
+    def f():
+        row_sums = _get_row_sums(data, cache)
+        return _divide_rows(data, numpy.where(row_sums == 0.0, 1.0, row_sums))
+    return _get_cached(cache, 'profiles', f)
+
+
+def _get_binary_counts(data, rowidxs):
+    """Return the number of nonzero columns shared by each pair of rows"""
+    return _dot_rows(data, rowidxs, data)
+
+
+def _rows_bray_curtis(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    totals = row_sums[rowidxs][:, None] + row_sums
+    dists = _sum_pair_terms(data, rowidxs, _absolute_difference,
+                            block_memory) / totals
+    dists[totals <= 0] = 0.0
+    return dists
+
+
+def _rows_bray_curtis_magurran(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    totals = row_sums[rowidxs][:, None] + row_sums
+    dists = 1 - 2 * _sum_pair_terms(data, rowidxs, numpy.minimum,
+                                    block_memory) / totals
+    dists[totals == 0] = 0.0
+    return dists
+
+
+def _canberra_terms(a, b):
+    return numpy.nan_to_num(numpy.absolute(a - b) / (a + b))
+
+
+def _rows_canberra(data, rowidxs, cache, block_memory):
+    sums = _sum_pair_terms(data, rowidxs, _canberra_terms, block_memory)
+    counts = _sum_pair_terms(data, rowidxs,
+                             lambda a, b: _canberra_terms(a, b) != 0,
+                             block_memory)
+    return numpy.nan_to_num(sums / counts)
+
+
+def _rows_chisq(data, rowidxs, cache, block_memory):
+    def f():
+        col_sums = _sums(data, 0)
+        col_sums[col_sums == 0.0] = 1.0
+        return _divide_columns(_get_profiles(data, cache),
+                               numpy.sqrt(col_sums))
+    weighted_profiles = _get_cached(cache, 'chisq_profiles', f)
+    dists = numpy.sqrt(data.sum()) * numpy.sqrt(
+        _sum_pair_terms(weighted_profiles, rowidxs, _squared_difference,
+                        block_memory))
+    return _set_empty_row_distances(dists, rowidxs,
+                                    _get_row_sums(data, cache) == 0.0)
+
+
+def _rows_chord(data, rowidxs, cache, block_memory):
+    def f():
+        norms = numpy.sqrt(_sums(_map_values(data, numpy.square), 1))
+        return _divide_rows(data, numpy.where(norms == 0.0, 1.0, norms)), \
+            norms == 0.0
+    normalized, empty = _get_cached(cache, 'chord', f)
+    dists = numpy.sqrt(_sum_pair_terms(normalized, rowidxs,
+                                       _squared_difference, block_memory))
+    return _set_empty_row_distances(dists, rowidxs, empty)
+
+
+def _rows_euclidean(data, rowidxs, cache, block_memory):
+    dists = numpy.sqrt(_sum_pair_terms(data, rowidxs, _squared_difference,
+                                       block_memory))
+    if numpy.isnan(dists).any():
+        raise RuntimeError(
+            'ERROR: overflow when computing euclidean distance')
+    return dists
+
+
+def _rows_gower(data, rowidxs, cache, block_memory):
+    def f():
+        col_ranges = (_to_dense(data.max(axis=0)) -
+                      _to_dense(data.min(axis=0))).ravel()
+        col_ranges[col_ranges == 0.0] = 1.0
+        return _divide_columns(data, col_ranges)
+    scaled = _get_cached(cache, 'gower', f)
+    return _sum_pair_terms(scaled, rowidxs, _absolute_difference,
+                           block_memory)
+
+
+def _rows_hellinger(data, rowidxs, cache, block_memory):
+    roots = _get_cached(cache, 'hellinger',
+                        lambda: _map_values(_get_profiles(data, cache),
+                                            numpy.sqrt))
+    dists = numpy.sqrt(_sum_pair_terms(roots, rowidxs, _squared_difference,
+                                       block_memory))
+    return _set_empty_row_distances(dists, rowidxs,
+                                    _get_row_sums(data, cache) == 0.0)
+
+
+def _rows_kulczynski(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    min_sums = _sum_pair_terms(data, rowidxs, numpy.minimum, block_memory)
+    dists = 1.0 - (min_sums / row_sums[rowidxs][:, None] +
+                   min_sums / row_sums) / 2.0
+    return _set_empty_row_distances(dists, rowidxs, row_sums == 0.0)
+
+
+def _rows_manhattan(data, rowidxs, cache, block_memory):
+    return _sum_pair_terms(data, rowidxs, _absolute_difference, block_memory)
+
+
+def _rows_abund_jaccard(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    present = _get_cached(cache, 'present', lambda: _map_values(
+        data, lambda values: (values != 0).astype(float)))
+    # the fraction of each sample's counts in the taxa shared with the other
+    u = _dot_rows(data, rowidxs, present) / row_sums[rowidxs][:, None]
+    v = _dot_rows(present, rowidxs, data) / row_sums
+    similarities = (u * v) / (u + v - (u * v))
+    similarities[(u == 0.0) & (v == 0.0)] = 0.0
+    return _set_empty_row_distances(1 - similarities, rowidxs,
+                                    row_sums == 0.0)
+
+
+def _rows_morisita_horn(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+
+    def f():
+        row_ds = _sums(_map_values(data, numpy.square), 1)
+        nonzero = row_ds != 0.0
+        row_ds[nonzero] /= row_sums[nonzero] ** 2
+        return row_ds
+    row_ds = _get_cached(cache, 'morisita_horn', f)
+    similarities = 2 * _dot_rows(data, rowidxs, data) / (
+        (row_ds[rowidxs][:, None] + row_ds) * row_sums[rowidxs][:, None] *
+        row_sums)
+    return _set_empty_row_distances(1 - similarities, rowidxs,
+                                    row_sums == 0.0)
+
+
+def _rows_pearson(data, rowidxs, cache, block_memory):
+    def f():
+        dense = _to_dense(data)
+        deviations = dense - dense.mean(axis=1)[:, None]
+        return deviations, numpy.square(deviations).sum(axis=1)
+    deviations, squares = _get_cached(cache, 'pearson', f)
+    correlations = numpy.dot(deviations[rowidxs], deviations.T) / \
+        numpy.sqrt(squares[rowidxs][:, None] * squares)
+    # rows with no variance are perfectly correlated only with each other
+    return _set_empty_row_distances(1.0 - correlations, rowidxs,
+                                    squares == 0.0)
+
+
+def _rows_soergel(data, rowidxs, cache, block_memory):
+    tops = _sum_pair_terms(data, rowidxs, _absolute_difference, block_memory)
+    bottoms = _sum_pair_terms(data, rowidxs, numpy.maximum, block_memory)
+    dists = tops / bottoms
+    dists[bottoms <= 0.0] = 0.0
+    return dists
+
+
+def _rows_spearman_approx(data, rowidxs, cache, block_memory):
+    num_cols = data.shape[1]
+    if num_cols < 2:
+        raise ValueError("input matrix has < 2 columns")
+    ranks = _get_cached(
+        cache, 'ranks', lambda: numpy.array(
+            [rankdata(_to_dense(data[i]).ravel())
+             for i in range(data.shape[0])]))
+    return 6 * _sum_pair_terms(ranks, rowidxs, _squared_difference,
+                               block_memory) / float(num_cols *
+                                                     (num_cols ** 2 - 1))
+
+
+def _rows_specprof(data, rowidxs, cache, block_memory):
+    dists = numpy.sqrt(_sum_pair_terms(_get_profiles(data, cache), rowidxs,
+                                       _squared_difference, block_memory))
+    return _set_empty_row_distances(dists, rowidxs,
+                                    _get_row_sums(data, cache) == 0.0)
+
+
+def _rows_binary_otu_gain(data, rowidxs, cache, block_memory):
+    # the taxa in each of rowidxs which aren't in each row are those in it
+    # less those it shares with the row
+    positive = _map_values(data, lambda values: (values > 0).astype(float))
+    nonzero = _map_values(data, lambda values: (values != 0).astype(float))
+    return (_sums(positive[rowidxs], 1)[:, None] -
+            _dot_rows(positive, rowidxs, nonzero))
+
+
+def _rows_binary_sorensen_dice(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    totals = row_sums[rowidxs][:, None] + row_sums
+    dists = 1 - 2 * _get_binary_counts(data, rowidxs) / totals
+    dists[totals == 0] = 0.0
+    return dists
+
+
+def _rows_binary_hamming(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    return row_sums[rowidxs][:, None] + row_sums - \
+        2.0 * _get_binary_counts(data, rowidxs)
+
+
+def _rows_binary_jaccard(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    shared = _get_binary_counts(data, rowidxs)
+    dists = 1.0 - shared / (row_sums[rowidxs][:, None] + row_sums - shared)
+    dists[(row_sums[rowidxs][:, None] == 0.0) & (row_sums == 0.0)] = 0.0
+    return dists
+
+
+def _rows_binary_lennon(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    shared = _get_binary_counts(data, rowidxs)
+    dists = 1.0 - shared / (shared + numpy.minimum(
+        row_sums[rowidxs][:, None] - shared, row_sums - shared))
+    dists[shared == 0.0] = 1.0
+    dists[(row_sums[rowidxs][:, None] == 0.0) & (row_sums == 0.0)] = 0.0
+    return dists
+
+
+def _rows_binary_ochiai(data, rowidxs, cache, block_memory):
+    row_sums = _get_row_sums(data, cache)
+    dists = 1.0 - _get_binary_counts(data, rowidxs) / \
+        numpy.sqrt(row_sums[rowidxs][:, None] * row_sums)
+    return _set_empty_row_distances(dists, rowidxs, row_sums == 0.0)
+
+
+rows_bray_curtis = make_row_metric(_rows_bray_curtis)
+# as in distance_transform, where dist_bray_curtis_faith is dist_bray_curtis
+rows_bray_curtis_faith = rows_bray_curtis
+rows_bray_curtis_magurran = make_row_metric(_rows_bray_curtis_magurran)
+rows_canberra = make_row_metric(_rows_canberra)
+rows_chisq = make_row_metric(_rows_chisq)
+rows_chord = make_row_metric(_rows_chord, nonnegative=False)
+rows_euclidean = make_row_metric(_rows_euclidean, nonnegative=False)
+rows_gower = make_row_metric(_rows_gower, nonnegative=False)
+rows_hellinger = make_row_metric(_rows_hellinger)
+rows_kulczynski = make_row_metric(_rows_kulczynski)
+rows_manhattan = make_row_metric(_rows_manhattan, nonnegative=False)
+rows_abund_jaccard = make_row_metric(_rows_abund_jaccard)
+rows_morisita_horn = make_row_metric(_rows_morisita_horn)
+rows_pearson = make_row_metric(_rows_pearson, nonnegative=False)
+rows_soergel = make_row_metric(_rows_soergel)
+rows_spearman_approx = make_row_metric(_rows_spearman_approx,
+                                       nonnegative=False)
+rows_specprof = make_row_metric(_rows_specprof)
+rows_binary_otu_gain = make_row_metric(_rows_binary_otu_gain,
+                                       nonnegative=False, finite=False)
+rows_binary_chisq = make_row_metric(_rows_chisq, binary=True)
+rows_binary_chord = make_row_metric(_rows_chord, binary=True)
+rows_binary_euclidean = make_row_metric(_rows_euclidean, binary=True)
+rows_binary_pearson = make_row_metric(_rows_pearson, binary=True)
+rows_binary_sorensen_dice = make_row_metric(_rows_binary_sorensen_dice,
+                                            binary=True)
+rows_binary_hamming = make_row_metric(_rows_binary_hamming, binary=True)
+rows_binary_jaccard = make_row_metric(_rows_binary_jaccard, binary=True)
+rows_binary_lennon = make_row_metric(_rows_binary_lennon, binary=True)
+rows_binary_ochiai = make_row_metric(_rows_binary_ochiai, binary=True)
@@ -24,7 +24,8 @@ methods = ['adonis', 'anosim', 'best', 'morans_i', 'mrpp', 'permanova',
            'permdisp', 'dbrda']
 
 
-def compare_categories(dm_fp, map_fp, method, categories, num_perms, out_dir):
+def compare_categories(dm_fp, map_fp, method, categories, num_perms, out_dir,
+                       jobs_to_start=1):
     """Runs the specified statistical method using the category of interest.
 
     This method does not return anything; all output is written to results
@@ -43,6 +44,9 @@ def compare_categories(dm_fp, map_fp, method, categories, num_perms, out_dir):
         out_dir - path to the output directory where results files will be
             written. It is assumed that this directory already exists and we
             have write permissions to it
+        jobs_to_start - the number of processes to compute the permuted
+            statistics with. Only applies if method is 'anosim' or
+            'permanova'; the results don't depend on it
     """
 
     # Make sure we were passed a list of categories, not a single string.
@@ -130,7 +134,7 @@ def compare_categories(dm_fp, map_fp, method, categories, num_perms, out_dir):
         rex(command_args, '%s.r' % method, output_dir=out_dir)
     elif method == 'anosim':
         anosim = Anosim(md_map, dm, categories[0])
-        anosim_results = anosim(num_perms)
+        anosim_results = anosim(num_perms, jobs_to_start)
 
         out_f = open(join(out_dir, '%s_results.txt' % method), 'w+')
         out_f.write(format_anosim_results(anosim_results))
@@ -144,7 +148,7 @@ def compare_categories(dm_fp, map_fp, method, categories, num_perms, out_dir):
         out_f.close()
     elif method == 'permanova':
         permanova = Permanova(md_map, dm, categories[0])
-        permanova_results = permanova(num_perms)
+        permanova_results = permanova(num_perms, jobs_to_start)
 
         out_f = open(join(out_dir, '%s_results.txt' % method), 'w+')
         out_f.write(format_permanova_results(permanova_results))
@@ -11,7 +11,9 @@ __maintainer__ = "Jai Ram Rideout"
 __email__ = "jai.rideout@gmail.com"
 
 from os import path
+from multiprocessing import Pool
 
+from numpy.random import get_state, randint, seed, set_state
 from skbio.core.distance import DistanceMatrix
 
 from qiime.format import format_p_value_for_num_iters
@@ -21,7 +23,7 @@ from qiime.stats import Mantel, MantelCorrelogram, PartialMantel
 
 def run_mantel_test(method, fps, distmats, num_perms, tail_type, comment,
                     control_dm_fp=None, control_dm=None,
-                    sample_id_map=None):
+                    sample_id_map=None, jobs_to_start=1):
     """Runs a Mantel test on all pairs of distance matrices.
 
     Returns a string suitable for writing out to a file containing the results
@@ -49,6 +51,10 @@ def run_mantel_test(method, fps, distmats, num_perms, tail_type, comment,
             then)
         sample_id_map - dict mapping sample IDs (i.e. what is expected by
             make_compatible_distance_matrices)
+        jobs_to_start - the number of processes to test the pairs of
+            distance matrices in. Each pair is tested with its own random
+            seed (drawn from the current random state), so the results don't
+            depend on how many processes are used
     """
     if len(fps) != len(distmats):
         raise ValueError("Must provide the same number of filepaths as there "
@@ -72,15 +78,51 @@ def run_mantel_test(method, fps, distmats, num_perms, tail_type, comment,
         raise ValueError("Invalid method '%s'. Must be either 'mantel' or "
                          "'partial_mantel'." % method)
 
-    # Loop over all pairs of dms.
+    # The pairs of dms are made compatible and tested one at a time, so only
+    # the pairs being tested are held in memory.
+    tests = _iter_mantel_tests(method, fps, distmats, num_perms, tail_type,
+                               control_dm, sample_id_map)
+    num_pairs = len(fps) * (len(fps) - 1) // 2
+    if jobs_to_start > 1 and num_pairs > 1:
+        pool = Pool(min(jobs_to_start, num_pairs))
+        try:
+            result += _format_mantel_test_lines(
+                method, pool.imap(_run_mantel_test, tests), num_perms,
+                tail_type, control_dm_fp)
+        finally:
+            pool.terminate()
+    else:
+        result += _format_mantel_test_lines(
+            method, (_run_mantel_test(test) for test in tests), num_perms,
+            tail_type, control_dm_fp)
+    return result
+
+
+def _iter_mantel_tests(method, fps, distmats, num_perms, tail_type,
+                       control_dm, sample_id_map):
+    """Yields the test of each pair of distance matrices for run_mantel_test.
+
+    Each test is a tuple of the filepaths of the pair, the method, the
+    (labels, data) of the two compatible distance matrices and the
+    compatible control distance matrix (labels and data are None unless
+    method is partial_mantel), the number of permutations, the tail type
+    and the random seed to use. The labels of the first matrix are None if
+    the pair has too few samples in common to be tested.
+
+    Each pair's seed is drawn from the current random state when the pair
+    is reached, whether or not it can be tested, so a pair's results don't
+    depend on which process tests it.
+    """
     for i, (fp1, (dm1_labels, dm1_data)) in enumerate(zip(fps, distmats)):
         for fp2, (dm2_labels, dm2_data) in zip(fps, distmats)[i + 1:]:
+            random_seed = randint(2 ** 31 - 1)
             # Make the current pair of distance matrices compatible by only
             # keeping samples that match between them, and ordering them by
             # the same sample IDs.
             (dm1_labels, dm1_data), (dm2_labels, dm2_data) = \
                 make_compatible_distance_matrices((dm1_labels, dm1_data),
                                                   (dm2_labels, dm2_data), lookup=sample_id_map)
+            cdm_labels = cdm_data = None
             if method == 'partial_mantel':
                 # We need to intersect three sets (three matrices).
                 (dm1_labels, dm1_data), (cdm_labels, cdm_data) = \
@@ -91,37 +133,77 @@ def run_mantel_test(method, fps, distmats, num_perms, tail_type, comment,
                     make_compatible_distance_matrices(
                         (dm1_labels, dm1_data), (dm2_labels, dm2_data),
                         lookup=sample_id_map)
-                if len(dm1_labels) < 3:
-                    result += '%s\t%s\t%s\t%d\tToo few samples\n' % (fp1,
-                                                                     fp2, control_dm_fp, len(dm1_labels))
-                    continue
-            elif len(dm1_labels) < 3:
-                result += '%s\t%s\t%d\tToo few samples\n' % (fp1, fp2,
-                                                             len(dm1_labels))
-                continue
+            if len(dm1_labels) < 3:
+                yield (fp1, fp2, method, (None, len(dm1_labels)),
+                       (None, None), (None, None), num_perms, tail_type,
+                       random_seed)
+            else:
+                yield (fp1, fp2, method, (dm1_labels, dm1_data),
+                       (dm2_labels, dm2_data), (cdm_labels, cdm_data),
+                       num_perms, tail_type, random_seed)
 
-            dm1 = DistanceMatrix(dm1_data, dm1_labels)
-            dm2 = DistanceMatrix(dm2_data, dm2_labels)
 
-            # Create an instance of our correlation test and run it with
-            # the specified number of permutations.
+def _run_mantel_test(test):
+    """Runs a Mantel or partial Mantel test for run_mantel_test.
+
+    Returns the filepaths of the pair of distance matrices, the number of
+    entries they have in common, and the Mantel r statistic and p-value of
+    the test (both None if there were too few entries to test).
+
+    Arguments:
+        test - tuple yielded by _iter_mantel_tests. The test is run with
+            its random seed, and the random state is restored afterwards.
+    """
+    fp1, fp2, method, (dm1_labels, dm1_data), (dm2_labels, dm2_data), \
+        (cdm_labels, cdm_data), num_perms, tail_type, random_seed = test
+    if dm1_labels is None:
+        return fp1, fp2, dm1_data, None, None
+
+    dm1 = DistanceMatrix(dm1_data, dm1_labels)
+    dm2 = DistanceMatrix(dm2_data, dm2_labels)
+    random_state = get_state()
+    seed(random_seed)
+    try:
+        # Create an instance of our correlation test and run it with the
+        # specified number of permutations.
+        if method == 'mantel':
+            results = Mantel(dm1, dm2, tail_type)(num_perms)
+            r_value, p_value = results['r_value'], results['p_value']
+        else:
+            cdm = DistanceMatrix(cdm_data, cdm_labels)
+            results = PartialMantel(dm1, dm2, cdm)(num_perms)
+            r_value, p_value = results['mantel_r'], results['mantel_p']
+    finally:
+        set_state(random_state)
+    return fp1, fp2, len(dm1_labels), r_value, p_value
+
+
+def _format_mantel_test_lines(method, test_results, num_perms, tail_type,
+                              control_dm_fp):
+    """Returns the lines of the results of run_mantel_test.
+
+    Arguments:
+        test_results - iterable of the results of _run_mantel_test for each
+            pair of distance matrices, in order
+    """
+    result = ''
+    for fp1, fp2, num_entries, r_value, p_value in test_results:
+        if r_value is None:
             if method == 'mantel':
-                results = Mantel(dm1, dm2, tail_type)(num_perms)
-                p_str = format_p_value_for_num_iters(results['p_value'],
-                                                     num_perms)
-                result += "%s\t%s\t%d\t%.5f\t%s\t%d\t%s\n" % (fp1, fp2,
-                                                              len(dm1_labels), results[
-                                                                  'r_value'], p_str,
-                                                              num_perms, tail_type)
-            elif method == 'partial_mantel':
-                cdm = DistanceMatrix(cdm_data, cdm_labels)
-                results = PartialMantel(dm1, dm2, cdm)(num_perms)
-                p_str = format_p_value_for_num_iters(results['mantel_p'],
-                                                     num_perms)
-                result += "%s\t%s\t%s\t%d\t%.5f\t%s\t%d\t%s\n" % (fp1, fp2,
-                                                                  control_dm_fp, len(
-                                                                      dm1_labels),
-                                                                  results['mantel_r'], p_str, num_perms, 'greater')
+                result += '%s\t%s\t%d\tToo few samples\n' % (
+                    fp1, fp2, num_entries)
+            else:
+                result += '%s\t%s\t%s\t%d\tToo few samples\n' % (
+                    fp1, fp2, control_dm_fp, num_entries)
+            continue
+        p_str = format_p_value_for_num_iters(p_value, num_perms)
+        if method == 'mantel':
+            result += "%s\t%s\t%d\t%.5f\t%s\t%d\t%s\n" % (
+                fp1, fp2, num_entries, r_value, p_str, num_perms, tail_type)
+        else:
+            result += "%s\t%s\t%s\t%d\t%.5f\t%s\t%d\t%s\n" % (
+                fp1, fp2, control_dm_fp, num_entries, r_value, p_str,
+                num_perms, 'greater')
     return result
 
 
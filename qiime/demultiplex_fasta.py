@@ -32,7 +32,7 @@ from qiime.parse import QiimeParseError, MinimalQualParser
 from qiime.hamming import decode_barcode_8
 from qiime.golay import decode as decode_golay_12
 from qiime.check_id_map import process_id_map
-from qiime.barcode import correct_barcode
+from qiime.barcode import get_barcode_corrector
 
 """ This library contains the code for demultiplexing 454 data.  Apart from
     barcode correction/mismatch counts, this code does not quality
@@ -170,8 +170,9 @@ def demultiplex_sequences(file_data,
 
     bc_lens = get_bc_lens(ids_bcs_added_field)
 
-    # Get all bcs in a list here to save computation later
-    all_bcs = [curr_bc[0] for curr_bc in ids_bcs_added_field.keys()]
+    # Get all bcs in a tuple here to save computation later (the barcode
+    # corrector is looked up by the tuple for each read)
+    all_bcs = tuple([curr_bc[0] for curr_bc in ids_bcs_added_field.keys()])
 
     log_data, bc_freqs, seq_counts, corrected_bc_count =\
         assign_seqs(
@@ -576,7 +577,7 @@ def attempt_bc_correction(curr_bc,
     elif barcode_type == 0:
         corrected_bc, num_errors = ('', 0)
     else:
-        corrected_bc, num_errors = correct_barcode(curr_bc, all_bcs)
+        corrected_bc, num_errors = get_barcode_corrector(all_bcs)(curr_bc)
 
     return corrected_bc, num_errors
 
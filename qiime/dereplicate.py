@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Contains code for collapsing identical sequences with bounded memory.
+
+Sequences are grouped on the md5 digest of the sequence (or of a fixed-length
+prefix of the sequence), so the sequences themselves are only held in memory
+once per group. When the estimated memory used by the groups exceeds a budget,
+the groups are written to a temporary file sorted by digest and the in-memory
+groups are cleared. The sorted files are merged when the groups are read back.
+The member ids of each group can then be kept on disk in a SeqIdMap.
+"""
+
+from array import array
+from hashlib import md5
+from heapq import merge
+from itertools import groupby
+from os import close, remove
+from tempfile import mkstemp, TemporaryFile
+
+from qiime.util import get_qiime_temp_dir
+
+# estimated number of bytes used by the sequences, ids and bookkeeping of the
+# groups held in memory before they are written to disk
+DEFAULT_MAX_MEMORY = 1000000000
+
+# rough per-object overheads (in bytes) used when estimating memory use
+_GROUP_OVERHEAD = 250
+_MEMBER_OVERHEAD = 80
+
+
+class SequenceDereplicator(object):
+
+    """Groups sequences which are identical or share a prefix
+
+    Sequences are added with add or add_seqs, and the groups are then
+    retrieved by iterating over the SequenceDereplicator, which yields
+    (representative id, representative sequence, member ids) in the order
+    in which each group was first seen. Member ids are in input order. The
+    representative of a group is its longest sequence, the first one seen
+    if several are equally long (so for identical sequences it is the first
+    sequence seen).
+    """
+
+    def __init__(self,
+                 prefix_length=None,
+                 max_memory=DEFAULT_MAX_MEMORY,
+                 temp_dir=None):
+        """
+        prefix_length: if provided, sequences are grouped if their first
+         prefix_length bases are identical, otherwise sequences are grouped
+         only if they are identical
+        max_memory: estimated number of bytes of groups to hold in memory
+         before writing them to a temporary file
+        temp_dir: directory where temporary files are written [default:
+         the QIIME temp_dir]
+        """
+        self.prefix_length = prefix_length
+        self.max_memory = max_memory
+        if temp_dir is None:
+            temp_dir = get_qiime_temp_dir()
+        self.temp_dir = temp_dir
+        self._seq_count = 0
+        self._run_fps = []
+        self._clear_groups()
+
+    def _clear_groups(self):
+        """Reset the in-memory groups"""
+        self._group_lookup = {}
+        self._first_indices = array('l')
+        self._rep_lengths = array('l')
+        self._rep_ids = []
+        self._rep_seqs = []
+        self._member_ids = []
+        self._digests = []
+        self._memory_used = 0
+
+    def add(self, seq_id, seq):
+        """Add a sequence to its group"""
+        if self.prefix_length is None:
+            key = seq
+        else:
+            key = seq[:self.prefix_length]
+        digest = md5(key).digest()
+        seq_len = len(seq)
+        try:
+            group = self._group_lookup[digest]
+        except KeyError:
+            self._group_lookup[digest] = len(self._rep_ids)
+            self._digests.append(digest)
+            self._first_indices.append(self._seq_count)
+            self._rep_lengths.append(seq_len)
+            self._rep_ids.append(seq_id)
+            self._rep_seqs.append(seq)
+            self._member_ids.append([seq_id])
+            self._memory_used += seq_len + len(seq_id) + _GROUP_OVERHEAD
+        else:
+            if seq_len > self._rep_lengths[group]:
+                self._memory_used += seq_len - self._rep_lengths[group]
+                self._rep_lengths[group] = seq_len
+                self._rep_ids[group] = seq_id
+                self._rep_seqs[group] = seq
+            self._member_ids[group].append(seq_id)
+            self._memory_used += len(seq_id) + _MEMBER_OVERHEAD
+        self._seq_count += 1
+
+        if self._memory_used > self.max_memory:
+            self._run_fps.append(
+                self._write_run(self._iter_memory_groups(),
+                                key=lambda g: g[0]))
+            self._clear_groups()
+
+    def add_seqs(self, seqs):
+        """Add (seq_id, seq) pairs, truncating seq_ids at the first space"""
+        for seq_id, seq in seqs:
+            self.add(seq_id.split()[0], seq)
+
+    def __iter__(self):
+        """Yield (rep_id, rep_seq, member_ids) in first-seen order"""
+        if not self._run_fps:
+            # everything fit in memory, and groups were created in
+            # first-seen order
+            for group in self._iter_memory_groups():
+                yield group[2], group[4], group[5]
+            return
+
+        # merge the groups from each file with the in-memory groups, which
+        # are all sorted by digest, then first index
+        runs = [self._read_run(fp) for fp in self._run_fps]
+        runs.append(iter(sorted(self._iter_memory_groups())))
+        merged_fps = []
+        buffered = []
+        memory_used = 0
+        for digest, groups in groupby(merge(*runs), key=lambda g: g[0]):
+            group = _combine_groups(groups)
+            buffered.append(group)
+            memory_used += group[3] + len(group[2]) + _GROUP_OVERHEAD + \
+                sum([len(m) + _MEMBER_OVERHEAD for m in group[5]])
+            if memory_used > self.max_memory:
+                merged_fps.append(self._write_run(buffered,
+                                                  key=lambda g: g[1]))
+                buffered = []
+                memory_used = 0
+
+        # merge the combined groups back into first-seen order
+        runs = [self._read_run(fp) for fp in merged_fps]
+        buffered.sort(key=lambda g: g[1])
+        runs.append(iter(buffered))
+        try:
+            for group in merge(*[((g[1], g) for g in run) for run in runs]):
+                group = group[1]
+                yield group[2], group[4], group[5]
+        finally:
+            for fp in merged_fps:
+                remove(fp)
+
+    def cleanup(self):
+        """Remove any temporary files and discard all groups"""
+        for fp in self._run_fps:
+            remove(fp)
+        self._run_fps = []
+        self._seq_count = 0
+        self._clear_groups()
+
+    def _iter_memory_groups(self):
+        """Yield the in-memory groups in first-seen order
+
+        groups are (digest, first index, rep id, rep length, rep seq,
+         member ids)
+        """
+        for i in range(len(self._rep_ids)):
+            yield (self._digests[i],
+                   self._first_indices[i],
+                   self._rep_ids[i],
+                   self._rep_lengths[i],
+                   self._rep_seqs[i],
+                   self._member_ids[i])
+
+    def _write_run(self, groups, key):
+        """Write groups to a temporary file sorted by key, returning its path
+        """
+        fd, fp = mkstemp(dir=self.temp_dir, prefix='SequenceDereplicator',
+                         suffix='.txt')
+        close(fd)
+        f = open(fp, 'w')
+        for digest, first_index, rep_id, rep_length, rep_seq, member_ids in \
+                sorted(groups, key=key):
+            f.write('%s\t%d\t%s\t%d\t%s\t%s\n' %
+                    (digest.encode('hex'), first_index, rep_id, rep_length,
+                     rep_seq, '\t'.join(member_ids)))
+        f.close()
+        return fp
+
+    def _read_run(self, fp):
+        """Yield the groups written to fp by _write_run"""
+        for line in open(fp, 'U'):
+            fields = line.rstrip('\n').split('\t')
+            yield (fields[0].decode('hex'),
+                   int(fields[1]),
+                   fields[2],
+                   int(fields[3]),
+                   fields[4],
+                   fields[5:])
+
+
+class SeqIdMap(object):
+
+    """Maps the representative id of each group of sequences to its members
+
+    The member ids of each group are written to an anonymous temporary file
+    as they are added, and only the offset of each group in the file is
+    held in memory, so the memory used doesn't grow with the number of
+    sequences in the groups. The file is removed when the SeqIdMap is
+    closed or garbage collected.
+    """
+
+    def __init__(self, temp_dir=None):
+        """
+        temp_dir: directory where the temporary file is written [default:
+         the QIIME temp_dir]
+        """
+        if temp_dir is None:
+            temp_dir = get_qiime_temp_dir()
+        self._f = TemporaryFile(dir=temp_dir, prefix='SeqIdMap')
+        self._offsets = {}
+        self._end = 0
+
+    def __setitem__(self, rep_id, member_ids):
+        self._f.seek(self._end)
+        self._f.write('%s\n' % '\t'.join(member_ids))
+        self._offsets[rep_id] = self._end
+        self._end = self._f.tell()
+
+    def __getitem__(self, rep_id):
+        self._f.seek(self._offsets[rep_id])
+        return self._f.readline().rstrip('\n').split('\t')
+
+    def __contains__(self, rep_id):
+        return rep_id in self._offsets
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        return iter(self._offsets)
+
+    def close(self):
+        """Remove the temporary file and discard all groups"""
+        self._f.close()
+        self._offsets = {}
+
+
+def _combine_groups(groups):
+    """Combine parts of one group, which must be sorted by first index"""
+    groups = list(groups)
+    digest, first_index, rep_id, rep_length, rep_seq, member_ids = groups[0]
+    member_ids = list(member_ids)
+    for group in groups[1:]:
+        if group[3] > rep_length:
+            rep_id, rep_length, rep_seq = group[2], group[3], group[4]
+        member_ids.extend(group[5])
+    return digest, first_index, rep_id, rep_length, rep_seq, member_ids
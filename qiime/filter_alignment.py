@@ -4,11 +4,12 @@ from random import sample
 from sys import stdout
 from string import lowercase
 from os.path import split, exists, splitext
-from os import mkdir, remove
+from os import mkdir, remove, close
 from collections import defaultdict
+from tempfile import mkstemp
 
 from numpy import (nonzero, array, fromstring, repeat, bitwise_or,
-    uint8, zeros, arange, finfo)
+    uint8, zeros, arange, finfo, memmap, bincount)
 
 from cogent import DNA
 from cogent.core.alignment import DenseAlignment
@@ -17,6 +18,8 @@ from cogent.core.profile import Profile
 
 from skbio.parse.sequences import parse_fasta
 
+from qiime.util import get_qiime_temp_dir
+
 
 __author__ = "Dan Knights"
 __copyright__ = "Copyright 2011, The QIIME Project"
@@ -130,6 +133,163 @@ def apply_lane_mask_and_gap_filter(fastalines, mask,
         yield "%s\n" % seq
 
 
+def alignment_to_array(fastalines, array_fp):
+    """Reads an aligned fasta file into a uint8 array memory-mapped to array_fp
+
+    The alignment is parsed once, each sequence being written to array_fp
+    as a row of bytes ('.' characters are converted to '-'). Returns the
+    list of sequence ids and a read-only memmap of shape (number of
+    sequences, alignment length), or None in place of the memmap if there
+    are no sequences.
+
+    Raises a ValueError if the sequences aren't all the same length.
+    """
+    seq_ids = []
+    seq_len = None
+    array_f = open(array_fp, 'wb')
+    try:
+        for seq_id, seq in parse_fasta(fastalines):
+            seq = seq.replace('.', '-')
+            if seq_len is None:
+                seq_len = len(seq)
+            elif len(seq) != seq_len:
+                raise ValueError("Sequence %s is of length %d, but the "
+                                 "preceding sequences are of length %d. All "
+                                 "sequences in an alignment must be the same "
+                                 "length." % (seq_id, len(seq), seq_len))
+            seq_ids.append(seq_id)
+            array_f.write(seq)
+    finally:
+        array_f.close()
+
+    if not seq_ids or seq_len == 0:
+        return seq_ids, None
+    return seq_ids, memmap(array_fp, dtype=uint8, mode='r',
+                           shape=(len(seq_ids), seq_len))
+
+
+def _iter_row_blocks(aln_array, block_size):
+    """Yields (start index, rows) of aln_array in blocks of block_size rows
+    """
+    for start in range(0, aln_array.shape[0], block_size):
+        yield start, aln_array[start:start + block_size]
+
+
+def freqs_from_array(aln_array, positions, block_size=10000):
+    """Returns per-position freqs of the aln_array columns at positions
+
+    aln_array: 2D uint8 array of sequences, as returned by
+     alignment_to_array
+    positions: index array of the columns to count
+
+    The result is the same as freqs_from_aln_array on the alignment with
+    existing_mask=positions, but is computed with column reductions over
+    blocks of block_size rows.
+    """
+    # map each character present to its index in the alphabet used by
+    # freqs_from_aln_array
+    present = zeros(256, dtype=bool)
+    for start, rows in _iter_row_blocks(aln_array, block_size):
+        rows = rows[:, positions]
+        if rows.size:
+            present |= bincount(rows.ravel(), minlength=256) > 0
+    alphabet = ModelDnaSequence('-').Alphabet
+    char_indices = [(c, ModelDnaSequence(chr(c))._data[0])
+                    for c in nonzero(present)[0]]
+
+    result = zeros((len(alphabet), len(positions)), dtype=int)
+    for start, rows in _iter_row_blocks(aln_array, block_size):
+        rows = rows[:, positions]
+        for c, i in char_indices:
+            result[i] += (rows == c).sum(0)
+    return Profile(result, alphabet)
+
+
+def apply_lane_mask_and_gap_filter_array(fastalines, mask,
+                                         allowed_gap_frac=1 -
+                                         finfo(float).eps,
+                                         verbose=False,
+                                         entropy_threshold=None,
+                                         working_dir=None,
+                                         block_size=10000):
+    """Applies a mask and gap filter to fasta file, yielding filtered seqs.
+
+    The results are the same as those of apply_lane_mask_and_gap_filter,
+    but the alignment is parsed only once, into a uint8 array
+    memory-mapped to a temporary file in working_dir (the QIIME temp dir
+    by default). The gap fractions and the entropy of each column are
+    computed with column reductions over the array, and the filtered
+    sequences are selected from it block_size rows at a time.
+    """
+    if entropy_threshold is not None and not (0 < entropy_threshold < 1):
+        raise ValueError('Entropy threshold parameter (-e) needs to be '
+                         'between 0 and 1')
+
+    if working_dir is None:
+        working_dir = get_qiime_temp_dir()
+    fd, array_fp = mkstemp(dir=working_dir, prefix='filter_alignment_',
+                           suffix='.bin')
+    close(fd)
+    try:
+        seq_ids, aln_array = alignment_to_array(fastalines, array_fp)
+        if aln_array is None:
+            for seq_id in seq_ids:
+                yield ">%s\n" % seq_id
+                yield "\n"
+            return
+        all_positions = arange(aln_array.shape[1])
+
+        if mask is not None:
+            mask = mask_to_positions(mask)
+            prefilter_positions = mask
+        else:
+            prefilter_positions = all_positions
+
+        # resolve the gaps based on masked sequence
+        gapmask = None
+        if allowed_gap_frac < 1:
+            gapcounts = zeros(len(prefilter_positions))
+            for start, rows in _iter_row_blocks(aln_array, block_size):
+                gapcounts += (rows[:, prefilter_positions] == 45).sum(0)
+            gapmask = (gapcounts / len(seq_ids)) <= allowed_gap_frac
+            gapmask = mask_to_positions(gapmask)
+
+        # resolve the entropy mask
+        ent_mask = None
+        if entropy_threshold is not None:
+            if gapmask is None:
+                freqs = freqs_from_array(aln_array, all_positions, block_size)
+            else:
+                freqs = freqs_from_array(aln_array, gapmask, block_size)
+            ent_mask = mask_to_positions(lane_mask_from_freqs(
+                freqs, entropy_threshold))
+
+        # The masks are composed in the same order as they are applied to
+        # each sequence in apply_lane_mask_and_gap_filter
+        if mask is None:
+            positions = all_positions
+            if gapmask is not None:
+                positions = positions[gapmask]
+            if ent_mask is not None:
+                positions = positions[ent_mask]
+        else:
+            if ent_mask is not None:
+                positions = ent_mask
+            else:
+                positions = mask
+            if gapmask is not None:
+                positions = positions[gapmask]
+
+        # mask and yield
+        for start, rows in _iter_row_blocks(aln_array, block_size):
+            rows = rows[:, positions]
+            for i, row in enumerate(rows):
+                yield ">%s\n" % seq_ids[start + i]
+                yield "%s\n" % row.tostring()
+    finally:
+        remove(array_fp)
+
+
 def remove_outliers(seqs, num_sigmas, fraction_seqs_for_stats=.95):
     """ remove sequences very different from the majority consensus
 
@@ -185,6 +345,15 @@ def generate_lane_mask(infile, entropy_threshold, existing_mask=None):
     """
 
     base_freqs = freqs_from_aln_array(infile, existing_mask)
+    return lane_mask_from_freqs(base_freqs, entropy_threshold)
+
+
+def lane_mask_from_freqs(base_freqs, entropy_threshold):
+    """ Generates lane mask from a Profile of per-position base frequencies
+
+    base_freqs: Profile, as returned by freqs_from_aln_array
+    entropy_threshold: as for generate_lane_mask
+    """
     uncertainty = base_freqs.columnUncertainty()
     uncertainty_sorted = sorted(uncertainty)
 
@@ -21,6 +21,8 @@ from skbio.core.sequence import BiologicalSequence
 from biom.table import DenseOTUTable, SparseTaxonTable, table_factory
 
 from qiime.util import get_qiime_library_version, load_qiime_config
+from qiime.parse import (BINARY_DISTMAT_MAGIC, BINARY_DISTMAT_ALIGNMENT,
+                         DISTMAT_FORMATS)
 from qiime.colors import data_color_hsv
 
 """Contains formatters for the files we expect to encounter in 454 workflow.
@@ -334,6 +336,52 @@ def format_distance_matrix(labels, data):
     return format_matrix(data, labels, labels)
 
 
+def write_distance_matrix(f, labels, row_blocks, output_format='text'):
+    """Writes a distance matrix to open file f as its rows are calculated
+
+    labels: the sample ids, in the order of the rows and columns
+    row_blocks: iterable of 2d arrays of consecutive rows of the matrix.
+     Each block is written as soon as it is generated, so the whole matrix
+     is never held in memory.
+    output_format: 'text' writes the tab-delimited text of
+     format_distance_matrix. 'float32' and 'float64' write a binary file
+     which can be memory-mapped with qiime.parse.parse_binary_distmat: a
+     header line, the tab-separated labels on a line starting with a tab,
+     then space padding and the row-major matrix at an aligned offset.
+     f must be opened in binary mode for these.
+    """
+    labels = map(str, labels)
+    if output_format not in DISTMAT_FORMATS:
+        raise ValueError("Unknown distance matrix format %s. Known formats "
+                         "are: %s" % (output_format,
+                                      ', '.join(sorted(DISTMAT_FORMATS))))
+    dtype = DISTMAT_FORMATS[output_format]
+    if dtype is None:
+        f.write('\t'.join([''] + labels))
+    else:
+        header = '%s\t%s\t%d\n\t%s\n' % (BINARY_DISTMAT_MAGIC,
+                                          output_format, len(labels),
+                                          '\t'.join(labels))
+        padding = -(len(header) + 1) % BINARY_DISTMAT_ALIGNMENT
+        f.write(header + ' ' * padding + '\n')
+
+    num_rows = 0
+    for block in row_blocks:
+        block = asarray(block)
+        if block.ndim != 2 or block.shape[1] != len(labels):
+            raise ValueError("Block shape %s doesn't match %d labels" %
+                             (block.shape, len(labels)))
+        if dtype is None:
+            for sam, vals in zip(labels[num_rows:], block):
+                f.write('\n' + '\t'.join([sam] + map(str, vals)))
+        else:
+            f.write(block.astype(dtype).tostring())
+        num_rows += len(block)
+    if num_rows != len(labels):
+        raise ValueError("Wrote %d rows for %d labels" %
+                         (num_rows, len(labels)))
+
+
 def format_matrix(data, row_names, col_names):
     """Writes matrix as tab-delimited text.
 
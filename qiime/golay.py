@@ -1,4 +1,6 @@
 #!/usr/bin/env python
+from itertools import product
+
 import numpy
 
 __author__ = "Justin Kuczynski"
@@ -14,6 +16,10 @@ module provides golay encoding/decoding of DNA barcodes.
 may not be the same golay code as previously used.
 Provides mainly decode_nt()
 
+decode() uses GolayDecoder, which packs each barcode into a 24 bit integer
+and looks up its syndrome in integer tables, so it is fast enough to be called
+for every read. Use decode_many() to decode a batch of barcodes.
+
 If you wish to assign a read DNA seq barcode to a list of known originals,
 correcting for errors if necessary, I recommend you use the generic version
 in barcode.py .  Golay decoding assumes that the sequence can be any valid
@@ -69,19 +75,129 @@ def decode(seq, nt_to_bits=None):
     output:
     corrected_seq (str), num_bit_errors
     corrected_seq is None if 4 bit error detected"""
-    if nt_to_bits is None:
-        nt_to_bits = DEFAULT_GOLAY_NT_TO_BITS
-    received_bits = _seq_to_bits(seq, nt_to_bits)
-    corrected_bits, num_errors = decode_bits(received_bits)  # errors in # bits
-    if corrected_bits is None:
-        return None, num_errors
-    else:
-        # put match into nucleotide format
-        return _bits_to_seq(corrected_bits, nt_to_bits), num_errors
+    return get_decoder(nt_to_bits)(seq)
 # alt name for the decode function for consistency with hamming decoding
 decode_golay_12 = decode
 
 
+def decode_many(seqs, nt_to_bits=None):
+    """decodes an iterable of 12 base nucleotide strings
+
+    returns a list of (corrected_seq, num_bit_errors), as decode() would
+    return for each sequence"""
+    return get_decoder(nt_to_bits).decode_many(seqs)
+
+
+def get_decoder(nt_to_bits=None):
+    """ returns the GolayDecoder for nt_to_bits, building it if necessary
+    """
+    if nt_to_bits is None:
+        return DEFAULT_GOLAY_DECODER
+    key = tuple(sorted(nt_to_bits.items()))
+    try:
+        return _DECODERS[key]
+    except KeyError:
+        decoder = GolayDecoder(nt_to_bits)
+        _DECODERS[key] = decoder
+        return decoder
+
+
+class GolayDecoder(object):
+
+    """ decodes 12 nt golay barcodes using precomputed integer tables
+
+    each half of a barcode (6 nt, 12 bits) is looked up in tables giving its
+    bits and its contribution to the syndrome, so decoding a barcode takes
+    two lookups per half, one into the syndrome table, and a xor. results
+    for barcodes with errors are memoized, up to max_cache_size barcodes.
+
+    the tables are built on the first decode, so importing this module (and
+    creating DEFAULT_GOLAY_DECODER) stays cheap.
+    """
+
+    def __init__(self, nt_to_bits=None, max_cache_size=100000):
+        if nt_to_bits is None:
+            nt_to_bits = DEFAULT_GOLAY_NT_TO_BITS
+        self.nt_to_bits = nt_to_bits
+        self.max_cache_size = max_cache_size
+        self._cache = {}
+        self._syndrome_errors = None
+
+    def _build_tables(self):
+        """ builds the half barcode and syndrome tables """
+        nt_codes = dict([(nt, int(bits, 2))
+                         for nt, bits in self.nt_to_bits.items()])
+        self._half_codes = {}
+        self._high_syndromes = {}
+        self._low_syndromes = {}
+        self._code_halves = [None] * 4096
+        for half in product(nt_codes.keys(), repeat=6):
+            half = ''.join(half)
+            code = 0
+            for nt in half:
+                code = (code << 2) | nt_codes[nt]
+            self._half_codes[half] = code
+            self._high_syndromes[half] = _int_syndrome(code << 12)
+            self._low_syndromes[half] = _int_syndrome(code)
+            self._code_halves[code] = half
+
+        # entry is (24 bit error, num bit errors), or None for
+        # uncorrectable (4 bit) errors
+        syndrome_errors = [None] * 4096
+        for errvec in _ALL_3BIT_ERRORS:
+            err = _bitvec_to_int(errvec)
+            syndrome_errors[_int_syndrome(err)] = (err, sum(errvec))
+        # set last, as it marks the tables as built
+        self._syndrome_errors = syndrome_errors
+
+    def __call__(self, seq):
+        """ returns corrected_seq, num_bit_errors, as decode() """
+        try:
+            return self._cache[seq]
+        except KeyError:
+            pass
+
+        if len(seq) != 12:
+            raise ValueError("Golay barcodes must be 12 nt long: %s" % seq)
+        if self._syndrome_errors is None:
+            self._build_tables()
+        high = seq[:6]
+        low = seq[6:]
+        syndrome = self._high_syndromes[high] ^ self._low_syndromes[low]
+        if syndrome == 0:
+            # valid codeword, nothing to correct or remember
+            return seq, 0
+
+        error = self._syndrome_errors[syndrome]
+        if error is None:
+            result = None, 4
+        else:
+            err, num_errors = error
+            corrected = ((self._half_codes[high] << 12) |
+                         self._half_codes[low]) ^ err
+            result = (self._code_halves[corrected >> 12] +
+                      self._code_halves[corrected & 4095], num_errors)
+
+        if len(self._cache) >= self.max_cache_size:
+            self._cache.clear()
+        self._cache[seq] = result
+        return result
+
+    def decode_many(self, seqs):
+        """ returns a list of (corrected_seq, num_bit_errors), one per seq
+
+        each distinct sequence is decoded only once"""
+        decoded = {}
+        result = []
+        for seq in seqs:
+            try:
+                result.append(decoded[seq])
+            except KeyError:
+                decoded[seq] = self(seq)
+                result.append(decoded[seq])
+        return result
+
+
 def encode(bits, nt_to_bits=None):
     """ takes any 12 bits, returns the golay 24bit codeword in nucleotide format
 
@@ -162,6 +278,26 @@ def _make_3bit_errors(veclen=24):
     return errorvecs
 
 
+def _bitvec_to_int(bitvec):
+    """ e.g.: [0,1,1] -> 3, the first bit being the most significant
+    """
+    result = 0
+    for bit in bitvec:
+        result = (result << 1) | int(bit)
+    return result
+
+
+def _int_syndrome(received):
+    """ returns the 12 bit syndrome (an int) of a 24 bit received int
+
+    equivalent to _bitvec_to_int(numpy.dot(DEFAULT_H, rec) % 2), where rec
+    is the bit vector of received"""
+    syndrome = 0
+    for row in _H_ROWS:
+        syndrome = (syndrome << 1) | (bin(row & received).count('1') & 1)
+    return syndrome
+
+
 def _seq_to_bits(seq, nt_to_bits):
     """ e.g.: "AAG" -> array([0,0,0,0,1,0])
     output is array of ints, 1's and 0's
@@ -242,4 +378,12 @@ for errvec in _ALL_3BIT_ERRORS:
     syn = tuple(numpy.dot(DEFAULT_H, errvec) % 2)
     DEFAULT_SYNDROME_LUT[syn] = (errvec)
 
+# rows of H as 24 bit ints, for computing syndromes of int codewords
+_H_ROWS = [_bitvec_to_int(row) for row in DEFAULT_H]
+
+DEFAULT_GOLAY_DECODER = GolayDecoder()
+
+# decoders for non default nt_to_bits, built by get_decoder as needed
+_DECODERS = {}
+
 # END module level constants
@@ -14,10 +14,10 @@ from skbio.app.util import (which, CommandLineApplication, ResultPath,
 from skbio.parse.sequences import parse_fasta
 
 from qiime.util import (FunctionWithParams, write_degapped_fasta_to_file,
-                        split_fasta_on_sample_ids_to_files)
+                        split_fasta_on_sample_ids_to_files,
+                        get_blast_db_from_fasta_path)
 from qiime.assign_taxonomy import BlastTaxonAssigner
 
-from brokit.formatdb import build_blast_db_from_fasta_path
 from brokit.usearch import (usearch61_smallmem_cluster,
                             usearch61_chimera_check_denovo,
                             parse_usearch61_clusters,
@@ -203,7 +203,7 @@ class BlastFragmentsChimeraChecker(ChimeraChecker):
                     "refseqs_fp or blast_db must be provided to  %s" %
                     self.Name)
             blast_db, self._db_files_to_remove = \
-                build_blast_db_from_fasta_path(reference_seqs_fp)
+                get_blast_db_from_fasta_path(reference_seqs_fp)
         else:
             blast_db = params['blast_db']
             self._db_files_to_remove = []
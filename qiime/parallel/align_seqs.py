@@ -10,11 +10,12 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
-from brokit.formatdb import build_blast_db_from_fasta_path
 
-from qiime.align_seqs import compute_min_alignment_length
+from qiime.align_seqs import (compute_min_alignment_length,
+                              load_pynast_template)
 from qiime.parallel.util import ParallelWrapper
-from qiime.util import get_qiime_temp_dir
+from qiime.util import (get_qiime_temp_dir, get_blast_db_from_fasta_path,
+                        get_reference_db_cache)
 
 
 class ParallelAlignSeqsPyNast(ParallelWrapper):
@@ -28,11 +29,16 @@ class ParallelAlignSeqsPyNast(ParallelWrapper):
             # Build the blast database from the reference_seqs_fp -- all procs
             # will then access one db rather than create one per proc
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(params['template_fp'],
-                                               output_dir=get_qiime_temp_dir())
+                get_blast_db_from_fasta_path(params['template_fp'],
+                                             output_dir=get_qiime_temp_dir())
             self.files_to_remove += db_files_to_remove
             params['blast_db'] = blast_db
 
+        if get_reference_db_cache() is not None:
+            # parse and validate the template into the cache once, rather
+            # than in the first of the jobs while the others wait for it
+            load_pynast_template(params['template_fp'])
+
         if params['min_length'] < 0:
             params['min_length'] = compute_min_alignment_length(
                 open(input_fp, 'U'))
@@ -60,6 +66,7 @@ class ParallelAlignSeqsPyNast(ParallelWrapper):
         # Create lists to store the results
         commands = []
         result_filepaths = []
+        job_result_filepaths = []
 
         # If there is a value for blast_db, pass it. If not, it
         # will be created on-the-fly. Note that on-the-fly blast dbs
@@ -77,6 +84,7 @@ class ParallelAlignSeqsPyNast(ParallelWrapper):
             rename_command, current_result_filepaths = self._get_rename_command(
                 [fn % i for fn in out_filenames], working_dir, output_dir)
             result_filepaths += current_result_filepaths
+            job_result_filepaths.append(current_result_filepaths)
 
             command = \
                 '%s %s %s -p %1.2f -e %d -m pynast -t %s -a %s -o %s -i %s %s %s' %\
@@ -94,6 +102,7 @@ class ParallelAlignSeqsPyNast(ParallelWrapper):
 
             commands.append(command)
 
+        self._job_result_filepaths = job_result_filepaths
         return commands, result_filepaths
 
     def _write_merge_map_file(self,
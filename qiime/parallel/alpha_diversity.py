@@ -12,6 +12,8 @@ __email__ = "gregcaporaso@gmail.com"
 
 from os.path import join, split
 from qiime.parallel.util import ParallelWrapper
+from qiime.alpha_diversity import phylogenetic_metrics, tree_metrics
+from qiime.unifrac import get_flat_tree_from_fp, write_flat_tree
 
 
 class ParallelAlphaDiversity(ParallelWrapper):
@@ -19,6 +21,22 @@ class ParallelAlphaDiversity(ParallelWrapper):
     _job_prefix = 'ALDIV'
     _input_splitter = ParallelWrapper._input_existing_filepaths
 
+    def _precommand_initiation(
+            self, input_fp, output_dir, working_dir, params):
+        if not params['tree_path']:
+            return
+        metrics = params['metrics'].split(',')
+        if [m for m in phylogenetic_metrics
+                if m.__name__ in metrics and m not in tree_metrics]:
+            return
+        # Flatten the tree once -- all procs will then load the flattened
+        # tree rather than each parse the newick tree.
+        flat_tree_fp = join(working_dir, 'flat_tree.npz')
+        write_flat_tree(get_flat_tree_from_fp(params['tree_path']),
+                        flat_tree_fp)
+        self.files_to_remove.append(flat_tree_fp)
+        params['tree_path'] = flat_tree_fp
+
     def _identify_files_to_remove(self, job_result_filepaths, params):
         """ The output of the individual jobs are the files we want to keep
         """
@@ -9,8 +9,11 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Jai Ram Rideout"
 __email__ = "jai.rideout@gmail.com"
 
-from brokit.formatdb import build_blast_db_from_fasta_path
+from os.path import join
 
+from qiime.assign_taxonomy import (naive_bayes_model_exists,
+                                   train_naive_bayes_model)
+from qiime.util import get_blast_db_from_fasta_path
 from qiime.parallel.util import ParallelWrapper
 
 
@@ -31,6 +34,7 @@ class ParallelTaxonomyAssigner(ParallelWrapper):
         # Create lists to store the results.
         commands = []
         result_filepaths = []
+        job_result_filepaths = []
 
         # Iterate over the input files.
         for i, fasta_fp in enumerate(fasta_fps):
@@ -40,6 +44,7 @@ class ParallelTaxonomyAssigner(ParallelWrapper):
                 self._get_rename_command([fn % i for fn in out_filenames],
                                          working_dir, output_dir)
             result_filepaths += current_result_filepaths
+            job_result_filepaths.append(current_result_filepaths)
 
             command = '%s %s %s -o %s -i %s %s %s' %\
                 (command_prefix,
@@ -50,6 +55,7 @@ class ParallelTaxonomyAssigner(ParallelWrapper):
                  rename_command,
                  command_suffix)
             commands.append(command)
+        self._job_result_filepaths = job_result_filepaths
         return commands, result_filepaths
 
     def _write_merge_map_file(self,
@@ -129,6 +135,46 @@ class ParallelUclustConsensusTaxonomyAssigner(ParallelTaxonomyAssigner):
                                         command_suffix)
 
 
+class ParallelNaiveBayesTaxonomyAssigner(ParallelTaxonomyAssigner):
+    _job_prefix = 'NBTA'
+
+    def _precommand_initiation(
+            self, input_fp, output_dir, working_dir, params):
+        # Train the classifier once, and have all of the jobs load it. If
+        # the user didn't pass a model directory, the classifier is kept
+        # in the working directory, so is cleaned up with it.
+        if not params['naive_bayes_model_dir']:
+            params['naive_bayes_model_dir'] = join(working_dir,
+                                                   'naive_bayes_model')
+        if not naive_bayes_model_exists(params['naive_bayes_model_dir']):
+            train_naive_bayes_model(params['reference_seqs_fp'],
+                                    params['id_to_taxonomy_fp'],
+                                    params['naive_bayes_model_dir'],
+                                    word_size=params['naive_bayes_word_size'])
+
+    def _get_job_commands(self, fasta_fps, output_dir, params, job_prefix,
+                          working_dir, command_prefix=None,
+                          command_suffix='; exit'):
+        command_prefix = command_prefix or ''
+
+        naive_bayes_params = ' '.join(
+            ['-m naive_bayes',
+             '-c %1.2f' % params['confidence'],
+             '--naive_bayes_model_dir %s' % params['naive_bayes_model_dir'],
+             '--naive_bayes_word_size %d' % params['naive_bayes_word_size'],
+             '--naive_bayes_num_bootstraps %d' %
+             params['naive_bayes_num_bootstraps']])
+
+        return self._build_job_commands(naive_bayes_params,
+                                        fasta_fps,
+                                        output_dir,
+                                        params,
+                                        job_prefix,
+                                        working_dir,
+                                        command_prefix,
+                                        command_suffix)
+
+
 class ParallelBlastTaxonomyAssigner(ParallelTaxonomyAssigner):
     _job_prefix = 'BTA'
 
@@ -138,7 +184,7 @@ class ParallelBlastTaxonomyAssigner(ParallelTaxonomyAssigner):
             # Build the blast database from the reference_seqs_fp -- all procs
             # will then access one db rather than create one per proc.
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(params['reference_seqs_fp'])
+                get_blast_db_from_fasta_path(params['reference_seqs_fp'])
             self.files_to_remove += db_files_to_remove
             params['blast_db'] = blast_db
 
@@ -13,7 +13,7 @@ __email__ = "gregcaporaso@gmail.com"
 from os.path import join, split, splitext
 from cogent.util.misc import create_dir
 from biom.parse import parse_biom_table
-from qiime.parallel.util import ParallelWrapper
+from qiime.parallel.util import ParallelWrapper, balanced_partition
 from qiime.format import format_distance_matrix
 
 
@@ -21,6 +21,8 @@ class ParallelBetaDiversity(ParallelWrapper):
     _script_name = "beta_diversity.py"
     _input_splitter = ParallelWrapper._input_existing_filepaths
     _job_prefix = 'BDIV'
+    _process_run_results_f = \
+        'qiime.parallel.beta_diversity.parallel_beta_diversity_process_run_results_f'
 
     def _identify_files_to_remove(self, job_result_filepaths, params):
         """ The output of the individual jobs are the files we want to keep
@@ -81,7 +83,8 @@ class ParallelBetaDiversitySingle(ParallelBetaDiversity):
         commands = []
         result_filepaths = []
 
-        sids = parse_biom_table(open(input_fp, 'U')).SampleIds
+        table = parse_biom_table(open(input_fp, 'U'))
+        sids = table.SampleIds
 
         if params['full_tree']:
             full_tree_str = '-f'
@@ -95,14 +98,11 @@ class ParallelBetaDiversitySingle(ParallelBetaDiversity):
 
         metrics = params['metrics']
 
-        # this is a little bit of an abuse of _merge_to_n_commands, so may
-        # be worth generalizing that method - this determines the correct
-        # number of samples to process in each command
-        sample_id_groups = self._merge_to_n_commands(sids,
-                                                     params['jobs_to_start'],
-                                                     delimiter=',',
-                                                     command_prefix='',
-                                                     command_suffix='')
+        # distribute the samples across the jobs so that each job has a
+        # similar amount of work to do, based on the number of OTUs
+        # observed in each sample
+        sample_id_groups = get_balanced_sample_id_groups(
+            sids, get_sample_costs(table), params['jobs_to_start'])
 
         for i, sample_id_group in enumerate(sample_id_groups):
             working_dir_i = join(working_dir, str(i))
@@ -150,13 +150,14 @@ class ParallelBetaDiversitySingle(ParallelBetaDiversity):
                             command_suffix='; exit'):
         """Generate command to initiate a poller to monitior/process completed runs
         """
-        result = '%s poller.py -f %s -m %s -d %s -t %d -p %s %s' % \
+        result = '%s poller.py -f %s -m %s -d %s -t %d -p %s %s %s' % \
             (command_prefix,
              expected_files_filepath,
              merge_map_filepath,
              deletion_list_filepath,
              self._seconds_to_sleep,
-             'qiime.parallel.beta_diversity.parallel_beta_diversity_process_run_results_f',
+             self._process_run_results_f,
+             self._get_poller_status_options(),
              command_suffix)
 
         return result, []
@@ -221,6 +222,33 @@ class ParallelBetaDiversityMultiple(ParallelBetaDiversity):
         return commands, result_filepaths
 
 
+def get_sample_costs(table):
+    """ Estimate the relative cost of computing each sample's distances
+
+        Computing a row of the distance matrix compares the sample to every
+         other sample, and each comparison scales with the number of OTUs
+         observed in the two samples. The cost of a sample is therefore
+         estimated as its number of observed OTUs plus the mean number of
+         observed OTUs per sample.
+    """
+    nonzero_counts = table.nonzeroCounts('sample', binary=True)
+    if len(nonzero_counts) == 0:
+        return nonzero_counts
+    return nonzero_counts + nonzero_counts.mean()
+
+
+def get_balanced_sample_id_groups(sample_ids, costs, n):
+    """ Split sample_ids into at most n comma-separated groups of even cost
+
+        Samples keep their input order within each group, and empty groups
+         (when there are fewer samples than n) are not returned.
+    """
+    sample_indices = dict([(sid, i) for i, sid in enumerate(sample_ids)])
+    buckets, _ = balanced_partition(dict(zip(sample_ids, costs)), n)
+    return [','.join(sorted(bucket, key=sample_indices.get))
+            for bucket in buckets if bucket]
+
+
 def parallel_beta_diversity_process_run_results_f(f):
     """ Handles re-assembling of a distance matrix from component vectors
     """
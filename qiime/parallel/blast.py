@@ -11,9 +11,8 @@ __email__ = "jai.rideout@gmail.com"
 
 from os.path import split, splitext
 
-from brokit.formatdb import build_blast_db_from_fasta_path
-
-from qiime.util import load_qiime_config, get_options_lookup
+from qiime.util import (load_qiime_config, get_options_lookup,
+                        get_blast_db_from_fasta_path)
 from qiime.parallel.util import ParallelWrapper
 
 
@@ -28,7 +27,7 @@ class ParallelBlaster(ParallelWrapper):
             # Build the blast database from the refseqs_path -- all procs
             # will then access one db rather than create one per proc.
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(params['refseqs_path'])
+                get_blast_db_from_fasta_path(params['refseqs_path'])
             self.files_to_remove += db_files_to_remove
             params['blast_db'] = blast_db
 
@@ -51,6 +50,7 @@ class ParallelBlaster(ParallelWrapper):
         # Create lists to store the results.
         commands = []
         result_filepaths = []
+        job_result_filepaths = []
 
         # Iterate over the input files.
         for i, fasta_fp in enumerate(fasta_fps):
@@ -70,6 +70,7 @@ class ParallelBlaster(ParallelWrapper):
             rename_command = '; mv %s %s' % (working_outfile_path,
                                              outfile_path)
             result_filepaths.append(outfile_path)
+            job_result_filepaths.append([outfile_path])
 
             command = '%s %s -p blastn -m 9 -e %s -F %s -W %s -b %s -i %s -d %s > %s %s %s' % \
                 (command_prefix,
@@ -84,6 +85,7 @@ class ParallelBlaster(ParallelWrapper):
                  rename_command,
                  command_suffix)
             commands.append(command)
+        self._job_result_filepaths = job_result_filepaths
         return commands, result_filepaths
 
     def _write_merge_map_file(self,
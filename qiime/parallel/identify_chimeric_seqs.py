@@ -18,7 +18,8 @@ from skbio.parse.sequences import parse_fasta
 
 from qiime.identify_chimeric_seqs import make_cidx_file
 from qiime.parse import parse_tmp_to_final_filepath_map_file
-from qiime.util import write_degapped_fasta_to_file
+from qiime.util import (write_degapped_fasta_to_file,
+                        get_blast_db_from_fasta_path)
 from qiime.parallel.util import ParallelWrapper
 
 
@@ -33,8 +34,8 @@ class ParallelChimericSequenceIdentifier(ParallelWrapper):
                                params):
         if params['chimera_detection_method'] == 'blast_fragments':
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(params['reference_seqs_fp'],
-                                               output_dir=working_dir)
+                get_blast_db_from_fasta_path(params['reference_seqs_fp'],
+                                             output_dir=working_dir)
             self.files_to_remove += db_files_to_remove
             params['blast_db'] = blast_db
         elif params['chimera_detection_method'] == 'ChimeraSlayer':
@@ -65,7 +66,8 @@ class ParallelChimericSequenceIdentifier(ParallelWrapper):
             params['reference_seqs_fp'] = reference_seqs_fp
 
             # build blast db of reference, otherwise ChimeraSlayer will do it
-            # and parallel jobs clash
+            # and parallel jobs clash. ChimeraSlayer looks for the db next to
+            # the reference, so it's not taken from the reference db cache
             _, db_files_to_remove = \
                 build_blast_db_from_fasta_path(reference_seqs_fp)
             self.files_to_remove += db_files_to_remove
@@ -148,13 +150,14 @@ class ParallelChimericSequenceIdentifier(ParallelWrapper):
                             command_suffix='; exit'):
         """Generate command to initiate a poller to monitior/process completed runs
         """
-        result = '%s poller.py -f %s -p %s -m %s -d %s -t %d %s' % \
+        result = '%s poller.py -f %s -p %s -m %s -d %s -t %d %s %s' % \
             (command_prefix,
              expected_files_filepath,
              self._process_run_results_f,
              merge_map_filepath,
              deletion_list_filepath,
              self._seconds_to_sleep,
+             self._get_poller_status_options(),
              command_suffix)
         return result, []
 
@@ -14,11 +14,11 @@ from math import ceil
 from os.path import basename, join
 from re import compile
 
-from brokit.formatdb import build_blast_db_from_fasta_path
-
 from skbio.parse.sequences import parse_fasta
 
-from qiime.parallel.util import ParallelWrapper, BufferedWriter
+from qiime.util import get_blast_db_from_fasta_path
+from qiime.parallel.util import (ParallelWrapper, BufferedWriter,
+                                 balanced_partition)
 from qiime.parallel.poller import basic_process_run_results_f
 
 
@@ -38,13 +38,14 @@ class ParallelPickOtus(ParallelWrapper):
         """Generate command to initiate a poller to monitior/process completed runs
         """
 
-        result = '%s poller.py -f %s -p %s -m %s -d %s -t %d %s' % \
+        result = '%s poller.py -f %s -p %s -m %s -d %s -t %d %s %s' % \
             (command_prefix,
              expected_files_filepath,
              self._process_run_results_f,
              merge_map_filepath,
              deletion_list_filepath,
              self._seconds_to_sleep,
+             self._get_poller_status_options(),
              command_suffix)
 
         return result, []
@@ -268,7 +269,7 @@ class ParallelPickOtusBlast(ParallelPickOtus):
             # Build the blast database from the reference_seqs_fp -- all procs
             # will then access one db rather than create one per proc
             blast_db, db_files_to_remove = \
-                build_blast_db_from_fasta_path(params['refseqs_fp'])
+                get_blast_db_from_fasta_path(params['refseqs_fp'])
             self.files_to_remove += db_files_to_remove
             params['blast_db'] = blast_db
 
@@ -590,14 +591,4 @@ def greedy_partition(counts, n):
     counts: dict of key, counts pairs
     n: number of buckets that the counts should be distributed over
     """
-
-    buckets = [[] for i in range(n)]
-    fill_levels = [0 for i in range(n)]
-
-    for key in sorted(counts, reverse=True,
-                      key=lambda c: counts[c]):
-        smallest = fill_levels.index(min(fill_levels))
-        buckets[smallest].append(key)
-        fill_levels[smallest] += counts[key]
-
-    return buckets, fill_levels
+    return balanced_partition(counts, n)
@@ -1,23 +1,41 @@
 #!/usr/bin/env python
 
 from __future__ import division
-from time import sleep
+from time import sleep, time
 from optparse import OptionParser
-from os import getenv, remove
-from os.path import exists, isdir
+from os import getenv, remove, rename, close, read
+from os.path import exists, getmtime, isdir, join
 from shutil import rmtree
+from select import select
+from subprocess import Popen
+from threading import Event, Thread
+from resource import getrusage, RUSAGE_CHILDREN
+from ctypes import CDLL
+from ctypes.util import find_library
 from cogent.util.misc import remove_files
-from qiime.parse import parse_tmp_to_final_filepath_map_file
+from qiime.parse import (parse_tmp_to_final_filepath_map_file,
+                         parse_job_status)
 
 __author__ = "Greg Caporaso"
 __copyright__ = "Copyright 2011, The QIIME Project"
-__credits__ = ["Greg Caporaso"]
+__credits__ = ["Greg Caporaso", "agent"]
 __license__ = "GPL"
 __version__ = "1.8.0-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+# how often (in seconds) a running job updates its heartbeat file, and how
+# long the poller waits for an update before deciding that the job was
+# killed without writing its status record
+JOB_HEARTBEAT_SECONDS = 60
+JOB_HEARTBEAT_TIMEOUT = 600
+
+
 def get_function_handle(s):
     last_dot = s.rindex('.')
     module_name = s[:last_dot]
@@ -187,13 +205,199 @@ def verbose_clean_up_f(f):
     return True
 
 
+def get_job_status_fp(status_dir, job_id):
+    """ Return the path of the status record of job_id in status_dir
+    """
+    return join(status_dir, '%d.status' % job_id)
+
+
+def get_job_heartbeat_fp(status_fp):
+    """ Return the path of the heartbeat file of the job writing status_fp
+    """
+    return '%s.heartbeat' % status_fp
+
+
+def write_job_status(status_fp, exit_status, wall_time, peak_rss, job_fp):
+    """ Write a job status record to status_fp
+
+        The record is written to a temporary file which is then renamed,
+         so a poller never sees a partially written record.
+    """
+    tmp_fp = '%s.tmp' % status_fp
+    f = open(tmp_fp, 'w')
+    f.write('%d\t%1.3f\t%d\t%s\n' %
+            (exit_status, wall_time, peak_rss, job_fp))
+    f.close()
+    rename(tmp_fp, status_fp)
+
+
+def run_job_with_status(job_fp,
+                        status_fp,
+                        heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+    """ Run the shell script job_fp and write its status record to status_fp
+
+        The record contains the exit status of the job, its wall time in
+         seconds and the peak resident set size (in kilobytes) of the
+         largest process it ran. The script is run with sh -e, so it
+         ends at the first command that fails. Returns the exit status.
+
+        While the job runs, its heartbeat file (see get_job_heartbeat_fp)
+         is rewritten every heartbeat_seconds, so a poller can tell that a
+         job which stops without writing its status record (e.g., because
+         it was killed by the queueing system) has failed.
+    """
+    heartbeat_fp = get_job_heartbeat_fp(status_fp)
+    job_done = Event()
+
+    def write_heartbeats():
+        while not job_done.is_set():
+            open(heartbeat_fp, 'w').close()
+            job_done.wait(heartbeat_seconds)
+
+    start_time = time()
+    proc = Popen(['/bin/sh', '-e', job_fp])
+    heartbeat_thread = Thread(target=write_heartbeats)
+    heartbeat_thread.daemon = True
+    heartbeat_thread.start()
+    exit_status = proc.wait()
+    wall_time = time() - start_time
+    job_done.set()
+    heartbeat_thread.join()
+    peak_rss = getrusage(RUSAGE_CHILDREN).ru_maxrss
+    write_job_status(status_fp, exit_status, wall_time, peak_rss, job_fp)
+    remove_all([heartbeat_fp])
+    return exit_status
+
+
+def _check_job_heartbeat(job_id, status_fp, heartbeats, heartbeat_timeout):
+    """ Raise a RuntimeError if job job_id has stopped updating its heartbeat
+
+        heartbeats maps job ids to the last heartbeat file mtime seen for
+         each job, and the time it was first seen. These times are from
+         this process's clock, rather than the clock of the host that the
+         job runs on (or of the file server), which may differ.
+    """
+    try:
+        mtime = getmtime(get_job_heartbeat_fp(status_fp))
+    except OSError:
+        # the job hasn't started yet, or has just finished
+        return
+    now = time()
+    last_mtime, first_seen = heartbeats.get(job_id, (None, now))
+    if mtime != last_mtime:
+        heartbeats[job_id] = (mtime, now)
+    elif now - first_seen > heartbeat_timeout and not exists(status_fp):
+        raise RuntimeError(
+            "Parallel job %d stopped running without writing its status "
+            "record (no heartbeat for %d seconds). It may have been killed "
+            "by the queueing system, or for running out of memory.\n"
+            "Status record: %s\n" % (job_id, heartbeat_timeout, status_fp))
+
+
+def _get_inotify_fd(dir_path):
+    """ Return an inotify fd watching dir_path for new files, or None
+
+        None is returned if inotify is not available on this system.
+    """
+    try:
+        libc = CDLL(find_library('c'), use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, dir_path,
+                              IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        close(fd)
+        return None
+    return fd
+
+
+def wait_for_job_statuses(status_dir,
+                          num_jobs,
+                          seconds_to_sleep,
+                          min_seconds_to_sleep=0.1,
+                          heartbeat_timeout=JOB_HEARTBEAT_TIMEOUT):
+    """ Wait for status records of num_jobs jobs to be written to status_dir
+
+        Returns a dict mapping job ids (0 to num_jobs - 1) to their
+         (exit_status, wall_time, peak_rss, job_fp) status records, and
+         raises a RuntimeError as soon as a job reports a non-zero exit
+         status, or a running job's heartbeat file hasn't been updated for
+         heartbeat_timeout seconds (pass None to wait indefinitely).
+
+        Where inotify is available, new records are picked up as they are
+         written, and status_dir is also rechecked every seconds_to_sleep
+         (e.g., for network filesystems which don't deliver events).
+         Otherwise status_dir is checked after sleeping for
+         min_seconds_to_sleep, doubling the sleep after each check up to
+         seconds_to_sleep.
+    """
+    statuses = {}
+    heartbeats = {}
+    inotify_fd = _get_inotify_fd(status_dir)
+    time_to_sleep = min(min_seconds_to_sleep, seconds_to_sleep)
+    try:
+        while True:
+            for job_id in range(num_jobs):
+                status_fp = get_job_status_fp(status_dir, job_id)
+                if job_id in statuses:
+                    continue
+                if not exists(status_fp):
+                    if heartbeat_timeout is not None:
+                        _check_job_heartbeat(job_id, status_fp, heartbeats,
+                                             heartbeat_timeout)
+                    continue
+                status = parse_job_status(open(status_fp, 'U'))
+                if status[0] != 0:
+                    raise RuntimeError(
+                        "Parallel job %d failed with exit status %d after "
+                        "%1.3f seconds.\nJob script: %s\n" %
+                        (job_id, status[0], status[1], status[3]))
+                statuses[job_id] = status
+            if len(statuses) == num_jobs:
+                return statuses
+
+            if inotify_fd is not None:
+                if select([inotify_fd], [], [], seconds_to_sleep)[0]:
+                    # discard the events, status_dir is checked directly
+                    read(inotify_fd, 4096)
+            else:
+                sleep(time_to_sleep)
+                time_to_sleep = min(time_to_sleep * 2, seconds_to_sleep)
+    finally:
+        if inotify_fd is not None:
+            close(inotify_fd)
+
+
+def write_job_timing_summary(statuses, f):
+    """ Write a summary of job status records to f, slowest jobs first
+
+        statuses: dict of job id to status record, as returned by
+         wait_for_job_statuses
+    """
+    f.write('#job\texit status\twall time (s)\tpeak RSS (KB)\tjob script\n')
+    for job_id, status in sorted(statuses.items(),
+                                 key=lambda s: (-s[1][1], s[0])):
+        f.write('%d\t%d\t%1.3f\t%d\t%s\n' %
+                ((job_id,) + tuple(status)))
+    wall_times = [s[1] for s in statuses.values()]
+    if wall_times:
+        f.write('#mean wall time (s): %1.3f\n' %
+                (sum(wall_times) / len(wall_times)))
+
+
 def poller(check_run_complete_f,
            process_run_results_f,
            clean_up_f,
            check_run_complete_file,
            process_run_results_file,
            clean_up_file,
-           seconds_to_sleep):
+           seconds_to_sleep,
+           status_dir=None,
+           num_jobs=None,
+           timing_summary_fp=None,
+           heartbeat_timeout=JOB_HEARTBEAT_TIMEOUT):
     """ Polls for completion of job(s) and then processes/cleans up results
 
         check_run_complete_f: function which returns True when polled
@@ -208,8 +412,28 @@ def poller(check_run_complete_f,
         clean_up_file: file passed to clean_up_f
         seconds_to_sleep: number of seconds to sleep between calls
          to check_run_complete_f
+        status_dir: directory where the jobs write their status records
+         (see wait_for_job_statuses). If provided, the poller waits for
+         the status records of num_jobs jobs before checking for
+         completion, and raises a RuntimeError as soon as a job fails.
+        num_jobs: number of jobs writing status records to status_dir
+        timing_summary_fp: if provided with status_dir, a per-job
+         timing summary is written to this path
+        heartbeat_timeout: seconds after which a running job which
+         hasn't updated its heartbeat file is considered to have failed
+         (see wait_for_job_statuses)
 
     """
+    if status_dir is not None:
+        statuses = wait_for_job_statuses(status_dir,
+                                         num_jobs,
+                                         seconds_to_sleep,
+                                         heartbeat_timeout=heartbeat_timeout)
+        if timing_summary_fp is not None:
+            timing_summary_f = open(timing_summary_fp, 'w')
+            write_job_timing_summary(statuses, timing_summary_f)
+            timing_summary_f.close()
+
     number_of_loops = 0
     while(not check_run_complete_f(check_run_complete_file)):
         sleep(seconds_to_sleep)
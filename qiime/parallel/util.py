@@ -12,12 +12,20 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from math import ceil
-from os.path import split, splitext, join
-from os import makedirs, mkdir
+from heapq import heapify, heapreplace
+from os.path import split, splitext, join, exists
+from os import makedirs, mkdir, setsid, killpg
+from signal import SIGKILL
 from random import choice
+from subprocess import Popen, PIPE
+from threading import Thread
+from Queue import Queue
 from skbio.parse.sequences import parse_fasta
-from qiime.split import split_fasta
-from qiime.util import load_qiime_config, qiime_system_call, count_seqs
+from qiime.split import split_fasta_on_byte_offsets
+from qiime.parse import parse_tmp_to_final_filepath_map_file
+from qiime.parallel.poller import (get_function_handle, remove_all,
+                                   get_job_status_fp)
+from qiime.util import load_qiime_config, qiime_system_call
 
 qiime_config = load_qiime_config()
 
@@ -25,11 +33,24 @@ RANDOM_JOB_PREFIX_CHARS = "abcdefghigklmnopqrstuvwxyz"
 RANDOM_JOB_PREFIX_CHARS += RANDOM_JOB_PREFIX_CHARS.upper()
 RANDOM_JOB_PREFIX_CHARS += "0123456790"
 
+# value of cluster_jobs_fp which runs the jobs in subprocesses of the
+# current process rather than submitting them with a cluster jobs script
+LOCAL_CLUSTER_JOBS = 'local'
+
 
 class ParallelWrapper(object):
 
     """
     """
+    # name of the function used by the poller to merge the job results (see
+    # qiime.parallel.poller.get_function_handle), or None to concatenate the
+    # files listed in the merge map file
+    _process_run_results_f = None
+    # the list of the result filepaths created by each job, which
+    # _get_job_commands can set as it builds the commands. Jobs run locally
+    # then have their results merged as soon as they complete; otherwise
+    # the results are merged when all jobs have completed.
+    _job_result_filepaths = None
 
     def __init__(self,
                  cluster_jobs_fp=qiime_config['cluster_jobs_fp'],
@@ -134,6 +155,7 @@ class ParallelWrapper(object):
 
         # Generate the list of commands to be pushed out to workers
         # and the list of output files generated by each job.
+        self._job_result_filepaths = None
         commands, job_result_filepaths = self._get_job_commands(input_fps,
                                                                 output_dir,
                                                                 params,
@@ -150,48 +172,62 @@ class ParallelWrapper(object):
                                                   input_file_basename,
                                                   params)
 
-        # Set up poller apparatus if the user does not suppress polling
-        if not self._suppress_polling:
-            poller_command = self._initiate_polling(job_result_filepaths,
-                                                    working_dir,
-                                                    poll_directly,
-                                                    merge_map_filepath,
-                                                    deletion_list_filepath,
-                                                    expected_files_filepath)
-
-        # If the poller should be run in the same way as the other commands
-        # (rather than by the current process), add it to the list of commands
-        if not poll_directly:
-            commands.append(poller_command)
-
-        # Build the filepath for the 'jobs script'. Add that file to the
-        # files_to_remove list.
-        jobs_fp = join(working_dir, job_prefix + 'jobs.txt')
-        self._write_jobs_file(commands, jobs_fp)
-        self.files_to_remove.append(jobs_fp)
-
-        # submit the jobs file using cluster_jobs, if not suppressed by the
-        # user
-        if not suppress_submit_jobs:
-            stdout, stderr, return_value = self._submit_jobs(
-                jobs_fp=jobs_fp, job_prefix=job_prefix)
-
-        # If the poller is going to be run by the current process,
-        # start polling
-        if poll_directly:
-            # IMPORTANT: the following line MUST use qiime_system_call()
-            # instead of subprocess.call, .check_call, or .check_output in case
-            # we are invoked in a child process with PIPEs (a deadlock will
-            # occur otherwise). This can happen if this code is tested by
-            # all_tests.py, for example.
-            stdout, stderr, return_value = qiime_system_call(poller_command)
-            if return_value != 0:
-                print '**Error occuring when calling the poller directly. ' +\
-                    'Jobs may have been submitted, but are not being polled.'
-                print stderr
-                print poller_command
-                exit(-1)
-        self.files_to_remove = []
+        if self._cluster_jobs_fp == LOCAL_CLUSTER_JOBS:
+            # Run the jobs in subprocesses of the current process. Results
+            # are merged as jobs complete, so no poller is needed.
+            if not suppress_submit_jobs:
+                self._run_jobs_locally(commands, merge_map_filepath)
+            self.files_to_remove = []
+        else:
+            # Each job is run by run_parallel_job.py, which writes the job's
+            # status record to status_dir. The poller watches status_dir,
+            # so that it stops as soon as a job fails.
+            commands = self._get_status_reporting_commands(commands,
+                                                           job_prefix,
+                                                           working_dir)
+
+            # Set up poller apparatus if the user does not suppress polling
+            if not self._suppress_polling:
+                poller_command = self._initiate_polling(job_result_filepaths,
+                                                        working_dir,
+                                                        poll_directly,
+                                                        merge_map_filepath,
+                                                        deletion_list_filepath,
+                                                        expected_files_filepath)
+
+            # If the poller should be run in the same way as the other commands
+            # (rather than by the current process), add it to the list of commands
+            if not poll_directly:
+                commands.append(poller_command)
+
+            # Build the filepath for the 'jobs script'. Add that file to the
+            # files_to_remove list.
+            jobs_fp = join(working_dir, job_prefix + 'jobs.txt')
+            self._write_jobs_file(commands, jobs_fp)
+            self.files_to_remove.append(jobs_fp)
+
+            # submit the jobs file using cluster_jobs, if not suppressed by the
+            # user
+            if not suppress_submit_jobs:
+                stdout, stderr, return_value = self._submit_jobs(
+                    jobs_fp=jobs_fp, job_prefix=job_prefix)
+
+            # If the poller is going to be run by the current process,
+            # start polling
+            if poll_directly:
+                # IMPORTANT: the following line MUST use qiime_system_call()
+                # instead of subprocess.call, .check_call, or .check_output in case
+                # we are invoked in a child process with PIPEs (a deadlock will
+                # occur otherwise). This can happen if this code is tested by
+                # all_tests.py, for example.
+                stdout, stderr, return_value = qiime_system_call(poller_command)
+                if return_value != 0:
+                    print '**Error occuring when calling the poller directly. ' +\
+                        'Jobs may have been submitted, but are not being polled.'
+                    print stderr
+                    print poller_command
+                    exit(-1)
+            self.files_to_remove = []
 
         # Perform any method-specific cleanup. This should prevent the need to
         # overwrite __call__
@@ -202,6 +238,44 @@ class ParallelWrapper(object):
                            poll_directly,
                            suppress_submit_jobs)
 
+    def _get_status_reporting_commands(self,
+                                       commands,
+                                       job_prefix,
+                                       working_dir):
+        """ Return commands which run each of commands with run_parallel_job.py
+
+            The subcommands of each command are written to a job script in
+             working_dir, and the returned commands run those scripts with
+             run_parallel_job.py, which writes the status record of each
+             job to self._status_dir.
+        """
+        self._status_dir = join(working_dir, 'job_status')
+        try:
+            makedirs(self._status_dir)
+        except OSError:
+            # status dir already exists
+            pass
+        self._num_jobs = len(commands)
+
+        result = []
+        for i, command in enumerate(commands):
+            job_fp = join(working_dir, '%sjob%d.sh' % (job_prefix, i))
+            f = open(job_fp, 'w')
+            f.write(_get_shell_script(command))
+            f.write('\n')
+            f.close()
+            result.append('/bin/bash; run_parallel_job.py -i %s -s %s; exit' %
+                          (job_fp, get_job_status_fp(self._status_dir, i)))
+        return result
+
+    def _get_poller_status_options(self):
+        """ Return the poller options for watching the job status records
+        """
+        return '-s %s -n %d -w %s' % (
+            self._status_dir,
+            self._num_jobs,
+            join(self._status_dir, 'job_timings.txt'))
+
     def _initialize_output_cleanup_files(self,
                                          job_result_filepaths,
                                          output_dir,
@@ -234,6 +308,75 @@ class ParallelWrapper(object):
                 deletion_list_filepath,
                 expected_files_filepath)
 
+    def _run_jobs_locally(self,
+                          commands,
+                          merge_map_filepath):
+        """ Run commands in parallel subprocesses and merge their results
+
+            Results are merged into the final output files as soon as the
+             jobs which create them have completed (and all earlier result
+             files have been merged), rather than by a poller. If a job
+             fails, the jobs which are still running are killed and a
+             RuntimeError is raised.
+        """
+        process_results = not self._suppress_polling
+        if process_results and self._process_run_results_f is None:
+            merger = _JobResultsMerger(open(merge_map_filepath, 'U'),
+                                       len(commands),
+                                       self._job_result_filepaths)
+        else:
+            merger = None
+
+        results = Queue()
+        procs = []
+        for i, command in enumerate(commands):
+            # each job is started in its own process group so that the
+            # commands it runs can be killed along with it
+            proc = Popen(['/bin/sh', '-e', '-c', _get_shell_script(command)],
+                         universal_newlines=True,
+                         stdout=PIPE,
+                         stderr=PIPE,
+                         preexec_fn=setsid)
+            procs.append(proc)
+            t = Thread(target=_communicate, args=(i, proc, results))
+            t.daemon = True
+            t.start()
+
+        try:
+            for num_complete in range(1, len(commands) + 1):
+                i, stdout, stderr, return_value = results.get()
+                if return_value != 0:
+                    for proc in procs:
+                        if proc.returncode is None:
+                            try:
+                                killpg(proc.pid, SIGKILL)
+                            except OSError:
+                                # process already exited
+                                pass
+                    # wait for the killed jobs to be reaped
+                    for _ in range(len(commands) - num_complete):
+                        results.get()
+                    msg = "\n\n*** Parallel job failed.\n" +\
+                        "Command run was:\n %s\n" % commands[i] +\
+                        "Command returned exit status: %d\n" % return_value +\
+                        "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
+                    raise RuntimeError(msg)
+                if merger is not None:
+                    merger.job_complete(i)
+        finally:
+            if merger is not None:
+                merger.close()
+
+        if process_results:
+            if merger is not None:
+                merger.check_complete()
+            else:
+                process_run_results_f = \
+                    get_function_handle(self._process_run_results_f)
+                process_run_results_f(open(merge_map_filepath, 'U'))
+            if not self._retain_temp_files:
+                remove_all(self.files_to_remove)
+
     def _submit_jobs(self,
                      jobs_fp,
                      job_prefix):
@@ -349,12 +492,13 @@ class ParallelWrapper(object):
         """Generate command to initiate a poller to monitior/process completed runs
         """
 
-        result = '%s poller.py -f %s -m %s -d %s -t %d %s' % \
+        result = '%s poller.py -f %s -m %s -d %s -t %d %s %s' % \
             (command_prefix,
              expected_files_filepath,
              merge_map_filepath,
              deletion_list_filepath,
              self._seconds_to_sleep,
+             self._get_poller_status_options(),
              command_suffix)
 
         return result, []
@@ -446,24 +590,6 @@ class ParallelWrapper(object):
 
         return result
 
-    def _compute_seqs_per_file(self,
-                               input_fasta_fp,
-                               num_jobs_to_start):
-        """ Compute the number of sequences to include in each split file
-        """
-        # count the number of sequences in the fasta file
-        num_input_seqs = count_seqs(input_fasta_fp)[0]
-
-        # divide the number of sequences by the number of jobs to start
-        result = num_input_seqs / num_jobs_to_start
-
-        # if we don't have a perfect split, round up
-        if result % 1 != 0:
-            result += 1
-
-        # return the result as an integer
-        return int(result)
-
     ####
     # General purpose _input_splitter functions
     ####
@@ -473,16 +599,11 @@ class ParallelWrapper(object):
                      jobs_to_start,
                      job_prefix,
                      output_dir):
-        # compute the number of sequences that should be included in
-        # each file after splitting the input fasta file
-        num_seqs_per_file = self._compute_seqs_per_file(
-            input_fp,
-            jobs_to_start)
-
-        # split the fasta files and get the list of resulting files
-        tmp_fasta_fps =\
-            split_fasta(open(input_fp), num_seqs_per_file,
-                        job_prefix, working_dir=output_dir)
+        # split the fasta file into jobs_to_start files of roughly equal
+        # size, copying byte ranges rather than parsing the records
+        tmp_fasta_fps = \
+            split_fasta_on_byte_offsets(input_fp, jobs_to_start,
+                                        job_prefix, working_dir=output_dir)
 
         return tmp_fasta_fps, True
 
@@ -495,6 +616,128 @@ class ParallelWrapper(object):
         return input_fps, False
 
 
+def balanced_partition(costs, n):
+    """ Distribute items across n buckets so that their total costs are even
+
+        costs: dict of item, cost pairs, where cost is an estimate of the
+         work required to process the item
+        n: number of buckets that the items should be distributed over
+
+        Items are assigned from most to least costly, each to the bucket with
+         the lowest total cost so far (the first such bucket on ties). Returns
+         the list of items in each bucket, and the total cost of each bucket.
+    """
+    if n < 1:
+        raise ValueError("number of buckets (n) must be an integer >= 1")
+
+    buckets = [[] for i in range(n)]
+    fill_levels = [0 for i in range(n)]
+    # heap of (fill level, bucket index), so the least filled bucket (with
+    # the lowest index on ties) is always at the top
+    heap = [(0, i) for i in range(n)]
+    heapify(heap)
+
+    for key in sorted(costs, reverse=True,
+                      key=lambda c: costs[c]):
+        fill_level, smallest = heap[0]
+        buckets[smallest].append(key)
+        fill_levels[smallest] += costs[key]
+        heapreplace(heap, (fill_levels[smallest], smallest))
+
+    return buckets, fill_levels
+
+
+def _get_shell_script(command):
+    """ Return the lines of a shell script which runs command
+
+        The '/bin/bash' and 'exit' subcommands which wrap commands for
+         cluster jobs scripts are removed (as in start_parallel_jobs.py).
+    """
+    ignored_subcommands = {}.fromkeys(['/bin/bash', 'exit'])
+    return '\n'.join([subcommand
+                      for subcommand in command.split(';')
+                      if subcommand.strip() not in ignored_subcommands])
+
+
+def _communicate(job_index, proc, results):
+    """ Wait for proc to complete and put its results on the results queue
+    """
+    stdout, stderr = proc.communicate()
+    results.put((job_index, stdout, stderr, proc.returncode))
+
+
+class _JobResultsMerger(object):
+
+    """ Concatenates job result files into final output files incrementally
+
+        Merges follow the semantics of the poller's
+         basic_process_run_results_f, but each result file is appended to
+         its output file as soon as it, and all of the result files listed
+         before it in the merge map, have been created by completed jobs.
+    """
+
+    def __init__(self, merge_map_lines, num_jobs, job_result_filepaths=None):
+        """
+            merge_map_lines: lines of the merge map file written by
+             ParallelWrapper._write_merge_map_file
+            num_jobs: the number of jobs
+            job_result_filepaths: the list of the result filepaths created
+             by each job (as recorded by ParallelWrapper._get_job_commands).
+             Result files which aren't listed for any job (or all result
+             files, if this is None) are merged once all jobs complete.
+        """
+        self.infiles_lists, out_filepaths = \
+            parse_tmp_to_final_filepath_map_file(merge_map_lines)
+        creating_jobs = {}
+        for i, fps in enumerate(job_result_filepaths or []):
+            for fp in fps:
+                creating_jobs.setdefault(fp, set()).add(i)
+        self._jobs_remaining = {}
+        for infiles_list in self.infiles_lists:
+            for fp in infiles_list:
+                self._jobs_remaining[fp] = \
+                    set(creating_jobs.get(fp, range(num_jobs)))
+        self._out_fs = []
+        for out_filepath in out_filepaths:
+            try:
+                self._out_fs.append(open(out_filepath, 'w'))
+            except IOError:
+                raise IOError("Can't open final output file: %s" % out_filepath +
+                              "\nLeaving individual jobs output.\n Do you have write access?")
+        self._next_infile_indices = [0] * len(self.infiles_lists)
+
+    def job_complete(self, job_index):
+        """ Record that job_index completed and merge any available results
+        """
+        for jobs in self._jobs_remaining.values():
+            jobs.discard(job_index)
+        for i, infiles_list in enumerate(self.infiles_lists):
+            of = self._out_fs[i]
+            j = self._next_infile_indices[i]
+            while j < len(infiles_list) and \
+                    not self._jobs_remaining[infiles_list[j]] and \
+                    exists(infiles_list[j]):
+                for line in open(infiles_list[j]):
+                    of.write('%s\n' % line.strip('\n'))
+                j += 1
+            self._next_infile_indices[i] = j
+
+    def check_complete(self):
+        """ Raise a RuntimeError if any result files were not merged
+        """
+        missing = []
+        for i, infiles_list in enumerate(self.infiles_lists):
+            missing.extend(infiles_list[self._next_infile_indices[i]:])
+        if missing:
+            raise RuntimeError("All jobs completed, but the following "
+                               "result files were not created:\n%s" %
+                               '\n'.join(missing))
+
+    def close(self):
+        for of in self._out_fs:
+            of.close()
+
+
 class BufferedWriter():
 
     """A file like object that delays writing to file without keeping an open filehandle
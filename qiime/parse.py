@@ -19,7 +19,7 @@ from os.path import expandvars
 import re
 from types import GeneratorType
 
-from numpy import concatenate, repeat, zeros, nan, asarray
+from numpy import concatenate, repeat, zeros, nan, asarray, memmap
 from numpy.random import permutation
 
 from skbio.math.stats.ordination import OrdinationResults
@@ -32,6 +32,14 @@ from cogent.core.tree import PhyloNode
 
 from qiime.quality import ascii_to_phred33, ascii_to_phred64
 
+# the first field of the first line of a binary distance matrix file
+BINARY_DISTMAT_MAGIC = '#QIIME binary distance matrix'
+# the data in a binary distance matrix file starts at a multiple of this
+BINARY_DISTMAT_ALIGNMENT = 64
+# output formats of qiime.format.write_distance_matrix, and the (little
+# endian) dtypes of the binary formats
+DISTMAT_FORMATS = {'text': None, 'float32': '<f4', 'float64': '<f8'}
+
 
 def is_casava_v180_or_later(header_line):
     """ True if this file is generated by Illumina software post-casava 1.8 """
@@ -233,6 +241,49 @@ def parse_distmat(lines):
     return header, asarray(result)
 
 
+def is_binary_distmat(fp):
+    """Returns True if fp is a binary distance matrix file
+
+    Binary distance matrix files are written by
+    qiime.format.write_distance_matrix.
+    """
+    f = open(fp, 'rb')
+    try:
+        return f.read(len(BINARY_DISTMAT_MAGIC)) == BINARY_DISTMAT_MAGIC
+    finally:
+        f.close()
+
+
+def parse_binary_distmat(fp, mmap_mode='r'):
+    """Parser for binary distance matrix files.
+
+    Returns the list of labels and the matrix as a numpy memmap of the file,
+    so the matrix is not read into memory. mmap_mode is passed to
+    numpy.memmap, e.g. 'c' for a matrix which can be changed in memory
+    without changing the file.
+    """
+    f = open(fp, 'rb')
+    try:
+        header = f.readline()
+        labels_line = f.readline()
+        padding = f.readline()
+    finally:
+        f.close()
+    fields = header.rstrip('\n').split('\t')
+    if len(fields) != 3 or fields[0] != BINARY_DISTMAT_MAGIC or \
+            not DISTMAT_FORMATS.get(fields[1]):
+        raise ValueError("%s is not a binary distance matrix file" % fp)
+    num_samples = int(fields[2])
+    labels = labels_line.rstrip('\n').split('\t')[1:]
+    if len(labels) != num_samples or padding.strip():
+        raise ValueError("Malformed binary distance matrix header in %s" %
+                         fp)
+    data = memmap(fp, dtype=DISTMAT_FORMATS[fields[1]], mode=mmap_mode,
+                  offset=len(header) + len(labels_line) + len(padding),
+                  shape=(num_samples, num_samples))
+    return labels, data
+
+
 def parse_matrix(lines):
     """Parser for a matrix file Tab delimited. skips first lines if led
     by '#', assumes column headers line starts with a tab
@@ -692,6 +743,27 @@ def parse_tmp_to_final_filepath_map_file(lines):
     return infiles_lists, out_filepaths
 
 
+def parse_job_status(lines):
+    """Parses a parallel job status record
+
+       For example, lines:
+        0	12.104	51324	/tmp/POTU_abc_/POTU_abc_job0.sh
+
+       Would result in:
+        (0, 12.104, 51324, '/tmp/POTU_abc_/POTU_abc_job0.sh')
+
+       where the fields are the job's exit status, wall time (in seconds),
+       peak RSS (in kilobytes), and the path to the job script.
+    """
+    for line in lines:
+        line = line.strip()
+        if line:
+            fields = line.split('\t')
+            return (int(fields[0]), float(fields[1]), int(fields[2]),
+                    fields[3])
+    raise ValueError("No job status record found.")
+
+
 def parse_metadata_state_descriptions(state_string):
     """From string in format 'col1:good1,good2;col2:good1' return dict."""
     result = {}
@@ -31,12 +31,13 @@ from skbio.parse.sequences import parse_fasta
 from skbio.core.alignment import SequenceCollection
 from skbio.core.sequence import DNA
 
-from qiime.util import FunctionWithParams, get_qiime_temp_dir
+from qiime.util import (FunctionWithParams, get_qiime_temp_dir,
+                        get_blast_db_from_fasta_path)
 from qiime.sort import sort_fasta_by_abundance
 from qiime.parse import fields_to_dict
+from qiime.dereplicate import SequenceDereplicator, SeqIdMap
 
 from brokit.blast import blast_seqs, Blastall, BlastResult
-from brokit.formatdb import build_blast_db_from_fasta_path
 from brokit.mothur import Mothur
 from brokit.cd_hit import cdhit_clusters_from_seqs
 from brokit.uclust import get_clusters_from_fasta_filepath
@@ -80,64 +81,46 @@ class OtuPicker(FunctionWithParams):
         raise NotImplementedError("OtuPicker is an abstract class")
 
     def _prefilter_exact_prefixes(self, seqs, prefix_length=100):
+        """Groups seqs whose first prefix_length bases are identical
+
+        The longest sequence in each group (the first one seen if several
+         are equally long) is its representative.
         """
-        """
-        unique_prefixes = {}
-        for seq_id, seq in seqs:
-            seq_len = len(seq)
-            seq_id = seq_id.split()[0]
-            current_prefix = seq[:prefix_length]
-            try:
-                prefix_data = unique_prefixes[current_prefix]
-                if seq_len > prefix_data[2]:
-                    # if this is the longest seq with this prefix so far,
-                    # update the list of seq_ids, the best seq_len, and the
-                    # best hit seq_id
-                    prefix_data[0].append(seq_id)
-                    prefix_data[1] = seq_id
-                    prefix_data[2] = seq_len
-                    prefix_data[3] = seq
-                else:
-                    # if longer have been seen, only update the list of seq_ids
-                    prefix_data[0].append(seq_id)
-            except KeyError:
-                # list of seq_ids mapped to this prefix, best hit seq_id, best
-                # hit seq_len
-                unique_prefixes[current_prefix] = [[seq_id],
-                                                   seq_id,
-                                                   seq_len,
-                                                   seq]
-
-        # construct the result objects
-        filtered_seqs = []
-        seq_id_map = {}
-        for data in unique_prefixes.values():
-            filtered_seqs.append((data[1], data[3]))
-            seq_id_map[data[1]] = data[0]
+        dereplicator = SequenceDereplicator(prefix_length=prefix_length)
+        try:
+            dereplicator.add_seqs(seqs)
+            filtered_seqs = []
+            seq_id_map = {}
+            for rep_id, rep_seq, member_ids in dereplicator:
+                filtered_seqs.append((rep_id, rep_seq))
+                seq_id_map[rep_id] = member_ids
+        finally:
+            dereplicator.cleanup()
 
         return filtered_seqs, seq_id_map
 
+    def _iter_exact_matches(self, seqs):
+        """Yields (temp_seq_id, seq, seq_ids) for each unique seq in seqs
+
+        Unique sequences are yielded in the order in which they were
+         first seen.
+        """
+        dereplicator = SequenceDereplicator()
+        try:
+            dereplicator.add_seqs(seqs)
+            for rep_id, rep_seq, member_ids in dereplicator:
+                yield 'QiimeExactMatch.%s' % rep_id, rep_seq, member_ids
+        finally:
+            dereplicator.cleanup()
+
     def _prefilter_exact_matches(self, seqs):
         """
         """
-        unique_sequences = {}
         seq_id_map = {}
         filtered_seqs = []
-        for seq_id, seq in seqs:
-            seq_id = seq_id.split()[0]
-            try:
-                temp_seq_id = unique_sequences[seq]
-            except KeyError:
-                # unseen sequence so create a new temp_seq_id,
-                # a new unique_sequence entry, and new seq_id_map
-                # entry, and add the sequence to the list of
-                # filtered seqs -- this will retain the order
-                # of the input sequences too
-                temp_seq_id = 'QiimeExactMatch.%s' % seq_id
-                unique_sequences[seq] = temp_seq_id
-                seq_id_map[temp_seq_id] = []
-                filtered_seqs.append((temp_seq_id, seq))
-            seq_id_map[temp_seq_id].append(seq_id)
+        for temp_seq_id, seq, seq_ids in self._iter_exact_matches(seqs):
+            seq_id_map[temp_seq_id] = seq_ids
+            filtered_seqs.append((temp_seq_id, seq))
         return filtered_seqs, seq_id_map
 
     def _prefilter_with_trie(self, seq_path):
@@ -203,10 +186,10 @@ class BlastOtuPicker(OtuPicker):
 
         if not blast_db:
             self.blast_db, self.db_files_to_remove = \
-                build_blast_db_from_fasta_path(abspath(refseqs_fp),
-                                               is_protein=self.Params[
-                                                   'is_protein'],
-                                               output_dir=get_qiime_temp_dir())
+                get_blast_db_from_fasta_path(abspath(refseqs_fp),
+                                             is_protein=self.Params[
+                                                 'is_protein'],
+                                             output_dir=get_qiime_temp_dir())
             self.log_lines.append('Reference seqs fp (to build blast db): %s' %
                                   abspath(refseqs_fp))
         else:
@@ -795,16 +778,18 @@ class UclustOtuPickerBase(OtuPicker):
         fd, unique_seqs_fp = mkstemp(
             prefix='UclustExactMatchFilter', suffix='.fasta')
         close(fd)
-        seqs_to_cluster, exact_match_id_map =\
-            self._prefilter_exact_matches(parse_fasta(open(seq_path, 'U')))
         self.files_to_remove.append(unique_seqs_fp)
+        # write the unique seqs as they are read back from the
+        # dereplicator, and keep their member ids on disk, so neither are
+        # ever all held in memory at once
+        exact_match_id_map = SeqIdMap()
         unique_seqs_f = open(unique_seqs_fp, 'w')
-        for seq_id, seq in seqs_to_cluster:
-            unique_seqs_f.write('>%s\n%s\n' % (seq_id, seq))
+        with open(seq_path, 'U') as seq_f:
+            for seq_id, seq, seq_ids in \
+                    self._iter_exact_matches(parse_fasta(seq_f)):
+                exact_match_id_map[seq_id] = seq_ids
+                unique_seqs_f.write('>%s\n%s\n' % (seq_id, seq))
         unique_seqs_f.close()
-        # clean up the seqs_to_cluster list as it can be big and we
-        # don't need it again
-        # del(seqs_to_cluster)
         return exact_match_id_map, unique_seqs_fp
 
 
@@ -909,6 +894,7 @@ class UclustOtuPicker(UclustOtuPickerBase):
         if prefilter_identical_sequences:
             clusters = self._map_filtered_clusters_to_full_clusters(
                 clusters, exact_match_id_map)
+            exact_match_id_map.close()
 
         otu_id_prefix = self.Params['new_cluster_identifier']
         if otu_id_prefix is None:
@@ -1541,6 +1527,7 @@ class UclustReferenceOtuPicker(UclustOtuPickerBase):
             for fa in failures:
                 temp_failures.extend(exact_match_id_map[fa])
             failures = temp_failures
+            exact_match_id_map.close()
 
         self._rename_clusters(cluster_map, new_seeds)
 
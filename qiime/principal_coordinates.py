@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 from skbio.core.distance import DistanceMatrix
 from skbio.math.stats.ordination import PCoA
+from qiime.parse import is_binary_distmat, parse_binary_distmat
 
 __author__ = "Justin Kuzynski"
 __copyright__ = "Copyright 2011, The QIIME Project"
@@ -21,3 +22,37 @@ def pcoa(lines):
     pcoa_obj = PCoA(dist_mtx)
     # Get the PCoA results and return them
     return pcoa_obj.scores()
+
+
+def pcoa_fp(fp):
+    """Run PCoA on the text or binary distance matrix file at fp
+
+    Binary distance matrices (see qiime.format.write_distance_matrix) are
+    memory-mapped rather than parsed.
+    """
+    if is_binary_distmat(fp):
+        # copy-on-write, so the matrix can be symmetrized without changing
+        # the file
+        labels, data = parse_binary_distmat(fp, mmap_mode='c')
+        # rows calculated in separate tiles can differ from their transpose
+        # by rounding error, which the text format hides
+        _symmetrize(data)
+        return PCoA(DistanceMatrix(data, labels)).scores()
+    with open(fp, 'U') as lines:
+        return pcoa(lines)
+
+
+def _symmetrize(data, block_size=1024):
+    """Replaces each pair of entries of the square data with their mean
+
+    data is changed in place, a block at a time, so no copy of the whole
+    matrix is made.
+    """
+    num_rows = len(data)
+    for i in range(0, num_rows, block_size):
+        for j in range(i, num_rows, block_size):
+            upper = data[i:i + block_size, j:j + block_size]
+            lower = data[j:j + block_size, i:i + block_size]
+            means = (upper + lower.T) / 2
+            upper[...] = means
+            lower[...] = means.T
@@ -20,6 +20,7 @@ import os.path
 import numpy
 from numpy import inf
 from skbio.math.subsample import subsample
+from biom.exception import TableException
 
 from qiime.util import FunctionWithParams
 from qiime.filter import filter_samples_from_otu_table, filter_otus_from_otu_table
@@ -111,18 +112,15 @@ class RarefactionMaker(FunctionWithParams):
                     pass
 
         self.output_dir = output_dir
-        for depth in self.rare_depths:
-            for rep in range(self.num_reps):
-                sub_otu_table = get_rare_data(self.otu_table,
-                                              depth,
-                                              small_included,
-                                              subsample_f=subsample_f)
-                if empty_otus_removed:
-                    sub_otu_table = filter_otus_from_otu_table(
-                        sub_otu_table,
-                        sub_otu_table.ObservationIds, 1, inf, 0, inf)
-
-                self._write_rarefaction(depth, rep, sub_otu_table)
+        for depth, rep, sub_otu_table in iter_rare_tables(
+                self.otu_table, self.rare_depths, self.num_reps,
+                small_included, subsample_f=subsample_f):
+            if empty_otus_removed:
+                sub_otu_table = filter_otus_from_otu_table(
+                    sub_otu_table,
+                    sub_otu_table.ObservationIds, 1, inf, 0, inf)
+
+            self._write_rarefaction(depth, rep, sub_otu_table)
 
         if include_full:
             self._write_rarefaction('full', 0, self.otu_table)
@@ -139,12 +137,12 @@ class RarefactionMaker(FunctionWithParams):
             otu_lineages = self.lineages
         else:
             otu_lineages = None
-        res = []
-        for depth in self.rare_depths:
-            for rep in range(self.num_reps):
-                sub_otu_table = get_rare_data(self.otu_table,
-                                              depth, small_included)
-                res.append([depth, rep, sub_otu_table])
+        res = [[depth, rep, sub_otu_table]
+               for depth, rep, sub_otu_table in iter_rare_tables(
+                   self.otu_table, self.rare_depths, self.num_reps,
+                   small_included)]
+        # iter_rare_tables draws all depths of a rep together
+        res.sort(key=lambda r: (r[0], r[1]))
 
         if include_full:
             res.append(['full', 0, self.otu_table])
@@ -190,3 +188,108 @@ def get_rare_data(otu_table,
     subsampled_otu_table = otu_table.transformSamples(func)
 
     return subsampled_otu_table
+
+
+def nested_subsample(counts, depths, include_small_samples=False,
+                     subsample_f=subsample):
+    """Subsample counts to each of depths, nesting the subsamples.
+
+    The counts are subsampled (without replacement) to the largest depth,
+    and each smaller depth is subsampled from the result for the next larger
+    depth, so each depth is a random subset of the deeper ones and all
+    depths are drawn in one pass over the sequences.
+
+    Subsets of a subsample are only distributed as subsamples of counts
+    when they are drawn without replacement, so any subsample_f other than
+    the default (e.g. subsample with replace=True, as for
+    multiple_rarefactions.py --subsample_multinomial) draws each depth
+    independently from counts instead.
+
+    - include_small_samples=False => depths greater than the total of counts
+    are left out of the result, otherwise the counts are used unchanged for
+    them (as in get_rare_data)
+
+    Returns a list of (depth, subsampled counts), in increasing depth order.
+    """
+    total = counts.sum()
+    nested = subsample_f is subsample
+    current = counts.astype(int)
+    result = []
+    for depth in sorted(set(depths), reverse=True):
+        if total < depth:
+            if include_small_samples:
+                result.append((depth, counts))
+            continue
+        if nested:
+            current = subsample_f(current, depth)
+            result.append((depth, current))
+        else:
+            result.append((depth, subsample_f(counts.astype(int), depth)))
+    result.reverse()
+    return result
+
+
+def iter_rare_samples(otu_table,
+                      depths,
+                      num_reps,
+                      include_small_samples=False,
+                      subsample_f=subsample):
+    """Yields the rarefied counts of each sample at all depths, by replicate
+
+    yields (rep, sample_id, rarefied) for each replicate in turn, and each
+    sample in the order of otu_table, where rarefied is the result of
+    nested_subsample: a list of (depth, counts) in increasing depth order.
+
+    This is for consumers which use the rarefied counts directly, rather
+    than as OTU tables (see iter_rare_tables).
+    """
+    for rep in range(num_reps):
+        for counts, sample_id, sample_md in otu_table.iterSamples():
+            yield rep, sample_id, nested_subsample(counts, depths,
+                                                   include_small_samples,
+                                                   subsample_f)
+
+
+def iter_rare_tables(otu_table,
+                     depths,
+                     num_reps,
+                     include_small_samples=False,
+                     subsample_f=subsample):
+    """Yields (depth, rep, rarefied otu table) for each depth and replicate
+
+    All depths of a replicate are drawn in one pass with nested_subsample,
+    and yielded in increasing depth order before the next replicate. The
+    tables are as returned by get_rare_data, which raises a TableException
+    if no sample has enough sequences for a depth (unless small samples are
+    included); that is checked before any tables are drawn.
+    """
+    depths = sorted(set(depths))
+    if depths and not include_small_samples:
+        max_total = max([counts.sum() for counts in
+                         otu_table.iterSampleData()] or [0])
+        if max_total < depths[-1]:
+            raise TableException("All samples were filtered out! No sample "
+                                 "has %d sequences." % depths[-1])
+    for rep in range(num_reps):
+        # the rarefied counts of this rep, kept sparse until each table is
+        # made: depth -> {sample_id: (nonzero otu indices, counts)}
+        rare_counts = dict([(depth, {}) for depth in depths])
+        for counts, sample_id, sample_md in otu_table.iterSamples():
+            for depth, rare in nested_subsample(counts, depths,
+                                                include_small_samples,
+                                                subsample_f):
+                nonzero = rare.nonzero()[0]
+                rare_counts[depth][sample_id] = (nonzero, rare[nonzero])
+
+        for depth in depths:
+            depth_counts = rare_counts.pop(depth)
+
+            def get_counts(values, sample_id, sample_md):
+                nonzero, rare = depth_counts[sample_id]
+                result = numpy.zeros(len(values), dtype=values.dtype)
+                result[nonzero] = rare
+                return result
+            sub_otu_table = otu_table.filterSamples(
+                lambda values, sample_id, sample_md:
+                sample_id in depth_counts).transformSamples(get_counts)
+            yield depth, rep, sub_otu_table
@@ -10,6 +10,7 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
+from skbio.core.exception import RecordError
 from skbio.parse.sequences import parse_fasta
 from cogent.util.misc import create_dir
 from qiime.parse import parse_mapping_file
@@ -128,3 +129,157 @@ def split_fasta(infile, seqs_per_file, outfile_prefix, working_dir=''):
         current_out_file.close()
 
     return out_files
+
+
+def _get_fasta_newline(fasta_f, block_size=65536):
+    """ Return the line ending used in fasta_f: '\n' (or '\r\n'), or '\r'
+
+        fasta_f: fasta file opened in binary mode
+
+        Only the first block_size bytes are checked.
+    """
+    fasta_f.seek(0)
+    data = fasta_f.read(block_size)
+    if '\r' in data and '\n' not in data:
+        return '\r'
+    return '\n'
+
+
+def _find_fasta_first_record(fasta_f, block_size=65536):
+    """ Return the offset of the first fasta record in fasta_f
+
+        fasta_f: fasta file opened in binary mode
+
+        Whitespace before the first record is skipped. Returns the size of
+         the file if it contains only whitespace, and raises a RecordError
+         if anything else comes before the first record.
+    """
+    fasta_f.seek(0)
+    position = 0
+    data = fasta_f.read(block_size)
+    while data:
+        stripped = data.lstrip()
+        if stripped:
+            if not stripped.startswith('>'):
+                raise RecordError("Found Fasta record without label line "
+                                  "at the start of the file.")
+            return position + len(data) - len(stripped)
+        position += len(data)
+        data = fasta_f.read(block_size)
+    return position
+
+
+def _find_fasta_record_start(fasta_f, position, block_size=65536,
+                             newline='\n'):
+    """ Return the offset of the first fasta record starting at or after position
+
+        fasta_f: fasta file opened in binary mode
+        position: byte offset (> 0) to start searching from
+        newline: the line ending used in fasta_f (see _get_fasta_newline)
+
+        Returns the size of the file if no record starts at or after position.
+    """
+    # a record starts at a '>' which follows a newline, so start looking
+    # one byte before position
+    data_start = position - 1
+    fasta_f.seek(data_start)
+    data = fasta_f.read(block_size)
+    while data:
+        i = data.find(newline + '>')
+        if i != -1:
+            return data_start + i + 1
+        block = fasta_f.read(block_size)
+        if not block:
+            break
+        # keep the last byte in case it is the newline before a '>'
+        data_start += len(data) - 1
+        data = data[-1:] + block
+    fasta_f.seek(0, 2)
+    return fasta_f.tell()
+
+
+def get_fasta_split_offsets(fasta_f, num_chunks, block_size=65536):
+    """ Return (start, end) byte offsets splitting fasta_f into whole records
+
+        fasta_f: fasta file opened in binary mode
+        num_chunks: the maximum number of ranges to return
+
+        The file is split into ranges of roughly equal size (so larger
+         ranges hold fewer sequences, which generally take longer to
+         process), each beginning at the start of a record. Only the bytes
+         around each split point are read. Fewer than num_chunks ranges are
+         returned if the file has too few records. Records may end with
+         '\n', '\r\n' or '\r'. Whitespace before the first record is
+         skipped, and a RecordError is raised if anything else precedes it.
+    """
+    if num_chunks <= 0:
+        raise ValueError("num_chunks must be > 0!")
+
+    newline = _get_fasta_newline(fasta_f, block_size)
+    first_record_start = _find_fasta_first_record(fasta_f, block_size)
+    fasta_f.seek(0, 2)
+    file_size = fasta_f.tell()
+    boundaries = [first_record_start]
+    for i in range(1, num_chunks):
+        position = first_record_start + \
+            int((file_size - first_record_start) * i / num_chunks)
+        if position <= boundaries[-1]:
+            continue
+        record_start = _find_fasta_record_start(fasta_f, position, block_size,
+                                                newline)
+        if boundaries[-1] < record_start < file_size:
+            boundaries.append(record_start)
+    boundaries.append(file_size)
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:])
+            if end > start]
+
+
+def split_fasta_on_byte_offsets(fasta_fp,
+                                num_files,
+                                outfile_prefix,
+                                working_dir='',
+                                buffer_size=1048576):
+    """ Split fasta_fp into at most num_files files of whole records
+
+        fasta_fp: path to the fasta file to split
+        num_files: the maximum number of files to create
+        out_fileprefix: string used to create output filepath - output filepaths
+         are <out_prefix>.<i>.fasta where i runs from 0 to number of output files
+        working_dir: directory to prepend to temp filepaths (defaults to
+         empty string -- files written to cwd)
+
+        Unlike split_fasta, the records are not parsed: the split points are
+         found with get_fasta_split_offsets, and the byte range between them
+         is copied to each output file ('\r' line endings are written as
+         '\n'). List of output filepaths is returned.
+
+    """
+    if working_dir and not working_dir.endswith('/'):
+        working_dir += '/'
+        create_dir(working_dir)
+
+    out_files = []
+    fasta_f = open(fasta_fp, 'rb')
+    newline = _get_fasta_newline(fasta_f)
+    for start, end in get_fasta_split_offsets(fasta_f, num_files):
+        current_out_fp = '%s%s.%d.fasta' \
+            % (working_dir, outfile_prefix, len(out_files))
+        current_out_file = open(current_out_fp, 'wb')
+        fasta_f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = fasta_f.read(min(buffer_size, remaining))
+            if not data:
+                current_out_file.close()
+                fasta_f.close()
+                raise IOError("%s ended before byte %d: was it changed "
+                              "while it was being split?" % (fasta_fp, end))
+            remaining -= len(data)
+            if newline == '\r':
+                data = data.replace('\r', '\n')
+            current_out_file.write(data)
+        current_out_file.close()
+        out_files.append(current_out_fp)
+    fasta_f.close()
+
+    return out_files
@@ -53,7 +53,7 @@ from cogent.util.misc import remove_files
 from skbio.core.sequence import DNASequence
 
 from qiime.check_id_map import process_id_map
-from qiime.barcode import correct_barcode
+from qiime.barcode import correct_barcode, get_barcode_corrector
 from qiime.hamming import decode_barcode_8
 from qiime.golay import decode as decode_golay_12
 from qiime.format import format_histograms
@@ -468,8 +468,9 @@ def check_barcode(curr_barcode, barcode_type, valid_map,
             return num_errors, barcode, corrected_bc
     else:
         try:
-            expect_len, curr_bc_fun = int(barcode_type), correct_barcode
-            barcode, num_errors = curr_bc_fun(curr_barcode, valid_map)
+            expect_len = int(barcode_type)
+            curr_bc_fun = get_barcode_corrector(valid_map)
+            barcode, num_errors = curr_bc_fun(curr_barcode)
             corrected_bc = True
 
             if added_demultiplex_field:
@@ -592,6 +593,10 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
         sorted(set([len(bc.split(',')[0]) for bc in valid_map]))
     barcode_length_order = barcode_length_order[::-1]
 
+    # check_barcode reuses its barcode corrector while it is passed the same
+    # tuple of barcodes
+    valid_barcodes = tuple(valid_map)
+
     primer_mismatch_count = 0
     all_primers_lens = sorted(set(all_primers.values()))
 
@@ -702,7 +707,7 @@ def check_seqs(fasta_out, fasta_files, starting_ix, valid_map, qual_mappings,
             # get current barcode
             try:
                 bc_diffs, curr_bc, corrected_bc = \
-                    check_barcode(cbc, barcode_type, valid_map.keys(),
+                    check_barcode(cbc, barcode_type, valid_barcodes,
                                   attempt_bc_correction, added_demultiplex_field, curr_id)
                 if bc_diffs > max_bc_errors:
                     raise ValueError("Too many errors in barcode")
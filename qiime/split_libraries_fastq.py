@@ -11,10 +11,13 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from itertools import izip, cycle
-from os.path import split, splitext
-from os import makedirs
+from os.path import split, splitext, getsize, exists
+from os import makedirs, close, remove
+from tempfile import mkstemp
+from multiprocessing import Pool
 
-from numpy import log10, arange, histogram
+from numpy import (log10, arange, histogram, fromstring, int8, int16, int32,
+                   uint8, array, zeros, concatenate, newaxis)
 
 from skbio.parse.sequences import parse_fastq
 from skbio.core.sequence import DNA
@@ -25,6 +28,7 @@ from qiime.parse import is_casava_v180_or_later
 from qiime.hamming import decode_hamming_8
 from qiime.golay import decode_golay_12
 from qiime.quality import phred_to_ascii33, phred_to_ascii64
+from qiime.util import get_qiime_temp_dir
 
 
 class FastqParseError(Exception):
@@ -83,21 +87,9 @@ def quality_filter_sequence(header,
                             min_per_read_length,
                             seq_max_N,
                             filter_bad_illumina_qual_digit):
-    if filter_bad_illumina_qual_digit:
-        h = header.split()[0]
-        try:
-            # this block is a little strange because each of these
-            # can throw a ValueError. The same thing needs to be done
-            # in either case, so it doesn't really make sense to split
-            # into two separate try/excepts, particulary because that would
-            # complicate the logic
-            quality_char = header[h.index('#') + 1]
-            illumina_quality_digit = int(quality_char)
-        except ValueError:
-            pass
-        else:
-            if illumina_quality_digit == 0:
-                return 3, sequence, quality
+    if filter_bad_illumina_qual_digit and \
+       has_bad_illumina_qual_digit(header):
+        return 3, sequence, quality
 
     sequence, quality = read_qual_score_filter(sequence,
                                                quality,
@@ -112,6 +104,146 @@ def quality_filter_sequence(header,
         return 0, sequence, quality
 
 
+def has_bad_illumina_qual_digit(header):
+    """Return True if header carries an Illumina quality digit of 0
+    """
+    h = header.split()[0]
+    try:
+        # this block is a little strange because each of these
+        # can throw a ValueError. The same thing needs to be done
+        # in either case, so it doesn't really make sense to split
+        # into two separate try/excepts, particulary because that would
+        # complicate the logic
+        quality_char = header[h.index('#') + 1]
+        illumina_quality_digit = int(quality_char)
+    except ValueError:
+        return False
+    else:
+        return illumina_quality_digit == 0
+
+
+def pack_reads(sequences, qualities):
+    """Pack lists of sequences and quality arrays into 2D arrays
+
+        return value: (sequence array, quality array, read lengths)
+
+        Rows are padded to the length of the longest read: sequences with
+         spaces and qualities with zeros.
+    """
+    num_reads = len(sequences)
+    lengths = array([len(seq) for seq in sequences], dtype=int)
+    if num_reads == 0:
+        width = 0
+    else:
+        width = lengths.max()
+    packed_sequences = fromstring(
+        ''.join([seq.ljust(width) for seq in sequences]),
+        dtype=uint8).reshape((num_reads, width))
+    packed_qualities = zeros((num_reads, width), dtype=int16)
+    if width > 0:
+        packed_qualities[arange(width) < lengths[:, newaxis]] = \
+            concatenate(qualities)
+    return packed_sequences, packed_qualities, lengths
+
+
+def quality_filter_packed_reads(sequences,
+                                qualities,
+                                lengths,
+                                max_bad_run_length,
+                                phred_quality_threshold,
+                                min_per_read_length,
+                                seq_max_N):
+    """Quality filter a block of reads packed into 2D arrays
+
+        sequences, qualities, lengths: as returned by pack_reads
+
+        This computes, for every read at once, the same truncation and
+         pass/fail decision as read_qual_score_filter followed by the length
+         and N checks in quality_filter_sequence.
+
+        return value: (filter results, truncated read lengths), where the
+         filter results are 0 (pass), 1 (too short) or 2 (too many Ns).
+         max_bad_run_length must be zero or greater.
+    """
+    num_reads, width = qualities.shape
+    in_read = arange(width) < lengths[:, newaxis]
+    truncated_lengths = lengths.copy()
+
+    # reads are truncated before the first run of more than
+    # max_bad_run_length bases at or below the quality threshold. a run
+    # of window bad bases starting at position i is found by
+    # differencing the cumulative count of bad bases.
+    window = max_bad_run_length + 1
+    if phred_quality_threshold is not None and 0 < window <= width:
+        bad = (qualities <= phred_quality_threshold) & in_read
+        bad_counts = zeros((num_reads, width + 1), dtype=int32)
+        bad.cumsum(axis=1, out=bad_counts[:, 1:])
+        bad_runs = (bad_counts[:, window:] - bad_counts[:, :-window]) == window
+        has_bad_run = bad_runs.any(axis=1)
+        truncated_lengths[has_bad_run] = bad_runs.argmax(axis=1)[has_bad_run]
+
+    in_truncated_read = arange(width) < truncated_lengths[:, newaxis]
+    n_counts = ((sequences == ord('N')) & in_truncated_read).sum(axis=1)
+
+    results = zeros(num_reads, dtype=int)
+    results[n_counts > seq_max_N] = 2
+    results[truncated_lengths < min_per_read_length] = 1
+    return results, truncated_lengths
+
+
+def quality_filter_sequences(headers,
+                             sequences,
+                             qualities,
+                             max_bad_run_length,
+                             phred_quality_threshold,
+                             min_per_read_length,
+                             seq_max_N,
+                             filter_bad_illumina_qual_digit):
+    """Quality filter a block of reads
+
+        This is a batched equivalent of quality_filter_sequence: the reads
+         are packed into 2D arrays and filtered with
+         quality_filter_packed_reads.
+
+        return value: list of (filter result, sequence, quality), one per
+         read, identical to calling quality_filter_sequence on each read
+    """
+    if max_bad_run_length < 0:
+        # the packed filter only finds runs of one or more bad bases
+        return [quality_filter_sequence(header,
+                                        sequence,
+                                        quality,
+                                        max_bad_run_length,
+                                        phred_quality_threshold,
+                                        min_per_read_length,
+                                        seq_max_N,
+                                        filter_bad_illumina_qual_digit)
+                for header, sequence, quality in izip(headers,
+                                                      sequences,
+                                                      qualities)]
+
+    packed_sequences, packed_qualities, lengths = pack_reads(sequences,
+                                                             qualities)
+    results, truncated_lengths = quality_filter_packed_reads(
+        packed_sequences,
+        packed_qualities,
+        lengths,
+        max_bad_run_length,
+        phred_quality_threshold,
+        min_per_read_length,
+        seq_max_N)
+
+    filtered = []
+    for header, sequence, quality, result, length in izip(
+            headers, sequences, qualities, results, truncated_lengths):
+        if filter_bad_illumina_qual_digit and \
+           has_bad_illumina_qual_digit(header):
+            filtered.append((3, sequence, quality))
+        else:
+            filtered.append((result, sequence[:length], quality[:length]))
+    return filtered
+
+
 def check_header_match_pre180(header1, header2):
 
     # split on '#' and '/' to handle cases with and without the
@@ -238,10 +370,6 @@ def process_fastq_single_end_read_file(fastq_read_f,
                                        phred_to_ascii_f=None):
     """parses fastq single-end read file
     """
-    header_index = 0
-    sequence_index = 1
-    quality_index = 2
-
     seq_id = start_seq_id
     # grab the first lines and then seek back to the beginning of the file
     try:
@@ -253,11 +381,94 @@ def process_fastq_single_end_read_file(fastq_read_f,
         fastq_read_f_line2 = fastq_read_f[1]
 
     post_casava_v180 = is_casava_v180_or_later(fastq_read_f_line1)
+    # compute the minimum read length as a fraction of the length of the input
+    # read
+    min_per_read_length = min_per_read_length_fraction * \
+        len(fastq_read_f_line2)
+
+    stats = _init_demultiplex_stats()
+    for sample_id, header_fields, sequence, quality in _demultiplex_fastq(
+            fastq_read_f,
+            fastq_barcode_f,
+            barcode_to_sample_id,
+            post_casava_v180,
+            min_per_read_length,
+            stats,
+            store_unassigned=store_unassigned,
+            max_bad_run_length=max_bad_run_length,
+            phred_quality_threshold=phred_quality_threshold,
+            rev_comp=rev_comp,
+            rev_comp_barcode=rev_comp_barcode,
+            seq_max_N=seq_max_N,
+            filter_bad_illumina_qual_digit=filter_bad_illumina_qual_digit,
+            barcode_correction_fn=barcode_correction_fn,
+            max_barcode_errors=max_barcode_errors,
+            strict_header_match=strict_header_match):
+        fasta_header = '%s_%s %s' % (sample_id, seq_id, header_fields)
+        yield fasta_header, sequence, quality, seq_id
+        seq_id += 1
+
+    _write_demultiplex_summary(stats, barcode_to_sample_id, log_f,
+                               histogram_f)
+
+
+def _init_demultiplex_stats():
+    """Return an empty container for the demultiplexing counts
+
+        The keys mirror the arguments of format_split_libraries_fastq_log so
+         partial results (e.g., from several shards of one file) can be summed.
+    """
+    return {'count_barcode_not_in_map': 0,
+            'count_too_short': 0,
+            'count_too_many_N': 0,
+            'count_bad_illumina_qual_digit': 0,
+            'count_barcode_errors_exceed_max': 0,
+            'input_sequence_count': 0,
+            'sequence_lengths': [],
+            'seqs_per_sample_counts': {}}
+
+
+def _get_phred_offset(post_casava_v180):
+    """Return the ascii offset of quality scores in fastq files"""
+    if post_casava_v180:
+        return 33
+    else:
+        return 64
+
+
+def _demultiplex_fastq(fastq_read_f,
+                       fastq_barcode_f,
+                       barcode_to_sample_id,
+                       post_casava_v180,
+                       min_per_read_length,
+                       stats,
+                       store_unassigned=False,
+                       max_bad_run_length=0,
+                       phred_quality_threshold=2,
+                       rev_comp=False,
+                       rev_comp_barcode=False,
+                       seq_max_N=0,
+                       filter_bad_illumina_qual_digit=False,
+                       barcode_correction_fn=None,
+                       max_barcode_errors=1.5,
+                       strict_header_match=True,
+                       block_size=10000):
+    """Demultiplex and quality filter paired read/barcode fastq records
+
+        yields (sample_id, header fields, sequence, quality) for each
+         record that passes, where header fields is everything in the fasta
+         header after the sample_id and seq_id. stats (as returned by
+         _init_demultiplex_stats) is updated in place. Quality filtering is
+         applied to block_size assigned reads at a time.
+    """
+    header_index = 0
+    sequence_index = 1
+    quality_index = 2
+
+    offset = _get_phred_offset(post_casava_v180)
     if post_casava_v180:
-        offset = 33
         check_header_match_f = check_header_match_180_or_later
     else:
-        offset = 64
         check_header_match_f = check_header_match_pre180
 
     # compute the barcode length, if they are all the same.
@@ -270,24 +481,18 @@ def process_fastq_single_end_read_file(fastq_read_f,
     else:
         barcode_length = None
 
-    # compute the minimum read length as a fraction of the length of the input
-    # read
-    min_per_read_length = min_per_read_length_fraction * \
-        len(fastq_read_f_line2)
-
-    # prep data for logging
-    input_sequence_count = 0
-    count_barcode_not_in_map = 0
-    count_too_short = 0
-    count_too_many_N = 0
-    count_bad_illumina_qual_digit = 0
-    count_barcode_errors_exceed_max = 0
-    sequence_lengths = []
-    seqs_per_sample_counts = {}
+    filter_kwargs = {'max_bad_run_length': max_bad_run_length,
+                     'phred_quality_threshold': phred_quality_threshold,
+                     'min_per_read_length': min_per_read_length,
+                     'seq_max_N': seq_max_N,
+                     'filter_bad_illumina_qual_digit':
+                     filter_bad_illumina_qual_digit,
+                     'rev_comp': rev_comp}
+    block = []
     for bc_data, read_data in izip(
             parse_fastq(fastq_barcode_f, strict=False, phred_offset=offset),
             parse_fastq(fastq_read_f, strict=False, phred_offset=offset)):
-        input_sequence_count += 1
+        stats['input_sequence_count'] += 1
         # Confirm match between barcode and read headers
         if strict_header_match and \
            (not check_header_match_f(bc_data[header_index], read_data[header_index])):
@@ -323,37 +528,72 @@ def process_fastq_single_end_read_file(fastq_read_f,
                 barcode_correction_fn)
         # skip samples with too many errors
         if (num_barcode_errors > max_barcode_errors):
-            count_barcode_errors_exceed_max += 1
+            stats['count_barcode_errors_exceed_max'] += 1
             continue
 
         # skip unassignable samples unless otherwise requested
         if sample_id is None:
             if not store_unassigned:
-                count_barcode_not_in_map += 1
+                stats['count_barcode_not_in_map'] += 1
                 continue
             else:
                 sample_id = 'Unassigned'
 
-        quality_filter_result, sequence, quality =\
-            quality_filter_sequence(header,
-                                    sequence,
-                                    quality,
-                                    max_bad_run_length,
-                                    phred_quality_threshold,
-                                    min_per_read_length,
-                                    seq_max_N,
-                                    filter_bad_illumina_qual_digit)
-
+        header_fields = '%s orig_bc=%s new_bc=%s bc_diffs=%d' %\
+            (header, barcode, corrected_barcode, num_barcode_errors)
+        block.append((sample_id, header_fields, header, sequence, quality))
+        # quality filtering is applied to blocks of reads at once
+        if len(block) == block_size:
+            for record in _quality_filter_block(block, stats, **filter_kwargs):
+                yield record
+            block = []
+
+    for record in _quality_filter_block(block, stats, **filter_kwargs):
+        yield record
+
+
+def _quality_filter_block(block,
+                          stats,
+                          max_bad_run_length,
+                          phred_quality_threshold,
+                          min_per_read_length,
+                          seq_max_N,
+                          filter_bad_illumina_qual_digit,
+                          rev_comp):
+    """Quality filter a block of demultiplexed records
+
+        block: list of (sample_id, header fields, header, sequence, quality)
+
+        yields (sample_id, header fields, sequence, quality) for each
+         record that passes. stats is updated in place.
+    """
+    if not block:
+        return
+    sample_ids, header_fields, headers, sequences, qualities = zip(*block)
+    filter_results = quality_filter_sequences(headers,
+                                              sequences,
+                                              qualities,
+                                              max_bad_run_length,
+                                              phred_quality_threshold,
+                                              min_per_read_length,
+                                              seq_max_N,
+                                              filter_bad_illumina_qual_digit)
+
+    sequence_lengths = stats['sequence_lengths']
+    seqs_per_sample_counts = stats['seqs_per_sample_counts']
+    for sample_id, fields, filter_result in izip(sample_ids, header_fields,
+                                                  filter_results):
+        quality_filter_result, sequence, quality = filter_result
         # process quality result
         if quality_filter_result != 0:
             # if the quality filter didn't pass record why and
             # move on to the next record
             if quality_filter_result == 1:
-                count_too_short += 1
+                stats['count_too_short'] += 1
             elif quality_filter_result == 2:
-                count_too_many_N += 1
+                stats['count_too_many_N'] += 1
             elif quality_filter_result == 3:
-                count_bad_illumina_qual_digit += 1
+                stats['count_bad_illumina_qual_digit'] += 1
             else:
                 raise ValueError(
                     "Unknown quality filter result: %d" %
@@ -371,26 +611,30 @@ def process_fastq_single_end_read_file(fastq_read_f,
             sequence = str(DNA(sequence).rc())
             quality = quality[::-1]
 
-        fasta_header = '%s_%s %s orig_bc=%s new_bc=%s bc_diffs=%d' %\
-            (sample_id, seq_id, header, barcode,
-             corrected_barcode, num_barcode_errors)
-        yield fasta_header, sequence, quality, seq_id
-        seq_id += 1
+        yield sample_id, fields, sequence, quality
 
+
+def _write_demultiplex_summary(stats, barcode_to_sample_id, log_f,
+                               histogram_f):
+    """Write the split libraries log and length histogram for stats
+    """
+    seqs_per_sample_counts = stats['seqs_per_sample_counts']
+    sequence_lengths = stats['sequence_lengths']
     # Add sample IDs with zero counts to dictionary for logging
     for curr_sample_id in barcode_to_sample_id.values():
-        if curr_sample_id not in seqs_per_sample_counts.keys():
+        if curr_sample_id not in seqs_per_sample_counts:
             seqs_per_sample_counts[curr_sample_id] = 0
 
     if log_f is not None:
-        log_str = format_split_libraries_fastq_log(count_barcode_not_in_map,
-                                                   count_too_short,
-                                                   count_too_many_N,
-                                                   count_bad_illumina_qual_digit,
-                                                   count_barcode_errors_exceed_max,
-                                                   input_sequence_count,
-                                                   sequence_lengths,
-                                                   seqs_per_sample_counts)
+        log_str = format_split_libraries_fastq_log(
+            stats['count_barcode_not_in_map'],
+            stats['count_too_short'],
+            stats['count_too_many_N'],
+            stats['count_bad_illumina_qual_digit'],
+            stats['count_barcode_errors_exceed_max'],
+            stats['input_sequence_count'],
+            sequence_lengths,
+            seqs_per_sample_counts)
         log_f.write(log_str)
 
     if len(sequence_lengths) and histogram_f is not None:
@@ -400,6 +644,252 @@ def process_fastq_single_end_read_file(fastq_read_f,
         histogram_f.write('\n--\n\n')
 
 
+def get_fastq_shard_boundaries(fastq_read_fp, fastq_barcode_fp, num_shards):
+    """Split a read/barcode fastq pair into record-aligned byte ranges
+
+        The read file is divided into num_shards ranges of roughly equal
+         size, with each boundary moved forward to the start of the next
+         four-line record. The barcode file is then divided at the same
+         record indices, so the nth range of each file contains the same
+         reads.
+
+        return value: list of ((read_start, read_end),
+                               (barcode_start, barcode_end)) byte offsets.
+         Fewer than num_shards ranges are returned if the files contain
+         fewer records than that.
+    """
+    read_size = getsize(fastq_read_fp)
+    targets = [read_size * i // num_shards for i in range(1, num_shards)]
+
+    # find the record indices at which the read file should be split
+    read_offsets = [0]
+    split_indices = [0]
+    fastq_read_f = open(fastq_read_fp, 'rb')
+    read_lines = _iter_fastq_lines(fastq_read_f)
+    record_index = 0
+    offset = 0
+    target_index = 0
+    while target_index < len(targets):
+        record = [next(read_lines, '') for i in range(4)]
+        if not record[0]:
+            break
+        offset += sum(map(len, record))
+        record_index += 1
+        if offset >= targets[target_index] and offset < read_size:
+            read_offsets.append(offset)
+            split_indices.append(record_index)
+            while (target_index < len(targets) and
+                   targets[target_index] <= offset):
+                target_index += 1
+    fastq_read_f.close()
+    read_offsets.append(read_size)
+
+    # find the byte offsets of the same record indices in the barcode file
+    barcode_offsets = [0]
+    fastq_barcode_f = open(fastq_barcode_fp, 'rb')
+    barcode_lines = _iter_fastq_lines(fastq_barcode_f)
+    record_index = 0
+    offset = 0
+    for split_index in split_indices[1:]:
+        while record_index < split_index:
+            offset += sum([len(next(barcode_lines, ''))
+                           for i in range(4)])
+            record_index += 1
+        barcode_offsets.append(offset)
+    fastq_barcode_f.close()
+    barcode_offsets.append(getsize(fastq_barcode_fp))
+
+    return [((read_offsets[i], read_offsets[i + 1]),
+             (barcode_offsets[i], barcode_offsets[i + 1]))
+            for i in range(len(read_offsets) - 1)]
+
+
+def _get_fastq_newline(fastq_f, block_size=65536):
+    """Return the line ending used in fastq_f: '\n' (or '\r\n'), or '\r'
+
+        fastq_f: fastq file opened in binary mode. Only the first
+         block_size bytes are checked.
+    """
+    fastq_f.seek(0)
+    data = fastq_f.read(block_size)
+    if '\r' in data and '\n' not in data:
+        return '\r'
+    return '\n'
+
+
+def _iter_fastq_lines(fastq_f, start=0, block_size=65536):
+    """Yield the lines of fastq_f, with their line endings, from offset start
+
+        fastq_f is opened in binary mode so that the lengths of the lines
+         are their sizes in bytes, so unlike universal newline mode, lines
+         ending in '\r' have to be split here. start must be the offset of
+         the start of a line.
+    """
+    newline = _get_fastq_newline(fastq_f, block_size)
+    fastq_f.seek(start)
+    if newline == '\n':
+        for line in iter(fastq_f.readline, ''):
+            yield line
+        return
+    remainder = ''
+    for data in iter(lambda: fastq_f.read(block_size), ''):
+        lines = (remainder + data).split('\r')
+        remainder = lines.pop()
+        for line in lines:
+            yield line + '\r'
+    if remainder:
+        yield remainder
+
+
+def _iter_fastq_range(fastq_f, start, end):
+    """Yield the lines of fastq_f between byte offsets start and end
+
+        Lines are yielded ending in '\n', whatever the line endings of
+         fastq_f, as they would be read in universal newline mode.
+    """
+    position = start
+    for line in _iter_fastq_lines(fastq_f, start):
+        if position >= end:
+            break
+        position += len(line)
+        yield line.rstrip('\r\n') + '\n'
+
+
+def _process_fastq_shard(shard):
+    """Demultiplex one byte range of a read/barcode fastq pair
+
+        Run in a worker process by
+         process_fastq_single_end_read_file_sharded. Passing records are
+         written to a temporary file (sample_id, header fields, sequence and
+         quality on consecutive lines) so that
+         the parent can assign seq_ids in input order. Quality scores are
+         written with the same ascii offset as the input file.
+
+        return value: (filepath of passing records, stats)
+    """
+    (fastq_read_fp, fastq_barcode_fp, (read_start, read_end),
+     (barcode_start, barcode_end), barcode_to_sample_id, post_casava_v180,
+     min_per_read_length, output_fp, kwargs) = shard
+    stats = _init_demultiplex_stats()
+    offset = _get_phred_offset(post_casava_v180)
+    fastq_read_f = open(fastq_read_fp, 'rb')
+    fastq_barcode_f = open(fastq_barcode_fp, 'rb')
+    output_f = open(output_fp, 'w')
+    for sample_id, header_fields, sequence, quality in _demultiplex_fastq(
+            _iter_fastq_range(fastq_read_f, read_start, read_end),
+            _iter_fastq_range(fastq_barcode_f, barcode_start, barcode_end),
+            barcode_to_sample_id,
+            post_casava_v180,
+            min_per_read_length,
+            stats,
+            **kwargs):
+        output_f.write('%s\n%s\n%s\n%s\n' %
+                       (sample_id, header_fields, sequence,
+                        (quality + offset).astype(int8).tostring()))
+    output_f.close()
+    fastq_read_f.close()
+    fastq_barcode_f.close()
+    return output_fp, stats
+
+
+def process_fastq_single_end_read_file_sharded(fastq_read_fp,
+                                               fastq_barcode_fp,
+                                               barcode_to_sample_id,
+                                               jobs=2,
+                                               store_unassigned=False,
+                                               max_bad_run_length=0,
+                                               phred_quality_threshold=2,
+                                               min_per_read_length_fraction=0.75,
+                                               rev_comp=False,
+                                               rev_comp_barcode=False,
+                                               seq_max_N=0,
+                                               start_seq_id=0,
+                                               filter_bad_illumina_qual_digit=False,
+                                               log_f=None,
+                                               histogram_f=None,
+                                               barcode_correction_fn=None,
+                                               max_barcode_errors=1.5,
+                                               strict_header_match=True,
+                                               temp_dir=None):
+    """Demultiplex an uncompressed read/barcode fastq pair across processes
+
+        The files are split into jobs record-aligned byte ranges (see
+         get_fastq_shard_boundaries), each range is demultiplexed in a worker
+         process, and the results are merged in input order. The yielded
+         records, seq_ids, log and histogram are identical to those of
+         process_fastq_single_end_read_file run on the same files.
+    """
+    if temp_dir is None:
+        temp_dir = get_qiime_temp_dir()
+
+    fastq_read_f = open(fastq_read_fp, 'U')
+    fastq_read_f_line1 = fastq_read_f.readline()
+    fastq_read_f_line2 = fastq_read_f.readline()
+    fastq_read_f.close()
+    post_casava_v180 = is_casava_v180_or_later(fastq_read_f_line1)
+    offset = _get_phred_offset(post_casava_v180)
+    min_per_read_length = min_per_read_length_fraction * \
+        len(fastq_read_f_line2)
+
+    kwargs = {'store_unassigned': store_unassigned,
+              'max_bad_run_length': max_bad_run_length,
+              'phred_quality_threshold': phred_quality_threshold,
+              'rev_comp': rev_comp,
+              'rev_comp_barcode': rev_comp_barcode,
+              'seq_max_N': seq_max_N,
+              'filter_bad_illumina_qual_digit': filter_bad_illumina_qual_digit,
+              'barcode_correction_fn': barcode_correction_fn,
+              'max_barcode_errors': max_barcode_errors,
+              'strict_header_match': strict_header_match}
+
+    shards = []
+    for read_range, barcode_range in get_fastq_shard_boundaries(
+            fastq_read_fp, fastq_barcode_fp, jobs):
+        fd, output_fp = mkstemp(dir=temp_dir, prefix='split_libraries_fastq_',
+                                suffix='.txt')
+        close(fd)
+        shards.append((fastq_read_fp, fastq_barcode_fp, read_range,
+                       barcode_range, barcode_to_sample_id, post_casava_v180,
+                       min_per_read_length, output_fp, kwargs))
+
+    stats = _init_demultiplex_stats()
+    seq_id = start_seq_id
+    pool = Pool(jobs)
+    try:
+        # imap returns the shards in input order, so records can be
+        # yielded from the first shard while later shards are running
+        for output_fp, shard_stats in pool.imap(_process_fastq_shard, shards):
+            for key, value in shard_stats.items():
+                if key == 'sequence_lengths':
+                    stats[key].extend(value)
+                elif key == 'seqs_per_sample_counts':
+                    for sample_id, count in value.items():
+                        stats[key][sample_id] = \
+                            stats[key].get(sample_id, 0) + count
+                else:
+                    stats[key] += value
+
+            output_f = open(output_fp, 'U')
+            for sample_id, header_fields, sequence, quality in \
+                    izip(output_f, output_f, output_f, output_f):
+                quality = fromstring(quality[:-1],
+                                     dtype='|S1').view(int8) - offset
+                fasta_header = '%s_%s %s' % (sample_id[:-1], seq_id,
+                                             header_fields[:-1])
+                yield fasta_header, sequence[:-1], quality, seq_id
+                seq_id += 1
+            output_f.close()
+            remove(output_fp)
+    finally:
+        pool.terminate()
+        for shard in shards:
+            if exists(shard[7]):
+                remove(shard[7])
+
+    _write_demultiplex_summary(stats, barcode_to_sample_id, log_f,
+                               histogram_f)
+
+
 def make_histograms(lengths, binwidth=10):
     """Makes histogram data for pre and post lengths"""
     min_len = min(lengths)
@@ -25,21 +25,23 @@ from os.path import join
 from types import ListType
 from copy import deepcopy
 from itertools import combinations
+from multiprocessing import Pool
 
 from matplotlib import use
 use('Agg', warn=False)
 from matplotlib.pyplot import figure
 from numpy import (argsort, array, ceil, empty, fill_diagonal, finfo,
                    log2, mean, ones, sqrt, tri, unique, zeros, ndarray, floor,
-                   median, nan, min as np_min, max as np_max)
+                   median, nan, min as np_min, max as np_max, arange,
+                   bincount, dot, tile, triu_indices, where)
 from numpy.random import permutation
+from scipy.stats import rankdata
 from cogent.maths.stats.test import t_one_sample
 from biom.table import table_factory, DenseOTUTable
 from skbio.core.distance import DistanceMatrix
 from skbio.util.misc import create_dir
 
-from qiime.pycogent_backports.test import (mantel_test, mc_t_two_sample,
-                                           pearson, permute_2d, spearman)
+from qiime.pycogent_backports.test import mc_t_two_sample, spearman
 from qiime.format import format_p_value_for_num_iters, format_biom_table
 from qiime.util import MetadataMap
 
@@ -52,6 +54,14 @@ tail_type_desc = {
     'two-sided': ('two-sided', '!=')
 }
 
+# The number of bytes of temporary arrays to use for each batch of
+# permutations in permutation tests.
+DEFAULT_PERMUTATION_MEMORY = 100000000
+
+# The absolute difference below which a permuted statistic is counted as a
+# tie with the observed statistic in the Mantel tests.
+_STAT_TOLERANCE = 1e-12
+
 
 def all_pairs_t_test(labels, dists, tail_type='two-sided',
                      num_permutations=999):
@@ -559,6 +569,289 @@ class CategoryStats(DistanceMatrixStats):
         self._validate_compatibility()
         return super(CategoryStats, self).__call__(num_perms)
 
+    def _get_group_indices(self, samples, category):
+        """Returns the grouping of samples by category as group indices.
+
+        Returns a tuple containing an array of the group index of each sample
+        (the index of its category value in the sorted category values) and
+        the number of groups.
+
+        Arguments:
+            samples - the sample IDs to group
+            category - the category to group the samples by
+        """
+        values = [self.MetadataMap.getCategoryValue(samp_id, category)
+                  for samp_id in samples]
+        unique_values = sorted(set(values))
+        value_indices = dict([(value, i)
+                              for i, value in enumerate(unique_values)])
+        return array([value_indices[value] for value in values]), \
+            len(unique_values)
+
+
+def _permuted_stats(stat_f, stat_args, values, num_perms, random_fn,
+                    batch_size, jobs_to_start=1):
+    """Computes a statistic on values and on permutations of values.
+
+    Returns the statistic of values and an array of the statistics of the
+    permutations. The permutations are made with random_fn in the current
+    process, each from the previous permutation (as the statistical methods
+    have always permuted their grouping), so the results are reproducible
+    for a given random seed whatever the number of jobs. The statistics are
+    computed in batches of permutations with stat_f, and if jobs_to_start is
+    greater than one, the batches are spread across that many processes.
+
+    stat_f may return several statistics for each permutation (e.g. one for
+    each distance class of a Mantel correlogram), in which case the results
+    have an extra dimension.
+
+    Arguments:
+        stat_f - function taking a 2D array whose rows are permutations of
+            values, followed by stat_args, and returning an array of the
+            statistic(s) of each row. It must be a module-level function if
+            jobs_to_start is greater than one
+        stat_args - tuple of additional arguments to stat_f. If
+            jobs_to_start is greater than one, they are sent to each process
+            once
+        values - 1D array to permute
+        num_perms - the number of permutations
+        random_fn - the function to use to permute values
+        batch_size - the number of permutations to compute at a time
+        jobs_to_start - the number of processes to use
+    """
+    observed = stat_f(values[None], *stat_args)[0]
+
+    def get_batches():
+        permuted = values
+        for start in range(0, num_perms, batch_size):
+            batch = empty((min(batch_size, num_perms - start), len(values)),
+                          values.dtype)
+            for i in range(len(batch)):
+                permuted = random_fn(permuted)
+                batch[i] = permuted
+            yield batch
+
+    perm_stats = empty((num_perms,) + observed.shape)
+    if jobs_to_start > 1 and num_perms > batch_size:
+        pool = Pool(jobs_to_start, _init_permuted_stats_worker,
+                    (stat_f, stat_args))
+        try:
+            batch_stats = pool.imap(_permuted_stats_worker, get_batches())
+            start = 0
+            for stats in batch_stats:
+                perm_stats[start:start + len(stats)] = stats
+                start += len(stats)
+        finally:
+            pool.terminate()
+    else:
+        start = 0
+        for batch in get_batches():
+            perm_stats[start:start + len(batch)] = stat_f(batch, *stat_args)
+            start += len(batch)
+    return observed, perm_stats
+
+
+# stat_f and stat_args of _permuted_stats in worker processes
+_permuted_stats_worker_state = []
+
+
+def _init_permuted_stats_worker(stat_f, stat_args):
+    """Sets up a worker process of _permuted_stats"""
+    _permuted_stats_worker_state[:] = [stat_f, stat_args]
+
+
+def _permuted_stats_worker(batch):
+    """Computes the statistics of a batch of permutations in a worker"""
+    stat_f, stat_args = _permuted_stats_worker_state
+    return stat_f(batch, *stat_args)
+
+
+def _get_pair_indices(num_samples):
+    """Returns the row and column indices of the pairs of samples.
+
+    The pairs are in the order of the upper triangle of a distance matrix
+    (i.e. of its condensed form).
+    """
+    return triu_indices(num_samples, 1)
+
+
+def _group_sizes(groupings, num_groups):
+    """Returns the number of samples in each group of each grouping (row)"""
+    num_groupings = len(groupings)
+    offsets = num_groups * arange(num_groupings)[:, None]
+    return bincount((groupings + offsets).ravel(),
+                    minlength=num_groupings * num_groups).reshape(
+                        num_groupings, num_groups)
+
+
+def _within_group_sums(pair_values, rows, cols, groupings, num_groups):
+    """Returns the sums of pair_values within each group of each grouping.
+
+    The sums are taken with bincount, which adds the values of each group in
+    the order of the pairs, so a grouping's sums don't depend on the other
+    groupings in the batch or on how its groups are numbered.
+
+    Arguments:
+        pair_values - condensed array of a value for each pair of samples
+        rows, cols - the samples of each pair
+        groupings - 2D array of the group index (0 to num_groups - 1) of
+            each sample (column) in each grouping (row)
+        num_groups - the number of groups
+    """
+    num_groupings = len(groupings)
+    row_groups = groupings[:, rows]
+    # pairs between groups are counted in an extra group that is dropped
+    labels = where(row_groups == groupings[:, cols], row_groups, num_groups)
+    labels += (num_groups + 1) * arange(num_groupings)[:, None]
+    sums = bincount(labels.ravel(), weights=tile(pair_values, num_groupings),
+                    minlength=num_groupings * (num_groups + 1))
+    return sums.reshape(num_groupings, num_groups + 1)[:, :num_groups]
+
+
+def _permutation_batch_size(num_samples, memory=DEFAULT_PERMUTATION_MEMORY):
+    """Returns the number of permutations of samples to evaluate at once.
+
+    Each permutation uses about 40 bytes of temporary arrays per pair of
+    samples, both to sum the pairs within groups and to gather the permuted
+    pairs of a Mantel test.
+    """
+    num_pairs = num_samples * (num_samples - 1) // 2
+    return max(1, int(memory // (40 * max(num_pairs, 1))))
+
+
+def _anosim_r_values(groupings, ranks, rows, cols, num_groups):
+    """Returns the ANOSIM R statistic of each grouping (row) of groupings.
+
+    Arguments:
+        ranks - the ranks of the condensed distances, doubled, so that the
+            averaged ranks of ties are integers and their sums are exact
+        rows, cols - the samples of each distance
+        num_groups - the number of groups
+    """
+    num_samps = groupings.shape[1]
+    sizes = _group_sizes(groupings, num_groups)
+    num_within = (sizes * (sizes - 1) // 2).sum(axis=1)
+    num_between = len(ranks) - num_within
+    within = _within_group_sums(ranks, rows, cols, groupings,
+                                num_groups).sum(axis=1)
+    r_W = within / 2 / num_within
+    r_B = (ranks.sum() - within) / 2 / num_between
+    divisor = num_samps * ((num_samps - 1) / 4)
+    return (r_B - r_W) / divisor
+
+
+def _permanova_f_values(groupings, squared_distances, rows, cols,
+                        num_groups):
+    """Returns the PERMANOVA pseudo-F statistic of each grouping (row).
+
+    Arguments:
+        squared_distances - the condensed distances, squared
+        rows, cols - the samples of each distance
+        num_groups - the number of groups
+    """
+    N = groupings.shape[1]
+    a = num_groups
+    s_T = squared_distances.sum() / N
+    s_W = (_within_group_sums(squared_distances, rows, cols, groupings,
+                              num_groups) /
+           _group_sizes(groupings, num_groups)).sum(axis=1)
+    s_A = s_T - s_W
+    return (s_A / (a - 1)) / (s_W / (N - a))
+
+
+def _standardize(values):
+    """Returns values centered on their mean and scaled to unit length.
+
+    The Pearson correlation of two vectors is the dot product of their
+    standardized forms, and permuting a vector doesn't change its
+    standardized values, only their order.
+    """
+    centered = values - values.mean()
+    return centered / sqrt(dot(centered, centered))
+
+
+def _standardized_square(values, rows, cols, num_samples):
+    """Returns the standardized condensed values as a square matrix.
+
+    Gathering the square matrix at permuted row and column indices gives the
+    standardized condensed form of the permuted distance matrix.
+    """
+    square = zeros((num_samples, num_samples))
+    standardized = _standardize(values)
+    square[rows, cols] = standardized
+    square[cols, rows] = standardized
+    return square
+
+
+def _random_order(order):
+    """Returns a new random order of the samples.
+
+    Used as the random_fn of _permuted_stats by the Mantel tests, which draw
+    each permutation of the samples independently (as mantel_test does).
+    """
+    return permutation(len(order))
+
+
+def _mantel_r_values(orders, x_square, y_standardized, rows, cols):
+    """Returns the Mantel r statistics of each order (row) of the samples.
+
+    Returns an array with a row for each order, containing its Pearson
+    correlation with each row of y_standardized.
+
+    Arguments:
+        orders - 2D array of permutations of the sample indices
+        x_square - the distance matrix to permute, as returned by
+            _standardized_square
+        y_standardized - 2D array of the standardized condensed forms of the
+            distance matrices to correlate the permuted matrix with
+        rows, cols - the samples of each distance
+    """
+    return dot(x_square[orders[:, rows], orders[:, cols]], y_standardized.T)
+
+
+def _partial_mantel_r_values(orders, x_square, y_standardized, rows, cols,
+                             r_yz):
+    """Returns the partial Mantel r statistics of each order of the samples.
+
+    Arguments:
+        orders - 2D array of permutations of the sample indices
+        x_square - the distance matrix to permute, as returned by
+            _standardized_square
+        y_standardized - 2D array of the standardized condensed forms of the
+            second and the control distance matrices
+        rows, cols - the samples of each distance
+        r_yz - the correlation of the second and the control distance matrices
+    """
+    r_values = _mantel_r_values(orders, x_square, y_standardized, rows, cols)
+    r_xy = r_values[:, 0]
+    r_xz = r_values[:, 1]
+    return (r_xy - r_xz * r_yz) / (sqrt(1 - r_xz ** 2) * sqrt(1 - r_yz ** 2))
+
+
+def _count_at_least(perm_stats, stat):
+    """Returns the number of perm_stats greater than or equal to stat.
+
+    The permuted statistics are computed differently from stat, so a
+    permutation which ties with stat may differ from it in the last bits.
+    Statistics within _STAT_TOLERANCE of stat count as ties.
+    """
+    return (perm_stats >= stat - _STAT_TOLERANCE).sum()
+
+
+def _count_at_most(perm_stats, stat):
+    """Returns the number of perm_stats less than or equal to stat.
+
+    Ties are counted as in _count_at_least.
+    """
+    return (perm_stats <= stat + _STAT_TOLERANCE).sum()
+
+
+def _check_mantel_num_perms(num_perms):
+    """Raises a ValueError if num_perms is too small for a Mantel test."""
+    if num_perms < 1:
+        raise ValueError("The number of permutations must be greater than or "
+                         "equal to one.")
+
 
 class Anosim(CategoryStats):
     """Class for the ANOSIM categorical statistical analysis.
@@ -585,7 +878,8 @@ class Anosim(CategoryStats):
         super(Anosim, self).__init__(mdmap, [dm], [cat], num_dms=1,
                                      random_fn=random_fn)
 
-    def __call__(self, num_perms=999):
+    def __call__(self, num_perms=999, jobs_to_start=1,
+                 memory=DEFAULT_PERMUTATION_MEMORY):
         """Runs ANOSIM on the current distance matrix and sample grouping.
 
         Returns a dict containing the results. The following keys are set:
@@ -596,39 +890,32 @@ class Anosim(CategoryStats):
             num_perms - the number of permutations used when calculating the
                 p-value
 
+        The distances are ranked once, and the R statistics of the permuted
+        groupings are computed in batches (see _permuted_stats).
+
         Arguments:
             num_perms - the number of permutations to use when calculating the
                 p-value
+            jobs_to_start - the number of processes to compute the
+                permutations' statistics with
+            memory - the approximate number of bytes of temporary arrays to
+                use for each batch of permutations
         """
         results = super(Anosim, self).__call__(num_perms)
-        category = self.Categories[0]
-        samples = self.DistanceMatrices[0].ids
-
-        # Create the group map, which maps sample ID to category value (e.g.
-        # sample 1 to 'control' and sample 2 to 'fast').
-        group_map = {}
-        for samp_id in samples:
-            group_map[samp_id] = self.MetadataMap.getCategoryValue(
-                samp_id, category)
+        dm = self.DistanceMatrices[0]
+        grouping, num_groups = self._get_group_indices(dm.ids,
+                                                       self.Categories[0])
+        rows, cols = _get_pair_indices(dm.shape[0])
+        ranks = 2 * rankdata(dm.data[rows, cols])
 
-        # Calculate the R statistic with the grouping found in the current
-        # metadata map.
-        r_stat = self._anosim(group_map)
+        r_stat, perm_stats = _permuted_stats(
+            _anosim_r_values, (ranks, rows, cols, num_groups), grouping,
+            num_perms, self.RandomFunction,
+            _permutation_batch_size(dm.shape[0], memory), jobs_to_start)
 
         if num_perms > 0:
-            # Calculate the p-value based on the number of permutations.
-            perm_stats = []
-            for i in range(num_perms):
-                # Randomize grouping. We don't use values() in order to
-                # preserve ordering in case the user's random function doesn't
-                # change the order of the items in the list.
-                grouping_random = [group_map[sample] for sample in samples]
-                grouping_random = self.RandomFunction(grouping_random)
-                for j, sample in enumerate(samples):
-                    group_map[sample] = grouping_random[j]
-                perm_stats.append(self._anosim(group_map))
             # Calculate the p-value.
-            p_value = (sum(perm_stats >= r_stat) + 1) / (num_perms + 1)
+            p_value = ((perm_stats >= r_stat).sum() + 1) / (num_perms + 1)
         else:
             p_value = 1.0
 
@@ -787,7 +1074,8 @@ class Permanova(CategoryStats):
         super(Permanova, self).__init__(mdmap, [dm], [cat], num_dms=1,
                                         random_fn=random_fn)
 
-    def __call__(self, num_perms=999):
+    def __call__(self, num_perms=999, jobs_to_start=1,
+                 memory=DEFAULT_PERMUTATION_MEMORY):
         """Runs PERMANOVA on the current distance matrix and sample grouping.
 
         Returns a dict containing the results. The following keys are set:
@@ -798,39 +1086,33 @@ class Permanova(CategoryStats):
             num_perms - the number of permutations used when calculating the
                 p-value
 
+        The F statistics of the permuted groupings are computed in batches
+        (see _permuted_stats).
+
         Arguments:
             num_perms - the number of permutations to use when calculating the
                 p-value
+            jobs_to_start - the number of processes to compute the
+                permutations' statistics with
+            memory - the approximate number of bytes of temporary arrays to
+                use for each batch of permutations
         """
         results = super(Permanova, self).__call__(num_perms)
-        category = self.Categories[0]
-        samples = self.DistanceMatrices[0].ids
-
-        # Create the group map, which maps sample ID to category value (e.g.
-        # sample 1 to 'control' and sample 2 to 'fast').
-        group_map = {}
-        for samp_id in samples:
-            group_map[samp_id] = self.MetadataMap.getCategoryValue(
-                samp_id, category)
+        dm = self.DistanceMatrices[0]
+        grouping, num_groups = self._get_group_indices(dm.ids,
+                                                       self.Categories[0])
+        rows, cols = _get_pair_indices(dm.shape[0])
+        distances = dm.data[rows, cols]
 
-        # Calculate the F statistic with the grouping found in the current
-        # metadata map.
-        f_stat = self._permanova(group_map)
+        f_stat, perm_stats = _permuted_stats(
+            _permanova_f_values,
+            (distances * distances, rows, cols, num_groups), grouping,
+            num_perms, self.RandomFunction,
+            _permutation_batch_size(dm.shape[0], memory), jobs_to_start)
 
         if num_perms > 0:
-            # Calculate the p-value based on the number of permutations.
-            perm_stats = []
-            for i in range(num_perms):
-                # Randomize grouping. We don't use values() in order to
-                # preserve ordering in case the user's random function doesn't
-                # change the order of the items in the list.
-                grouping_random = [group_map[sample] for sample in samples]
-                grouping_random = self.RandomFunction(grouping_random)
-                for j, sample in enumerate(samples):
-                    group_map[sample] = grouping_random[j]
-                perm_stats.append(self._permanova(group_map))
             # Calculate the p-value.
-            p_value = (sum(perm_stats >= f_stat) + 1) / (num_perms + 1)
+            p_value = ((perm_stats >= f_stat).sum() + 1) / (num_perms + 1)
         else:
             p_value = 1.0
 
@@ -1116,61 +1398,67 @@ class MantelCorrelogram(CorrelationStats):
         results['mantel_r'] = []
         results['mantel_p'] = []
 
-        # Create a model matrix for each distance class, then compute a Mantel
-        # test using it and the original eco distance matrix. A model matrix
-        # contains ones for each element that is in the current distance class,
-        # and zeros otherwise (zeros on the diagonal as well).
+        # Find the distance classes to run a Mantel test on. The model matrix
+        # of a distance class contains ones for each element that is in the
+        # class, and zeros otherwise (zeros on the diagonal as well); only its
+        # condensed form is needed.
+        rows, cols = _get_pair_indices(dm_size)
+        pair_classes = dist_class_matrix[rows, cols]
+        tested_classes = []
+        model_vectors = []
         for class_num in range(num_classes):
             results['class_index'].append(class_indices[class_num])
-            model_matrix = zeros([dm_size, dm_size], dtype=int)
-            for i in range(dm_size):
-                for j in range(dm_size):
-                    curr_ele = dist_class_matrix[i][j]
-                    if curr_ele == class_num and i != j:
-                        model_matrix[i][j] = 1
-            model_matrix = DistanceMatrix(model_matrix, geo_dm.ids)
-
-            # Count the number of distances in the current distance class.
-            num_distances = int(model_matrix.data.sum())
+            results['mantel_r'].append(None)
+            results['mantel_p'].append(None)
+            in_class = pair_classes == class_num
+
+            # Count the number of distances in the current distance class (in
+            # both triangles of the model matrix).
+            num_distances = 2 * int(in_class.sum())
             results['num_dist'].append(num_distances)
-            if num_distances == 0:
-                results['mantel_r'].append(None)
-                results['mantel_p'].append(None)
-            else:
-                row_sums = model_matrix.data.sum(axis=1)
-                row_sums = map(int, row_sums)
-                has_zero_sum = 0 in row_sums
+            if num_distances > 0:
+                row_sums = (bincount(rows[in_class], minlength=dm_size) +
+                            bincount(cols[in_class], minlength=dm_size))
+                has_zero_sum = (row_sums == 0).any()
 
                 # Only stop running Mantel tests if we've gone through half of
                 # the distance classes and at least one row has a sum of zero
                 # (i.e. the sample doesn't have any distances that fall in the
                 # current class).
                 if not (class_num > ((num_classes // 2) - 1) and has_zero_sum):
-                    mantel_test = Mantel(model_matrix, eco_dm,
-                                         tail_type='greater')
-                    mantel_test_results = mantel_test(num_perms)
-                    p_val, orig_stat, perm_stats = (
-                        mantel_test_results['p_value'],
-                        mantel_test_results['r_value'],
-                        mantel_test_results['perm_stats'])
-
-                    # Negate the Mantel r statistic because we are using
-                    # distance matrices, not similarity matrices (this is a
-                    # necessary step, see Legendre's Numerical Ecology
-                    # algorithm reference for more details).
-                    results['mantel_r'].append(-orig_stat)
-
-                    # The mantel function produces a one-tailed p-value
-                    # (H1: r>0). Here, compute a one-tailed p-value in the
-                    # direction of the sign.
-                    if orig_stat < 0:
-                        perm_sum = sum([1 for ps in perm_stats
-                                        if ps <= orig_stat]) + 1
-                        p_val = perm_sum / (num_perms + 1)
-                    results['mantel_p'].append(p_val)
+                    tested_classes.append(class_num)
+                    model_vectors.append(_standardize(in_class * 1.0))
+
+        if tested_classes:
+            # Run the Mantel tests of all distance classes on the same
+            # permutations, permuting the eco distance matrix rather than each
+            # model matrix (which gives the same distribution of statistics).
+            _check_mantel_num_perms(num_perms)
+            eco_square = _standardized_square(eco_dm.data[rows, cols], rows,
+                                              cols, dm_size)
+            orig_stats, perm_stats = _permuted_stats(
+                _mantel_r_values,
+                (eco_square, array(model_vectors), rows, cols),
+                arange(dm_size), num_perms, _random_order,
+                _permutation_batch_size(dm_size))
+
+            for i, class_num in enumerate(tested_classes):
+                orig_stat = orig_stats[i]
+
+                # Negate the Mantel r statistic because we are using distance
+                # matrices, not similarity matrices (this is a necessary step,
+                # see Legendre's Numerical Ecology algorithm reference for more
+                # details).
+                results['mantel_r'][class_num] = -orig_stat
+
+                # Compute a one-tailed p-value in the direction of the sign
+                # (H1: r>0 if the Mantel r statistic is positive).
+                if orig_stat < 0:
+                    perm_sum = _count_at_most(perm_stats[:, i], orig_stat) + 1
                 else:
-                    results['mantel_r'].append(None)
-                    results['mantel_p'].append(None)
+                    perm_sum = _count_at_least(perm_stats[:, i],
+                                               orig_stat) + 1
+                results['mantel_p'][class_num] = perm_sum / (num_perms + 1)
 
         # Correct p-values for multiple testing.
         results['mantel_p_corr'] = self._correct_p_values(results['mantel_p'])
@@ -1453,6 +1741,10 @@ class Mantel(CorrelationStats):
                 permutation
             tail_type - the type of Mantel test performed
 
+        The results are the same as those of mantel_test, but the condensed
+        distances are standardized once, and each permutation is applied as
+        an index into them, in batches of permutations (see _permuted_stats).
+
         Arguments:
             num_perms - the number of times to permute the distance matrix
                 while calculating the p-value
@@ -1463,21 +1755,34 @@ class Mantel(CorrelationStats):
         """
         m1, m2 = self.DistanceMatrices
         alt = self.TailType
-
-        # We suppress the symmetry and hollowness check since we are
-        # guaranteed to have DistanceMatrix instances (we don't need to check a
-        # second time here).
-        results = mantel_test(m1.data, m2.data, num_perms, alt=alt,
-                              suppress_symmetry_and_hollowness_check=True)
+        _check_mantel_num_perms(num_perms)
+
+        size = m1.shape[0]
+        rows, cols = _get_pair_indices(size)
+        orig_stat, perm_stats = _permuted_stats(
+            _mantel_r_values,
+            (_standardized_square(m1.data[rows, cols], rows, cols, size),
+             _standardize(m2.data[rows, cols])[None], rows, cols),
+            arange(size), num_perms, _random_order,
+            _permutation_batch_size(size))
+        orig_stat = orig_stat[0]
+        perm_stats = perm_stats[:, 0]
+
+        if alt == 'two sided':
+            better = _count_at_least(abs(perm_stats), abs(orig_stat))
+        elif alt == 'greater':
+            better = _count_at_least(perm_stats, orig_stat)
+        else:
+            better = _count_at_most(perm_stats, orig_stat)
 
         resultsDict = super(Mantel, self).__call__(num_perms)
         resultsDict['method_name'] = "Mantel"
         resultsDict['dm1'] = self.DistanceMatrices[0]
         resultsDict['dm2'] = self.DistanceMatrices[1]
         resultsDict['num_perms'] = num_perms
-        resultsDict['p_value'] = results[0]
-        resultsDict['r_value'] = results[1]
-        resultsDict['perm_stats'] = results[2]
+        resultsDict['p_value'] = (better + 1) / (num_perms + 1)
+        resultsDict['r_value'] = orig_stat
+        resultsDict['perm_stats'] = perm_stats.tolist()
         resultsDict['tail_type'] = self.TailType
 
         return resultsDict
@@ -1515,48 +1820,38 @@ class PartialMantel(CorrelationStats):
             num_perms - the number of times to permute the distance matrix
                 while calculating the p-value
 
+        The condensed distances are standardized once, so the correlations
+        of each permutation are dot products (see _partial_mantel_r_values).
+
         Credit: The code herein is based loosely on the implementation found in
         R's vegan package.
         """
         res = super(PartialMantel, self).__call__(num_perms)
 
-        # Calculate the correlation statistic.
-        corr = lambda rxy, rxz, ryz: (rxy - rxz * ryz) / (sqrt(1 -
-                                                               rxz ** 2) * sqrt(1 - ryz ** 2))
         # Load initial/placeholder values in the results dictionary.
         res['method_name'] = 'Partial Mantel'
         res['mantel_r'] = None
         res['mantel_p'] = None
 
         dm1, dm2, cdm = self.DistanceMatrices
-        dm1_flat = dm1.condensed_form()
-        dm2_flat = dm2.condensed_form()
-        cdm_flat = cdm.condensed_form()
-
-        # Get the initial r-values before permuting.
-        rval1 = pearson(dm1_flat, dm2_flat)
-        rval2 = pearson(dm1_flat, cdm_flat)
-        rval3 = pearson(dm2_flat, cdm_flat)
-
-        # Calculate the original test statistic (r-value).
-        orig_stat = corr(rval1, rval2, rval3)
-
-        # Calculate permuted r-values and p-values, storing them for use in the
-        # calculation of the final statistic.
-        perm_stats = []
-        numerator = 0
-        for i in range(0, num_perms):
-            # Permute the first distance matrix and calculate new r and
-            # p-values.
-            p1 = permute_2d(dm1, permutation(dm1.shape[0]))
-            dm1_perm = DistanceMatrix(p1, dm1.ids)
-            dm1_perm_flat = dm1_perm.condensed_form()
-            rval1 = pearson(dm1_perm_flat, dm2_flat)
-            rval2 = pearson(dm1_perm_flat, cdm_flat)
-            perm_stats.append(corr(rval1, rval2, rval3))
-
-            if perm_stats[-1] >= orig_stat:
-                numerator += 1
+        size = dm1.shape[0]
+        rows, cols = _get_pair_indices(size)
+        dm1_square = _standardized_square(dm1.data[rows, cols], rows, cols,
+                                          size)
+        dm2_flat = _standardize(dm2.data[rows, cols])
+        cdm_flat = _standardize(cdm.data[rows, cols])
+
+        # Calculate the original test statistic (r-value) and the permuted
+        # r-values. Only the first distance matrix is permuted, so the
+        # correlation of the other two is the same for every permutation.
+        orig_stat, perm_stats = _permuted_stats(
+            _partial_mantel_r_values,
+            (dm1_square, array([dm2_flat, cdm_flat]), rows, cols,
+             dot(dm2_flat, cdm_flat)),
+            arange(size), num_perms, _random_order,
+            _permutation_batch_size(size))
+        numerator = _count_at_least(perm_stats, orig_stat)
+
         # Load the final statistics into the result dictionary.
         res['mantel_r'] = orig_stat
         res['mantel_p'] = (numerator + 1) / (num_perms + 1)
@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+"""Contains a matrix-based implementation of the UniFrac family of metrics.
+
+The tree is flattened once into postorder arrays of parent indices and branch
+lengths, and the sample x OTU count matrix is mapped directly onto the tips
+of the flattened tree. Counts (or presence) are then propagated to internal
+nodes one tree level at a time with vectorized operations, and the pairwise
+distances are computed in blocks of nodes and samples whose temporary arrays
+fit within a memory budget.
+
+The results match those of cogent's fast_unifrac and fast_unifrac_one_sample
+(as wrapped in qiime.beta_metrics), including their handling of counts,
+which are truncated to integers, and of samples that have no counts on the
+tree. Faith's phylogenetic diversity (cogent's PD_whole_tree) is calculated
+from the same flattened tree.
+"""
+
+import warnings
+from zipfile import is_zipfile
+
+from numpy import (add, arange, argsort, array, asarray, concatenate, diff,
+                   empty, flatnonzero, float64, int64, ix_, load,
+                   logical_or, minimum, multiply, ones, savez, zeros)
+from scipy.sparse import issparse
+from cogent.core.tree import PhyloNode
+from cogent.util.misc import safe_md5
+
+from qiime.parse import parse_newick
+
+# the metrics that can be calculated, named as in qiime.beta_metrics
+UNIFRAC_METRICS = ['unweighted_unifrac', 'unweighted_unifrac_full_tree',
+                   'weighted_unifrac', 'weighted_normalized_unifrac',
+                   'unifrac_g', 'unifrac_g_full_tree']
+
+# the number of bytes of temporary arrays to use in each block
+DEFAULT_BLOCK_MEMORY = 100000000
+
+# single-entry caches, as the same tree is typically used for many calls
+_flat_tree_cache = [None, None]
+_flat_tree_file_cache = [None, None]
+
+
+class FlatTree(object):
+
+    """A tree flattened into postorder arrays
+
+    Attributes:
+     TipIndices: dict of tip name -> node index
+     Parents: parent node index for each node (-1 for the root, which is the
+      last node)
+     Lengths: branch length for each node (0.0 where it is not set)
+     TipDistances: distance from the root to each tip, including the branch
+      lengths of the tip and of the root (0.0 for internal nodes)
+     Levels: list of (child indices, parent indices, run starts), one for each
+      depth in the tree starting from the deepest. The children are sorted by
+      parent, so the values of each parent's children can be combined with
+      reduceat.
+    """
+
+    def __init__(self, tree):
+        nodes = list(tree.traverse(self_before=False, self_after=True))
+        node_indices = dict([(id(n), i) for i, n in enumerate(nodes)])
+        num_nodes = len(nodes)
+        self.TipIndices = {}
+        self.Parents = zeros(num_nodes, int64)
+        self.Lengths = zeros(num_nodes, float64)
+        for i, node in enumerate(nodes):
+            if node is tree:
+                self.Parents[i] = -1
+            else:
+                self.Parents[i] = node_indices[id(node.Parent)]
+            if node.Length is not None:
+                self.Lengths[i] = node.Length
+            if not node.Children:
+                self.TipIndices[node.Name] = i
+        self._index()
+
+    @classmethod
+    def fromArrays(cls, parents, lengths, tip_indices):
+        """Return the FlatTree with the given Parents, Lengths and TipIndices
+        """
+        result = cls.__new__(cls)
+        result.Parents = asarray(parents, int64)
+        result.Lengths = asarray(lengths, float64)
+        result.TipIndices = dict(tip_indices)
+        result._index()
+        return result
+
+    def _index(self):
+        """Set TipDistances and Levels from Parents and Lengths"""
+        num_nodes = len(self.Parents)
+        # the nodes which aren't the parent of any node (the root is last)
+        is_tip = ones(num_nodes, bool)
+        is_tip[self.Parents[:-1]] = False
+
+        # parents always follow their children in postorder, so walking
+        # backwards visits each parent before its children
+        depths = zeros(num_nodes, int64)
+        root_distances = zeros(num_nodes, float64)
+        root_distances[-1] = self.Lengths[-1]
+        for i in range(num_nodes - 2, -1, -1):
+            parent = self.Parents[i]
+            depths[i] = depths[parent] + 1
+            root_distances[i] = root_distances[parent] + self.Lengths[i]
+        self.TipDistances = root_distances * is_tip
+
+        self.Levels = []
+        for depth in range(depths.max(), 0, -1):
+            children = flatnonzero(depths == depth)
+            parents = self.Parents[children]
+            order = argsort(parents, kind='mergesort')
+            children = children[order]
+            parents = parents[order]
+            starts = concatenate(([0], flatnonzero(diff(parents)) + 1))
+            self.Levels.append((children, parents[starts], starts))
+
+    def getSubtreeMask(self, tip_names):
+        """Return a bool array of the nodes on the paths to tip_names
+
+        The root is always included.
+        """
+        mask = zeros(len(self.Parents), bool)
+        mask[-1] = True
+        for name in tip_names:
+            node = self.TipIndices.get(name)
+            while node is not None and node >= 0 and not mask[node]:
+                mask[node] = True
+                node = self.Parents[node]
+        return mask
+
+    def propagate(self, values, reduce_f=add):
+        """Combine the values of each node's children into the node, in place
+
+        values: nodes x samples array, where only the rows of the tips are
+         set
+        reduce_f: ufunc used to combine the children (add for counts,
+         logical_or for presence)
+        """
+        for children, parents, starts in self.Levels:
+            values[parents] = reduce_f(values[parents],
+                                       reduce_f.reduceat(values[children],
+                                                         starts, axis=0))
+        return values
+
+
+def get_flat_tree(tree):
+    """Return the FlatTree for tree, reusing the last one if possible"""
+    if _flat_tree_cache[0] is not tree:
+        _flat_tree_cache[0] = tree
+        _flat_tree_cache[1] = FlatTree(tree)
+    return _flat_tree_cache[1]
+
+
+def write_flat_tree(flat_tree, fp):
+    """Write flat_tree to fp (an open file or a path ending in .npz)
+
+    The tree is written as a numpy .npz file, which load_flat_tree reads back
+     without parsing the newick tree again.
+    """
+    tip_names = [n for n in flat_tree.TipIndices if n is not None]
+    savez(fp, parents=flat_tree.Parents, lengths=flat_tree.Lengths,
+          tip_names=array(tip_names),
+          tip_indices=array([flat_tree.TipIndices[n] for n in tip_names],
+                            int64))
+
+
+def load_flat_tree(fp):
+    """Return the FlatTree written to fp by write_flat_tree"""
+    data = load(fp)
+    return FlatTree.fromArrays(
+        data['parents'], data['lengths'],
+        zip(data['tip_names'].tolist(), data['tip_indices'].tolist()))
+
+
+def get_flat_tree_from_fp(tree_fp):
+    """Return the FlatTree of a newick tree file, or a flattened tree file
+
+    tree_fp: path to a newick tree, or to a tree written by write_flat_tree
+
+    The last tree file read is cached on the md5 of its contents, so a tree
+     that is used for many OTU tables is only parsed once, and a file that is
+     rewritten with a different tree is always read again.
+    """
+    tree_f = open(tree_fp, 'rb')
+    key = safe_md5(tree_f).hexdigest()
+    tree_f.close()
+    if _flat_tree_file_cache[0] != key:
+        if is_zipfile(tree_fp):
+            flat_tree = load_flat_tree(tree_fp)
+        else:
+            tree_f = open(tree_fp, 'U')
+            flat_tree = FlatTree(parse_newick(tree_f, PhyloNode))
+            tree_f.close()
+        _flat_tree_file_cache[0] = key
+        _flat_tree_file_cache[1] = flat_tree
+    return _flat_tree_file_cache[1]
+
+
+def _get_tip_counts(data, taxon_names, sample_names, flat_tree):
+    """Map the sample x OTU data (dense or scipy.sparse) onto flat_tree's tips
+
+    Returns (tip node indices, tips x samples counts, indices of samples
+     with counts on the tree). Counts are truncated to integers, as in
+     cogent's fast_unifrac.
+    """
+    if not issparse(data):
+        data = asarray(data)
+    if data.shape != (len(sample_names), len(taxon_names)):
+        raise ValueError(
+            "Shape of matrix %s doesn't match # samples and # taxa (%s and %s)"
+            % (data.shape, len(sample_names), len(taxon_names)))
+    columns = []
+    tips = []
+    for i, name in enumerate(taxon_names):
+        if name in flat_tree.TipIndices:
+            columns.append(i)
+            tips.append(flat_tree.TipIndices[name])
+    if not tips:
+        raise ValueError("No valid samples/environments found. Check whether "
+                         "tree tips match otus/taxa present in "
+                         "samples/environments")
+    if issparse(data):
+        tip_data = data.tocsc()[:, columns].toarray().T
+    else:
+        tip_data = data[:, columns].T
+    present = flatnonzero((tip_data != 0).any(axis=0))
+    counts = tip_data[:, present].astype(int64)
+    return array(tips), counts, present
+
+
+def _get_node_counts(flat_tree, tips, tip_counts, dtype):
+    """Return the nodes x samples counts (or presence) for all nodes"""
+    counts = zeros((len(flat_tree.Parents), tip_counts.shape[1]), dtype)
+    counts[tips] = tip_counts
+    if dtype is bool:
+        return flat_tree.propagate(counts, logical_or)
+    return flat_tree.propagate(counts)
+
+
+def _sum_node_terms(terms_f, num_nodes, shape, block_memory):
+    """Return the sum over nodes of the terms from terms_f
+
+    terms_f: f(start, stop, out) that writes the terms of nodes start to
+     stop into the (stop - start) x shape array out
+    shape: the shape of the terms of one node (e.g. samples, or rows x
+     samples)
+
+    The nodes are added one after another in order (numpy sums over the
+    first axis sequentially), so each sum depends only on its own terms, and
+    terms that are zero leave it unchanged. This makes each distance
+    identical wherever it is calculated from, e.g. in a full matrix or in a
+    single row.
+    """
+    if not isinstance(shape, tuple):
+        shape = (shape,)
+    size = 1
+    for length in shape:
+        size *= length
+    block_size = max(1, int(block_memory // (8 * max(size, 1))))
+    result = zeros(shape)
+    for start in range(0, num_nodes, block_size):
+        stop = min(start + block_size, num_nodes)
+        terms = empty((stop - start + 1,) + shape)
+        terms[0] = result
+        terms_f(start, stop, terms[1:])
+        result = terms.sum(axis=0)
+    return result
+
+
+def _get_row_block_size(num_rows, num_samples, block_memory):
+    """Return the number of rows to calculate at a time
+
+    Each block of rows leaves room for at least 16 nodes' terms in
+     block_memory.
+    """
+    return max(1, min(num_rows,
+                      int(block_memory // (8 * 16 * max(num_samples, 1)))))
+
+
+def _get_rows_f(flat_tree, values, sums, metric, total_length, block_memory):
+    """Return f(indices) -> distances from the samples at indices to each
+     sample, as a len(indices) x samples array
+
+    values: nodes x samples presence (for the unweighted metrics) or counts
+     (for the weighted metrics)
+    sums: total count of each sample
+    total_length: branch length used to normalize the _full_tree metrics
+
+    The rows are calculated together over the nodes covered by any of their
+    samples. The other samples' terms on a node that one row's sample
+    doesn't cover are zero, so each row is the same as if it was calculated
+    alone.
+    """
+    num_samples = values.shape[1]
+    lengths = flat_tree.Lengths
+
+    if metric.startswith('weighted'):
+        # nodes without length or counts don't contribute to any distance
+        nodes = flatnonzero((lengths > 0) & values.any(axis=1))
+        node_lengths = lengths[nodes].reshape(-1, 1)
+        node_weights = values[nodes] / sums
+        if metric == 'weighted_normalized_unifrac':
+            tips = flatnonzero(flat_tree.TipDistances)
+            normalizers = _sum_node_terms(
+                lambda start, stop, out: multiply(
+                    values[tips[start:stop]] / sums,
+                    flat_tree.TipDistances[tips[start:stop]].reshape(-1, 1),
+                    out),
+                len(tips), num_samples, block_memory)
+        else:
+            normalizers = None
+
+        # sum(l * |w_i - w_j|) == sum(l * w_i) + sum(l * w_j) -
+        # 2 * sum(l * min(w_i, w_j)), and the last sum is only over the
+        # nodes covered by sample i
+        weighted_lengths = _sum_node_terms(
+            lambda start, stop, out: multiply(node_weights[start:stop],
+                                              node_lengths[start:stop], out),
+            len(nodes), num_samples, block_memory)
+
+        def rows_f(indices):
+            row_nodes = flatnonzero(node_weights[:, indices].any(axis=1))
+
+            def terms_f(start, stop, out):
+                block_nodes = row_nodes[start:stop]
+                block_weights = node_weights[block_nodes]
+                minimum(block_weights[:, None, :],
+                        block_weights[:, indices][:, :, None], out)
+                multiply(out, node_lengths[block_nodes][:, :, None], out)
+            shared = _sum_node_terms(terms_f, len(row_nodes),
+                                     (len(indices), num_samples),
+                                     block_memory)
+            result = weighted_lengths[indices].reshape(-1, 1) + \
+                weighted_lengths - 2 * shared
+            if normalizers is not None:
+                result /= normalizers[indices].reshape(-1, 1) + normalizers
+            result[arange(len(indices)), indices] = 0.0
+            return result
+        return rows_f
+
+    # branch length covered by each sample, summed in the same order as the
+    # shared branch length of pairs of samples
+    sample_lengths = _sum_node_terms(
+        lambda start, stop, out: multiply(values[start:stop],
+                                          lengths[start:stop, None], out),
+        len(lengths), num_samples, block_memory)
+
+    def rows_f(indices):
+        # only the nodes covered by the rows' samples can be shared with them
+        nodes = flatnonzero(values[:, indices].any(axis=1))
+
+        def terms_f(start, stop, out):
+            block_values = values[nodes[start:stop]]
+            out[...] = block_values[:, None, :] & \
+                block_values[:, indices][:, :, None]
+            multiply(out, lengths[nodes[start:stop]].reshape(-1, 1, 1), out)
+        shared = _sum_node_terms(terms_f, len(nodes),
+                                 (len(indices), num_samples), block_memory)
+        row_lengths = sample_lengths[indices].reshape(-1, 1)
+        if metric == 'unweighted_unifrac':
+            result = 1 - shared / (row_lengths + sample_lengths - shared)
+        elif metric == 'unweighted_unifrac_full_tree':
+            result = (row_lengths + sample_lengths - 2 * shared) / \
+                total_length
+        elif metric == 'unifrac_g':
+            result = (row_lengths - shared) / \
+                (row_lengths + sample_lengths - shared)
+        else:
+            result = (row_lengths - shared) / total_length
+        result[arange(len(indices)), indices] = 0.0
+        return result
+    return rows_f
+
+
+def _prepare(data, taxon_names, tree, sample_names, metric, make_subtree,
+             block_memory):
+    """Return (f(indices) -> distances from the samples with counts on the
+     tree at indices to each sample with counts on the tree, indices of
+     those samples)
+    """
+    if metric not in UNIFRAC_METRICS:
+        raise ValueError("Unknown UniFrac metric: %s. Known metrics are: %s" %
+                         (metric, ', '.join(UNIFRAC_METRICS)))
+    flat_tree = get_flat_tree(tree)
+    tips, tip_counts, present = _get_tip_counts(data, taxon_names,
+                                                sample_names, flat_tree)
+    sums = tip_counts.sum(axis=0)
+    if metric.startswith('weighted'):
+        values = _get_node_counts(flat_tree, tips, tip_counts, int64)
+    else:
+        values = _get_node_counts(flat_tree, tips, tip_counts, bool)
+    if make_subtree:
+        total_length = \
+            flat_tree.Lengths[flat_tree.getSubtreeMask(taxon_names)].sum()
+    else:
+        total_length = flat_tree.Lengths.sum()
+    rows_f = _get_rows_f(flat_tree, values, sums, metric, total_length,
+                         block_memory)
+    return rows_f, present
+
+
+def faith_pd(data, taxon_names, tree, sample_names,
+             block_memory=DEFAULT_BLOCK_MEMORY):
+    """Return Faith's phylogenetic diversity of each sample
+
+    data: samples x OTUs count array, or scipy.sparse matrix
+    taxon_names: the OTU ids, in the order of the columns of data
+    tree: PhyloNode tree whose tips are (some of) the OTU ids, or its FlatTree
+    sample_names: the sample ids, in the order of the rows of data
+    block_memory: number of bytes of temporary arrays to use at a time
+
+    The result matches cogent's PD_whole_tree: the total branch length
+     (including the root's) of the nodes on the paths to the OTUs in each
+     sample. Samples that have no counts on the tree have a PD of 0.0.
+    """
+    if isinstance(tree, FlatTree):
+        flat_tree = tree
+    else:
+        flat_tree = get_flat_tree(tree)
+    tips, tip_counts, present = _get_tip_counts(data, taxon_names,
+                                                sample_names, flat_tree)
+    values = _get_node_counts(flat_tree, tips, tip_counts, bool)
+    lengths = flat_tree.Lengths
+    result = zeros(len(sample_names))
+    result[present] = _sum_node_terms(
+        lambda start, stop, out: multiply(values[start:stop],
+                                          lengths[start:stop, None], out),
+        len(lengths), len(present), block_memory)
+    return result
+
+
+def unifrac_matrix(data, taxon_names, tree, sample_names, metric,
+                   make_subtree=True, block_memory=DEFAULT_BLOCK_MEMORY):
+    """Return the samples x samples UniFrac distance matrix
+
+    data: samples x OTUs count array
+    taxon_names: the OTU ids, in the order of the columns of data
+    tree: PhyloNode tree whose tips are (some of) the OTU ids
+    sample_names: the sample ids, in the order of the rows of data
+    metric: one of UNIFRAC_METRICS
+    make_subtree: if True, the tree is restricted to the tips in
+     taxon_names (this only affects the _full_tree metrics)
+    block_memory: number of bytes of temporary arrays to use at a time
+
+    Samples that have no counts on the tree are 1.0 from all other samples
+     and 0.0 from each other, with a warning.
+    """
+    rows_f, present = _prepare(data, taxon_names, tree, sample_names, metric,
+                               make_subtree, block_memory)
+    num_samples = len(sample_names)
+    result = ones((num_samples, num_samples))
+    block_size = _get_row_block_size(len(present), len(present), block_memory)
+    for start in range(0, len(present), block_size):
+        indices = arange(start, min(start + block_size, len(present)))
+        result[ix_(present[indices], present)] = rows_f(indices)
+
+    missing = flatnonzero(~_get_mask(present, num_samples))
+    result[ix_(missing, missing)] = 0.0
+    for i in missing:
+        warnings.warn('unifrac had no information for sample ' +
+                      sample_names[i] +
+                      ". Distances involving that sample aren't meaningful")
+    return result
+
+
+def get_unifrac_rows_f(data, taxon_names, tree, sample_names, metric,
+                       make_subtree=False, block_memory=DEFAULT_BLOCK_MEMORY):
+    """Return f(row_sample_names) -> the UniFrac distances from those samples
+
+    Parameters are as for unifrac_row. The tree and data are prepared once,
+     so this is for calculating many rows of the same matrix (e.g. in tiles).
+     f returns a len(row_sample_names) x samples array, and calculates the
+     rows in blocks, as unifrac_matrix does.
+    """
+    rows_f, present = _prepare(data, taxon_names, tree, sample_names, metric,
+                               make_subtree, block_memory)
+    sample_indices = dict([(name, i) for i, name in enumerate(sample_names)])
+    present_indices = dict([(sample_index, i)
+                            for i, sample_index in enumerate(present)])
+    block_size = _get_row_block_size(len(sample_names), len(present),
+                                     block_memory)
+
+    def result_f(row_sample_names):
+        result = ones((len(row_sample_names), len(sample_names)))
+        rows = []
+        indices = []
+        for row, name in enumerate(row_sample_names):
+            sample_index = sample_indices[name]
+            result[row, sample_index] = 0.0
+            if sample_index not in present_indices:
+                warnings.warn('unifrac had no information on sample ' +
+                              name +
+                              ". Distances involving that sample aren't "
+                              "meaningful")
+            else:
+                rows.append(row)
+                indices.append(present_indices[sample_index])
+        for start in range(0, len(rows), block_size):
+            stop = start + block_size
+            result[ix_(rows[start:stop], present)] = \
+                rows_f(indices[start:stop])
+        return result
+    return result_f
+
+
+def get_unifrac_row_f(data, taxon_names, tree, sample_names, metric,
+                      make_subtree=False, block_memory=DEFAULT_BLOCK_MEMORY):
+    """Return f(one_sample_name) -> the UniFrac distances from that sample
+
+    Parameters are as for unifrac_row. The tree and data are prepared once,
+     so this is for calculating many rows of the same matrix one at a time.
+    """
+    rows_f = get_unifrac_rows_f(data, taxon_names, tree, sample_names,
+                                metric, make_subtree, block_memory)
+    return lambda one_sample_name: rows_f([one_sample_name])[0]
+
+
+def unifrac_row(data, taxon_names, tree, sample_names, one_sample_name,
+                metric, make_subtree=False, block_memory=DEFAULT_BLOCK_MEMORY):
+    """Return the UniFrac distances from one_sample_name to each sample
+
+    Parameters are as for unifrac_matrix, except that the tree is not
+     restricted to the tips in taxon_names by default.
+
+    If one_sample_name has no counts on the tree, it is 1.0 from all other
+     samples, with a warning.
+    """
+    return get_unifrac_row_f(data, taxon_names, tree, sample_names, metric,
+                             make_subtree, block_memory)(one_sample_name)
+
+
+def _get_mask(indices, length):
+    """Return a bool array of length that is True at indices"""
+    mask = zeros(length, bool)
+    mask[indices] = True
+    return mask
@@ -18,8 +18,11 @@ __email__ = "gregcaporaso@gmail.com"
 A lot of this might migrate into cogent at some point.
 """
 
-from os import getenv, listdir, close
-from os.path import abspath, basename, exists, dirname, join, splitext, isfile
+from os import getenv, listdir, close, rename, utime, walk
+from os.path import (abspath, basename, exists, dirname, join, splitext,
+                     isfile, isdir, getmtime, getsize)
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_SH
+from shutil import rmtree
 from collections import defaultdict
 from gzip import open as gz_open
 from sys import stderr
@@ -28,7 +31,7 @@ from datetime import datetime
 from subprocess import Popen
 from random import random
 from itertools import repeat, izip
-from tempfile import mkstemp
+from tempfile import mkstemp, mkdtemp
 
 from numpy import (array, zeros, shape, vstack, ndarray, asarray,
                    float, where, isnan, std, sqrt, ravel, mean, median,
@@ -49,6 +52,7 @@ from biom.table import (DenseFunctionTable, DenseGeneTable,
                         SparseTable, SparseTaxonTable)
 
 from cogent.parse.tree import DndParser
+from cogent.util.misc import safe_md5
 from cogent.cluster.procrustes import procrustes
 
 from skbio.util.misc import remove_files, create_dir
@@ -358,6 +362,193 @@ def load_qiime_config():
     return parse_qiime_config_files(qiime_config_files)
 
 
+class ReferenceDbCache(object):
+
+    """Cache of databases built from reference sequence files
+
+        Each database is kept in a directory under cache_dir named by the
+        md5 of the contents of the file it was built from (and the kind of
+        database), so the same reference is only built once, whatever its
+        path, and a changed reference is rebuilt. Processes building the
+        same database (e.g. the jobs of a parallel run) take a lock on it
+        with flock, so it's built by the first of them and used by the
+        rest. Databases are built in a temporary directory which is renamed
+        into place, so a database directory is always complete.
+
+        A process using a database holds a shared lock on it (from getDb
+        until release is called, or the process exits), so it's not
+        removed while in use.
+
+        If max_size (in megabytes) is passed, the least recently used
+        databases which aren't in use are removed after each build until
+        the cache is within max_size (if it can be).
+    """
+
+    _record_fn = 'db_name.txt'
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = abspath(cache_dir)
+        self.max_size = max_size
+        create_dir(self.cache_dir)
+        # the open lock files of the databases in use, by key
+        self._lock_fs = {}
+
+    def getBlastDb(self, fasta_path, is_protein=False):
+        """Return the name of the blast db of fasta_path, building it if needed
+        """
+        f = open(fasta_path, 'rb')
+        key = safe_md5(f).hexdigest()
+        f.close()
+        if is_protein:
+            key += '_blast_protein'
+        else:
+            key += '_blast_nucleotide'
+
+        def build_f(output_dir):
+            db_name, db_filepaths = build_blast_db_from_fasta_path(
+                abspath(fasta_path), is_protein=is_protein,
+                output_dir=output_dir)
+            return basename(db_name)
+        return self.getDb(key, build_f)
+
+    def getDb(self, key, build_f):
+        """Return the path of the database key, building it if needed
+
+            build_f is passed the directory to build the database in, and
+            must return the name of the database in that directory. The
+            database is locked against removal until release is called.
+        """
+        entry_dir = join(self.cache_dir, key)
+        record_fp = join(entry_dir, self._record_fn)
+        built = False
+        lock_f = self._lock_fs.get(key)
+        if lock_f is None:
+            lock_f = open(join(self.cache_dir, key + '.lock'), 'w')
+            try:
+                flock(lock_f, LOCK_SH)
+                # converting between shared and exclusive locks isn't
+                # atomic, so another process may build the database (or
+                # remove it) while the lock is converted
+                while not exists(record_fp):
+                    flock(lock_f, LOCK_EX)
+                    if not exists(record_fp):
+                        build_dir = mkdtemp(prefix='tmp', dir=self.cache_dir)
+                        try:
+                            db_name = build_f(build_dir)
+                            f = open(join(build_dir, self._record_fn), 'w')
+                            f.write(db_name)
+                            f.close()
+                            rename(build_dir, entry_dir)
+                        except:
+                            rmtree(build_dir)
+                            raise
+                        built = True
+                    flock(lock_f, LOCK_SH)
+            except:
+                # closing the lock file releases the lock
+                lock_f.close()
+                raise
+            self._lock_fs[key] = lock_f
+        # mark the entry as used
+        utime(record_fp, None)
+        db_name = open(record_fp).read().strip()
+        if built:
+            self.evict()
+        return join(entry_dir, db_name)
+
+    def release(self):
+        """Release the locks on the databases returned by getDb """
+        for lock_f in self._lock_fs.values():
+            lock_f.close()
+        self._lock_fs = {}
+
+    def evict(self):
+        """Remove the least recently used databases until within max_size
+
+            Databases which are in use (by any process, including this
+            one), and databases which are being built, are not removed.
+        """
+        if self.max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for name in listdir(self.cache_dir):
+            entry_dir = join(self.cache_dir, name)
+            record_fp = join(entry_dir, self._record_fn)
+            # directories without a record are builds in progress
+            if not isdir(entry_dir) or not exists(record_fp):
+                continue
+            size = 0
+            for root, dirs, files in walk(entry_dir):
+                for f in files:
+                    size += getsize(join(root, f))
+            total_size += size
+            entries.append((getmtime(record_fp), name, size))
+        entries.sort()
+        for last_used, name, size in entries:
+            if total_size <= self.max_size * 2 ** 20:
+                break
+            lock_f = open(join(self.cache_dir, name + '.lock'), 'w')
+            try:
+                flock(lock_f, LOCK_EX | LOCK_NB)
+            except IOError:
+                # the database is in use or being rebuilt
+                lock_f.close()
+                continue
+            try:
+                # another process may have removed it already
+                if exists(join(self.cache_dir, name)):
+                    rmtree(join(self.cache_dir, name))
+            finally:
+                lock_f.close()
+            total_size -= size
+
+
+# the ReferenceDbCaches returned by get_reference_db_cache, which are kept
+# so that the databases they return stay locked while the process runs
+_reference_db_caches = {}
+
+
+def get_reference_db_cache(qiime_config=None):
+    """Return the ReferenceDbCache set in qiime_config, or None
+
+        The cache is set with reference_db_cache_dir, and its maximum size
+        in megabytes with reference_db_cache_max_size.
+    """
+    if qiime_config is None:
+        qiime_config = load_qiime_config()
+    cache_dir = qiime_config['reference_db_cache_dir']
+    if not cache_dir:
+        return None
+    max_size = qiime_config['reference_db_cache_max_size']
+    if max_size:
+        max_size = float(max_size)
+    else:
+        max_size = None
+    key = (abspath(cache_dir), max_size)
+    if key not in _reference_db_caches:
+        _reference_db_caches[key] = ReferenceDbCache(cache_dir,
+                                                     max_size=max_size)
+    return _reference_db_caches[key]
+
+
+def get_blast_db_from_fasta_path(fasta_path, is_protein=False,
+                                 output_dir=None, qiime_config=None):
+    """Return (blast db name, db filepaths to remove) for fasta_path
+
+        If reference_db_cache_dir is set in qiime_config (by default, the
+        loaded qiime_config) the db is taken from that ReferenceDbCache,
+        and there are no files to remove. Otherwise the db is built next to
+        fasta_path, or in output_dir, as build_blast_db_from_fasta_path.
+    """
+    cache = get_reference_db_cache(qiime_config)
+    if cache is None:
+        return build_blast_db_from_fasta_path(fasta_path,
+                                              is_protein=is_protein,
+                                              output_dir=output_dir)
+    return cache.getBlastDb(fasta_path, is_protein=is_protein), []
+
+
 def qiime_blast_seqs(seqs,
                      blast_constructor=Blastall,
                      blast_program='blastn',
@@ -383,9 +574,9 @@ def qiime_blast_seqs(seqs,
 
     if refseqs_fp:
         blast_db, db_files_to_remove =\
-            build_blast_db_from_fasta_path(refseqs_fp,
-                                           output_dir=WorkingDir,
-                                           is_protein=is_protein)
+            get_blast_db_from_fasta_path(refseqs_fp,
+                                         output_dir=WorkingDir,
+                                         is_protein=is_protein)
     elif refseqs:
         blast_db, db_files_to_remove =\
             build_blast_db_from_fasta_file(refseqs,
@@ -637,6 +828,29 @@ def get_options_lookup():
                     ' jobs to be started if and only if -a is passed'
                     ' [default: %default]',
                     default=qiime_config['jobs_to_start'])
+    result['max_concurrent_steps'] =\
+        make_option('--max_concurrent_steps', type='int',
+                    help='Number of independent workflow steps to run at'
+                    ' the same time. Steps are ordered by the files they'
+                    ' read and write, and each step counts as one, even if'
+                    ' it is run in parallel with -a [default: %default]',
+                    default=1)
+    result['cache_dir'] =\
+        make_option('--cache_dir', type='new_dirpath',
+                    help='Directory to cache the outputs of workflow steps'
+                    ' in. Steps which have been run before with the same'
+                    ' command, parameters and input file contents (for'
+                    ' example, into another output directory) are restored'
+                    ' from the cache instead of being run again'
+                    ' [default: %default; steps aren\'t cached]',
+                    default=None)
+    result['max_cache_size'] =\
+        make_option('--max_cache_size', type='float',
+                    help='Maximum size of the directory passed as'
+                    ' --cache_dir, in megabytes. The least recently used'
+                    ' steps are removed from the cache when it is larger'
+                    ' [default: %default; no maximum]',
+                    default=None)
 
     # Define options used by the parallel scripts
     result['jobs_to_start'] =\
@@ -660,8 +874,11 @@ def get_options_lookup():
                     default=False)
     result['cluster_jobs_fp'] =\
         make_option('-U', '--cluster_jobs_fp',
-                    help='path to cluster jobs script (defined in qiime_config) ' +
-                    ' [default: %default]',
+                    help='path to cluster jobs script (defined in qiime_config, ' +
+                    'or start_parallel_jobs.py if it is not set there). Pass ' +
+                    '"local" to run the jobs in subprocesses of this ' +
+                    'script, which merges results as each job completes ' +
+                    'instead of starting a poller [default: %default]',
                     default=qiime_config['cluster_jobs_fp'] or
                     'start_parallel_jobs.py')
     result['suppress_polling'] =\
@@ -183,7 +183,8 @@ def run_core_diversity_analyses(
             "biom summarize-table -i %s -o %s --suppress-md5 %s" % \
             (biom_fp, biom_table_stats_output_fp, params_str)
         commands.append([('Generate BIOM table summary',
-                          biom_table_summary_cmd)])
+                          biom_table_summary_cmd,
+                          [biom_fp], [biom_table_stats_output_fp])])
     else:
         logger.write("Skipping 'biom summarize-table' as %s exists.\n\n"
                      % biom_table_stats_output_fp)
@@ -201,7 +202,7 @@ def run_core_diversity_analyses(
             (biom_fp, filtered_biom_fp, sampling_depth)
         commands.append(
             [('Filter low sequence count samples from table (minimum sequence count: %d)' % sampling_depth,
-              filter_samples_cmd)])
+              filter_samples_cmd, [biom_fp], [filtered_biom_fp])])
     else:
         logger.write("Skipping filter_samples_from_otu_table.py as %s exists.\n\n"
                      % filtered_biom_fp)
@@ -214,7 +215,7 @@ def run_core_diversity_analyses(
             (biom_fp, rarefied_biom_fp, sampling_depth)
         commands.append(
             [('Rarify the OTU table to %d sequences/sample' % sampling_depth,
-              single_rarefaction_cmd)])
+              single_rarefaction_cmd, [biom_fp], [rarefied_biom_fp])])
     else:
         logger.write("Skipping single_rarefaction.py as %s exists.\n\n"
                      % rarefied_biom_fp)
@@ -227,6 +228,16 @@ def run_core_diversity_analyses(
                         close_logger_on_success=False)
         commands = []
 
+    # the commands of the beta diversity, alpha rarefaction and taxa summary
+    # workflows are collected rather than run by each workflow, so that
+    # command_handler is passed all of them at once (and, e.g.,
+    # call_commands_concurrently can run the workflows at the same time)
+    def collect_commands(workflow_commands,
+                         status_update_callback,
+                         logger,
+                         close_logger_on_success=True):
+        commands.extend(workflow_commands)
+
     if not suppress_beta_diversity:
         bdiv_even_output_dir = '%s/bdiv_even%d/' % (output_dir, sampling_depth)
         # Need to check for the existence of any distance matrices, since the user
@@ -237,7 +248,7 @@ def run_core_diversity_analyses(
                 otu_table_fp=rarefied_biom_fp,
                 mapping_fp=mapping_fp,
                 output_dir=bdiv_even_output_dir,
-                command_handler=command_handler,
+                command_handler=collect_commands,
                 params=params,
                 qiime_config=qiime_config,
                 # Note: we pass sampling depth=None here as
@@ -274,8 +285,11 @@ def run_core_diversity_analyses(
                         'make_distance_boxplots.py -d %s -f %s -o %s -m %s -n 999 %s' %\
                         (dm_fp, category, boxplots_output_dir,
                          mapping_fp, params_str)
+                    # the categories of a metric share an output directory,
+                    # which each command creates, so they're run in turn
                     commands.append([('Boxplots (%s)' % category,
-                                      boxplots_cmd)])
+                                      boxplots_cmd, [dm_fp, mapping_fp],
+                                      [boxplots_output_dir])])
                 else:
                     logger.write("Skipping make_distance_boxplots.py for %s as %s exists.\n\n"
                                  % (category, plot_output_fp))
@@ -312,7 +326,7 @@ def run_core_diversity_analyses(
                 otu_table_fp=biom_fp,
                 mapping_fp=mapping_fp,
                 output_dir=arare_full_output_dir,
-                command_handler=command_handler,
+                command_handler=collect_commands,
                 params=params,
                 qiime_config=qiime_config,
                 tree_fp=tree_fp,
@@ -332,51 +346,6 @@ def run_core_diversity_analyses(
                             rarefaction_plots_output_fp,
                             _index_headers['alpha_diversity']))
 
-        collated_alpha_diversity_fps = \
-            glob('%s/alpha_div_collated/*txt' % arare_full_output_dir)
-        try:
-            params_str = get_params_str(params['compare_alpha_diversity'])
-        except KeyError:
-            params_str = ''
-
-        if len(categories) > 0:
-            for collated_alpha_diversity_fp in collated_alpha_diversity_fps:
-                alpha_metric = splitext(
-                    split(collated_alpha_diversity_fp)[1])[0]
-                compare_alpha_output_dir = '%s/compare_%s' % \
-                    (arare_full_output_dir, alpha_metric)
-                if not exists(compare_alpha_output_dir):
-                    compare_alpha_cmd = \
-                        'compare_alpha_diversity.py -i %s -m %s -c %s -o %s -n 999 %s' %\
-                        (collated_alpha_diversity_fp,
-                         mapping_fp,
-                         comma_separated_categories,
-                         compare_alpha_output_dir,
-                         params_str)
-                    commands.append(
-                        [('Compare alpha diversity (%s)' % alpha_metric,
-                          compare_alpha_cmd)])
-                    for category in categories:
-                        alpha_comparison_stat_fp = '%s/%s_stats.txt' % \
-                            (compare_alpha_output_dir, category)
-                        alpha_comparison_boxplot_fp = '%s/%s_boxplots.pdf' % \
-                            (compare_alpha_output_dir, category)
-                        index_links.append(
-                            ('Alpha diversity statistics (%s, %s)' % (category, alpha_metric),
-                             alpha_comparison_stat_fp,
-                             _index_headers['alpha_diversity']))
-                        index_links.append(
-                            ('Alpha diversity boxplots (%s, %s)' % (category, alpha_metric),
-                             alpha_comparison_boxplot_fp,
-                             _index_headers['alpha_diversity']))
-                else:
-                    logger.write("Skipping compare_alpha_diversity.py"
-                                 " for %s as %s exists.\n\n"
-                                 % (alpha_metric, compare_alpha_output_dir))
-        else:
-            logger.write("Skipping compare_alpha_diversity.py as"
-                         " no categories were provided.\n\n")
-
     if not suppress_taxa_summary:
         taxa_plots_output_dir = '%s/taxa_plots/' % output_dir
         # need to check for existence of any html files, since the user can
@@ -390,7 +359,7 @@ def run_core_diversity_analyses(
                 output_dir=taxa_plots_output_dir,
                 mapping_cat=None,
                 sort=True,
-                command_handler=command_handler,
+                command_handler=collect_commands,
                 params=params,
                 qiime_config=qiime_config,
                 logger=logger,
@@ -423,7 +392,7 @@ def run_core_diversity_analyses(
                     output_dir=taxa_plots_output_dir,
                     mapping_cat=category,
                     sort=True,
-                    command_handler=command_handler,
+                    command_handler=collect_commands,
                     params=params,
                     qiime_config=qiime_config,
                     logger=logger,
@@ -455,7 +424,9 @@ def run_core_diversity_analyses(
                     (rarefied_biom_fp, mapping_fp, category,
                      group_signifance_fp, params_str)
                 commands.append([('Group significance (%s)' % category,
-                                  group_significance_cmd)])
+                                  group_significance_cmd,
+                                  [rarefied_biom_fp, mapping_fp],
+                                  [group_signifance_fp])])
             else:
                 logger.write("Skipping group_significance.py for %s as %s exists.\n\n"
                              % (category, group_signifance_fp))
@@ -464,11 +435,69 @@ def run_core_diversity_analyses(
                                 group_signifance_fp,
                                 _index_headers['group_significance']))
 
+    # run the workflows' commands, as the alpha diversity comparisons
+    # depend on which collated alpha diversity files they create
+    if len(commands) > 0:
+        command_handler(commands,
+                        status_update_callback,
+                        logger,
+                        close_logger_on_success=False)
+        commands = []
+
+    if not suppress_alpha_diversity:
+        collated_alpha_diversity_fps = \
+            glob('%s/alpha_div_collated/*txt' % arare_full_output_dir)
+        try:
+            params_str = get_params_str(params['compare_alpha_diversity'])
+        except KeyError:
+            params_str = ''
+
+        if len(categories) > 0:
+            for collated_alpha_diversity_fp in collated_alpha_diversity_fps:
+                alpha_metric = splitext(
+                    split(collated_alpha_diversity_fp)[1])[0]
+                compare_alpha_output_dir = '%s/compare_%s' % \
+                    (arare_full_output_dir, alpha_metric)
+                if not exists(compare_alpha_output_dir):
+                    compare_alpha_cmd = \
+                        'compare_alpha_diversity.py -i %s -m %s -c %s -o %s -n 999 %s' %\
+                        (collated_alpha_diversity_fp,
+                         mapping_fp,
+                         comma_separated_categories,
+                         compare_alpha_output_dir,
+                         params_str)
+                    commands.append(
+                        [('Compare alpha diversity (%s)' % alpha_metric,
+                          compare_alpha_cmd,
+                          [collated_alpha_diversity_fp, mapping_fp],
+                          [compare_alpha_output_dir])])
+                    for category in categories:
+                        alpha_comparison_stat_fp = '%s/%s_stats.txt' % \
+                            (compare_alpha_output_dir, category)
+                        alpha_comparison_boxplot_fp = '%s/%s_boxplots.pdf' % \
+                            (compare_alpha_output_dir, category)
+                        index_links.append(
+                            ('Alpha diversity statistics (%s, %s)' % (category, alpha_metric),
+                             alpha_comparison_stat_fp,
+                             _index_headers['alpha_diversity']))
+                        index_links.append(
+                            ('Alpha diversity boxplots (%s, %s)' % (category, alpha_metric),
+                             alpha_comparison_boxplot_fp,
+                             _index_headers['alpha_diversity']))
+                else:
+                    logger.write("Skipping compare_alpha_diversity.py"
+                                 " for %s as %s exists.\n\n"
+                                 % (alpha_metric, compare_alpha_output_dir))
+        else:
+            logger.write("Skipping compare_alpha_diversity.py as"
+                         " no categories were provided.\n\n")
+
     filtered_biom_gzip_fp = '%s.gz' % filtered_biom_fp
     if not exists(filtered_biom_gzip_fp):
         commands.append(
             [('Compress the filtered BIOM table', 'gzip %s' %
-              filtered_biom_fp)])
+              filtered_biom_fp, [filtered_biom_fp],
+              [filtered_biom_fp, filtered_biom_gzip_fp])])
     else:
         logger.write("Skipping compressing of filtered BIOM table as %s exists.\n\n"
                      % filtered_biom_gzip_fp)
@@ -481,7 +510,8 @@ def run_core_diversity_analyses(
     if not exists(rarified_biom_gzip_fp):
         commands.append(
             [('Compress the rarified BIOM table', 'gzip %s' %
-              rarefied_biom_fp)])
+              rarefied_biom_fp, [rarefied_biom_fp],
+              [rarefied_biom_fp, rarified_biom_gzip_fp])])
     else:
         logger.write("Skipping compressing of rarified BIOM table as %s exists.\n\n"
                      % rarified_biom_gzip_fp)
@@ -87,7 +87,8 @@ def run_beta_diversity_through_plots(otu_table_fp,
             (otu_table_fp, even_sampled_otu_table_fp, sampling_depth)
         commands.append([
             ('Sample OTU table at %d seqs/sample' % sampling_depth,
-             single_rarefaction_cmd)])
+             single_rarefaction_cmd,
+             [otu_table_fp], [even_sampled_otu_table_fp])])
         otu_table_fp = even_sampled_otu_table_fp
         otu_table_dir, otu_table_filename = split(even_sampled_otu_table_fp)
         otu_table_basename, otu_table_ext = splitext(otu_table_filename)
@@ -123,21 +124,21 @@ def run_beta_diversity_through_plots(otu_table_fp,
                 pass
             beta_div_cmd = 'parallel_beta_diversity.py -i %s -o %s --metrics %s -T %s' %\
                 (otu_table_fp, output_dir, beta_diversity_metric, params_str)
-            commands.append(
-                [('Beta Diversity (%s)' % beta_diversity_metric, beta_div_cmd)])
         else:
             beta_div_cmd = 'beta_diversity.py -i %s -o %s --metrics %s %s' %\
                 (otu_table_fp, output_dir, beta_diversity_metric, params_str)
-            commands.append(
-                [('Beta Diversity (%s)' % beta_diversity_metric, beta_div_cmd)])
 
         orig_beta_div_fp = '%s/%s_%s.txt' % \
             (output_dir, beta_diversity_metric, otu_table_basename)
         beta_div_fp = '%s/%s_dm.txt' % \
             (output_dir, beta_diversity_metric)
+        commands.append(
+            [('Beta Diversity (%s)' % beta_diversity_metric, beta_div_cmd,
+              [otu_table_fp, tree_fp], [orig_beta_div_fp])])
         commands.append(
             [('Rename distance matrix (%s)' % beta_diversity_metric,
-              'mv %s %s' % (orig_beta_div_fp, beta_div_fp))])
+              'mv %s %s' % (orig_beta_div_fp, beta_div_fp),
+              [orig_beta_div_fp], [orig_beta_div_fp, beta_div_fp])])
         dm_fps.append((beta_diversity_metric, beta_div_fp))
 
         # Prep the principal coordinates command
@@ -150,7 +151,8 @@ def run_beta_diversity_through_plots(otu_table_fp,
         pc_cmd = 'principal_coordinates.py -i %s -o %s %s' %\
             (beta_div_fp, pc_fp, params_str)
         commands.append(
-            [('Principal coordinates (%s)' % beta_diversity_metric, pc_cmd)])
+            [('Principal coordinates (%s)' % beta_diversity_metric, pc_cmd,
+              [beta_div_fp], [pc_fp])])
 
         # Generate emperor plots
         if not suppress_emperor_plots:
@@ -171,7 +173,7 @@ def run_beta_diversity_through_plots(otu_table_fp,
 
             commands.append(
                 [('Make emperor plots, %s)' % beta_diversity_metric,
-                  emperor_command)])
+                  emperor_command, [pc_fp, mapping_fp], [emperor_dir])])
 
     # Call the command handler on the list of commands
     command_handler(commands,
@@ -197,7 +199,8 @@ def run_alpha_rarefaction(otu_table_fp,
                           suppress_md5=False,
                           status_update_callback=print_to_stdout,
                           plot_stderr_and_stddev=False,
-                          retain_intermediate_files=True):
+                          retain_intermediate_files=True,
+                          fused=False):
     """ Run the data preparation steps of Qiime
 
         The steps performed by this function are:
@@ -206,6 +209,10 @@ def run_alpha_rarefaction(otu_table_fp,
           3) Collate alpha diversity results;
           4) Generate alpha rarefaction plots.
 
+        If fused is True, steps 1-3 are run as one serial command
+        (rarefaction_alpha_diversity.py), which keeps the rarefied OTU
+        tables and alpha diversity results in memory instead of writing
+        them as intermediate files. parallel is ignored for these steps.
     """
     # Prepare some variables for the later steps
     otu_table_dir, otu_table_filename = split(otu_table_fp)
@@ -231,68 +238,94 @@ def run_alpha_rarefaction(otu_table_fp,
     step = int((max_rare_depth - min_rare_depth) / num_steps) or 1
     max_rare_depth = int(max_rare_depth)
 
-    rarefaction_dir = '%s/rarefaction/' % output_dir
-    create_dir(rarefaction_dir)
-    try:
-        params_str = get_params_str(params['multiple_rarefactions'])
-    except KeyError:
-        params_str = ''
-    if parallel:
-        params_str += ' %s' % get_params_str(params['parallel'])
-        # Build the rarefaction command
-        rarefaction_cmd = \
-            'parallel_multiple_rarefactions.py -T -i %s -m %s -x %s -s %s -o %s %s' %\
-            (otu_table_fp, min_rare_depth, max_rare_depth, step,
-             rarefaction_dir, params_str)
-    else:
-        # Build the rarefaction command
-        rarefaction_cmd = \
-            'multiple_rarefactions.py -i %s -m %s -x %s -s %s -o %s %s' %\
+    if fused:
+        # Prep the fused rarefaction, alpha diversity and collation command
+        alpha_collated_dir = '%s/alpha_div_collated/' % output_dir
+        create_dir(alpha_collated_dir)
+        try:
+            params_str = get_params_str(params['multiple_rarefactions'])
+        except KeyError:
+            params_str = ''
+        try:
+            params_str += ' %s' % get_params_str(params['alpha_diversity'])
+        except KeyError:
+            pass
+        if tree_fp:
+            params_str += ' -t %s' % tree_fp
+        rarefaction_alpha_cmd = \
+            'rarefaction_alpha_diversity.py -i %s -m %s -x %s -s %s -o %s %s' %\
             (otu_table_fp, min_rare_depth, max_rare_depth, step,
-             rarefaction_dir, params_str)
-    commands.append([('Alpha rarefaction', rarefaction_cmd)])
-
-    # Prep the alpha diversity command
-    alpha_diversity_dir = '%s/alpha_div/' % output_dir
-    create_dir(alpha_diversity_dir)
-    try:
-        params_str = get_params_str(params['alpha_diversity'])
-    except KeyError:
-        params_str = ''
-    if tree_fp:
-        params_str += ' -t %s' % tree_fp
-    if parallel:
-        params_str += ' %s' % get_params_str(params['parallel'])
-        # Build the alpha diversity command
-        alpha_diversity_cmd = \
-            "parallel_alpha_diversity.py -T -i %s -o %s %s" %\
-            (rarefaction_dir, alpha_diversity_dir, params_str)
+             alpha_collated_dir, params_str)
+        commands.append([('Rarefied alpha diversity', rarefaction_alpha_cmd,
+                          [otu_table_fp, tree_fp], [alpha_collated_dir])])
     else:
-        # Build the alpha diversity command
-        alpha_diversity_cmd = \
-            "alpha_diversity.py -i %s -o %s %s" %\
-            (rarefaction_dir, alpha_diversity_dir, params_str)
+        rarefaction_dir = '%s/rarefaction/' % output_dir
+        create_dir(rarefaction_dir)
+        try:
+            params_str = get_params_str(params['multiple_rarefactions'])
+        except KeyError:
+            params_str = ''
+        if parallel:
+            params_str += ' %s' % get_params_str(params['parallel'])
+            # Build the rarefaction command
+            rarefaction_cmd = \
+                'parallel_multiple_rarefactions.py -T -i %s -m %s -x %s -s %s -o %s %s' %\
+                (otu_table_fp, min_rare_depth, max_rare_depth, step,
+                 rarefaction_dir, params_str)
+        else:
+            # Build the rarefaction command
+            rarefaction_cmd = \
+                'multiple_rarefactions.py -i %s -m %s -x %s -s %s -o %s %s' %\
+                (otu_table_fp, min_rare_depth, max_rare_depth, step,
+                 rarefaction_dir, params_str)
+        commands.append([('Alpha rarefaction', rarefaction_cmd,
+                          [otu_table_fp], [rarefaction_dir])])
+
+        # Prep the alpha diversity command
+        alpha_diversity_dir = '%s/alpha_div/' % output_dir
+        create_dir(alpha_diversity_dir)
+        try:
+            params_str = get_params_str(params['alpha_diversity'])
+        except KeyError:
+            params_str = ''
+        if tree_fp:
+            params_str += ' -t %s' % tree_fp
+        if parallel:
+            params_str += ' %s' % get_params_str(params['parallel'])
+            # Build the alpha diversity command
+            alpha_diversity_cmd = \
+                "parallel_alpha_diversity.py -T -i %s -o %s %s" %\
+                (rarefaction_dir, alpha_diversity_dir, params_str)
+        else:
+            # Build the alpha diversity command
+            alpha_diversity_cmd = \
+                "alpha_diversity.py -i %s -o %s %s" %\
+                (rarefaction_dir, alpha_diversity_dir, params_str)
 
-    commands.append(
-        [('Alpha diversity on rarefied OTU tables', alpha_diversity_cmd)])
+        commands.append(
+            [('Alpha diversity on rarefied OTU tables', alpha_diversity_cmd,
+              [rarefaction_dir, tree_fp], [alpha_diversity_dir])])
 
-    # Prep the alpha diversity collation command
-    alpha_collated_dir = '%s/alpha_div_collated/' % output_dir
-    create_dir(alpha_collated_dir)
-    try:
-        params_str = get_params_str(params['collate_alpha'])
-    except KeyError:
-        params_str = ''
-    # Build the alpha diversity collation command
-    alpha_collated_cmd = 'collate_alpha.py -i %s -o %s %s' %\
-        (alpha_diversity_dir, alpha_collated_dir, params_str)
-    commands.append([('Collate alpha', alpha_collated_cmd)])
-
-    if not retain_intermediate_files:
-        commands.append([('Removing intermediate files',
-                          'rm -r %s %s' % (rarefaction_dir, alpha_diversity_dir))])
-    else:
-        commands.append([('Skipping removal of intermediate files.', '')])
+        # Prep the alpha diversity collation command
+        alpha_collated_dir = '%s/alpha_div_collated/' % output_dir
+        create_dir(alpha_collated_dir)
+        try:
+            params_str = get_params_str(params['collate_alpha'])
+        except KeyError:
+            params_str = ''
+        # Build the alpha diversity collation command
+        alpha_collated_cmd = 'collate_alpha.py -i %s -o %s %s' %\
+            (alpha_diversity_dir, alpha_collated_dir, params_str)
+        commands.append([('Collate alpha', alpha_collated_cmd,
+                          [alpha_diversity_dir], [alpha_collated_dir])])
+
+        if not retain_intermediate_files:
+            commands.append([('Removing intermediate files',
+                              'rm -r %s %s' % (rarefaction_dir, alpha_diversity_dir),
+                              [], [rarefaction_dir, alpha_diversity_dir])])
+        else:
+            commands.append([('Skipping removal of intermediate files.', '',
+                              [], [])])
 
     # Prep the make rarefaction plot command(s)
     try:
@@ -310,7 +343,8 @@ def run_alpha_rarefaction(otu_table_fp,
             'make_rarefaction_plots.py -i %s -m %s -o %s %s' %\
             (alpha_collated_dir, mapping_fp, rarefaction_plot_dir, params_str)
         commands.append(
-            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd)])
+            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd,
+              [alpha_collated_dir, mapping_fp], [rarefaction_plot_dir])])
     else:
         rarefaction_plot_dir_stddev = '%s/alpha_rarefaction_plots_stddev/' % output_dir
         rarefaction_plot_dir_stderr = '%s/alpha_rarefaction_plots_stderr/' % output_dir
@@ -324,13 +358,15 @@ def run_alpha_rarefaction(otu_table_fp,
             (alpha_collated_dir, mapping_fp, rarefaction_plot_dir_stddev,
              params_str)
         commands.append(
-            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd)])
+            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd,
+              [alpha_collated_dir, mapping_fp], [rarefaction_plot_dir_stddev])])
         make_rarefaction_plot_cmd =\
             'make_rarefaction_plots.py -i %s -m %s -o %s %s --std_type stderr' %\
             (alpha_collated_dir, mapping_fp, rarefaction_plot_dir_stderr,
              params_str)
         commands.append(
-            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd)])
+            [('Rarefaction plot: %s' % 'All metrics', make_rarefaction_plot_cmd,
+              [alpha_collated_dir, mapping_fp], [rarefaction_plot_dir_stderr])])
 
     # Call the command handler on the list of commands
     command_handler(commands,
@@ -405,7 +441,11 @@ def run_jackknifed_beta_diversity(otu_table_fp,
     beta_div_cmd = 'beta_diversity.py -i %s -o %s %s' %\
         (otu_table_fp, output_dir, params_str)
     commands.append(
-        [('Beta Diversity (%s)' % ', '.join(beta_diversity_metrics), beta_div_cmd)])
+        [('Beta Diversity (%s)' % ', '.join(beta_diversity_metrics), beta_div_cmd,
+          [otu_table_fp, tree_fp],
+          ['%s/%s_%s.txt' % (output_dir, beta_diversity_metric,
+                             otu_table_basename)
+           for beta_diversity_metric in beta_diversity_metrics])])
 
     # Prep rarefaction command
     rarefaction_dir = '%s/rarefaction/' % output_dir
@@ -418,7 +458,8 @@ def run_jackknifed_beta_diversity(otu_table_fp,
     rarefaction_cmd = \
         'multiple_rarefactions_even_depth.py -i %s -d %d -o %s %s' %\
         (otu_table_fp, seqs_per_sample, rarefaction_dir, params_str)
-    commands.append([('Rarefaction', rarefaction_cmd)])
+    commands.append([('Rarefaction', rarefaction_cmd,
+                      [otu_table_fp], [rarefaction_dir])])
 
     # Begin iterating over beta diversity distance metrics, if more than one
     # was provided
@@ -439,7 +480,7 @@ def run_jackknifed_beta_diversity(otu_table_fp,
             (distance_matrix_fp, full_tree_fp, params_str)
         commands.append(
             [('UPGMA on full distance matrix: %s' % beta_diversity_metric,
-              hierarchical_cluster_cmd)])
+              hierarchical_cluster_cmd, [distance_matrix_fp], [full_tree_fp])])
 
         # Prep the beta diversity command (for rarefied OTU tables)
         dm_dir = '%s/rare_dm/' % metric_output_dir
@@ -469,7 +510,7 @@ def run_jackknifed_beta_diversity(otu_table_fp,
                 (rarefaction_dir, dm_dir, params_str)
         commands.append(
             [('Beta diversity on rarefied OTU tables (%s)' % beta_diversity_metric,
-              beta_div_rarefied_cmd)])
+              beta_div_rarefied_cmd, [rarefaction_dir, tree_fp], [dm_dir])])
 
         # Prep the hierarchical clustering command (for rarefied
         # distance matrices)
@@ -486,16 +527,16 @@ def run_jackknifed_beta_diversity(otu_table_fp,
             'upgma_cluster.py -i %s -o %s %s' % (dm_dir, upgma_dir, params_str)
         commands.append(
             [('UPGMA on rarefied distance matrix (%s)' % beta_diversity_metric,
-              hierarchical_cluster_cmd)])
+              hierarchical_cluster_cmd, [dm_dir], [upgma_dir])])
 
         # Build the consensus tree command
+        consensus_tree_fp = metric_output_dir + "/rare_upgma_consensus.tre"
         consensus_tree_cmd =\
             'consensus_tree.py -i %s -o %s %s' %\
-            (upgma_dir, metric_output_dir + "/rare_upgma_consensus.tre",
-             params_str)
+            (upgma_dir, consensus_tree_fp, params_str)
         commands.append(
             [('consensus on rarefied distance matrices (%s)' % beta_diversity_metric,
-              consensus_tree_cmd)])
+              consensus_tree_cmd, [upgma_dir], [consensus_tree_fp])])
 
         # Prep the tree compare command
         tree_compare_dir = '%s/upgma_cmp/' % metric_output_dir
@@ -517,7 +558,8 @@ def run_jackknifed_beta_diversity(otu_table_fp,
         tree_compare_cmd = 'tree_compare.py -s %s -m %s -o %s %s' %\
             (upgma_dir, master_tree_fp, tree_compare_dir, params_str)
         commands.append(
-            [('Tree compare (%s)' % beta_diversity_metric, tree_compare_cmd)])
+            [('Tree compare (%s)' % beta_diversity_metric, tree_compare_cmd,
+              [upgma_dir, master_tree_fp], [tree_compare_dir])])
 
         # Prep the PCoA command
         pcoa_dir = '%s/pcoa/' % metric_output_dir
@@ -530,7 +572,8 @@ def run_jackknifed_beta_diversity(otu_table_fp,
         pcoa_cmd = 'principal_coordinates.py -i %s -o %s %s' %\
             (dm_dir, pcoa_dir, params_str)
         commands.append(
-            [('Principal coordinates (%s)' % beta_diversity_metric, pcoa_cmd)])
+            [('Principal coordinates (%s)' % beta_diversity_metric, pcoa_cmd,
+              [dm_dir], [pcoa_dir])])
 
         # Prep the emperor plots command
         emperor_dir = '%s/emperor_pcoa_plots/' % metric_output_dir
@@ -542,7 +585,8 @@ def run_jackknifed_beta_diversity(otu_table_fp,
         emperor_cmd = 'make_emperor.py -i %s -o %s -m %s %s' %\
             (pcoa_dir, emperor_dir, mapping_fp, params_str)
         commands.append(
-            [('emperor plots (%s)' % beta_diversity_metric, emperor_cmd)])
+            [('emperor plots (%s)' % beta_diversity_metric, emperor_cmd,
+              [pcoa_dir, mapping_fp], [emperor_dir])])
 
     # Call the command handler on the list of commands
     command_handler(commands,
@@ -619,7 +663,8 @@ def run_summarize_taxa_through_plots(otu_table_fp,
             (mapping_fp, otu_table_fp, output_fp, mapping_cat, params_str)
 
         commands.append(
-            [('Summarize OTU table by Category', summarize_otu_by_cat_cmd)])
+            [('Summarize OTU table by Category', summarize_otu_by_cat_cmd,
+              [mapping_fp, otu_table_fp], [output_fp])])
 
         otu_table_fp = output_fp
 
@@ -640,12 +685,15 @@ def run_summarize_taxa_through_plots(otu_table_fp,
             # handle separately
             sort_otu_table_cmd = \
                 "sort_otu_table.py -i %s -o %s" % (otu_table_fp, sorted_fp)
+            sort_input_fps = [otu_table_fp]
         else:
             sort_otu_table_cmd = \
                 "sort_otu_table.py -i %s -o %s -m %s %s" %\
                 (otu_table_fp, sorted_fp, mapping_fp, params_str)
+            sort_input_fps = [otu_table_fp, mapping_fp]
 
-        commands.append([('Sort OTU Table', sort_otu_table_cmd)])
+        commands.append([('Sort OTU Table', sort_otu_table_cmd,
+                          sort_input_fps, [sorted_fp])])
 
         # redefine otu_table_fp to use
         otu_table_fp = sorted_fp
@@ -661,12 +709,6 @@ def run_summarize_taxa_through_plots(otu_table_fp,
     except:
         sum_taxa_levels = None
 
-    # Build the summarize taxonomy command
-    summarize_taxa_cmd = 'summarize_taxa.py -i %s -o %s %s' %\
-        (otu_table_fp, output_dir, params_str)
-
-    commands.append([('Summarize Taxonomy', summarize_taxa_cmd)])
-
     sum_taxa_fps = []
 
     if sum_taxa_levels:
@@ -680,6 +722,16 @@ def run_summarize_taxa_through_plots(otu_table_fp,
         for i in [2, 3, 4, 5, 6]:
             sum_taxa_fps.append(basename + '_L%s.txt' % (str(i)))
 
+    # Build the summarize taxonomy command
+    summarize_taxa_cmd = 'summarize_taxa.py -i %s -o %s %s' %\
+        (otu_table_fp, output_dir, params_str)
+
+    # each level is written in both classic and BIOM format
+    commands.append([('Summarize Taxonomy', summarize_taxa_cmd,
+                      [otu_table_fp],
+                      sum_taxa_fps + [splitext(fp)[0] + '.biom'
+                                      for fp in sum_taxa_fps])])
+
     # Prep the plot taxa summary plot command(s)
     taxa_summary_plots_dir = '%s/taxa_summary_plots/' % output_dir
     create_dir(taxa_summary_plots_dir)
@@ -695,7 +747,8 @@ def run_summarize_taxa_through_plots(otu_table_fp,
         (','.join(sum_taxa_fps), taxa_summary_plots_dir, params_str)
 
     commands.append(
-        [('Plot Taxonomy Summary', plot_taxa_summary_cmd)])
+        [('Plot Taxonomy Summary', plot_taxa_summary_cmd,
+          sum_taxa_fps, [taxa_summary_plots_dir])])
 
     # Call the command handler on the list of commands
     command_handler(commands,
@@ -13,11 +13,23 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 import sys
-from os.path import join
+from os import killpg, listdir, remove, rename, setsid, utime, walk
+from os.path import (abspath, dirname, exists, getmtime, getsize, isdir,
+                     join, normpath, relpath, sep)
+from shutil import copy2, copytree, rmtree
+from tempfile import mkdtemp
+from hashlib import md5
 from datetime import datetime
+from multiprocessing import cpu_count
+from signal import SIGKILL
+from subprocess import PIPE, Popen
+from threading import Thread
+from time import time
+from Queue import Queue
 from cogent.util.misc import safe_md5
 from qiime.util import (qiime_system_call,
-                        get_qiime_library_version)
+                        get_qiime_library_version,
+                        create_dir)
 
 
 def generate_log_fp(output_dir,
@@ -98,39 +110,438 @@ def print_commands(commands,
         for e in c:
             status_update_callback('#%s' % e[0])
             print '%s' % e[1]
-            logger.write('# %s command\n%s\n\n' % e)
+            logger.write('# %s command\n%s\n\n' % e[:2])
 
 
 def call_commands_serially(commands,
                            status_update_callback,
                            logger,
-                           close_logger_on_success=True):
-    """Run list of commands, one after another """
+                           close_logger_on_success=True,
+                           cache=None):
+    """Run list of commands, one after another
+
+        If a WorkflowCache is passed as cache, steps whose outputs are
+        cached are restored from it instead of being run, and the outputs
+        of the other steps are stored in it.
+    """
     logger.write("Executing commands.\n\n")
     for c in commands:
         for e in c:
-            status_update_callback('%s\n%s' % e)
-            logger.write('# %s command \n%s\n\n' % e)
+            status_update_callback('%s\n%s' % e[:2])
+            logger.write('# %s command \n%s\n\n' % e[:2])
+            key, hit = _fetch_cached_step(e, cache)
+            _log_cache_lookup(key, hit, logger)
+            if hit:
+                continue
             stdout, stderr, return_value = qiime_system_call(e[1])
-            if return_value != 0:
-                msg = "\n\n*** ERROR RAISED DURING STEP: %s\n" % e[0] +\
-                    "Command run was:\n %s\n" % e[1] +\
-                    "Command returned exit status: %d\n" % return_value +\
-                    "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
-                logger.write(msg)
-                logger.close()
-                raise WorkflowError(msg)
-            # in the no error case, we write commands' output to the log
-            # and also echo to this proc's stdout/stderr
+            _log_command_result(e, stdout, stderr, return_value, logger)
+            if key is not None:
+                cache.store(e, key)
+    if close_logger_on_success:
+        logger.close()
+
+
+def _fetch_cached_step(e, cache):
+    """Return the cache key of step e, and whether it was restored from cache
+
+        The key is None if there is no cache, or if the step can't be
+        cached (see WorkflowCache.getKey).
+    """
+    if cache is None:
+        return None, False
+    key = cache.getKey(e)
+    if key is None:
+        return None, False
+    return key, cache.fetch(e, key)
+
+
+def _log_cache_lookup(key, hit, logger):
+    """Log whether the step with cache key key was a cache hit or miss """
+    if key is None:
+        pass
+    elif hit:
+        logger.write("Cache hit (%s): outputs restored, command not run.\n\n"
+                     % key)
+    else:
+        logger.write("Cache miss (%s): running command.\n\n" % key)
+
+
+def _log_command_result(e, stdout, stderr, return_value, logger):
+    """Log the output of a command, raising a WorkflowError if it failed """
+    if return_value != 0:
+        msg = "\n\n*** ERROR RAISED DURING STEP: %s\n" % e[0] +\
+            "Command run was:\n %s\n" % e[1] +\
+            "Command returned exit status: %d\n" % return_value +\
+            "Stdout:\n%s\nStderr\n%s\n" % (stdout, stderr)
+        logger.write(msg)
+        logger.close()
+        raise WorkflowError(msg)
+    # in the no error case, we write commands' output to the log
+    # and also echo to this proc's stdout/stderr
+    else:
+        # write stdout and stderr to log file
+        logger.write("Stdout:\n%s\nStderr:\n%s\n" % (stdout, stderr))
+        # write stdout to stdout
+        if stdout:
+            print stdout
+        # write stderr to stderr
+        if stderr:
+            sys.stderr.write(stderr)
+
+
+def _normalize_fps(fps):
+    """Return absolute, normalized versions of fps, dropping Nones """
+    return [normpath(abspath(fp)) for fp in fps if fp is not None]
+
+
+def _fps_overlap(fps1, fps2):
+    """Return True if any path in fps1 is, contains, or is in one in fps2 """
+    for fp1 in fps1:
+        for fp2 in fps2:
+            if (fp1 == fp2 or fp1.startswith(fp2 + sep) or
+                    fp2.startswith(fp1 + sep)):
+                return True
+    return False
+
+
+def get_step_dependencies(steps):
+    """Return the indices of the earlier steps that each step depends on
+
+        Each step is a (description, command) tuple, optionally followed
+        by a list of the filepaths (or directories) that the command reads
+        and a list of those that it writes (or removes). A step with
+        declared filepaths depends on each earlier step that writes
+        something it reads or writes, or that reads something it writes.
+        A step without declared filepaths may read or write anything, so it
+        depends on all earlier steps, and all later steps depend on it.
+    """
+    result = []
+    declared = []
+    for i, step in enumerate(steps):
+        if len(step) > 2:
+            inputs = _normalize_fps(step[2])
+            outputs = _normalize_fps(step[3])
+            declared.append((inputs, outputs))
+            dependencies = []
+            for j in range(i):
+                if declared[j] is None:
+                    dependencies.append(j)
+                    continue
+                prev_inputs, prev_outputs = declared[j]
+                if (_fps_overlap(inputs + outputs, prev_outputs) or
+                        _fps_overlap(outputs, prev_inputs)):
+                    dependencies.append(j)
+        else:
+            declared.append(None)
+            dependencies = range(i)
+        result.append(dependencies)
+    return result
+
+
+def _get_fp_md5(fp):
+    """Return the md5 hex digest of fp, or None if fp doesn't exist
+
+        The md5 of a directory is of the relative path and md5 of each
+        file under it.
+    """
+    if isdir(fp):
+        result = md5()
+        for root, dirs, files in walk(fp):
+            dirs.sort()
+            for f in sorted(files):
+                file_fp = join(root, f)
+                result.update(relpath(file_fp, fp))
+                result.update(_get_fp_md5(file_fp))
+        return result.hexdigest()
+    elif exists(fp):
+        f = open(fp, 'rb')
+        result = safe_md5(f).hexdigest()
+        f.close()
+        return result
+    else:
+        return None
+
+
+def _get_fp_size(fp):
+    """Return the total size in bytes of fp, or of the files under it """
+    if not isdir(fp):
+        return getsize(fp)
+    result = 0
+    for root, dirs, files in walk(fp):
+        for f in files:
+            result += getsize(join(root, f))
+    return result
+
+
+def _remove_fp(fp):
+    """Remove the file or directory fp, if it exists """
+    if isdir(fp):
+        rmtree(fp)
+    elif exists(fp):
+        remove(fp)
+
+
+def _copy_fp(src, dest):
+    """Copy the file or directory src to dest, replacing dest if it exists """
+    _remove_fp(dest)
+    dest_dir = dirname(normpath(dest))
+    if dest_dir:
+        create_dir(dest_dir)
+    if isdir(src):
+        copytree(src, dest)
+    else:
+        copy2(src, dest)
+
+
+class WorkflowCache(object):
+
+    """Cache of the outputs of workflow steps
+
+        A step is keyed on the md5 of its command (which holds its
+        parameters), of the contents of the filepaths that it reads, and
+        of the QIIME version. The filepaths that the step declares (see
+        get_step_dependencies), and the directories of its outputs, are
+        replaced by placeholders in the command before it's hashed, so
+        re-running a workflow on the same data into a new output directory
+        finds the steps cached by the earlier run. Only steps which declare
+        their outputs can be cached.
+
+        Each cached step is a directory under cache_dir, named by its key,
+        which holds a copy of each output and a record of the md5 of each
+        output (or that the step didn't create it). If max_size (in
+        megabytes) is passed, the least recently used steps are removed
+        once the cache is larger than max_size.
+    """
+    _record_fn = 'outputs.txt'
+    # seconds since a directory without a record was last changed before
+    # it's treated as left by an interrupted store, rather than as a store
+    # still running in another process
+    _incomplete_entry_age = 24 * 60 * 60
+
+    def __init__(self, cache_dir, max_size=None):
+        create_dir(cache_dir)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def getKey(self, step):
+        """Return the cache key of step, or None if it can't be cached """
+        if len(step) < 4:
+            return None
+        inputs = [fp for fp in step[2] if fp is not None]
+        outputs = [fp for fp in step[3] if fp is not None]
+        if not outputs:
+            return None
+
+        placeholders = [(fp, '<input %d>' % i)
+                        for i, fp in enumerate(inputs)]
+        placeholders += [(fp, '<output %d>' % i)
+                         for i, fp in enumerate(outputs)]
+        output_dirs = []
+        for fp in outputs:
+            output_dir = dirname(fp)
+            if output_dir and output_dir not in output_dirs:
+                output_dirs.append(output_dir)
+        placeholders += [(d, '<output dir %d>' % i)
+                         for i, d in enumerate(output_dirs)]
+        # replace the longest filepaths first, so directories aren't
+        # replaced inside the filepaths that they contain
+        placeholders.sort(key=lambda p: len(p[0]), reverse=True)
+        command = step[1]
+        for fp, placeholder in placeholders:
+            command = command.replace(fp, placeholder)
+
+        result = md5(get_qiime_library_version())
+        result.update(command)
+        for fp in inputs:
+            result.update('\t%s' % (_get_fp_md5(fp) or 'missing'))
+        return result.hexdigest()
+
+    def fetch(self, step, key):
+        """Make the outputs of step match its cache entry
+
+            Outputs which already match the recorded md5s are left alone,
+            and the others are copied from the cache (or removed, if the
+            step didn't create them). Returns False, without changing any
+            outputs, if key isn't cached.
+        """
+        entry_dir = join(self.cache_dir, key)
+        record_fp = join(entry_dir, self._record_fn)
+        if not exists(record_fp):
+            return False
+        outputs = [fp for fp in step[3] if fp is not None]
+        output_md5s = [l.strip() for l in open(record_fp, 'U')]
+        if len(output_md5s) != len(outputs):
+            return False
+
+        to_restore = []
+        for i, (fp, output_md5) in enumerate(zip(outputs, output_md5s)):
+            if (_get_fp_md5(fp) or 'absent') == output_md5:
+                continue
+            cached_fp = join(entry_dir, str(i))
+            if output_md5 != 'absent' and not exists(cached_fp):
+                return False
+            to_restore.append((fp, output_md5, cached_fp))
+        for fp, output_md5, cached_fp in to_restore:
+            if output_md5 == 'absent':
+                _remove_fp(fp)
             else:
-                # write stdout and stderr to log file
-                logger.write("Stdout:\n%s\nStderr:\n%s\n" % (stdout, stderr))
-                # write stdout to stdout
-                if stdout:
-                    print stdout
-                # write stderr to stderr
-                if stderr:
-                    sys.stderr.write(stderr)
+                _copy_fp(cached_fp, fp)
+        # the record's mtime is the time that the entry was last used
+        utime(record_fp, None)
+        return True
+
+    def store(self, step, key):
+        """Copy the outputs of step into the cache under key """
+        outputs = [fp for fp in step[3] if fp is not None]
+        # the entry is built under a temporary name, so an interrupted
+        # store never leaves a partial entry behind under key
+        tmp_dir = mkdtemp(prefix='tmp', dir=self.cache_dir)
+        output_md5s = []
+        for i, fp in enumerate(outputs):
+            output_md5 = _get_fp_md5(fp)
+            if output_md5 is None:
+                output_md5s.append('absent')
+            else:
+                _copy_fp(fp, join(tmp_dir, str(i)))
+                output_md5s.append(output_md5)
+        record_f = open(join(tmp_dir, self._record_fn), 'w')
+        record_f.write('\n'.join(output_md5s))
+        record_f.write('\n')
+        record_f.close()
+
+        entry_dir = join(self.cache_dir, key)
+        _remove_fp(entry_dir)
+        rename(tmp_dir, entry_dir)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until within max_size """
+        if self.max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for name in listdir(self.cache_dir):
+            entry_dir = join(self.cache_dir, name)
+            if not isdir(entry_dir):
+                continue
+            record_fp = join(entry_dir, self._record_fn)
+            # entries without a record are being stored, possibly by another
+            # process, or were left by interrupted stores, which are removed
+            # first once they haven't changed for _incomplete_entry_age
+            try:
+                if exists(record_fp):
+                    last_used = getmtime(record_fp)
+                elif time() - getmtime(entry_dir) > \
+                        self._incomplete_entry_age:
+                    last_used = 0
+                else:
+                    continue
+                size = _get_fp_size(entry_dir)
+            except OSError:
+                # the store finished, or the entry was evicted, while it was
+                # being checked
+                continue
+            entries.append((last_used, name, size))
+            total_size += size
+        entries.sort()
+        for last_used, name, size in entries:
+            if total_size <= self.max_size * 2 ** 20:
+                break
+            rmtree(join(self.cache_dir, name), ignore_errors=True)
+            total_size -= size
+
+
+def _call_command(index, proc, results):
+    """Wait for proc, putting its index and results on the results queue """
+    stdout, stderr = proc.communicate()
+    results.put((index, stdout, stderr, proc.returncode))
+
+
+def call_commands_concurrently(commands,
+                               status_update_callback,
+                               logger,
+                               close_logger_on_success=True,
+                               max_concurrent_steps=None,
+                               cache=None):
+    """Run list of commands, running independent steps at the same time
+
+        The steps are ordered by the filepaths that they declare (see
+        get_step_dependencies), and each step is started as soon as the
+        steps it depends on have finished, running at most
+        max_concurrent_steps (default: the number of CPUs) at a time.
+        Each step is logged as call_commands_serially logs it, once the
+        step has finished. If a step fails, the steps which are still
+        running are killed and a WorkflowError is raised. cache is used as
+        in call_commands_serially.
+    """
+    if max_concurrent_steps is None:
+        max_concurrent_steps = cpu_count()
+    steps = [e for c in commands for e in c]
+    dependencies = get_step_dependencies(steps)
+    waiting_on = [set(d) for d in dependencies]
+    dependents = [[] for e in steps]
+    for i, d in enumerate(dependencies):
+        for j in d:
+            dependents[j].append(i)
+
+    logger.write("Executing commands.\n\n")
+    ready = [i for i, d in enumerate(waiting_on) if not d]
+    results = Queue()
+    keys = {}
+    procs = {}
+    num_running = 0
+    while ready or num_running:
+        while ready and num_running < max_concurrent_steps:
+            # start the steps in the order they were listed
+            i = min(ready)
+            ready.remove(i)
+            status_update_callback('%s\n%s' % steps[i][:2])
+            # cache lookups are made here rather than in the workers, as
+            # the cache isn't safe to share between threads
+            keys[i], hit = _fetch_cached_step(steps[i], cache)
+            if hit:
+                results.put((i, None, None, None))
+            else:
+                # each step is started in its own process group so that the
+                # commands it runs can be killed along with it
+                procs[i] = Popen(steps[i][1],
+                                 shell=True,
+                                 universal_newlines=True,
+                                 stdout=PIPE,
+                                 stderr=PIPE,
+                                 preexec_fn=setsid)
+                worker = Thread(target=_call_command,
+                                args=(i, procs[i], results))
+                worker.daemon = True
+                worker.start()
+            num_running += 1
+
+        i, stdout, stderr, return_value = results.get()
+        num_running -= 1
+        procs.pop(i, None)
+        logger.write('# %s command \n%s\n\n' % steps[i][:2])
+        _log_cache_lookup(keys[i], return_value is None, logger)
+        if return_value is None:
+            # restored from cache
+            pass
+        else:
+            if return_value != 0:
+                for proc in procs.values():
+                    try:
+                        killpg(proc.pid, SIGKILL)
+                    except OSError:
+                        # process already exited
+                        pass
+            # raises a WorkflowError if the step failed
+            _log_command_result(steps[i], stdout, stderr, return_value,
+                                logger)
+            if keys[i] is not None:
+                cache.store(steps[i], keys[i])
+        for j in dependents[i]:
+            waiting_on[j].discard(i)
+            if not waiting_on[j]:
+                ready.append(j)
+
     if close_logger_on_success:
         logger.close()
 
@@ -0,0 +1 @@
+echo "job ran"
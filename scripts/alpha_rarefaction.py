@@ -10,6 +10,7 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
+from functools import partial
 from qiime.util import parse_command_line_parameters, get_options_lookup
 from qiime.util import make_option
 from os import makedirs
@@ -17,6 +18,8 @@ from qiime.util import load_qiime_config
 from qiime.parse import parse_qiime_parameters
 from qiime.workflow.util import (print_commands,
                                  call_commands_serially,
+                                 call_commands_concurrently,
+                                 WorkflowCache,
                                  print_to_stdout,
                                  no_status_updates,
                                  validate_and_set_jobs_to_start)
@@ -78,10 +81,19 @@ script_info['optional_options'] = [
                 help='the upper limit of rarefaction depths ' +
                 '[default: median sequence/sample count]'),
     options_lookup['jobs_to_start_workflow'],
+    options_lookup['max_concurrent_steps'],
+    options_lookup['cache_dir'],
+    options_lookup['max_cache_size'],
     make_option('--retain_intermediate_files', action='store_true', help='retain '
                 'intermediate files: rarefied OTU tables (rarefaction) and alpha diversity '
                 'results (alpha_div). By default these will be erased [default: %default]',
                 default=False),
+    make_option('--fused', action='store_true', help='rarefy the OTU table, '
+                'compute alpha diversity and collate the results in one step, '
+                'without writing the rarefied OTU tables or per-table alpha '
+                'diversity results. This is always run serially (-a is '
+                'ignored for these steps) [default: %default]',
+                default=False),
 ]
 script_info['version'] = __version__
 
@@ -133,10 +145,19 @@ def main():
             option_parser.error("Output directory already exists. Please choose"
                                 " a different directory, or force overwrite with -f.")
 
+    if opts.cache_dir:
+        cache = WorkflowCache(opts.cache_dir, opts.max_cache_size)
+    else:
+        cache = None
+
     if print_only:
         command_handler = print_commands
+    elif opts.max_concurrent_steps > 1:
+        command_handler = partial(call_commands_concurrently,
+                                  max_concurrent_steps=opts.max_concurrent_steps,
+                                  cache=cache)
     else:
-        command_handler = call_commands_serially
+        command_handler = partial(call_commands_serially, cache=cache)
 
     if verbose:
         status_update_callback = print_to_stdout
@@ -155,7 +176,8 @@ def main():
                           min_rare_depth=min_rare_depth,
                           max_rare_depth=max_rare_depth,
                           status_update_callback=status_update_callback,
-                          retain_intermediate_files=retain_intermediate_files)
+                          retain_intermediate_files=retain_intermediate_files,
+                          fused=opts.fused)
 
 if __name__ == "__main__":
     main()
@@ -23,7 +23,8 @@ from tempfile import mkstemp
 from qiime.assign_taxonomy import (
     BlastTaxonAssigner, MothurTaxonAssigner, RdpTaxonAssigner,
     RtaxTaxonAssigner, Tax2TreeTaxonAssigner, validate_rdp_version,
-    UclustConsensusTaxonAssigner)
+    UclustConsensusTaxonAssigner, NaiveBayesTaxonAssigner,
+    naive_bayes_model_exists)
 
 assignment_method_constructors = {
     'blast': BlastTaxonAssigner,
@@ -31,7 +32,8 @@ assignment_method_constructors = {
     'rdp': RdpTaxonAssigner,
     'rtax': RtaxTaxonAssigner,
     'tax2tree': Tax2TreeTaxonAssigner,
-    'uclust': UclustConsensusTaxonAssigner
+    'uclust': UclustConsensusTaxonAssigner,
+    'naive_bayes': NaiveBayesTaxonAssigner
 }
 
 assignment_method_choices = [
@@ -40,7 +42,8 @@ assignment_method_choices = [
     'rtax',
     'mothur',
     'tax2tree',
-    'uclust']
+    'uclust',
+    'naive_bayes']
 
 options_lookup = get_options_lookup()
 
@@ -50,7 +53,7 @@ script_info = {}
 script_info['brief_description'] = """Assign taxonomy to each sequence"""
 script_info['script_description'] = """Contains code for assigning taxonomy, using several techniques.
 
-Given a set of sequences, %prog attempts to assign the taxonomy of each sequence. Currently the methods implemented are assignment with BLAST, the RDP classifier, RTAX, tax2tree, mothur, and uclust. The output of this step is an observation metadata mapping file of input sequence identifiers (1st column of output file) to taxonomy (2nd column) and quality score (3rd column). There may be method-specific information in subsequent columns.
+Given a set of sequences, %prog attempts to assign the taxonomy of each sequence. Currently the methods implemented are assignment with BLAST, the RDP classifier, RTAX, tax2tree, mothur, uclust, and QIIME's naive Bayes classifier. The output of this step is an observation metadata mapping file of input sequence identifiers (1st column of output file) to taxonomy (2nd column) and quality score (3rd column). There may be method-specific information in subsequent columns.
 
 Reference data sets and id-to-taxonomy maps for 16S rRNA sequences can be found in the Greengenes reference OTU builds. To get the latest build of the Greengenes OTUs (and other marker gene OTU collections), follow the "Resources" link from http://qiime.org. After downloading and unzipping you can use the following files as -r and -t, where <otus_dir> is the name of the new directory after unzipping the reference OTUs tgz file.
 
@@ -94,6 +97,10 @@ script_info['script_usage'].append(("""Assignment with Mothur:""", """The Mothur
 
 To make taxonomic classifications of the representative sequences, where the results are output to default directory \"mothur_assigned_taxonomy\", you can run the following command:""", "%prog -i mothur_repr_set_seqs.fasta -m mothur -r mothur_ref_seq_set.fna -t mothur_id_to_taxonomy.txt"))
 
+script_info['script_usage'].append(("""Assignment with the naive Bayes classifier:""", """QIIME's naive Bayes classifier uses the RDP Classifier's method (word size 8, with bootstrap confidence), without needing Java. The classifier is trained from the reference sequences and id-to-taxonomy map, and if --naive_bayes_model_dir is passed, the trained model is saved there and reused by later runs (including the jobs of parallel_assign_taxonomy_naive_bayes.py), which then don't need -r or -t. Remove the directory to retrain the classifier.
+
+To train the classifier, save it to nb_model/, and assign taxonomy using 4 processes, you can run the following command:""", """%prog -i repr_set_seqs.fasta -m naive_bayes -r ref_seq_set.fna -t id_to_taxonomy.txt --naive_bayes_model_dir nb_model/ -O 4"""))
+
 script_info[
     'output_description'] = """The consensus taxonomy assignment implemented here is the most detailed lineage description shared by 90% or more of the sequences within the OTU (this level of agreement can be adjusted by the user). The full lineage information for each sequence is one of the output files of the analysis. In addition, a conflict file records cases in which a phylum-level taxonomy assignment disagreement exists within an OTU (such instances are rare and can reflect sequence misclassification within the greengenes database)."""
 
@@ -167,8 +174,8 @@ script_info['optional_options'] = [
                 help='Database to blast against.  Must provide either --blast_db or '
                 '--reference_seqs_db for assignment with blast [default: %default]'),
     make_option('-c', '--confidence', type='float',
-                help='Minimum confidence to record an assignment, only used for rdp '
-                'and mothur methods [default: %default]', default=0.80),
+                help='Minimum confidence to record an assignment, only used for rdp, '
+                'mothur and naive_bayes methods [default: %default]', default=0.80),
     make_option('--uclust_min_consensus_fraction', type='float',
                 help=('Minimum fraction of database hits that must have a '
                       'specific taxonomic assignment to assign that taxonomy '
@@ -184,6 +191,24 @@ script_info['optional_options'] = [
     make_option('--rdp_max_memory', default=4000, type='int',
                 help='Maximum memory allocation, in MB, for Java virtual machine when '
                 'using the rdp method.  Increase for large training sets [default: %default]'),
+    make_option('--naive_bayes_model_dir', type='new_dirpath',
+                help='Directory of the trained naive Bayes classifier. If it '
+                'doesn\'t hold a trained classifier yet, the classifier is '
+                'trained from -r and -t and saved there, otherwise -r and -t '
+                'are ignored. Only used for naive_bayes method [default: '
+                '%default; the classifier is trained for this run only]'),
+    make_option('--naive_bayes_word_size', type='int',
+                help='Length of the words used by the naive Bayes classifier, '
+                'only used for naive_bayes method [default: %default]',
+                default=8),
+    make_option('--naive_bayes_num_bootstraps', type='int',
+                help='Number of bootstraps used to compute the confidence of '
+                'each assignment, only used for naive_bayes method '
+                '[default: %default]', default=100),
+    make_option('-O', '--jobs_to_start', type='int',
+                help='Number of processes to classify the sequences with, '
+                'only used for naive_bayes method [default: %default]',
+                default=1),
     make_option('-e', '--e_value', type='float',
                 help='Maximum e-value to record an assignment, only used for blast '
                 'method [default: %default]', default=0.001),
@@ -256,6 +281,16 @@ def main():
                 'reference sequences (via -r) and an id_to_taxonomy '
                 'file (via -t).')
 
+    if assignment_method == 'naive_bayes':
+        if not (opts.naive_bayes_model_dir and
+                naive_bayes_model_exists(opts.naive_bayes_model_dir)):
+            if None in [opts.id_to_taxonomy_fp, opts.reference_seqs_fp]:
+                option_parser.error(
+                    'Naive Bayes classification requires both a filepath for '
+                    'reference sequences (via -r) and an id_to_taxonomy '
+                    'file (via -t), unless a trained classifier is passed '
+                    'via --naive_bayes_model_dir.')
+
     if assignment_method == 'tax2tree':
         if opts.tree_fp is None:
             option_parser.error('Tax2Tree classification requires a '
@@ -333,6 +368,15 @@ def main():
         params['id_to_taxonomy_fp'] = opts.id_to_taxonomy_fp
         params['tree_fp'] = opts.tree_fp
 
+    elif assignment_method == 'naive_bayes':
+        params['Confidence'] = opts.confidence
+        params['id_to_taxonomy_fp'] = opts.id_to_taxonomy_fp
+        params['reference_sequences_fp'] = opts.reference_seqs_fp
+        params['model_dir'] = opts.naive_bayes_model_dir
+        params['word_size'] = opts.naive_bayes_word_size
+        params['num_bootstraps'] = opts.naive_bayes_num_bootstraps
+        params['jobs_to_start'] = opts.jobs_to_start
+
     else:
         # should not be able to get here as an unknown classifier would
         # have raised an optparse error
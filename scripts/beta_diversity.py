@@ -99,6 +99,18 @@ script_info['optional_options'] = [
                 'Pass to skip this step if you\'re already passing a minimal tree.' +
                 ' Beware with "full_tree" metrics, as extra tips in the tree' +
                 ' change the result'),
+    make_option('--memory_budget', default=None, type='int',
+                help='Calculate the full distance matrix in tiles of rows' +
+                ' which use about this many bytes of memory, writing each' +
+                ' tile as it is calculated, so the whole matrix is never held' +
+                ' in memory [default: %default; matrix is calculated at' +
+                ' once]'),
+    make_option('--output_format', default='text', type='choice',
+                choices=['text', 'float32', 'float64'],
+                help='Format of the output distance matrices. float32 and' +
+                ' float64 write binary (.bdm) files which can be' +
+                ' memory-mapped, and are always calculated in tiles' +
+                ' [default: %default]'),
 ]
 script_info['option_label'] = {'input_path': 'OTU table filepath',
                                'rows': 'List of samples for compute',
@@ -106,6 +118,8 @@ script_info['option_label'] = {'input_path': 'OTU table filepath',
                                'show_metrics': 'Show metrics',
                                'tree_path': 'Newick tree filepath',
                                'full_tree': 'Tree already trimmed',
+                               'memory_budget': 'Memory per tile (bytes)',
+                               'output_format': 'Distance matrix format',
                                'output_dir': 'Output directory'}
 
 script_info['version'] = __version__
@@ -139,10 +153,14 @@ def main():
 
     if os.path.isdir(opts.input_path):
         multiple_file_beta(opts.input_path, opts.output_dir, opts.metrics,
-                           opts.tree_path, opts.rows, full_tree=opts.full_tree)
+                           opts.tree_path, opts.rows, full_tree=opts.full_tree,
+                           memory_budget=opts.memory_budget,
+                           output_format=opts.output_format)
     elif os.path.isfile(opts.input_path):
         single_file_beta(opts.input_path, opts.metrics, opts.tree_path,
-                         opts.output_dir, opts.rows, full_tree=opts.full_tree)
+                         opts.output_dir, opts.rows, full_tree=opts.full_tree,
+                         memory_budget=opts.memory_budget,
+                         output_format=opts.output_format)
     else:
         stderr.write("io error, input path not valid.  Does it exist?")
         exit(1)
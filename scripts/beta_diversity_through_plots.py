@@ -10,6 +10,7 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
+from functools import partial
 from qiime.util import make_option
 from os import makedirs
 from qiime.util import load_qiime_config, parse_command_line_parameters,\
@@ -17,6 +18,8 @@ from qiime.util import load_qiime_config, parse_command_line_parameters,\
 from qiime.parse import parse_qiime_parameters
 from qiime.workflow.util import (print_commands,
                                  call_commands_serially,
+                                 call_commands_concurrently,
+                                 WorkflowCache,
                                  print_to_stdout,
                                  no_status_updates,
                                  validate_and_set_jobs_to_start)
@@ -80,7 +83,10 @@ script_info['optional_options'] = [
     make_option('--suppress_emperor_plots', action='store_true',
                 help='Do not generate emperor plots [default: %default]',
                 default=False),
-    options_lookup['jobs_to_start_workflow']]
+    options_lookup['jobs_to_start_workflow'],
+    options_lookup['max_concurrent_steps'],
+    options_lookup['cache_dir'],
+    options_lookup['max_cache_size']]
 script_info['version'] = __version__
 
 
@@ -133,10 +139,19 @@ def main():
             option_parser.error("Output directory already exists. Please choose"
                                 " a different directory, or force overwrite with -f.")
 
+    if opts.cache_dir:
+        cache = WorkflowCache(opts.cache_dir, opts.max_cache_size)
+    else:
+        cache = None
+
     if print_only:
         command_handler = print_commands
+    elif opts.max_concurrent_steps > 1:
+        command_handler = partial(call_commands_concurrently,
+                                  max_concurrent_steps=opts.max_concurrent_steps,
+                                  cache=cache)
     else:
-        command_handler = call_commands_serially
+        command_handler = partial(call_commands_serially, cache=cache)
 
     if verbose:
         status_update_callback = print_to_stdout
@@ -158,7 +158,13 @@ script_info['optional_options'] = [
                 'to use when calculating statistical significance. Only applies to '
                 'adonis, ANOSIM, MRPP, PERMANOVA, PERMDISP, and db-RDA. Must be '
                 'greater than or equal to zero [default: %default]', default=999,
-                type='int')
+                type='int'),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='number of processes to use when calculating the '
+                'statistics of the permutations. Only applies to ANOSIM and '
+                'PERMANOVA. The permutations are drawn in the main process, so '
+                'the results are the same for any number of processes '
+                '[default: %default]')
 ]
 script_info['version'] = __version__
 
@@ -178,7 +184,8 @@ def main():
                             "specified with the -o option." % out_dir)
 
     compare_categories(opts.input_dm, opts.mapping_file, opts.method,
-                       categories, opts.num_permutations, out_dir)
+                       categories, opts.num_permutations, out_dir,
+                       opts.jobs_to_start)
 
 
 if __name__ == "__main__":
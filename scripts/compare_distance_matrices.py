@@ -109,6 +109,11 @@ script_info['optional_options'] = [
     make_option('-s', '--sample_id_map_fp', type='existing_filepath',
                 help='Map of original sample ids to new sample ids [default: '
                 '%default]', default=None),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='the number of processes to test the pairs of distance '
+                'matrices in. If more than one, each pair is tested with its '
+                'own random seed. Only applies when method is mantel or '
+                'partial_mantel [default: %default]'),
     # Standard Mantel specific, i.e., method == mantel
     make_option('-t', '--tail_type',
                 help='the type of tail test to perform when calculating the p-value. '
@@ -183,7 +188,8 @@ def main():
         output_f = open(path.join(opts.output_dir, 'mantel_results.txt'), 'w')
         output_f.write(run_mantel_test('mantel', input_dm_fps, distmats,
                        opts.num_permutations, opts.tail_type,
-                       comment_mantel_pmantel, sample_id_map=sample_id_map))
+                       comment_mantel_pmantel, sample_id_map=sample_id_map,
+                       jobs_to_start=opts.jobs_to_start))
     elif opts.method == 'partial_mantel':
         output_f = open(path.join(opts.output_dir,
                         'partial_mantel_results.txt'), 'w')
@@ -191,7 +197,8 @@ def main():
                        distmats, opts.num_permutations, opts.tail_type,
                        comment_mantel_pmantel, control_dm_fp=opts.control_dm,
                        control_dm=parse_distmat(open(opts.control_dm, 'U')),
-                       sample_id_map=sample_id_map))
+                       sample_id_map=sample_id_map,
+                       jobs_to_start=opts.jobs_to_start))
     elif opts.method == 'mantel_corr':
         output_f = open(path.join(opts.output_dir,
                         'mantel_correlogram_results.txt'), 'w')
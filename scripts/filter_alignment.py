@@ -19,7 +19,7 @@ import numpy as np
 
 from qiime.util import load_qiime_config
 from qiime.filter_alignment import apply_lane_mask_and_gap_filter, \
-    remove_outliers, generate_lane_mask
+    remove_outliers, generate_lane_mask, apply_lane_mask_and_gap_filter_array
 from qiime.util import parse_command_line_parameters
 from qiime.util import make_option
 
@@ -39,6 +39,11 @@ script_info['script_usage'].append(
      """Alternatively, if the user would like to use a different gap fraction threshold ("-g"), they can use the following command:""",
      """%prog -i seqs_rep_set_aligned.fasta -m lanemask_in_1s_and_0s -o filtered_alignment/ -g 0.95"""))
 
+script_info['script_usage'].append(
+    ("",
+     """For large alignments, the alignment can be read once into a memory-mapped array (in the temp_dir from the qiime_config) rather than being parsed again for each filtering step. The output is the same:""",
+     """%prog -i seqs_rep_set_aligned.fasta -m lanemask_in_1s_and_0s -o filtered_alignment/ --memory_map"""))
+
 script_info[
     'output_description'] = """The output of filter_alignment.py consists of a single FASTA file, which ends with "pfiltered.fasta", where the "p" stands for positional filtering of the columns."""
 
@@ -81,7 +86,13 @@ script_info['optional_options'] = [
                 'specified, the top 10% most entropic base positions would be ' +
                 'filtered.  If this value is used, any lane mask supplied will be ' +
                 'ignored.  Entropy filtered occurs after gap filtering.  ' +
-                '  [default: %default]', default=None)
+                '  [default: %default]', default=None),
+    make_option('--memory_map', action='store_true',
+                help='read the alignment once into a memory-mapped array ' +
+                'in the temp_dir from the qiime_config, rather than parsing ' +
+                'it once for each filtering step. This is faster for large ' +
+                'alignments, but needs temporary disk space of about the ' +
+                'size of the alignment [default: %default]', default=False)
 ]
 script_info['version'] = __version__
 
@@ -123,12 +134,17 @@ def main():
     # open the input and output files
     infile = open(opts.input_fasta_file, 'U')
 
+    if opts.memory_map:
+        filter_f = apply_lane_mask_and_gap_filter_array
+    else:
+        filter_f = apply_lane_mask_and_gap_filter
+
     if opts.remove_outliers:
         # apply the lanemask/gap removal, then remove outliers
 
-        seq_gen = apply_lane_mask_and_gap_filter(infile, lane_mask,
-                                                 opts.allowed_gap_frac, verbose=opts.verbose,
-                                                 entropy_threshold=opts.entropy_threshold)
+        seq_gen = filter_f(infile, lane_mask,
+                           opts.allowed_gap_frac, verbose=opts.verbose,
+                           entropy_threshold=opts.entropy_threshold)
 
         filtered_aln = remove_outliers(seq_gen, opts.threshold)
         for seq in filtered_aln.Seqs:
@@ -137,9 +153,9 @@ def main():
 
     else:
         # just apply the lanemask/gap removal
-        for result in apply_lane_mask_and_gap_filter(infile, lane_mask,
-                                                     opts.allowed_gap_frac, verbose=opts.verbose,
-                                                     entropy_threshold=opts.entropy_threshold):
+        for result in filter_f(infile, lane_mask,
+                               opts.allowed_gap_frac, verbose=opts.verbose,
+                               entropy_threshold=opts.entropy_threshold):
             outfile.write(result)
     infile.close()
     outfile.close()
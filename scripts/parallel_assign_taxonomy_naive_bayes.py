@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from qiime.util import (get_options_lookup, load_qiime_config, make_option,
+                        parse_command_line_parameters)
+from qiime.assign_taxonomy import naive_bayes_model_exists
+from qiime.parallel.assign_taxonomy import ParallelNaiveBayesTaxonomyAssigner
+
+qiime_config = load_qiime_config()
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info[
+    'brief_description'] = """Parallel taxonomy assignment using QIIME's naive Bayes classifier"""
+script_info[
+    'script_description'] = """This script performs like the assign_taxonomy.py script, but is intended to make use of multicore/multiprocessor environments to perform analyses in parallel. The classifier is trained once, before the jobs are started, and all of the jobs load the trained classifier."""
+script_info['script_usage'] = []
+script_info['script_usage'].append(
+    ("""Example""",
+     """Assign taxonomy to all sequences in the input file (-i) using the naive Bayes classifier and write the results (-o) to $PWD/naive_bayes_assigned_taxonomy/. ALWAYS SPECIFY ABSOLUTE FILE PATHS (absolute path represented here as $PWD, but will generally look something like /home/ubuntu/my_analysis/).""",
+     """%prog -i $PWD/inseqs.fasta -o $PWD/naive_bayes_assigned_taxonomy/"""))
+script_info['script_usage'].append(
+    ("""Reusing a trained classifier""",
+     """Train the classifier into $PWD/nb_model/ if it isn't there yet, and use it for the assignment. Later runs with the same --naive_bayes_model_dir don't retrain the classifier.""",
+     """%prog -i $PWD/inseqs.fasta -o $PWD/naive_bayes_assigned_taxonomy/ --naive_bayes_model_dir $PWD/nb_model/"""))
+script_info[
+    'output_description'] = """Mapping of sequence identifiers to taxonomy and confidence."""
+script_info['required_options'] = [
+    make_option('-i', '--input_fasta_fp', action='store',
+                type='existing_filepath',
+                help='full path to fasta file containing query sequences [REQUIRED]'),
+    make_option('-o', '--output_dir', action='store',
+                type='new_dirpath', help='path to store output files [REQUIRED]'),
+]
+
+default_reference_seqs_fp = qiime_config['assign_taxonomy_reference_seqs_fp']
+default_id_to_taxonomy_fp = qiime_config['assign_taxonomy_id_to_taxonomy_fp']
+
+script_info['optional_options'] = [
+    make_option('-t', '--id_to_taxonomy_fp', action='store',
+                type='existing_filepath', help='full path to '
+                'id_to_taxonomy mapping file [default: %default]',
+                default=default_id_to_taxonomy_fp),
+    make_option('-r', '--reference_seqs_fp', action='store',
+                help='Ref seqs to train the classifier with. [default: %default]',
+                default=default_reference_seqs_fp, type='existing_filepath'),
+    make_option('-c', '--confidence', action='store',
+                type='float', help='Minimum confidence to'
+                ' record an assignment [default: %default]', default=0.80),
+    make_option('--naive_bayes_model_dir', type='new_dirpath',
+                help='Directory of the trained classifier. If it doesn\'t '
+                'hold a trained classifier yet, the classifier is trained '
+                'from -r and -t and saved there, otherwise -r and -t are '
+                'ignored [default: %default; the classifier is trained for '
+                'this run only]'),
+    make_option('--naive_bayes_word_size', type='int',
+                help='Length of the words used by the classifier '
+                '[default: %default]', default=8),
+    make_option('--naive_bayes_num_bootstraps', type='int',
+                help='Number of bootstraps used to compute the confidence of '
+                'each assignment [default: %default]', default=100),
+    options_lookup['jobs_to_start'],
+    options_lookup['retain_temp_files'],
+    options_lookup['suppress_submit_jobs'],
+    options_lookup['poll_directly'],
+    options_lookup['cluster_jobs_fp'],
+    options_lookup['suppress_polling'],
+    options_lookup['job_prefix'],
+    options_lookup['seconds_to_sleep']
+]
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    if not (opts.naive_bayes_model_dir and
+            naive_bayes_model_exists(opts.naive_bayes_model_dir)):
+        if None in [opts.id_to_taxonomy_fp, opts.reference_seqs_fp]:
+            option_parser.error(
+                'Both a filepath for reference sequences (via -r) and an '
+                'id_to_taxonomy file (via -t) are required, unless a trained '
+                'classifier is passed via --naive_bayes_model_dir.')
+
+    # create dict of command-line options
+    params = eval(str(opts))
+
+    parallel_runner = ParallelNaiveBayesTaxonomyAssigner(
+        cluster_jobs_fp=opts.cluster_jobs_fp,
+        jobs_to_start=opts.jobs_to_start,
+        retain_temp_files=opts.retain_temp_files,
+        suppress_polling=opts.suppress_polling,
+        seconds_to_sleep=opts.seconds_to_sleep)
+
+    parallel_runner(opts.input_fasta_fp,
+                    opts.output_dir,
+                    params,
+                    job_prefix=opts.job_prefix,
+                    poll_directly=opts.poll_directly,
+                    suppress_submit_jobs=opts.suppress_submit_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,7 +11,8 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from qiime.util import make_option
-from qiime.parallel.poller import poller, get_function_handle
+from qiime.parallel.poller import (poller, get_function_handle,
+                                   JOB_HEARTBEAT_TIMEOUT)
 from qiime.util import parse_command_line_parameters
 
 script_info = {}
@@ -53,19 +54,45 @@ script_info['optional_options'] = [
                 ' [default: %default]'),
     make_option('-t', '--time_to_sleep', type='int',
                 help='time to wait between calls to status_callback_f'
-                ' (in seconds) [default: %default]', default=3)
+                ' (in seconds) [default: %default]', default=3),
+    make_option('-s', '--status_dir',
+                help='directory where jobs write their status records (see '
+                'run_parallel_job.py). If provided, the poller exits with an '
+                'error as soon as a job fails [default: %default]'),
+    make_option('-n', '--num_jobs', type='int',
+                help='number of jobs writing status records to the status '
+                'dir. Required if -s is passed [default: %default]'),
+    make_option('-w', '--timing_summary_fp',
+                help='path where a summary of the wall time and peak memory '
+                'use of each job is written, slowest jobs first. Only '
+                'written if -s is passed [default: %default]'),
+    make_option('-b', '--heartbeat_timeout', type='int',
+                help='number of seconds after which a running job which has '
+                'stopped updating its heartbeat file (e.g., because it was '
+                'killed by the queueing system) is considered to have '
+                'failed. Only used if -s is passed [default: %default]',
+                default=JOB_HEARTBEAT_TIMEOUT)
 ]
 
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    if opts.status_dir is not None and opts.num_jobs is None:
+        option_parser.error('-n/--num_jobs is required when passing '
+                            '-s/--status_dir.')
+
     poller(get_function_handle(opts.check_run_complete_f),
            get_function_handle(opts.process_run_results_f),
            get_function_handle(opts.clean_up_f),
            list(open(opts.check_run_complete_file)),
            list(open(opts.process_run_results_file)),
            list(open(opts.clean_up_file)),
-           seconds_to_sleep=opts.time_to_sleep)
+           seconds_to_sleep=opts.time_to_sleep,
+           status_dir=opts.status_dir,
+           num_jobs=opts.num_jobs,
+           timing_summary_fp=opts.timing_summary_fp,
+           heartbeat_timeout=opts.heartbeat_timeout)
 
 
 if __name__ == "__main__":
@@ -16,7 +16,7 @@ from os import makedirs, listdir
 
 from qiime.util import (parse_command_line_parameters, get_options_lookup,
                         make_option)
-from qiime.principal_coordinates import pcoa
+from qiime.principal_coordinates import pcoa_fp
 
 options_lookup = get_options_lookup()
 
@@ -56,7 +56,8 @@ script_info['output_description'] = ("The resulting output file consists of "
                                      "(http://scikit-bio.org/)")
 script_info['required_options'] = [
     make_option('-i', '--input_path', type='existing_path',
-                help='path to the input distance matrix file(s) (i.e., the '
+                help='path to the input distance matrix file(s) (i.e., the text or '
+                     'binary '
                      'output from beta_diversity.py). Is a directory for '
                      'batch processing and a filename for a single file '
                      'operation.'),
@@ -90,8 +91,7 @@ def main():
             infile = join(input_path, fname)
 
             # Run PCoA on the input distance matrix
-            with open(infile, 'U') as lines:
-                pcoa_scores = pcoa(lines)
+            pcoa_scores = pcoa_fp(infile)
 
             # Store the PCoA results on the output directory
             base_fname, ext = splitext(fname)
@@ -101,8 +101,7 @@ def main():
 
     else:
         # Run PCoA on the input distance matrix
-        with open(input_path, 'U') as f:
-            pcoa_scores = pcoa(f)
+        pcoa_scores = pcoa_fp(input_path)
         # Store the results in the output file
         with open(output_path, 'w') as f:
             pcoa_scores.to_file(f)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from functools import partial
+
+from skbio.math.subsample import subsample
+
+from qiime.util import parse_command_line_parameters, create_dir
+from qiime.util import make_option
+from qiime.alpha_diversity import rarefaction_alpha, list_known_metrics
+
+script_info = {}
+script_info['brief_description'] = """Rarefy an otu table and collate the\
+ alpha diversity of the rarefied tables in one step"""
+script_info['script_description'] = """This script produces the same output as\
+ running multiple_rarefactions.py, alpha_diversity.py and collate_alpha.py in\
+ turn, without writing the rarefied OTU tables or the per-table alpha\
+ diversity files. Each rarefied OTU table is made in memory and all of the\
+ alpha diversity metrics are calculated on it straight away, so large tables\
+ don't need the scratch space or the time to write and re-read those files.\
+ Within each iteration, the rarefied tables at the smaller depths are\
+ subsamples of the tables at the larger depths.
+
+The options of multiple_rarefactions.py and alpha_diversity.py are accepted\
+ under the same long names, so a workflow parameters file applies to both\
+ ways of running the analysis."""
+script_info['script_usage'] = []
+
+script_info['script_usage'].append(
+    ("""Rarefied alpha diversity:""",
+     """Calculate chao1, observed species and PD at 10 (-m) to 140 (-x)\
+ sequences per sample in steps of 10 (-s), with 2 iterations at each depth\
+ (-n), and write one collated file per metric to collated_alpha/:""",
+     """%prog -i otu_table.biom -m 10 -x 140 -s 10 -n 2\
+ --metrics chao1,observed_species,PD_whole_tree -t rep_set.tre\
+ -o collated_alpha/"""))
+
+script_info['output_description'] = """The output directory contains one file\
+ for each metric, as written by collate_alpha.py, which can be passed to\
+ make_rarefaction_plots.py."""
+
+script_info['required_options'] = [
+    make_option('-i', '--input_path',
+                help='Input OTU table filepath.',
+                type='existing_filepath'),
+    make_option('-o', '--output_path',
+                help="Output directory.",
+                type='new_dirpath'),
+    make_option('-m', '--min', type='int',
+                help='Minimum number of seqs/sample for rarefaction.'),
+    make_option('-x', '--max', type='int',
+                help='Maximum number of seqs/sample (inclusive) for rarefaction. '),
+    make_option('-s', '--step', type='int',
+                help='Size of each steps between the min/max of' +
+                ' seqs/sample (e.g. min, min+step... for level <= max).')
+]
+script_info['optional_options'] = [
+    make_option('-n', '--num-reps', dest='num_reps', default=10, type='int',
+                help='The number of iterations at each step. [default: %default]'),
+    make_option('--metrics', type='multiple_choice',
+                mchoices=list_known_metrics(),
+                default='PD_whole_tree,chao1,observed_species',
+                help='Alpha-diversity metric(s) to use. A comma-separated list should' +
+                ' be provided when multiple metrics are specified. [default: %default]'),
+    make_option('-t', '--tree_path', default=None,
+                help='Input newick tree filepath.' +
+                ' [default: %default; REQUIRED for phylogenetic metrics]',
+                type='existing_filepath'),
+    make_option('--lineages_included', default=False,
+                action="store_true",
+                help='Accepted for compatibility with multiple_rarefactions.py;' +
+                ' lineages do not affect alpha diversity. [default: %default]'),
+    make_option('-k', '--keep_empty_otus', default=False, action='store_true',
+                help='Retain OTUs of all zeros, which are usually omitted from' +
+                ' the rarefied OTU tables. [default: %default]'),
+    make_option('--subsample_multinomial', default=False, action='store_true',
+                help='subsample using subsampling with replacement [default: %default]')
+]
+
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    if opts.step <= 0:
+        option_parser.error("nonpositive step not allowed (%s was supplied)" %
+                            (opts.step,))
+    create_dir(opts.output_path, fail_on_exist=False)
+
+    if opts.subsample_multinomial:
+        subsample_f = partial(subsample, replace=True)
+    else:
+        subsample_f = subsample
+
+    try:
+        rarefaction_alpha(opts.input_path,
+                          range(opts.min, opts.max + 1, opts.step),
+                          opts.num_reps,
+                          opts.metrics,
+                          opts.output_path,
+                          tree=opts.tree_path,
+                          empty_otus_removed=(not opts.keep_empty_otus),
+                          subsample_f=subsample_f)
+    except ValueError as e:
+        option_parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
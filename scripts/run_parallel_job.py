@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from sys import exit
+from qiime.util import make_option
+from qiime.util import parse_command_line_parameters
+from qiime.parallel.poller import run_job_with_status
+
+script_info = {}
+script_info['brief_description'] = """Runs one job of a parallel QIIME script and records its status."""
+script_info['script_description'] = """This script runs a shell script containing the commands of one job of a parallel QIIME script, and then writes a status record containing the job's exit status, wall time and peak memory use. While the job runs, a heartbeat file next to the status record is rewritten every minute, so that poller.py can tell that a job was killed (e.g., by the queueing system) before it could write its status record. poller.py watches for these records (when passed -s) so that it can stop as soon as any job fails, and summarize the run time of each job. Parallel QIIME scripts use this script to run each job; it is not generally necessary to call it directly."""
+script_info['script_usage'] = [(
+    "Example",
+    "Run the commands in job.sh, writing the status record of the job to job.status.",
+    "%prog -i job.sh -s job.status")]
+script_info['output_description'] = """The status record is a single tab-separated line containing the exit status of the job, its wall time (in seconds), the peak resident set size of its largest process (in kilobytes), and the path to the job script. This script exits with the exit status of the job."""
+script_info['required_options'] = [
+    make_option('-i', '--job_fp', type='existing_filepath',
+                help='the shell script to run'),
+    make_option('-s', '--status_fp', type='new_filepath',
+                help='the path where the status record should be written')
+]
+script_info['optional_options'] = []
+script_info['version'] = __version__
+
+
+def main():
+    option_parser, opts, args =\
+        parse_command_line_parameters(**script_info)
+
+    exit(run_job_with_status(opts.job_fp, opts.status_fp))
+
+
+if __name__ == "__main__":
+    main()
@@ -18,7 +18,8 @@ from skbio.core.sequence import DNA
 from qiime.util import parse_command_line_parameters, make_option, gzip_open
 from qiime.parse import parse_mapping_file
 from qiime.split_libraries_fastq import (process_fastq_single_end_read_file,
-                                         BARCODE_DECODER_LOOKUP, process_fastq_single_end_read_file_no_barcode)
+                                         BARCODE_DECODER_LOOKUP, process_fastq_single_end_read_file_no_barcode,
+                                         process_fastq_single_end_read_file_sharded)
 from qiime.split_libraries import check_map
 from qiime.split_libraries_fastq import get_illumina_qual_chars
 from qiime.golay import get_invalid_golay_barcodes
@@ -69,6 +70,12 @@ script_info['script_usage'].append(("Quality filter (at Phred >= Q20) two "
                                     "--sample_id my.sample.1,my.sample.2 -o slout_not_multiplexed_q20/ "
                                     "-q 19 --barcode_type 'not-barcoded'"))
 
+script_info['script_usage'].append(("Demultiplex and quality filter "
+                                    "(at Phred >= Q20) one lane of Illumina fastq data using eight "
+                                    "processes and write results to ./slout_q20.", "", "%prog -i "
+                                    "lane1_read1.fastq -b lane1_barcode.fastq --rev_comp_mapping_barcodes "
+                                    "-o slout_q20/ -m map.txt -q 19 -O 8"))
+
 script_info['output_description'] = ""
 script_info['required_options'] = [
     make_option('-i', '--sequence_read_fps', type="existing_filepaths",
@@ -137,7 +144,14 @@ script_info['optional_options'] = [
     make_option('--phred_offset', default=None, type="choice",
                 choices=phred_to_ascii_fs.keys(), help="the ascii offset to use when "
                 "decoding phred scores - warning: in most cases you don't need to "
-                "pass this value [default: determined automatically]")
+                "pass this value [default: determined automatically]"),
+    make_option('-O', '--jobs_to_start', type='int', default=1,
+                help='number of processes to use when demultiplexing. The '
+                'input is split into this many chunks which are processed '
+                'independently and merged in their original order, so the '
+                'output is identical to a single process run. Only applies '
+                'to uncompressed, barcoded input; other input is processed '
+                'by a single process [default: %default]'),
     # NEED TO FIX THIS FUNCTIONALITY - CURRENTLY READING THE WRONG FIELD
     # make_option('--filter_bad_illumina_qual_digit',
     #    action='store_true',
@@ -174,6 +188,7 @@ def main():
     store_demultiplexed_fastq = opts.store_demultiplexed_fastq
     barcode_type = opts.barcode_type
     max_barcode_errors = opts.max_barcode_errors
+    jobs_to_start = opts.jobs_to_start
 
     # if this is not a demultiplexed run,
     if barcode_type == 'not-barcoded':
@@ -216,6 +231,10 @@ def main():
                             '0 and 1 (inclusive). You passed %1.5f' %
                             min_per_read_length_fraction)
 
+    if jobs_to_start < 1:
+        option_parser.error('--jobs_to_start must be 1 or greater. You '
+                            'passed %d' % jobs_to_start)
+
     barcode_correction_fn = BARCODE_DECODER_LOOKUP.get(barcode_type, None)
 
     if len(mapping_fps) == 1 and len(sequence_read_fps) > 1:
@@ -320,6 +339,25 @@ def main():
             else:
                 barcode_read_f = open(barcode_read_fp, 'U')
 
+        if (barcode_read_fp is not None and jobs_to_start > 1 and
+                not sequence_read_fp.endswith('.gz') and
+                not barcode_read_fp.endswith('.gz')):
+            sequence_read_f.close()
+            barcode_read_f.close()
+            seq_generator = process_fastq_single_end_read_file_sharded(
+                sequence_read_fp, barcode_read_fp, barcode_to_sample_id,
+                jobs=jobs_to_start,
+                store_unassigned=retain_unassigned_reads,
+                max_bad_run_length=max_bad_run_length,
+                phred_quality_threshold=phred_quality_threshold,
+                min_per_read_length_fraction=min_per_read_length_fraction,
+                rev_comp=rev_comp, rev_comp_barcode=rev_comp_barcode,
+                seq_max_N=seq_max_N, start_seq_id=start_seq_id,
+                filter_bad_illumina_qual_digit=filter_bad_illumina_qual_digit,
+                log_f=log_f, histogram_f=histogram_f,
+                barcode_correction_fn=barcode_correction_fn,
+                max_barcode_errors=max_barcode_errors)
+        elif barcode_read_fp is not None:
             seq_generator = process_fastq_single_end_read_file(
                 sequence_read_f, barcode_read_f, barcode_to_sample_id,
                 store_unassigned=retain_unassigned_reads,
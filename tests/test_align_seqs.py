@@ -12,7 +12,9 @@ __email__ = "gregcaporaso@gmail.com"
 
 from os import remove, close
 from os.path import getsize
-from tempfile import mkstemp
+from glob import glob
+from shutil import rmtree
+from tempfile import mkstemp, mkdtemp
 from unittest import TestCase, main
 
 from numpy.testing import assert_almost_equal
@@ -21,9 +23,11 @@ from skbio.core.alignment import SequenceCollection, Alignment
 from skbio.core.sequence import DNA
 from skbio.parse.sequences import parse_fasta
 
+from qiime.util import get_qiime_temp_dir
 from qiime.align_seqs import (compute_min_alignment_length,
                               Aligner, CogentAligner, PyNastAligner,
-                              InfernalAligner, alignment_module_names)
+                              InfernalAligner, alignment_module_names,
+                              load_pynast_template)
 
 def remove_files(list_of_filepaths, error_on_missing=True):
     missing = []
@@ -303,6 +307,55 @@ class PyNastAlignerTests(SharedSetupTestCase):
                 parse_fasta(failure_f), DNA)
         self.assertEqual(actual_fail.sequence_count(), 3)
 
+    def test_load_pynast_template(self):
+        """load_pynast_template: parses the template, caching it if set
+        """
+        expected = Alignment.from_fasta_records(
+            parse_fasta(pynast_test1_template_fasta.split('\n')), DNA)
+        qiime_config = {'reference_db_cache_dir': None,
+                        'reference_db_cache_max_size': None}
+        self.assertEqual(
+            load_pynast_template(self.pynast_test1_template_fp,
+                                 qiime_config), expected)
+        self.assertEqual(
+            load_pynast_template(self.pynast_test_template_w_dots_fp,
+                                 qiime_config), expected)
+
+        cache_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                            prefix='PyNastAlignerTests_')
+        try:
+            qiime_config['reference_db_cache_dir'] = cache_dir
+            for i in range(2):
+                self.assertEqual(
+                    load_pynast_template(self.pynast_test_template_w_lower_fp,
+                                         qiime_config), expected)
+                self.assertEqual(
+                    len(glob('%s/*_pynast_template/template.pkl' %
+                             cache_dir)), 1)
+
+            # invalid templates raise errors and aren't cached
+            self.assertRaises(SequenceCollectionError, load_pynast_template,
+                              self.pynast_test_template_w_u_fp, qiime_config)
+            self.assertEqual(
+                len(glob('%s/*_pynast_template/template.pkl' % cache_dir)),
+                1)
+        finally:
+            rmtree(cache_dir)
+
+    def test_call_pynast_test1_file_output_no_failure_path(self):
+        """PyNastAligner writes aligned seqs without a failure path
+        """
+        actual = self.pynast_test1_aligner(
+            self.pynast_test1_input_fp, result_path=self.result_fp,
+            log_path=self.log_fp)
+        self.assertTrue(actual is None)
+
+        with open(self.result_fp) as result_f:
+            actual_aln = Alignment.from_fasta_records(parse_fasta(
+                    result_f), DNA)
+        self.assertEqual(actual_aln, self.pynast_test1_expected_aln)
+        self.assertEqual(getsize(self.failure_fp), 0)
+
     def test_call_pynast_test1(self):
         """PyNastAligner: functions as expected when returing objects
         """
@@ -13,9 +13,9 @@ __email__ = "justinak@gmail.com"
 from numpy import array
 import numpy
 from shutil import rmtree
-from os import makedirs, close
-from os.path import exists
-from tempfile import mkstemp
+from os import makedirs, close, listdir
+from os.path import exists, join
+from tempfile import mkstemp, mkdtemp
 from unittest import TestCase, main
 from numpy.testing import assert_almost_equal
 
@@ -25,10 +25,15 @@ from qiime.pycogent_backports.alpha_diversity import (observed_species, osd)
 from skbio.util.misc import remove_files
 from qiime.util import load_qiime_config
 from qiime.alpha_diversity import (AlphaDiversityCalc, AlphaDiversityCalcs,
-                                   single_file_cup)
+                                   single_file_cup, multiple_file_alpha,
+                                   rarefaction_alpha, get_sample_counts,
+                                   matrix_metrics)
+from qiime.rarefaction import RarefactionMaker
+from qiime.collate_alpha import make_output_row, write_output_file
 import qiime.alpha_diversity
-from qiime.parse import parse_newick
+from qiime.parse import parse_newick, parse_matrix
 from qiime.format import format_biom_table
+from qiime.unifrac import FlatTree, write_flat_tree
 from biom.table import table_factory, DenseOTUTable
 
 
@@ -163,6 +168,32 @@ class AlphaDiversityCalcTests(AlphaDiversitySharedSetUpTests):
         assert_almost_equal(escaped_result, expected)
         assert_almost_equal(non_escaped_result, escaped_result)
 
+    def test_call_phylogenetic_tree_files(self):
+        """AlphaDiversityCalc should read newick and flattened tree files"""
+        fd, tree_fp = mkstemp(dir=self.tmp_dir, prefix='alpha_diversity_tests',
+                              suffix='.tre')
+        close(fd)
+        fd, flat_tree_fp = mkstemp(dir=self.tmp_dir,
+                                   prefix='alpha_diversity_tests',
+                                   suffix='.npz')
+        close(fd)
+        self.files_to_remove.extend([tree_fp, flat_tree_fp])
+        open(tree_fp, 'w').write(self.tree1.getNewick(with_distances=True))
+        write_flat_tree(FlatTree(self.tree1), flat_tree_fp)
+
+        c = AlphaDiversityCalc(metric=PD_whole_tree, is_phylogenetic=True)
+        for tree_path in tree_fp, flat_tree_fp:
+            assert_almost_equal(c(data_path=self.otu_table1_fp,
+                                  tree_path=tree_path,
+                                  taxon_names=self.otu_table1.ObservationIds,
+                                  sample_names=self.otu_table1.SampleIds),
+                                [13, 17, 0])
+        # results are in the order of sample_names
+        assert_almost_equal(c(data_path=self.otu_table1_fp,
+                              tree_path=self.tree1,
+                              sample_names=['Z', 'Y', 'X', 'W']),
+                            [0, 17, 13, 0])
+
 
 class AlphaDiversityCalcsTests(AlphaDiversitySharedSetUpTests):
 
@@ -185,6 +216,135 @@ class AlphaDiversityCalcsTests(AlphaDiversitySharedSetUpTests):
         self.assertEqual(len(results[2]), 5)
 
 
+class MatrixMetricsTests(AlphaDiversitySharedSetUpTests):
+
+    """Tests of the matrix forms of the alpha diversity metrics"""
+
+    def setUp(self):
+        super(MatrixMetricsTests, self).setUp()
+        self.otu_table3 = table_factory(
+            data=array([[1, 2, 0, 4, 12, 1, 3, 0, 7, 25, 2, 1],
+                        [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0],
+                        [5, 2, 2, 11, 0, 3, 3, 6, 1, 1, 2, 40],
+                        [0, 0, 15, 0, 0, 0, 30, 0, 0, 0, 0, 0],
+                        [1, 1, 0, 0, 3, 0, 0, 2, 0, 0, 0, 0]]).T,
+            sample_ids=list('VWXYZ'),
+            observation_ids=list('abcdefghijkl'),
+            constructor=DenseOTUTable)
+
+    def test_get_sample_counts(self):
+        """get_sample_counts should return the nonzero counts of samples"""
+        counts = get_sample_counts(self.otu_table1)
+        self.assertEqual(counts.shape, (3, 4))
+        assert_almost_equal(counts.toarray(), array([[2, 0, 0, 1],
+                                                     [1, 1, 1, 1],
+                                                     [0, 0, 0, 0]]))
+        assert_almost_equal(counts.indptr, [0, 2, 6, 6])
+
+    def test_matrix_metrics(self):
+        """matrix metrics should match the metrics applied to each sample"""
+        for metric in matrix_metrics:
+            c = AlphaDiversityCalc(metric)
+            try:
+                expected = array([metric(v)
+                                  for v in self.otu_table3.iterSampleData()])
+            except FloatingPointError:
+                # otu_table3 has an empty sample, which some metrics can't
+                # handle under numpy's error settings
+                self.assertRaises(FloatingPointError, c,
+                                  data_path=self.otu_table3)
+                continue
+            assert_almost_equal(c(data_path=self.otu_table3), expected)
+
+    def test_matrix_metrics_empty_sample_divide_raise(self):
+        """matrix metrics should return nan for empty samples as before"""
+        old_settings = numpy.seterr(divide='raise')
+        try:
+            for metric in (qiime.alpha_diversity.alph.enspie,
+                           qiime.alpha_diversity.alph.simpson_e,
+                           qiime.alpha_diversity.alph.simpson_reciprocal):
+                expected = array([metric(v) for v in
+                                  self.otu_table3.iterSampleData()])
+                self.assertTrue(numpy.isnan(expected[1]))
+                c = AlphaDiversityCalc(metric)
+                assert_almost_equal(c(data_path=self.otu_table3), expected)
+        finally:
+            numpy.seterr(**old_settings)
+
+    def test_matrix_metrics_params(self):
+        """matrix metrics should be passed the calc's params"""
+        c = AlphaDiversityCalc(qiime.alpha_diversity.alph.chao1,
+                               params={'bias_corrected': False})
+        expected = [qiime.alpha_diversity.alph.chao1(v, bias_corrected=False)
+                    for v in self.otu_table3.iterSampleData()]
+        assert_almost_equal(c(data_path=self.otu_table3), expected)
+
+    def test_matrix_ACE_singletons(self):
+        """matrix ACE should raise ValueError if rare species are singles"""
+        c = AlphaDiversityCalc(qiime.alpha_diversity.alph.ACE)
+        self.assertRaises(ValueError, c, data_path=self.otu_table1)
+
+
+class RarefactionAlphaTests(AlphaDiversitySharedSetUpTests):
+
+    """Tests of rarefaction_alpha"""
+
+    def collate_alpha(self, input_dir, output_dir):
+        """ collates alpha diversity files as collate_alpha.py does """
+        file_names = sorted(listdir(input_dir))
+        example_fname = min(file_names, key=lambda f: int(f.split('_')[2]))
+        all_metrics, all_samples, example_data = parse_matrix(
+            open(join(input_dir, example_fname), 'U'))
+        for metric in all_metrics:
+            metric_file_data = []
+            for fname in file_names:
+                f_metrics, f_samples, f_data = parse_matrix(
+                    open(join(input_dir, fname), 'U'))
+                metric_file_data.append(
+                    make_output_row(f_metrics, metric, f_samples, f_data,
+                                    fname, len(all_samples), all_samples))
+            write_output_file(metric_file_data, output_dir, metric,
+                              all_samples)
+
+    def test_rarefaction_alpha(self):
+        """ rarefaction_alpha should match the separate steps' output """
+        fd, tree_fp = mkstemp(dir=self.tmp_dir, prefix='alpha_diversity_tests',
+                              suffix='.tre')
+        close(fd)
+        open(tree_fp, 'w').write(self.tree1.getNewick(with_distances=True))
+        self.files_to_remove.append(tree_fp)
+        out_dir = mkdtemp(dir=self.tmp_dir, prefix='alpha_diversity_tests')
+        self.dirs_to_remove.append(out_dir)
+        fused_dir, rare_dir, alpha_dir, collated_dir = \
+            [join(out_dir, d) for d in
+             ('fused', 'rarefaction', 'alpha_div', 'alpha_div_collated')]
+        for d in fused_dir, rare_dir, collated_dir:
+            makedirs(d)
+        metrics = 'observed_species,PD_whole_tree,osd,shannon'
+
+        numpy.random.seed(0)
+        rarefaction_alpha(self.otu_table1_fp, [1, 2, 3], 2, metrics,
+                          fused_dir, tree=tree_fp)
+
+        numpy.random.seed(0)
+        maker = RarefactionMaker(self.otu_table1_fp, 1, 3, 1, 2)
+        maker.rarefy_to_files(rare_dir, empty_otus_removed=True)
+        multiple_file_alpha(rare_dir, alpha_dir, metrics, tree_fp)
+        self.collate_alpha(alpha_dir, collated_dir)
+
+        self.assertEqual(sorted(listdir(fused_dir)),
+                         sorted(listdir(collated_dir)))
+        self.assertEqual(len(listdir(fused_dir)), 6)
+        for fname in listdir(collated_dir):
+            self.assertEqual(open(join(fused_dir, fname)).read(),
+                             open(join(collated_dir, fname)).read())
+
+    def test_rarefaction_alpha_unknown_metric(self):
+        """ rarefaction_alpha should raise ValueError on unknown metrics """
+        self.assertRaises(ValueError, rarefaction_alpha, self.otu_table1,
+                          [1], 1, 'observed_species,xyz', self.tmp_dir)
+
+
 class SingleFileCUPTests(TestCase):
     def setUp(self):
         self.files_to_remove = []
@@ -15,12 +15,14 @@ __email__ = "gregcaporaso@gmail.com"
 
 from cStringIO import StringIO
 from os import remove, system, path, getenv, close
-from os.path import exists
+from os.path import exists, join
 from glob import glob
 from tempfile import NamedTemporaryFile, mkdtemp, mkstemp
 from shutil import copy as copy_file, rmtree
 
 from unittest import TestCase, main
+from numpy import exp
+from numpy.random import seed
 from numpy.testing import assert_almost_equal, assert_allclose
 from skbio.app.util import ApplicationError
 from skbio.util.misc import remove_files, create_dir
@@ -37,7 +39,9 @@ from qiime.test import initiate_timeout, disable_timeout
 from qiime.assign_taxonomy import (
     TaxonAssigner, BlastTaxonAssigner, RdpTaxonAssigner, RtaxTaxonAssigner,
     RdpTrainingSet, RdpTree, _QIIME_RDP_TAXON_TAG, validate_rdp_version,
-    MothurTaxonAssigner, UclustConsensusTaxonAssigner)
+    MothurTaxonAssigner, UclustConsensusTaxonAssigner,
+    NaiveBayesTaxonAssigner, train_naive_bayes_model, load_naive_bayes_model,
+    _get_words)
 from sys import stderr
 
 
@@ -342,6 +346,39 @@ class UclustConsensusTaxonAssignerTests(TestCase):
         actual = t._uc_to_assignment(self.uc1_lines)
         self.assertEqual(actual, expected)
 
+    def test_iter_uc_assignments(self):
+        """_iter_uc_assignments yields each query's consensus in file order"""
+        expected = [('q3', (['Unassigned'], 1.0, 1)),
+                    ('q4', (['Unassigned'], 1.0, 1)),
+                    ('q5', (['Unassigned'], 1.0, 1)),
+                    ('q2', (['A', 'H', 'I', 'J'], 2. / 3., 3)),
+                    ('q1', (['A', 'B', 'C'], 1.0, 2))]
+        params = {'id_to_taxonomy_fp': self.id_to_tax1_fp,
+                  'reference_sequences_fp': self.refseqs1_fp}
+        t = UclustConsensusTaxonAssigner(params)
+        actual = list(t._iter_uc_assignments(self.uc1_lines))
+        self.assertEqual(actual, expected)
+
+        # the result is the same as computing the consensus from the
+        # split taxonomy strings
+        params['min_consensus_fraction'] = 0.7
+        t = UclustConsensusTaxonAssigner(params)
+        for query_id, assignments in \
+                t._uc_to_assignments(self.uc1_lines).items():
+            self.assertEqual(dict(t._iter_uc_assignments(self.uc1_lines))[
+                query_id], t._get_consensus_assignment(assignments))
+
+    def test_get_lineage_ids(self):
+        """_get_lineage_ids interns lineages as taxon ids"""
+        params = {'id_to_taxonomy_fp': self.id_to_tax1_fp,
+                  'reference_sequences_fp': self.refseqs1_fp}
+        t = UclustConsensusTaxonAssigner(params)
+        self.assertEqual(t._get_lineage_ids('r2'), (0, 1, 2, 3))
+        self.assertEqual(t._get_lineage_ids('r4'), (0, 1, 2, 4))
+        self.assertEqual(t._get_lineage_ids('r1'), (0, 5, 6))
+        self.assertTrue(t._get_lineage_ids('r2') is t._get_lineage_ids('r2'))
+        self.assertEqual(t._taxon_names, ['A', 'B', 'C', 'D', 'E', 'F', 'G'])
+
 
 uc1 = """# uclust --input /Users/caporaso/Dropbox/code/short-read-tax-assignment/data/qiime-mock-community/Broad-1/rep_set.fna --lib /Users/caporaso/data/gg_13_5_otus/rep_set/97_otus.fasta --uc /Users/caporaso/outbox/uclust_tax_parameter_sweep/Broad-1/gg_13_5_otus/uclust/id1.000000_ma3.uc --id 1.00 --maxaccepts 3 --libonly --allhits
 # version=1.2.22
@@ -1271,6 +1308,130 @@ class RdpTaxonAssignerTests(TestCase):
         self.assertEqual(obs, exp)
 
 
+class NaiveBayesTaxonAssignerTests(TestCase):
+
+    """Tests for the built-in naive Bayes taxon assigner.
+    """
+
+    def setUp(self):
+        self.test_out = mkdtemp(dir=get_qiime_temp_dir(),
+                                prefix='qiime_naive_bayes_tax_tests',
+                                suffix='')
+        self.ref_fp = join(self.test_out, 'ref.fasta')
+        open(self.ref_fp, 'w').write(test_refseq_coll.to_fasta())
+        self.id_to_tax_fp = join(self.test_out, 'id_to_tax.txt')
+        open(self.id_to_tax_fp, 'w').write(id_to_taxonomy_string)
+        self.seqs_fp = join(self.test_out, 'seqs.fasta')
+        open(self.seqs_fp, 'w').write(test_seq_coll.to_fasta())
+
+        self.params = {'id_to_taxonomy_fp': self.id_to_tax_fp,
+                       'reference_sequences_fp': self.ref_fp}
+        self.expected_lineages = {
+            's1': 'Archaea;Euryarchaeota;Halobacteriales;uncultured',
+            's2': 'Archaea;Euryarchaeota;Methanomicrobiales;'
+                  'Methanomicrobium et rel.',
+            's3': 'Archaea;Crenarchaeota;uncultured;uncultured',
+            's4': 'Archaea;Euryarchaeota;Methanobacteriales;'
+                  'Methanobacterium',
+            's5': 'Archaea;Crenarchaeota;uncultured;uncultured'}
+
+    def tearDown(self):
+        rmtree(self.test_out)
+
+    def test_get_words(self):
+        """_get_words indexes the words of the sequence"""
+        self.assertEqual(list(_get_words('ACGTACGTAC')),
+                         [6939, 27756, 45489])
+        self.assertEqual(list(_get_words('acgtacgtNACGUACGU')), [6939])
+        self.assertEqual(list(_get_words('AAC', 2)), [0, 1])
+        self.assertEqual(list(_get_words('ACGT')), [])
+
+    def test_train_naive_bayes_model(self):
+        """train_naive_bayes_model saves the word probabilities of each taxon
+        """
+        ref_fp = join(self.test_out, 'small_ref.fasta')
+        open(ref_fp, 'w').write('>r1\nAAC\n>r2\nAAA\n>r3\nAANAC\n')
+        id_to_tax_fp = join(self.test_out, 'small_id_to_tax.txt')
+        open(id_to_tax_fp, 'w').write('r1\tA; B\nr2\tA;C\nr3\tA;B\n')
+        model_dir = join(self.test_out, 'model')
+        train_naive_bayes_model(ref_fp, id_to_tax_fp, model_dir, word_size=2)
+        log_word_probs, taxon_ranks, taxa = load_naive_bayes_model(model_dir)
+
+        self.assertEqual(taxa, [['A', 'B'], ['A', 'C']])
+        self.assertEqual(taxon_ranks.tolist(), [[0, 1], [0, 2]])
+        self.assertEqual(log_word_probs.shape, (16, 2))
+        # AA is in all 3 sequences, AC in 2, and the other words in none
+        priors = [3.5 / 4, 2.5 / 4, 0.5 / 4]
+        assert_allclose(exp(log_word_probs[:3, 0]),
+                        [(2 + priors[0]) / 3, (2 + priors[1]) / 3,
+                         priors[2] / 3], rtol=1e-6)
+        assert_allclose(exp(log_word_probs[:3, 1]),
+                        [(1 + priors[0]) / 2, priors[1] / 2,
+                         priors[2] / 2], rtol=1e-6)
+
+    def test_assignment(self):
+        """NaiveBayesTaxonAssigner assigns the taxonomy of the references"""
+        self.params['Confidence'] = 0.0
+        result = NaiveBayesTaxonAssigner(self.params)(self.seqs_fp)
+        self.assertEqual(len(result), 6)
+        for seq_id, lineage in self.expected_lineages.items():
+            self.assertEqual(result[seq_id][0], lineage)
+            self.assertTrue(0.0 <= result[seq_id][1] <= 1.0)
+
+    def test_assignment_unassignable(self):
+        """NaiveBayesTaxonAssigner doesn't assign sequences without words"""
+        seqs_fp = join(self.test_out, 'short.fasta')
+        open(seqs_fp, 'w').write('>short\nACGT\n>Ns\nNNNNNNNNNNNN\n')
+        result = NaiveBayesTaxonAssigner(self.params)(seqs_fp)
+        self.assertEqual(result, {'short': ('Unassigned', 0.0),
+                                  'Ns': ('Unassigned', 0.0)})
+
+    def test_assignment_saved_model(self):
+        """NaiveBayesTaxonAssigner reuses the model in model_dir"""
+        model_dir = join(self.test_out, 'model')
+        self.params['model_dir'] = model_dir
+        seed(0)
+        expected = NaiveBayesTaxonAssigner(self.params)(self.seqs_fp)
+        # the model is loaded, so the reference files aren't needed
+        seed(0)
+        result = NaiveBayesTaxonAssigner({'model_dir': model_dir})(
+            self.seqs_fp)
+        self.assertEqual(result, expected)
+
+        self.assertRaises(ValueError,
+                          NaiveBayesTaxonAssigner({'model_dir': model_dir,
+                                                   'word_size': 6}),
+                          self.seqs_fp)
+
+    def test_assignment_jobs_to_start(self):
+        """NaiveBayesTaxonAssigner results don't depend on jobs_to_start"""
+        model_dir = join(self.test_out, 'model')
+        train_naive_bayes_model(self.ref_fp, self.id_to_tax_fp, model_dir)
+        # one sequence per batch
+        self.params = {'model_dir': model_dir, 'memory': 1}
+        seed(0)
+        expected = NaiveBayesTaxonAssigner(self.params)(self.seqs_fp)
+        self.params['jobs_to_start'] = 2
+        seed(0)
+        result = NaiveBayesTaxonAssigner(self.params)(self.seqs_fp)
+        self.assertEqual(result, expected)
+
+    def test_assignment_result_path(self):
+        """NaiveBayesTaxonAssigner writes results to result_path"""
+        self.params['Confidence'] = 0.0
+        result_path = join(self.test_out, 'result.txt')
+        log_path = join(self.test_out, 'result.log')
+        result = NaiveBayesTaxonAssigner(self.params)(
+            self.seqs_fp, result_path=result_path, log_path=log_path)
+        self.assertEqual(result, None)
+        lines = [l.split('\t') for l in open(result_path, 'U')]
+        self.assertEqual([l[0] for l in lines],
+                         ['s1', 's2', 's3', 's4', 's5', 's6'])
+        for fields in lines[:5]:
+            self.assertEqual(fields[1], self.expected_lineages[fields[0]])
+        self.assertTrue(exists(log_path))
+
+
 class RdpTrainingSetTests(TestCase):
 
     def setUp(self):
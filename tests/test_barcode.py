@@ -11,6 +11,8 @@ __email__ = "justinak@gmail.com"
 
 from unittest import TestCase, main
 
+import numpy
+
 import qiime.barcode as barcode
 
 
@@ -64,5 +66,102 @@ class BarcodeTests(TestCase):
         self.assertEqual(decoded, None)
         self.assertEqual(num_errors, 3)
 
+    def test_BarcodeCorrector(self):
+        """ BarcodeCorrector should match correct_barcode(_bitwise)
+        """
+        numpy.random.seed(0)
+        possibilities = [''.join(numpy.random.choice(list('ACGT'), size=8))
+                         for i in range(50)]
+        # include a tie at distance 0
+        possibilities.append(possibilities[0])
+        queries = possibilities[:]
+        for i in range(500):
+            query = list(possibilities[i % len(possibilities)])
+            for j in range(i % 5):
+                query[numpy.random.randint(8)] = \
+                    numpy.random.choice(list('ACGTN'))
+            queries.append(''.join(query))
+
+        nt_to_bits = {"A": "11", "C": "00", "T": "10", "G": "01"}
+        for max_dist in [0, 1, 2]:
+            corrector = barcode.BarcodeCorrector(possibilities, max_dist)
+            bitwise_corrector = barcode.BarcodeCorrector(
+                possibilities, max_dist, nt_to_bits)
+            for query in queries:
+                self.assertEqual(corrector(query),
+                                 barcode.correct_barcode(query, possibilities))
+                if 'N' not in query:
+                    self.assertEqual(
+                        bitwise_corrector(query),
+                        barcode.correct_barcode_bitwise(query, possibilities,
+                                                        nt_to_bits))
+
+    def test_BarcodeCorrector_tie(self):
+        """ BarcodeCorrector should not assign barcode to a tie situation
+        """
+        recieved = 'ATTTTTTTTTTT'
+        possibilities = ['TGTATTCGTGTA', 'ATTTTTTTTTCG', 'TGTAGGCGTGTA',
+                         'TGTAGAAGTGTA', 'TGTAGGCGTATA', 'TGTAAAAAAAAA',
+                         'ATTTTTTTTAAA']
+        nt_to_bits = {"A": "11", "C": "00", "T": "10", "G": "01"}
+        corrector = barcode.BarcodeCorrector(possibilities,
+                                             nt_to_bits=nt_to_bits)
+        self.assertEqual(corrector(recieved), (None, 3))
+        corrector = barcode.BarcodeCorrector(possibilities)
+        self.assertEqual(corrector(recieved), ('ATTTTTTTTTCG', 2))
+        self.assertEqual(corrector('GGGGGGGGGGGG'), ('TGTAGGCGTGTA', 7))
+
+    def test_BarcodeCorrector_variable_length(self):
+        """ BarcodeCorrector should handle variable length barcodes
+        """
+        possibilities = ['AAAACCCCGGGG', 'TTTTCCCC', 'AAAACCCCGGTT']
+        corrector = barcode.BarcodeCorrector(possibilities)
+        self.assertEqual(corrector('TTTTCCCG'),
+                         barcode.correct_barcode('TTTTCCCG', possibilities))
+
+    def test_BarcodeCorrector_prefix_index(self):
+        """ BarcodeCorrector should index each query length separately
+        """
+        numpy.random.seed(0)
+        possibilities = [''.join(numpy.random.choice(list('ACGT'), size=size))
+                         for size in [10, 10, 11, 12, 12] * 10]
+        # share a prefix to tie on shorter queries
+        possibilities.append(possibilities[0][:10] + 'AC')
+        corrector = barcode.BarcodeCorrector(possibilities)
+        queries = []
+        for i in range(300):
+            query = list(possibilities[i % len(possibilities)])
+            for j in range(i % 5):
+                query[numpy.random.randint(len(query))] = \
+                    numpy.random.choice(list('ACGTN'))
+            queries.append(''.join(query[:8 + i % 3]))
+        for query in queries:
+            self.assertEqual(corrector(query),
+                             barcode.correct_barcode(query, possibilities))
+        self.assertEqual(sorted(corrector._indices), [8, 9, 10])
+        # longer queries than the shortest barcode are not indexed
+        self.assertRaises(IndexError, corrector, 'A' * 12)
+        self.assertEqual(corrector._indices[12], None)
+
+    def test_get_barcode_corrector(self):
+        """ get_barcode_corrector should reuse correctors when possible
+        """
+        possibilities = ['TGTATTCGTGTA', 'ATTTTTTTTTCG', 'TGTAGGCGTGTA']
+        corrector = barcode.get_barcode_corrector(possibilities)
+        self.assertEqual(corrector('ATTTTTTTTTTT'), ('ATTTTTTTTTCG', 2))
+        self.assertTrue(barcode.get_barcode_corrector(possibilities[:]) is
+                        corrector)
+        self.assertFalse(barcode.get_barcode_corrector(possibilities[:2]) is
+                         corrector)
+        self.assertFalse(barcode.get_barcode_corrector(possibilities, 1) is
+                         corrector)
+        # a tuple of barcodes is recognised by identity
+        possibilities = tuple(possibilities)
+        corrector = barcode.get_barcode_corrector(possibilities)
+        self.assertTrue(barcode.get_barcode_corrector(possibilities) is
+                        corrector)
+        self.assertTrue(barcode.get_barcode_corrector(list(possibilities)) is
+                        corrector)
+
 if __name__ == '__main__':
     main()
@@ -22,13 +22,17 @@ from cogent.util.misc import remove_files
 from qiime.util import load_qiime_config
 from cogent.core.tree import PhyloNode
 from cogent.maths.distance_transform import dist_chisq
-from qiime.parse import parse_newick, parse_distmat, parse_matrix
+from qiime.parse import (parse_newick, parse_distmat, parse_matrix,
+                         parse_binary_distmat)
 from qiime.beta_diversity import BetaDiversityCalc, single_file_beta,\
     list_known_nonphylogenetic_metrics, list_known_phylogenetic_metrics,\
-    single_object_beta
-from qiime.beta_metrics import dist_unweighted_unifrac
+    single_object_beta, get_nonphylogenetic_row_metric, get_row_dissims,\
+    get_sample_matrix
+from qiime.beta_metrics import (dist_unweighted_unifrac, rows_bray_curtis,
+                                rows_binary_jaccard)
 from qiime.format import format_biom_table
 from biom.table import DenseOTUTable
+from biom.parse import parse_biom_table
 
 #from modified_beta_diversity import single_object_beta
 
@@ -269,6 +273,48 @@ class BetaDiversityCalcTests(TestCase):
         self.single_file_beta(missing_otu_table, missing_tree,
                               missing_sams=['M'], use_metric_list=True)
 
+    def test_single_file_beta_tiled(self):
+        """ tiled single_file_beta should give the same matrix as untiled"""
+        fd, input_path = mkstemp(suffix='.txt')
+        close(fd)
+        input_basename = os.path.splitext(os.path.split(input_path)[1])[0]
+        f = open(input_path, 'w')
+        f.write(l19_otu_table)
+        f.close()
+        fd, tree_path = mkstemp(suffix='.tre')
+        close(fd)
+        f = open(tree_path, 'w')
+        f.write(l19_tree)
+        f.close()
+        output_dir = mkdtemp()
+        self.files_to_remove.extend([input_path, tree_path])
+        self.folders_to_remove.append(output_dir)
+        tiled_dir = os.path.join(output_dir, 'tiled')
+        os.mkdir(tiled_dir)
+
+        metrics = list_known_nonphylogenetic_metrics()
+        metrics.extend(list_known_phylogenetic_metrics())
+        for metric in metrics:
+            out_name = metric + '_' + input_basename
+            single_file_beta(input_path, metric, tree_path, output_dir)
+            sams, dmtx = parse_distmat(open(os.path.join(output_dir,
+                                                         out_name + '.txt')))
+
+            # a tiny budget gives one row per tile
+            single_file_beta(input_path, metric, tree_path, tiled_dir,
+                             memory_budget=1)
+            tiled_sams, tiled_dmtx = parse_distmat(
+                open(os.path.join(tiled_dir, out_name + '.txt')))
+            self.assertEqual(tiled_sams, sams)
+            assert_almost_equal(tiled_dmtx, dmtx)
+
+            single_file_beta(input_path, metric, tree_path, tiled_dir,
+                             memory_budget=1000, output_format='float64')
+            bin_sams, bin_dmtx = parse_binary_distmat(
+                os.path.join(tiled_dir, out_name + '.bdm'))
+            self.assertEqual(bin_sams, sams)
+            assert_almost_equal(bin_dmtx, dmtx)
+
     def single_object_beta(self, otu_table, metric, tree_string,
                            missing_sams=None):
         """ running single_file_beta should give same result using --rows"""
@@ -363,6 +409,45 @@ class BetaDiversityCalcTests(TestCase):
             self.assertEqual(sams_ft, sams)
             assert_almost_equal(dmtx_ft, dmtx)
 
+    def test_get_row_dissims_phylogenetic_cache(self):
+        """phylogenetic rows are calculated from one preparation per cache"""
+        otu_table = parse_biom_table(open(self.l19_fp, 'U'))
+        otumtx = get_sample_matrix(otu_table)
+        expected = dist_unweighted_unifrac(otumtx, otu_table.ObservationIds,
+                                           self.l19_tree, otu_table.SampleIds,
+                                           make_subtree=False)
+        cache = {}
+        for start in range(0, len(otu_table.SampleIds), 5):
+            rowids = otu_table.SampleIds[start:start + 5]
+            actual = get_row_dissims('unweighted_unifrac',
+                                     dist_unweighted_unifrac, True, otumtx,
+                                     otu_table, self.l19_tree, rowids,
+                                     full_tree=True, cache=cache,
+                                     block_memory=64)
+            assert_almost_equal(actual, expected[start:start + 5])
+            if start == 0:
+                rows_f = cache['phylogenetic_rows_f']
+            # the prepared rows are reused by later calls
+            self.assertTrue(cache['phylogenetic_rows_f'] is rows_f)
+
+    def test_get_nonphylogenetic_row_metric(self):
+        """row metrics are found from any form of the metric name"""
+        self.assertEqual(get_nonphylogenetic_row_metric('bray_curtis'),
+                         rows_bray_curtis)
+        self.assertEqual(get_nonphylogenetic_row_metric('dist_bray_curtis'),
+                         rows_bray_curtis)
+        self.assertEqual(get_nonphylogenetic_row_metric('bray_curtis_faith'),
+                         rows_bray_curtis)
+        self.assertEqual(get_nonphylogenetic_row_metric('binary_jaccard'),
+                         rows_binary_jaccard)
+        self.assertEqual(
+            get_nonphylogenetic_row_metric('binary_dist_jaccard'),
+            rows_binary_jaccard)
+        for metric in list_known_nonphylogenetic_metrics():
+            get_nonphylogenetic_row_metric(metric)
+        self.assertRaises(AttributeError, get_nonphylogenetic_row_metric,
+                          'unweighted_unifrac')
+
     def test_single_object_beta(self):
         self.single_file_beta(l19_otu_table, l19_tree)
 
@@ -14,12 +14,19 @@ import os.path
 import numpy
 from unittest import TestCase, main
 from numpy.testing import assert_almost_equal
+from scipy.sparse import csr_matrix
 from cogent.maths.unifrac.fast_unifrac import fast_unifrac
 from qiime.parse import make_envs_dict
 from qiime.beta_metrics import (
     _reorder_unifrac_res,
     make_unifrac_metric,
-    make_unifrac_row_metric)
+    make_unifrac_row_metric,
+    rows_binary_jaccard,
+    rows_bray_curtis,
+    rows_chisq,
+    rows_euclidean)
+import qiime.beta_metrics
+import cogent.maths.distance_transform as distance_transform
 from qiime.parse import parse_newick
 from cogent.core.tree import PhyloNode
 from cogent.maths.unifrac.fast_tree import (unifrac)
@@ -274,6 +281,77 @@ class FunctionTests(TestCase):
                 self.assertEqual(res_row[j], res[i, j])
         warnings.resetwarnings()
 
+
+class RowMetricTests(TestCase):
+
+    def setUp(self):
+        self.data = numpy.array([[3, 0, 1, 5, 0, 2],
+                                 [0, 0, 0, 0, 0, 0],
+                                 [1, 4, 0, 0, 2, 2],
+                                 [3, 0, 1, 5, 0, 2],
+                                 [2, 2, 2, 2, 2, 2],
+                                 [0, 7, 0, 1, 0, 0]], float)
+
+    def test_row_metrics(self):
+        """row metrics match the full distance_transform matrices"""
+        warnings.filterwarnings('ignore')
+        try:
+            for name in dir(distance_transform):
+                if name.startswith('dist_'):
+                    row_name = 'rows_' + name[5:]
+                elif name.startswith('binary_dist_'):
+                    row_name = 'rows_binary_' + name[12:]
+                else:
+                    continue
+                expected = getattr(distance_transform, name)(self.data)
+                row_metric = getattr(qiime.beta_metrics, row_name)
+                cache = {}
+                for rowidxs in [[0], [5, 1, 2], range(6)]:
+                    actual = row_metric(self.data, rowidxs, cache)
+                    assert_almost_equal(actual, expected[rowidxs])
+                # small blocks of rows and columns give the same distances
+                for block_memory in [1, 8 * 5, 8 * 6 * 4]:
+                    actual = row_metric(self.data, [2, 4, 0],
+                                        block_memory=block_memory)
+                    assert_almost_equal(actual, expected[[2, 4, 0]])
+                    # as does sparse data
+                    actual = row_metric(csr_matrix(self.data), [2, 4, 0],
+                                        block_memory=block_memory)
+                    assert_almost_equal(actual, expected[[2, 4, 0]])
+        finally:
+            warnings.resetwarnings()
+
+    def test_row_metric_cache(self):
+        """values calculated from the whole matrix are cached"""
+        cache = {}
+        rows_chisq(self.data, [0], cache)
+        self.assertTrue('chisq_profiles' in cache[False])
+        # the cached values are used in later calls
+        cache[False]['chisq_profiles'] = \
+            numpy.zeros(self.data.shape)
+        # (only the distances to the empty row 1 don't come from them)
+        expected = numpy.zeros((2, 6))
+        expected[:, 1] = 1.0
+        assert_almost_equal(rows_chisq(self.data, [0, 2], cache), expected)
+        # binary metrics cache their values separately
+        rows_binary_jaccard(self.data, [0], cache)
+        self.assertEqual(cache[True]['data'].max(), 1.0)
+        self.assertEqual(cache[False]['data'].max(), 7.0)
+
+    def test_row_metric_invalid_data(self):
+        """row metrics reject data that distance_transform rejects"""
+        data = self.data.copy()
+        data[0, 0] = -1
+        self.assertRaises(ValueError, rows_bray_curtis, data, [0])
+        assert_almost_equal(rows_euclidean(data, [0]),
+                            distance_transform.dist_euclidean(data)[[0]])
+        self.assertRaises(ValueError, rows_bray_curtis, csr_matrix(data),
+                          [0])
+        data[0, 0] = numpy.nan
+        self.assertRaises(ValueError, rows_euclidean, data, [0])
+        self.assertRaises(ValueError, rows_euclidean, csr_matrix(data), [0])
+        self.assertRaises(ValueError, rows_bray_curtis, data[0], [0])
+
 # run tests if called from command line
 if __name__ == '__main__':
     main()
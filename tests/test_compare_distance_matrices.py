@@ -12,6 +12,7 @@ __email__ = "jai.rideout@gmail.com"
 
 from string import digits
 from unittest import TestCase, main
+from numpy.random import seed
 from qiime.parse import parse_distmat
 from qiime.compare_distance_matrices import (run_mantel_correlogram,
                                              run_mantel_test)
@@ -97,6 +98,26 @@ class CompareDistanceMatricesTests(TestCase):
                               self.comment, self.alpha)
         self.assertEqual(self.remove_nums(obs), exp)
 
+    def test_run_mantel_test_jobs_to_start(self):
+        """Test running mantel test on three distmats in several processes."""
+        exp = run_mantel_test('mantel', [self.fp1, self.fp2, self.fp3],
+                              [self.dm1, self.dm2, self.dm3], self.num_perms,
+                              self.tail_type, self.comment)
+        seed(0)
+        obs = run_mantel_test('mantel', [self.fp1, self.fp2, self.fp3],
+                              [self.dm1, self.dm2, self.dm3], self.num_perms,
+                              self.tail_type, self.comment, jobs_to_start=2)
+        self.assertEqual(self.remove_nums(obs), self.remove_nums(exp))
+
+        # Each pair has its own seed, so the number of processes doesn't
+        # change the results.
+        for jobs_to_start in 1, 3:
+            seed(0)
+            self.assertEqual(obs, run_mantel_test(
+                'mantel', [self.fp1, self.fp2, self.fp3],
+                [self.dm1, self.dm2, self.dm3], self.num_perms,
+                self.tail_type, self.comment, jobs_to_start=jobs_to_start))
+
     def test_run_mantel_test_sample_id_map(self):
         """Test running mantel test on two distmats that need IDs mapped."""
         exp = '# A sample comment.\nDM\tDM\tNumber of entries\tMantel r ' + \
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from os import listdir
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+
+from numpy.random import RandomState
+
+from qiime.dereplicate import SequenceDereplicator, SeqIdMap
+
+
+class SequenceDereplicatorTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = mkdtemp(prefix='SequenceDereplicatorTests')
+        self.seqs = [('s1 comment', 'ACGTAA'),
+                     ('s2', 'ACGTAAGG'),
+                     ('s3', 'ACGTAA'),
+                     ('s4', 'TTTT'),
+                     ('s5 comment', 'ACGTAAGG'),
+                     ('s6', 'ACGTAAGGC'),
+                     ('s7', 'ACGTAA')]
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_exact_matches(self):
+        """identical sequences are grouped in first-seen order"""
+        d = SequenceDereplicator(temp_dir=self.temp_dir)
+        d.add_seqs(self.seqs)
+        expected = [('s1', 'ACGTAA', ['s1', 's3', 's7']),
+                    ('s2', 'ACGTAAGG', ['s2', 's5']),
+                    ('s4', 'TTTT', ['s4']),
+                    ('s6', 'ACGTAAGGC', ['s6'])]
+        self.assertEqual(list(d), expected)
+        # iterating is repeatable
+        self.assertEqual(list(d), expected)
+        d.cleanup()
+        self.assertEqual(list(d), [])
+
+    def test_exact_prefixes(self):
+        """sequences with identical prefixes are grouped on the longest"""
+        d = SequenceDereplicator(prefix_length=4, temp_dir=self.temp_dir)
+        d.add_seqs(self.seqs)
+        expected = [('s6', 'ACGTAAGGC',
+                     ['s1', 's2', 's3', 's5', 's6', 's7']),
+                    ('s4', 'TTTT', ['s4'])]
+        self.assertEqual(list(d), expected)
+
+    def test_longest_tie_keeps_first(self):
+        """the first of several equally long sequences is the rep"""
+        d = SequenceDereplicator(prefix_length=2, temp_dir=self.temp_dir)
+        d.add_seqs([('a', 'AAC'), ('b', 'AAG'), ('c', 'AA')])
+        self.assertEqual(list(d), [('a', 'AAC', ['a', 'b', 'c'])])
+
+    def test_spill_to_disk(self):
+        """results are unchanged when groups are written to disk"""
+        d = SequenceDereplicator(max_memory=1000, temp_dir=self.temp_dir)
+        d.add_seqs(self.seqs * 20)
+        self.assertTrue(len(d._run_fps) > 0)
+        expected = [('s1', 'ACGTAA', ['s1', 's3', 's7'] * 20),
+                    ('s2', 'ACGTAAGG', ['s2', 's5'] * 20),
+                    ('s4', 'TTTT', ['s4'] * 20),
+                    ('s6', 'ACGTAAGGC', ['s6'] * 20)]
+        self.assertEqual(list(d), expected)
+        # only the sorted runs remain after iterating, and none after
+        # cleanup
+        self.assertEqual(len(listdir(self.temp_dir)), len(d._run_fps))
+        d.cleanup()
+        self.assertEqual(listdir(self.temp_dir), [])
+
+    def test_spill_to_disk_random(self):
+        """spilling matches the in-memory result on random sequences"""
+        rs = RandomState(42)
+        seqs = []
+        for i in range(2000):
+            length = rs.randint(3, 7)
+            seq = ''.join(rs.choice(list('AC'), length))
+            seqs.append(('seq%d' % i, seq))
+        for prefix_length in (None, 4):
+            in_memory = SequenceDereplicator(prefix_length=prefix_length,
+                                             temp_dir=self.temp_dir)
+            in_memory.add_seqs(seqs)
+            spilled = SequenceDereplicator(prefix_length=prefix_length,
+                                           max_memory=2000,
+                                           temp_dir=self.temp_dir)
+            spilled.add_seqs(seqs)
+            self.assertTrue(len(spilled._run_fps) > 1)
+            self.assertEqual(list(spilled), list(in_memory))
+            spilled.cleanup()
+
+
+class SeqIdMapTests(TestCase):
+
+    def setUp(self):
+        self.temp_dir = mkdtemp(prefix='SeqIdMapTests')
+
+    def tearDown(self):
+        rmtree(self.temp_dir)
+
+    def test_seq_id_map(self):
+        """SeqIdMap returns the member ids of each group from disk"""
+        m = SeqIdMap(temp_dir=self.temp_dir)
+        m['s1'] = ['s1', 's3', 's7']
+        m['s4'] = ['s4']
+        self.assertEqual(m['s4'], ['s4'])
+        m['s6'] = ['s6', 's2', 's5']
+        self.assertEqual(m['s1'], ['s1', 's3', 's7'])
+        self.assertEqual(m['s6'], ['s6', 's2', 's5'])
+        self.assertEqual(len(m), 3)
+        self.assertEqual(sorted(m), ['s1', 's4', 's6'])
+        self.assertTrue('s4' in m)
+        self.assertFalse('s2' in m)
+        self.assertRaises(KeyError, m.__getitem__, 's2')
+        # the temporary file is never visible in temp_dir
+        self.assertEqual(listdir(self.temp_dir), [])
+        m.close()
+        self.assertEqual(len(m), 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,20 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Dan Knights"
 __email__ = "danknights@gmail.com"
 
-from numpy import array
+from os import close
+from tempfile import mkstemp
+
+from numpy import array, arange
 
 from unittest import TestCase, main
 from numpy.testing import assert_almost_equal
 from cogent import LoadSeqs
+from skbio.util.misc import remove_files
+from qiime.util import get_qiime_temp_dir
 from qiime.filter_alignment import apply_lane_mask, apply_gap_filter,\
     apply_lane_mask_and_gap_filter, remove_outliers, freqs_from_aln_array,\
-    generate_lane_mask
+    generate_lane_mask, alignment_to_array, freqs_from_array,\
+    apply_lane_mask_and_gap_filter_array
 
 
 class FilterAlignmentTests(TestCase):
@@ -31,6 +37,22 @@ class FilterAlignmentTests(TestCase):
         ]
         self.aln2 = aln2_fasta.split('\n')
         self.aln2_lm = aln2_lm
+        self.sample_alignment = """>1
+        .ATC-G
+        >2
+        .AACCG
+        >3
+        .ATC-G
+        >4
+        .AAC-G""".split('\n')
+        fd, self.array_fp = mkstemp(dir=get_qiime_temp_dir(),
+                                    prefix='FilterAlignmentTests_',
+                                    suffix='.bin')
+        close(fd)
+        self.files_to_remove = [self.array_fp]
+
+    def tearDown(self):
+        remove_files(self.files_to_remove)
 
     def test_apply_lane_mask_and_gap_filter_real(self):
         """apply_lane_mask_and_gap_filter: no error on full length seqs
@@ -270,6 +292,65 @@ class FilterAlignmentTests(TestCase):
         for result in apply_lane_mask_and_gap_filter(aln, lm):
             self.assertEqual(result, expected.next() + '\n')
 
+    def test_alignment_to_array(self):
+        """alignment_to_array: reads the alignment into a memmap
+        """
+        seq_ids, aln_array = alignment_to_array(self.sample_alignment,
+                                                self.array_fp)
+        self.assertEqual(seq_ids, ['1', '2', '3', '4'])
+        self.assertEqual(aln_array.shape, (4, 6))
+        self.assertEqual(aln_array[1].tostring(), '-AACCG')
+        self.assertEqual(aln_array[:, 4].tostring(), '-C--')
+
+        self.assertEqual(alignment_to_array([], self.array_fp), ([], None))
+        self.assertRaises(ValueError, alignment_to_array,
+                          ['>a', 'AC-T', '>b', 'AC-'], self.array_fp)
+
+    def test_freqs_from_array(self):
+        """freqs_from_array: matches freqs_from_aln_array
+        """
+        seq_ids, aln_array = alignment_to_array(self.sample_alignment,
+                                                self.array_fp)
+        positions = arange(6)
+        for block_size in (1, 3, 10):
+            assert_almost_equal(
+                freqs_from_array(aln_array, positions, block_size).Data,
+                freqs_from_aln_array(self.sample_alignment).Data)
+        positions = array([1, 4, 5])
+        assert_almost_equal(
+            freqs_from_array(aln_array, positions).Data,
+            freqs_from_aln_array(self.sample_alignment, positions).Data)
+
+    def test_apply_lane_mask_and_gap_filter_array(self):
+        """apply_lane_mask_and_gap_filter_array: matches the text version
+        """
+        cases = [(self.aln1, None, 1.0, None),
+                 (self.aln1, '111111', 1.0, None),
+                 (self.aln1, None, 0.5, None),
+                 (self.aln1, '011111', 1.0, None),
+                 (self.aln1, '011111', 0.5, None),
+                 (self.aln1, '000000', 1.0, None),
+                 (self.aln1, None, 0.5, 0.5),
+                 (self.aln2, self.aln2_lm, 0.9, None),
+                 (self.aln2, None, 0.9, 0.2),
+                 (self.sample_alignment, None, 1.0, 0.7)]
+        for aln, lm, allowed_gap_frac, entropy_threshold in cases:
+            expected = list(apply_lane_mask_and_gap_filter(
+                aln, lm, allowed_gap_frac,
+                entropy_threshold=entropy_threshold))
+            for block_size in (1, 2, 10000):
+                actual = list(apply_lane_mask_and_gap_filter_array(
+                    aln, lm, allowed_gap_frac,
+                    entropy_threshold=entropy_threshold,
+                    block_size=block_size))
+                self.assertEqual(actual, expected)
+
+        self.assertEqual(
+            list(apply_lane_mask_and_gap_filter_array([], None, 1.0)), [])
+        self.assertRaises(ValueError, list,
+                          apply_lane_mask_and_gap_filter_array(
+                              self.aln1, None, entropy_threshold=1.5))
+
     def test_remove_outliers(self):
         """ remove outliers returns only seqs similar to consensus"""
         aln = [
@@ -35,7 +35,7 @@ from qiime.format import (format_distance_matrix, format_otu_table,
                           format_biom_table, format_mapping_html_data, format_te_prefs,
                           format_tep_file_lines, format_jnlp_file_lines, format_anosim_results,
                           format_best_results, format_permanova_results, format_fastq_record,
-                          format_histograms_two_bins)
+                          format_histograms_two_bins, write_distance_matrix)
 from biom.parse import parse_biom_table, parse_classic_table_to_rich_table
 from biom.table import SparseTaxonTable
 from StringIO import StringIO
@@ -398,6 +398,30 @@ class TopLevelTests(TestCase):
                          '\t11\t22\t33\n11\t1\t2\t3\n22\t4\t5\t6\n33\t7\t8\t9')
         self.assertRaises(ValueError, format_distance_matrix, labels[:2], a)
 
+    def test_write_distance_matrix(self):
+        """write_distance_matrix should write rows as blocks are generated"""
+        a = array([[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        labels = [11, 22, 33]
+        f = StringIO()
+        write_distance_matrix(f, labels, iter([a[:2], a[2:]]))
+        self.assertEqual(f.getvalue(), format_distance_matrix(labels, a))
+
+        f = StringIO()
+        write_distance_matrix(f, labels, [a], 'float32')
+        header, label_line, padding, data = f.getvalue().split('\n', 3)
+        self.assertEqual(header, '#QIIME binary distance matrix\tfloat32\t3')
+        self.assertEqual(label_line, '\t11\t22\t33')
+        self.assertEqual(padding.strip(), '')
+        self.assertEqual((len(f.getvalue()) - len(data)) % 64, 0)
+        self.assertEqual(data, a.astype('<f4').tostring())
+
+        self.assertRaises(ValueError, write_distance_matrix, StringIO(),
+                          labels, [a], 'float16')
+        self.assertRaises(ValueError, write_distance_matrix, StringIO(),
+                          labels, [a[:2]])
+        self.assertRaises(ValueError, write_distance_matrix, StringIO(),
+                          labels[:2], [a])
+
     def test_format_matrix(self):
         """format_matrix should return tab-delimited mat"""
         a = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
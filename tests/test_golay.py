@@ -193,6 +193,55 @@ class GolayTests(TestCase):
             self.assertEqual(corr, None)
             self.assertEqual(num_errs, 4)
 
+    def test_decode_matches_decode_bits(self):
+        """ decode should match decoding the bit vector with decode_bits"""
+        numpy.random.seed(0)
+        nt_to_bits_s = [golay.DEFAULT_GOLAY_NT_TO_BITS,
+                        {"A": "00", "C": "01", "T": "10", "G": "11"}]
+        for nt_to_bits in nt_to_bits_s:
+            bits_to_nt = dict([(v, k) for k, v in nt_to_bits.items()])
+            for i in range(2000):
+                seq = ''.join(numpy.random.choice(list('ACGT'), size=12))
+                bits = golay._seq_to_bits(seq, nt_to_bits)
+                corr_bits, num_errs = golay.decode_bits(bits)
+                if corr_bits is None:
+                    expected = (None, 4)
+                else:
+                    expected = (golay._bits_to_seq(corr_bits, nt_to_bits),
+                                num_errs)
+                self.assertEqual(golay.decode(seq, nt_to_bits), expected)
+                # second call is served from the cache
+                self.assertEqual(golay.decode(seq, nt_to_bits), expected)
+
+    def test_decode_errors(self):
+        """ decode should raise errors on invalid barcodes"""
+        self.assertRaises(ValueError, golay.decode, 'ACGT')
+        self.assertRaises(KeyError, golay.decode, 'ACGTACGTACGN')
+
+    def test_decode_many(self):
+        """ decode_many should decode each barcode as decode does"""
+        seqs = golay600[:10] + [golay600[0].replace('A', 'C', 1),
+                                golay600[0].replace('A', 'C', 2),
+                                golay600[0].replace('A', 'C', 1)]
+        expected = [golay.decode(seq) for seq in seqs]
+        self.assertEqual(golay.decode_many(seqs), expected)
+        self.assertEqual(golay.decode_many([]), [])
+
+    def test_GolayDecoder_cache_size(self):
+        """ GolayDecoder should not memoize more than max_cache_size seqs"""
+        decoder = golay.GolayDecoder(max_cache_size=3)
+        for bc in golay600[:20]:
+            err_bc = bc[:-1] + {'A': 'C', 'C': 'A', 'G': 'T', 'T': 'G'}[bc[-1]]
+            self.assertEqual(decoder(err_bc), golay.decode(err_bc))
+            self.assertTrue(len(decoder._cache) <= 3)
+
+    def test_GolayDecoder_lazy_tables(self):
+        """ GolayDecoder should build its tables on the first decode"""
+        decoder = golay.GolayDecoder()
+        self.assertEqual(decoder._syndrome_errors, None)
+        self.assertEqual(decoder(golay600[0]), (golay600[0], 0))
+        self.assertEqual(len(decoder._syndrome_errors), 4096)
+
 # random 24 bit vectors
 ten_bitvecs = numpy.array([
     [0, 0, 0, 1, 0, 1, 1, 0, 1, 1, 1, 1, 0, 0, 0, 1, 0, 1, 1, 0, 0, 0,
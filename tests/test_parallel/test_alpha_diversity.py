@@ -12,7 +12,7 @@ __email__ = "gregcaporaso@gmail.com"
 
 from shutil import rmtree
 from glob import glob
-from os import close
+from os import close, makedirs
 from os.path import exists, join
 from tempfile import mkstemp, mkdtemp
 
@@ -88,6 +88,24 @@ class ParallelAlphaDiversityTests(TestCase):
         output_fps = glob(join(self.test_out, '*txt'))
         self.assertEqual(len(output_fps), len(self.rt_fps))
 
+    def test_precommand_initiation(self):
+        """the tree is flattened once for all jobs
+        """
+        working_dir = join(self.test_out, 'ATEST')
+        makedirs(working_dir)
+        params = {'metrics': 'observed_species,PD_whole_tree',
+                  'tree_path': self.tree_fp,
+                  'jobs_to_start': 2
+                  }
+        app = ParallelAlphaDiversity()
+        app.files_to_remove = []
+        app._precommand_initiation(self.rt_fps, self.test_out, working_dir,
+                                   params)
+        self.assertEqual(params['tree_path'],
+                         join(working_dir, 'flat_tree.npz'))
+        self.assertTrue(exists(params['tree_path']))
+        self.assertEqual(app.files_to_remove, [params['tree_path']])
+
     def test_parallel_alpha_diversity_wo_tree(self):
         """parallel alpha diversity functions as expected without tree
         """
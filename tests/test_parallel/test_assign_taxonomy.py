@@ -24,7 +24,8 @@ from skbio.core.sequence import DNA
 
 from qiime.parallel.assign_taxonomy import (ParallelBlastTaxonomyAssigner,
                                             ParallelRdpTaxonomyAssigner,
-                                            ParallelUclustConsensusTaxonomyAssigner)
+                                            ParallelUclustConsensusTaxonomyAssigner,
+                                            ParallelNaiveBayesTaxonomyAssigner)
 from qiime.util import get_qiime_temp_dir
 from qiime.test import initiate_timeout, disable_timeout
 from qiime.parse import fields_to_dict
@@ -256,6 +257,83 @@ class ParallelUclustConsensusTaxonomyAssignerTests(TestCase):
         self.assertEqual(len(results['s6']), 3)
 
 
+class ParallelNaiveBayesTaxonomyAssignerTests(TestCase):
+
+    def setUp(self):
+        """
+        """
+        self.files_to_remove = []
+        self.dirs_to_remove = []
+
+        tmp_dir = get_qiime_temp_dir()
+        self.test_out = mkdtemp(dir=tmp_dir,
+                                prefix='qiime_parallel_taxonomy_assigner_tests_',
+                                suffix='')
+        self.dirs_to_remove.append(self.test_out)
+
+        fd, self.tmp_seq_filepath = mkstemp(dir=self.test_out,
+                                            prefix='qiime_parallel_taxonomy_assigner_tests_input',
+                                            suffix='.fasta')
+        close(fd)
+        seq_file = open(self.tmp_seq_filepath, 'w')
+        seq_file.write(uclust_test_seqs.to_fasta())
+        seq_file.close()
+        self.files_to_remove.append(self.tmp_seq_filepath)
+
+        self.id_to_taxonomy_file = NamedTemporaryFile(
+            prefix='qiime_parallel_taxonomy_assigner_tests_id_to_taxonomy',
+            suffix='.txt', dir=tmp_dir)
+        self.id_to_taxonomy_file.write(uclust_id_to_taxonomy)
+        self.id_to_taxonomy_file.seek(0)
+
+        self.reference_seqs_file = NamedTemporaryFile(
+            prefix='qiime_parallel_taxonomy_assigner_tests_ref_seqs',
+            suffix='.fasta', dir=tmp_dir)
+        self.reference_seqs_file.write(uclust_reference_seqs.to_fasta())
+        self.reference_seqs_file.seek(0)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        remove_files(self.files_to_remove)
+        # remove directories last, so we don't get errors
+        # trying to remove files which may be in the directories
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parallel_naive_bayes_taxonomy_assigner(self):
+        """ parallel_naive_bayes_taxonomy_assigner functions as expected """
+        model_dir = join(self.test_out, 'model')
+        params = {'id_to_taxonomy_fp': self.id_to_taxonomy_file.name,
+                  'reference_seqs_fp': self.reference_seqs_file.name,
+                  'confidence': 0.80,
+                  'naive_bayes_model_dir': model_dir,
+                  'naive_bayes_word_size': 8,
+                  'naive_bayes_num_bootstraps': 100
+                  }
+
+        app = ParallelNaiveBayesTaxonomyAssigner()
+        r = app(self.tmp_seq_filepath,
+                self.test_out,
+                params,
+                job_prefix='NBTATEST',
+                poll_directly=True,
+                suppress_submit_jobs=False)
+        results = fields_to_dict(open(glob(join(
+            self.test_out, '*_tax_assignments.txt'))[0], 'U'))
+        # some basic sanity checks: we should get the same number of sequences
+        # as our input with the same seq IDs. We should have a taxonomy string
+        # and a confidence value for each seq as well.
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(results['s1']), 2)
+        self.assertEqual(len(results['s6']), 2)
+        # the classifier was trained once, into the model directory
+        self.assertTrue(exists(join(model_dir, 'taxa.txt')))
+
+
 rdp_test_seqs = \
     """>X67228 some description
 aacgaacgctggcggcaggcttaacacatgcaagtcgaacgctccgcaaggagagtggcagacgggtgagtaacgcgtgggaatctacccaaccctgcggaatagctctgggaaactggaattaataccgcatacgccctacgggggaaagatttatcggggatggatgagcccgcgttggattagctagttggtggggtaaaggcctaccaaggcgacgatccatagctggtctgagaggatgatcagccacattgggactgagacacggcccaaa
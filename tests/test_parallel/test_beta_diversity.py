@@ -25,7 +25,9 @@ from qiime.parse import parse_distmat
 from qiime.util import get_qiime_temp_dir
 from qiime.test import initiate_timeout, disable_timeout
 from qiime.parallel.beta_diversity import (ParallelBetaDiversitySingle,
-                                           ParallelBetaDiversityMultiple)
+                                           ParallelBetaDiversityMultiple,
+                                           get_sample_costs,
+                                           get_balanced_sample_id_groups)
 
 
 class ParallelBetaDiversityTests(TestCase):
@@ -131,6 +133,31 @@ class ParallelBetaDiversitySingleTests(ParallelBetaDiversityTests):
             self.assertItemsEqual(dm_sample_ids, input_sample_ids)
 
 
+class SampleCostTests(TestCase):
+
+    def test_get_sample_costs(self):
+        """ get_sample_costs scales with the number of observed OTUs """
+        table = parse_biom_table(input1.split('\n'))
+        nonzero_counts = table.nonzeroCounts('sample', binary=True)
+        costs = get_sample_costs(table)
+        self.assertEqual(len(costs), len(table.SampleIds))
+        assert_almost_equal(costs - nonzero_counts,
+                            [nonzero_counts.mean()] * len(costs))
+
+    def test_get_balanced_sample_id_groups(self):
+        """ get_balanced_sample_id_groups evens out the cost of each group
+        """
+        sids = ['s1', 's2', 's3', 's4', 's5']
+        costs = [10, 1, 5, 4, 2]
+        self.assertEqual(get_balanced_sample_id_groups(sids, costs, 2),
+                         ['s1,s2', 's3,s4,s5'])
+        self.assertEqual(get_balanced_sample_id_groups(sids, costs, 1),
+                         ['s1,s2,s3,s4,s5'])
+        # no empty groups
+        self.assertEqual(get_balanced_sample_id_groups(sids[:2], costs, 3),
+                         ['s1', 's2'])
+
+
 class ParallelBetaDiversityMultipleTests(ParallelBetaDiversityTests):
 
     def test_parallel_beta_diversity(self):
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+from os.path import exists, join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from threading import Timer
+from time import time
+from unittest import TestCase, main
+
+from qiime.util import get_qiime_temp_dir
+from qiime.parse import parse_job_status
+import qiime.parallel.poller
+from qiime.parallel.poller import (get_job_status_fp, get_job_heartbeat_fp,
+                                   write_job_status, run_job_with_status,
+                                   wait_for_job_statuses,
+                                   write_job_timing_summary)
+
+
+class JobStatusTests(TestCase):
+
+    def setUp(self):
+        """ """
+        self.status_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                                  prefix='JobStatusTests')
+
+    def tearDown(self):
+        """ """
+        rmtree(self.status_dir)
+
+    def test_run_job_with_status(self):
+        """ run_job_with_status runs the job and writes its status """
+        job_fp = join(self.status_dir, 'job0.sh')
+        out_fp = join(self.status_dir, 'out.txt')
+        open(job_fp, 'w').write('echo hello > %s\n' % out_fp)
+        status_fp = get_job_status_fp(self.status_dir, 0)
+        self.assertEqual(run_job_with_status(job_fp, status_fp), 0)
+        self.assertEqual(open(out_fp).read(), 'hello\n')
+        status = parse_job_status(open(status_fp))
+        self.assertEqual(status[0], 0)
+        self.assertTrue(status[1] >= 0)
+        self.assertEqual(status[3], job_fp)
+        self.assertFalse(exists(status_fp + '.tmp'))
+        self.assertFalse(exists(get_job_heartbeat_fp(status_fp)))
+
+        # the heartbeat file is written while the job runs
+        heartbeat_fp = get_job_heartbeat_fp(status_fp)
+        open(job_fp, 'w').write('sleep 1\ntest -e %s\n' % heartbeat_fp)
+        self.assertEqual(run_job_with_status(job_fp, status_fp, 0.1), 0)
+        self.assertFalse(exists(heartbeat_fp))
+
+        # job ends at the first failing command
+        open(job_fp, 'w').write('false\necho hello > %s\n' % out_fp)
+        status_fp = get_job_status_fp(self.status_dir, 1)
+        self.assertEqual(run_job_with_status(job_fp, status_fp), 1)
+        self.assertEqual(parse_job_status(open(status_fp))[0], 1)
+
+    def test_wait_for_job_statuses(self):
+        """ wait_for_job_statuses returns statuses as they are written """
+        write_job_status(get_job_status_fp(self.status_dir, 0),
+                         0, 1.5, 100, 'job0.sh')
+        Timer(0.5, write_job_status,
+              (get_job_status_fp(self.status_dir, 1),
+               0, 2.5, 200, 'job1.sh')).start()
+        start = time()
+        actual = wait_for_job_statuses(self.status_dir, 2, 30)
+        self.assertTrue(time() - start < 10)
+        self.assertEqual(actual, {0: (0, 1.5, 100, 'job0.sh'),
+                                  1: (0, 2.5, 200, 'job1.sh')})
+
+    def test_wait_for_job_statuses_without_inotify(self):
+        """ wait_for_job_statuses backs off when inotify is not available
+        """
+        get_inotify_fd = qiime.parallel.poller._get_inotify_fd
+        qiime.parallel.poller._get_inotify_fd = lambda dir_path: None
+        try:
+            Timer(0.5, write_job_status,
+                  (get_job_status_fp(self.status_dir, 0),
+                   0, 2.5, 200, 'job0.sh')).start()
+            actual = wait_for_job_statuses(self.status_dir, 1, 2)
+        finally:
+            qiime.parallel.poller._get_inotify_fd = get_inotify_fd
+        self.assertEqual(actual, {0: (0, 2.5, 200, 'job0.sh')})
+
+    def test_wait_for_job_statuses_failure(self):
+        """ wait_for_job_statuses raises an error on the first failed job
+        """
+        write_job_status(get_job_status_fp(self.status_dir, 1),
+                         2, 0.5, 100, 'job1.sh')
+        start = time()
+        self.assertRaises(RuntimeError, wait_for_job_statuses,
+                          self.status_dir, 3, 30)
+        self.assertTrue(time() - start < 10)
+
+    def test_wait_for_job_statuses_killed_job(self):
+        """ wait_for_job_statuses raises an error if a job stops running
+        """
+        write_job_status(get_job_status_fp(self.status_dir, 0),
+                         0, 1.5, 100, 'job0.sh')
+        # job 1 has started, but its heartbeat is never updated
+        open(get_job_heartbeat_fp(get_job_status_fp(self.status_dir, 1)),
+             'w').close()
+        start = time()
+        self.assertRaises(RuntimeError, wait_for_job_statuses,
+                          self.status_dir, 3, 0.5, heartbeat_timeout=1)
+        self.assertTrue(time() - start < 10)
+
+    def test_write_job_timing_summary(self):
+        """ write_job_timing_summary lists the slowest jobs first """
+        statuses = {0: (0, 1.5, 100, 'job0.sh'),
+                    1: (0, 12.25, 200, 'job1.sh'),
+                    2: (0, 1.5, 300, 'job2.sh')}
+        f = StringIO()
+        write_job_timing_summary(statuses, f)
+        expected = ('#job\texit status\twall time (s)\tpeak RSS (KB)\t'
+                    'job script\n'
+                    '1\t0\t12.250\t200\tjob1.sh\n'
+                    '0\t0\t1.500\t100\tjob0.sh\n'
+                    '2\t0\t1.500\t300\tjob2.sh\n'
+                    '#mean wall time (s): 5.083\n')
+        self.assertEqual(f.getvalue(), expected)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,19 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from os import close
-from os.path import exists
-from tempfile import mkstemp
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkstemp, mkdtemp
+from time import time
 from unittest import TestCase, main
 
 from skbio.util.misc import remove_files
 
 from qiime.util import get_qiime_temp_dir
 from qiime.parallel.util import (ParallelWrapper,
-                                 BufferedWriter)
+                                 BufferedWriter,
+                                 _JobResultsMerger,
+                                 balanced_partition)
 
 
 class ParallelWrapperTests(TestCase):
@@ -218,28 +222,133 @@ class ParallelWrapperTests(TestCase):
         self.assertTrue(s1.startswith('HELLO'))
         self.assertFalse(s1.endswith('_'))
 
-    def test_compute_seqs_per_file(self):
-        """compute_seqs_per_file functions as expected
+
+class BalancedPartitionTests(TestCase):
+
+    def test_balanced_partition(self):
+        """ balanced_partition evens out the cost of each bucket """
+        obs_part, obs_levels = balanced_partition({'a': 2, 'b': 1, 'c': 3}, 1)
+        self.assertEqual(obs_part, [['c', 'a', 'b']])
+        self.assertEqual(obs_levels, [6])
+
+        costs = {'a': 9.5, 'b': 1, 'c': 1, 'd': 4, 'e': 3, 'f': 2.5}
+        obs_part, obs_levels = balanced_partition(costs, 2)
+        self.assertEqual(obs_part, [['a', 'c'], ['d', 'e', 'f', 'b']])
+        self.assertEqual(obs_levels, [10.5, 10.5])
+
+        # more buckets than items leaves empty buckets
+        obs_part, obs_levels = balanced_partition({'a': 2, 'b': 1}, 3)
+        self.assertEqual(obs_part, [['a'], ['b'], []])
+        self.assertEqual(obs_levels, [2, 1, 0])
+
+        self.assertRaises(ValueError, balanced_partition, costs, 0)
+
+
+class LocalJobsTests(TestCase):
+
+    def setUp(self):
+        """ """
+        self.test_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                                prefix='LocalJobsTests')
+        self.job_fps = [join(self.test_dir, 'job%d.txt' % i)
+                        for i in range(3)]
+        self.out_fp = join(self.test_dir, 'out.txt')
+        self.merge_map_fp = join(self.test_dir, 'merge_map.txt')
+        open(self.merge_map_fp, 'w').write(
+            '%s\t%s\n' % ('\t'.join(self.job_fps), self.out_fp))
+        self.commands = ['/bin/bash; echo %d > %s; exit' % (i, fp)
+                         for i, fp in enumerate(self.job_fps)]
+
+    def tearDown(self):
+        """ """
+        rmtree(self.test_dir)
+
+    def test_run_jobs_locally(self):
+        """ _run_jobs_locally runs jobs, merges results and cleans up """
+        pw = ParallelWrapper(cluster_jobs_fp='local')
+        pw.files_to_remove = list(self.job_fps)
+        pw._run_jobs_locally(self.commands, self.merge_map_fp)
+        self.assertEqual(open(self.out_fp).read(), '0\n1\n2\n')
+        for fp in self.job_fps:
+            self.assertFalse(exists(fp))
+
+        # temp files retained if requested
+        pw = ParallelWrapper(cluster_jobs_fp='local', retain_temp_files=True)
+        pw.files_to_remove = list(self.job_fps)
+        pw._run_jobs_locally(self.commands, self.merge_map_fp)
+        self.assertEqual(open(self.out_fp).read(), '0\n1\n2\n')
+        for fp in self.job_fps:
+            self.assertTrue(exists(fp))
+
+    def test_run_jobs_locally_failure(self):
+        """ _run_jobs_locally raises an error as soon as a job fails """
+        pw = ParallelWrapper(cluster_jobs_fp='local')
+        pw.files_to_remove = []
+        commands = ['/bin/bash; sleep 60; exit',
+                    '/bin/bash; false; echo 1 > %s; exit' % self.job_fps[1]]
+        start = time()
+        self.assertRaises(RuntimeError, pw._run_jobs_locally, commands,
+                          self.merge_map_fp)
+        self.assertTrue(time() - start < 30)
+        self.assertFalse(exists(self.job_fps[1]))
+
+    def test_get_status_reporting_commands(self):
+        """ _get_status_reporting_commands writes one script per job """
+        pw = ParallelWrapper(cluster_jobs_fp='start_parallel_jobs.py')
+        commands = ['/bin/bash; export X=1; echo $X > x.txt; exit',
+                    '/bin/bash; echo 2; exit']
+        actual = pw._get_status_reporting_commands(commands, 'TEST',
+                                                   self.test_dir)
+        status_dir = join(self.test_dir, 'job_status')
+        job_fps = [join(self.test_dir, 'TESTjob0.sh'),
+                   join(self.test_dir, 'TESTjob1.sh')]
+        expected = ['/bin/bash; run_parallel_job.py -i %s -s %s; exit' %
+                    (job_fps[0], join(status_dir, '0.status')),
+                    '/bin/bash; run_parallel_job.py -i %s -s %s; exit' %
+                    (job_fps[1], join(status_dir, '1.status'))]
+        self.assertEqual(actual, expected)
+        self.assertTrue(exists(status_dir))
+        self.assertEqual(open(job_fps[0]).read(),
+                         ' export X=1\n echo $X > x.txt\n')
+        self.assertEqual(open(job_fps[1]).read(), ' echo 2\n')
+        self.assertEqual(pw._get_poller_status_options(),
+                         '-s %s -n 2 -w %s' %
+                         (status_dir, join(status_dir, 'job_timings.txt')))
+
+    def test_job_results_merger(self):
+        """ _JobResultsMerger merges result files in order as jobs complete
         """
-        fd, temp_fasta_fp = mkstemp(prefix='QiimeScriptUtilTests',
-                                   suffix='.fasta')
-        close(fd)
-        temp_fasta = ['>seq', 'AAACCCCAAATTGG'] * 25
-        open(temp_fasta_fp, 'w').write('\n'.join(temp_fasta))
-
-        actual_25 = self.pw._compute_seqs_per_file(temp_fasta_fp, 25)
-        actual_2 = self.pw._compute_seqs_per_file(temp_fasta_fp, 2)
-        actual_10 = self.pw._compute_seqs_per_file(temp_fasta_fp, 10)
-        actual_5 = self.pw._compute_seqs_per_file(temp_fasta_fp, 5)
-        actual_40 = self.pw._compute_seqs_per_file(temp_fasta_fp, 40)
-
-        remove_files([temp_fasta_fp])
-
-        self.assertEqual(actual_25, 1)
-        self.assertEqual(actual_2, 13)
-        self.assertEqual(actual_10, 3)
-        self.assertEqual(actual_5, 5)
-        self.assertEqual(actual_40, 1)
+        m = _JobResultsMerger(open(self.merge_map_fp, 'U'), 3,
+                              [[fp] for fp in self.job_fps])
+        # job 1 completes first, but job 0's results must be merged first
+        open(self.job_fps[1], 'w').write('1\n')
+        m.job_complete(1)
+        self.assertEqual(open(self.out_fp).read(), '')
+        open(self.job_fps[0], 'w').write('0')
+        m.job_complete(0)
+        m._out_fs[0].flush()
+        self.assertEqual(open(self.out_fp).read(), '0\n1\n')
+        self.assertRaises(RuntimeError, m.check_complete)
+        open(self.job_fps[2], 'w').write('2\n')
+        m.job_complete(2)
+        m.check_complete()
+        m.close()
+        self.assertEqual(open(self.out_fp).read(), '0\n1\n2\n')
+
+    def test_job_results_merger_no_job_result_filepaths(self):
+        """ _JobResultsMerger merges once all jobs complete if unmapped
+        """
+        m = _JobResultsMerger(open(self.merge_map_fp, 'U'), 3)
+        for i, fp in enumerate(self.job_fps):
+            open(fp, 'w').write('%d\n' % i)
+        m.job_complete(0)
+        m.job_complete(1)
+        m._out_fs[0].flush()
+        self.assertEqual(open(self.out_fp).read(), '')
+        m.job_complete(2)
+        m.check_complete()
+        m.close()
+        self.assertEqual(open(self.out_fp).read(), '0\n1\n2\n')
 
 
 class BufferedWriterTests(TestCase):
@@ -33,7 +33,9 @@ from qiime.parse import (group_by_field, group_by_fields,
                          parse_taxa_summary_table, parse_prefs_file, parse_mapping_file_to_dict,
                          mapping_file_to_dict, MinimalQualParser, parse_denoiser_mapping,
                          parse_otu_map, parse_sample_id_map, parse_taxonomy_to_otu_metadata,
-                         is_casava_v180_or_later, MinimalSamParser)
+                         is_casava_v180_or_later, MinimalSamParser,
+                         parse_job_status, is_binary_distmat,
+                         parse_binary_distmat)
 
 
 class TopLevelTests(TestCase):
@@ -317,6 +319,28 @@ c\t1\t3.5\t0
         self.assertEqual(obs[0], exp[0])
         assert_almost_equal(obs[1], exp[1])
 
+    def test_parse_binary_distmat(self):
+        """parse_binary_distmat should memory-map a binary distmat"""
+        fd, fp = mkstemp(suffix='.bdm')
+        close(fd)
+        self.files_to_remove.append(fp)
+        header = '#QIIME binary distance matrix\tfloat64\t3\n\ta\tb\tc\n'
+        data = array([[0, 1, 2], [1, 0, 3.5], [1, 3.5, 0]])
+        f = open(fp, 'wb')
+        f.write(header + ' ' * (63 - len(header)) + '\n')
+        f.write(data.astype('<f8').tostring())
+        f.close()
+        self.assertTrue(is_binary_distmat(fp))
+        labels, obs = parse_binary_distmat(fp)
+        self.assertEqual(labels, ['a', 'b', 'c'])
+        assert_almost_equal(obs, data)
+
+        f = open(fp, 'w')
+        f.write('\ta\tb\na\t0\t1\nb\t1\t0\n')
+        f.close()
+        self.assertFalse(is_binary_distmat(fp))
+        self.assertRaises(ValueError, parse_binary_distmat, fp)
+
     def test_parse_distmat_to_dict(self):
         """parse_distmat should return dict of distmat"""
         lines = """\ta\tb\tc
@@ -947,6 +971,15 @@ node2\t0
         self.assertTrue('$' not in actual['key2'])
         self.assertTrue('$' not in actual['key3'])
 
+    def test_parse_job_status(self):
+        """parse_job_status functions as expected"""
+        lines = ['0\t12.104\t51324\t/tmp/POTU_abc_/POTU_abc_job0.sh\n']
+        self.assertEqual(parse_job_status(lines),
+                         (0, 12.104, 51324, '/tmp/POTU_abc_/POTU_abc_job0.sh'))
+        lines = ['\n', '137\t0.500\t0\tjob1.sh']
+        self.assertEqual(parse_job_status(lines), (137, 0.5, 0, 'job1.sh'))
+        self.assertRaises(ValueError, parse_job_status, [])
+
     def test_parse_metadata_state_descriptions(self):
         """parse_metadata_state_descriptions should return correct states from string."""
         s = ''
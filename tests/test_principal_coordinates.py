@@ -9,7 +9,12 @@ __version__ = "1.8.0-dev"
 __maintainer__ = "Justin Kuczynski"
 __email__ = "justinak@gmail.com"
 
-from qiime.principal_coordinates import pcoa
+from os import close, remove
+from tempfile import mkstemp
+from numpy import arange, array
+from numpy.testing import assert_almost_equal
+from qiime.principal_coordinates import pcoa, pcoa_fp, _symmetrize
+from qiime.format import write_distance_matrix
 from unittest import TestCase, main
 
 
@@ -28,6 +33,35 @@ sam3\t.44\t.66\t0""".split('\n')
         res = pcoa(self.distmtx_txt)
         assert res  # formatting tested elsewhere
 
+    def test_pcoa_fp(self):
+        """ pcoa_fp should give the same results for text and binary files"""
+        exp = pcoa(self.distmtx_txt)
+        data = array([[0.0, 0.18, 0.44], [0.18, 0.0, 0.66],
+                      [0.44, 0.66, 0.0]])
+        for output_format in 'text', 'float64':
+            fd, fp = mkstemp(suffix='.dm')
+            close(fd)
+            try:
+                f = open(fp, 'wb')
+                write_distance_matrix(f, ['sam1', 'sam2', 'sam3'], [data],
+                                      output_format)
+                f.close()
+                res = pcoa_fp(fp)
+            finally:
+                remove(fp)
+            assert_almost_equal(res.eigvals, exp.eigvals)
+            assert_almost_equal(abs(res.site), abs(exp.site))
+
+    def test_symmetrize(self):
+        """ _symmetrize should average the matrix with its transpose"""
+        data = arange(49.0).reshape(7, 7)
+        exp = (data + data.T) / 2
+        # blocks which don't divide the matrix evenly
+        for block_size in 1, 3, 7, 10:
+            obs = data.copy()
+            _symmetrize(obs, block_size)
+            assert_almost_equal(obs, exp)
+
 
 # run tests if called from command line
 if __name__ == '__main__':
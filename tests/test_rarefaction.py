@@ -21,8 +21,11 @@ from numpy.testing import assert_almost_equal
 import numpy
 from biom.table import table_factory, TableException
 from biom.parse import parse_biom_table
+from skbio.math.subsample import subsample
 
-from qiime.rarefaction import RarefactionMaker, get_rare_data
+from qiime.rarefaction import (RarefactionMaker, get_rare_data,
+                               nested_subsample, iter_rare_samples,
+                               iter_rare_tables)
 from qiime.util import load_qiime_config
 from qiime.format import format_biom_table
 
@@ -170,5 +173,72 @@ class FunctionTests(TestCase):
                        for (val, otu_id, meta) in rare_otu_table.iterObservations()]
         self.assertEqual(rare_values, [1.0, 5.0, 3.0, 2.0])
 
+    def test_nested_subsample(self):
+        """nested_subsample should draw each depth from the deeper ones"""
+        counts = numpy.array([10, 0, 5, 20, 1])
+        for i in range(10):
+            res = nested_subsample(counts, [30, 5, 20, 5, 100])
+            self.assertEqual([depth for depth, rare in res], [5, 20, 30])
+            last = numpy.zeros(5)
+            for depth, rare in res:
+                self.assertEqual(rare.sum(), depth)
+                self.assertTrue((rare >= last).all())
+                last = rare
+            self.assertTrue((last <= counts).all())
+
+        res = nested_subsample(counts, [30, 100], include_small_samples=True)
+        self.assertEqual(res[0][1].sum(), 30)
+        self.assertEqual(res[1][0], 100)
+        assert_almost_equal(res[1][1], counts)
+
+    def test_nested_subsample_replace(self):
+        """nested_subsample should draw other subsample_fs from the counts"""
+        counts = numpy.array([10, 0, 5, 20, 1])
+        drawn_from = []
+
+        def subsample_f(values, depth):
+            drawn_from.append(values.copy())
+            return subsample(values, depth, replace=True)
+        res = nested_subsample(counts, [30, 5, 20], subsample_f=subsample_f)
+        self.assertEqual([depth for depth, rare in res], [5, 20, 30])
+        self.assertEqual([rare.sum() for depth, rare in res], [5, 20, 30])
+        self.assertEqual(len(drawn_from), 3)
+        for values in drawn_from:
+            assert_almost_equal(values, counts)
+
+    def test_iter_rare_samples(self):
+        """iter_rare_samples should yield every sample for every rep"""
+        res = list(iter_rare_samples(self.otu_table, [1, 4], 2))
+        self.assertEqual([(rep, sample_id) for rep, sample_id, rare in res],
+                         [(0, 'Y'), (0, 'X'), (0, 'Z'),
+                          (1, 'Y'), (1, 'X'), (1, 'Z')])
+        self.assertEqual([depth for depth, counts in res[0][2]], [1])
+        self.assertEqual([depth for depth, counts in res[1][2]], [1, 4])
+        self.assertEqual(res[2][2], [])
+
+    def test_iter_rare_tables(self):
+        """iter_rare_tables should match get_rare_data for each depth"""
+        res = list(iter_rare_tables(self.otu_table, [1, 4], 2))
+        self.assertEqual([(depth, rep) for depth, rep, table in res],
+                         [(1, 0), (4, 0), (1, 1), (4, 1)])
+        for depth, rep, table in res:
+            exp = get_rare_data(self.otu_table, depth)
+            self.assertEqual(table.SampleIds, exp.SampleIds)
+            self.assertEqual(table.ObservationIds, exp.ObservationIds)
+            for sample_id in table.SampleIds:
+                self.assertEqual(table.sampleData(sample_id).sum(), depth)
+
+        # all samples are included if small samples are
+        res = list(iter_rare_tables(self.otu_table, [50], 1,
+                                    include_small_samples=True))
+        self.assertEqual(res[0][2], self.otu_table)
+
+    def test_iter_rare_tables_too_deep(self):
+        """iter_rare_tables should raise, as get_rare_data does, if no
+        sample is deep enough"""
+        self.assertRaises(TableException, get_rare_data, self.otu_table, 50)
+        self.assertRaises(TableException, list,
+                          iter_rare_tables(self.otu_table, [1, 4, 50], 2))
+
 if __name__ == '__main__':
     main()
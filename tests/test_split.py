@@ -11,6 +11,7 @@ __maintainer__ = "Greg Caporaso"
 __email__ = "gregcaporaso@gmail.com"
 
 from os import close
+from StringIO import StringIO
 from tempfile import mkstemp
 from unittest import TestCase, main
 
@@ -18,11 +19,15 @@ from biom.parse import parse_biom_table
 from biom.table import DenseOTUTable
 from skbio.core.sequence import DNA
 from skbio.core.alignment import SequenceCollection
+from skbio.core.exception import RecordError
 from skbio.parse.sequences import parse_fasta
 
 from qiime.split import (split_mapping_file_on_field,
                          split_otu_table_on_sample_metadata,
-                         split_fasta)
+                         split_fasta,
+                         get_fasta_split_offsets,
+                         split_fasta_on_byte_offsets)
+import qiime.split
 from qiime.util import get_qiime_temp_dir, remove_files
 from qiime.format import format_biom_table
 
@@ -165,6 +170,120 @@ class SplitTests(TestCase):
                 SequenceCollection.from_fasta_records(parse_fasta(actual_seqs), DNA))
 
 
+    def test_get_fasta_split_offsets(self):
+        """get_fasta_split_offsets splits on record boundaries
+        """
+        fasta = '>seq1\nAACCTTAA\n>seq2\nTTAACC\nAATTAA\n>seq3\nCCTT--AA\n'
+        # record starts are at 0, 15 and 35, and the file is 50 bytes
+        self.assertEqual(get_fasta_split_offsets(StringIO(fasta), 1),
+                         [(0, 50)])
+        self.assertEqual(get_fasta_split_offsets(StringIO(fasta), 2),
+                         [(0, 35), (35, 50)])
+        self.assertEqual(get_fasta_split_offsets(StringIO(fasta), 3),
+                         [(0, 35), (35, 50)])
+        self.assertEqual(get_fasta_split_offsets(StringIO(fasta), 4),
+                         [(0, 15), (15, 35), (35, 50)])
+        self.assertEqual(get_fasta_split_offsets(StringIO(fasta), 100),
+                         [(0, 15), (15, 35), (35, 50)])
+        # small blocks are searched across block boundaries
+        self.assertEqual(
+            get_fasta_split_offsets(StringIO(fasta), 4, block_size=1),
+            [(0, 15), (15, 35), (35, 50)])
+        # a single record can't be split
+        self.assertEqual(get_fasta_split_offsets(StringIO('>s1\nAAAA'), 3),
+                         [(0, 8)])
+        self.assertEqual(get_fasta_split_offsets(StringIO(''), 3), [])
+        self.assertRaises(ValueError, get_fasta_split_offsets,
+                          StringIO(fasta), 0)
+
+        # records ending with '\r' are split too
+        self.assertEqual(
+            get_fasta_split_offsets(StringIO(fasta.replace('\n', '\r')), 4),
+            [(0, 15), (15, 35), (35, 50)])
+        # whitespace before the first record is skipped, anything else isn't
+        # a valid fasta file
+        self.assertEqual(get_fasta_split_offsets(StringIO('\n \n' + fasta), 4),
+                         [(3, 18), (18, 38), (38, 53)])
+        self.assertEqual(get_fasta_split_offsets(StringIO('\n\n'), 3), [])
+        self.assertRaises(RecordError, get_fasta_split_offsets,
+                          StringIO('junk\n' + fasta), 4)
+
+    def test_split_fasta_on_byte_offsets(self):
+        """split_fasta_on_byte_offsets always catches all seqs
+        """
+        in_seqs = SequenceCollection.from_fasta_records(
+            [('seq%s' % k, 'AACCTTAA' * (k % 7 + 1)) for k in range(59)],
+            DNA)
+        fd, fasta_fp = mkstemp(dir=get_qiime_temp_dir(),
+                               prefix='split_fasta_tests',
+                               suffix='.fasta')
+        close(fd)
+        open(fasta_fp, 'w').write(in_seqs.to_fasta())
+        fd, filename_prefix = mkstemp(dir=get_qiime_temp_dir(),
+                                      prefix='split_fasta_tests',
+                                      suffix='')
+        close(fd)
+
+        for i in range(1, 70):
+            actual = split_fasta_on_byte_offsets(fasta_fp, i, filename_prefix,
+                                                 buffer_size=7)
+            actual_seqs = []
+            for fp in actual:
+                # each file contains whole records
+                self.assertEqual(open(fp).read(1), '>')
+                actual_seqs += list(open(fp))
+            remove_files(actual)
+
+            # split points in the same record give fewer files
+            self.assertTrue(0 < len(actual) <= i)
+            expected = ['%s.%d.fasta' % (filename_prefix, j)
+                        for j in range(len(actual))]
+            self.assertEqual(actual, expected)
+            self.assertEqual(''.join(actual_seqs), in_seqs.to_fasta())
+        remove_files([fasta_fp, filename_prefix])
+
+    def test_split_fasta_on_byte_offsets_cr_newlines(self):
+        """split_fasta_on_byte_offsets writes '\\r' line endings as '\\n'
+        """
+        fd, fasta_fp = mkstemp(dir=get_qiime_temp_dir(),
+                               prefix='split_fasta_tests',
+                               suffix='.fasta')
+        close(fd)
+        open(fasta_fp, 'wb').write('>s1\rACGT\r>s2\rAACC\r')
+        fd, filename_prefix = mkstemp(dir=get_qiime_temp_dir(),
+                                      prefix='split_fasta_tests',
+                                      suffix='')
+        close(fd)
+        actual = split_fasta_on_byte_offsets(fasta_fp, 2, filename_prefix)
+        self.assertEqual([open(fp, 'rb').read() for fp in actual],
+                         ['>s1\nACGT\n', '>s2\nAACC\n'])
+        remove_files(actual + [fasta_fp, filename_prefix])
+
+    def test_split_fasta_on_byte_offsets_truncated(self):
+        """split_fasta_on_byte_offsets raises if the file ends early
+        """
+        fd, fasta_fp = mkstemp(dir=get_qiime_temp_dir(),
+                               prefix='split_fasta_tests',
+                               suffix='.fasta')
+        close(fd)
+        open(fasta_fp, 'w').write('>s1\nACGT\n>s2\nAACC\n')
+        fd, filename_prefix = mkstemp(dir=get_qiime_temp_dir(),
+                                      prefix='split_fasta_tests',
+                                      suffix='')
+        close(fd)
+        # simulate the file shrinking after the offsets were found
+        original_get_offsets = qiime.split.get_fasta_split_offsets
+        qiime.split.get_fasta_split_offsets = \
+            lambda fasta_f, num_chunks: [(0, 100)]
+        try:
+            self.assertRaises(IOError, split_fasta_on_byte_offsets,
+                              fasta_fp, 1, filename_prefix, buffer_size=7)
+        finally:
+            qiime.split.get_fasta_split_offsets = original_get_offsets
+        remove_files([fasta_fp, filename_prefix,
+                      '%s.0.fasta' % filename_prefix])
+
+
 mapping_f1 = """#SampleID	BarcodeSequence	LinkerPrimerSequence	Treatment	DOB	Description
 #Example mapping file for the QIIME analysis package.  These 9 samples are from a study of the effects of exercise and diet on mouse cardiac physiology (Crawford, et al, PNAS, 2009).
 PC.354	AGCACGAGCCTA	YATGCTGCCTCCCGTAGGAGT	Co_ntrol	20061218	Control_mouse_I.D._354
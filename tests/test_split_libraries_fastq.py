@@ -12,6 +12,8 @@ __email__ = "gregcaporaso@gmail.com"
 
 import numpy as np
 
+from os import close, remove
+from tempfile import mkstemp
 from unittest import TestCase, main
 from qiime.split_libraries_fastq import (
     process_fastq_single_end_read_file,
@@ -23,7 +25,12 @@ from qiime.split_libraries_fastq import (
     check_header_match_pre180,
     check_header_match_180_or_later,
     correct_barcode,
-    process_fastq_single_end_read_file_no_barcode
+    process_fastq_single_end_read_file_no_barcode,
+    process_fastq_single_end_read_file_sharded,
+    get_fastq_shard_boundaries,
+    pack_reads,
+    quality_filter_packed_reads,
+    quality_filter_sequences
 )
 from qiime.golay import decode_golay_12
 
@@ -57,6 +64,20 @@ class SplitLibrariesFastqTests(TestCase):
         self.fastq2_expected_default = fastq2_expected_default
         self.fastq1_expected_single_barcode = fastq1_expected_single_barcode
         self.barcode_map1 = barcode_map1
+        self.files_to_remove = []
+
+    def tearDown(self):
+        for fp in self.files_to_remove:
+            remove(fp)
+
+    def _write_temp_file(self, data):
+        fd, fp = mkstemp(prefix='SplitLibrariesFastqTests', suffix='.fastq')
+        close(fd)
+        f = open(fp, 'w')
+        f.write(data)
+        f.close()
+        self.files_to_remove.append(fp)
+        return fp
 
     def test_correct_barcode_exact_match(self):
         """correct_barcode functions as expected w exact match"""
@@ -554,6 +575,95 @@ class SplitLibrariesFastqTests(TestCase):
         expected = []
         self.assertEqual(actual, expected)
 
+    def test_get_fastq_shard_boundaries(self):
+        """get_fastq_shard_boundaries splits files on matching records
+        """
+        read_fp = self._write_temp_file(fastq1)
+        barcode_fp = self._write_temp_file(barcode_fastq1)
+        actual = get_fastq_shard_boundaries(read_fp, barcode_fp, 3)
+        self.assertEqual(len(actual), 3)
+        self.assertEqual(actual[0][0][0], 0)
+        self.assertEqual(actual[0][1][0], 0)
+        self.assertEqual(actual[-1][0][1], len(fastq1))
+        self.assertEqual(actual[-1][1][1], len(barcode_fastq1))
+        for (read_range, barcode_range) in actual:
+            read_records = fastq1[read_range[0]:read_range[1]]
+            barcode_records = barcode_fastq1[barcode_range[0]:barcode_range[1]]
+            # each range starts on a record and covers the same reads
+            self.assertTrue(read_records.startswith('@'))
+            self.assertTrue(barcode_records.startswith('@'))
+            self.assertEqual(read_records.count('\n'),
+                             barcode_records.count('\n'))
+
+        # a single shard covers the whole of both files
+        actual = get_fastq_shard_boundaries(read_fp, barcode_fp, 1)
+        self.assertEqual(actual,
+                         [((0, len(fastq1)), (0, len(barcode_fastq1)))])
+
+        # no more shards than records are created
+        actual = get_fastq_shard_boundaries(read_fp, barcode_fp, 1000)
+        self.assertEqual(len(actual), len(fastq1.split('\n')) // 4)
+
+    def test_process_fastq_single_end_read_file_sharded(self):
+        """sharded demultiplexing matches process_fastq_single_end_read_file
+        """
+        for read_data, barcode_data in [(fastq1, barcode_fastq1),
+                                         (fastq2, barcode_fastq2)]:
+            read_fp = self._write_temp_file(read_data)
+            barcode_fp = self._write_temp_file(barcode_data)
+            for kwargs in [{'min_per_read_length_fraction': 0.45},
+                           {'store_unassigned': True,
+                            'rev_comp': True,
+                            'start_seq_id': 42,
+                            'min_per_read_length_fraction': 0.45},
+                           {'barcode_correction_fn': decode_golay_12,
+                            'max_barcode_errors': 0.9}]:
+                expected_log = FakeFile()
+                expected_histogram = FakeFile()
+                expected = list(process_fastq_single_end_read_file(
+                    open(read_fp, 'U'), open(barcode_fp, 'U'),
+                    self.barcode_map1, log_f=expected_log,
+                    histogram_f=expected_histogram, **kwargs))
+                for jobs in [1, 2, 5]:
+                    actual_log = FakeFile()
+                    actual_histogram = FakeFile()
+                    actual = list(process_fastq_single_end_read_file_sharded(
+                        read_fp, barcode_fp, self.barcode_map1, jobs=jobs,
+                        log_f=actual_log, histogram_f=actual_histogram,
+                        **kwargs))
+                    self.assertEqual(len(actual), len(expected))
+                    for i in range(len(expected)):
+                        np.testing.assert_equal(actual[i], expected[i])
+                    self.assertEqual(actual_log.s, expected_log.s)
+                    self.assertEqual(actual_histogram.s, expected_histogram.s)
+
+    def test_process_fastq_single_end_read_file_sharded_line_endings(self):
+        """sharded demultiplexing handles CRLF and CR line endings
+        """
+        read_fp = self._write_temp_file(fastq1)
+        barcode_fp = self._write_temp_file(barcode_fastq1)
+        expected = list(process_fastq_single_end_read_file(
+            open(read_fp, 'U'), open(barcode_fp, 'U'), self.barcode_map1,
+            min_per_read_length_fraction=0.45))
+        for newline in ['\r\n', '\r']:
+            read_data = fastq1.replace('\n', newline)
+            barcode_data = barcode_fastq1.replace('\n', newline)
+            read_fp = self._write_temp_file(read_data)
+            barcode_fp = self._write_temp_file(barcode_data)
+            for read_range, barcode_range in get_fastq_shard_boundaries(
+                    read_fp, barcode_fp, 3):
+                self.assertTrue(
+                    read_data[read_range[0]:read_range[1]].startswith('@'))
+                self.assertTrue(barcode_data[
+                    barcode_range[0]:barcode_range[1]].startswith('@'))
+            for jobs in [1, 3]:
+                actual = list(process_fastq_single_end_read_file_sharded(
+                    read_fp, barcode_fp, self.barcode_map1, jobs=jobs,
+                    min_per_read_length_fraction=0.45))
+                self.assertEqual(len(actual), len(expected))
+                for i in range(len(expected)):
+                    np.testing.assert_equal(actual[i], expected[i])
+
     def test_bad_chars_from_threshold(self):
         """bad_chars_from_threshold selects correct chars as bad
         """
@@ -759,6 +869,61 @@ class SplitLibrariesFastqTests(TestCase):
                                   "GCACTCACCGCCCGTCACACCACGAAAGTTGGTAACACCCGAAGCCGGTGAGATAACCTTTTAGGAGTCAGCTGTC",
                                   "bbbbbbbbbbbbbbbbbbbbbbbbbY``\`bbbbbbbbbbbbb`bbbbab`a`_[ba_aa]b^_bIWTTQ^YR^U`"))
 
+    def test_pack_reads(self):
+        """pack_reads pads reads into 2D arrays
+        """
+        sequences, qualities, lengths = pack_reads(
+            ['ACGT', 'AC', ''],
+            [np.array([30, 31, 32, 33], dtype=np.int8),
+             np.array([2, 3], dtype=np.int8),
+             np.array([], dtype=np.int8)])
+        np.testing.assert_equal(lengths, [4, 2, 0])
+        self.assertEqual(sequences.tostring(), 'ACGTAC      ')
+        np.testing.assert_equal(qualities, [[30, 31, 32, 33],
+                                            [2, 3, 0, 0],
+                                            [0, 0, 0, 0]])
+
+    def test_quality_filter_packed_reads(self):
+        """quality_filter_packed_reads truncates and filters blocks of reads
+        """
+        sequences, qualities, lengths = pack_reads(
+            ['ACGTACGT', 'ACGTACGT', 'NNGTACGT', 'ACGTACNN'],
+            [np.array([30, 2, 30, 2, 2, 30, 2, 2], dtype=np.int8),
+             np.array([2, 2, 30, 30, 30, 30, 30, 30], dtype=np.int8),
+             np.array([30, 30, 30, 30, 30, 30, 30, 30], dtype=np.int8),
+             np.array([30, 30, 30, 30, 30, 30, 30, 30], dtype=np.int8)])
+        results, truncated_lengths = quality_filter_packed_reads(
+            sequences, qualities, lengths,
+            max_bad_run_length=1,
+            phred_quality_threshold=2,
+            min_per_read_length=2,
+            seq_max_N=1)
+        np.testing.assert_equal(truncated_lengths, [3, 0, 8, 8])
+        np.testing.assert_equal(results, [0, 1, 2, 2])
+
+    def test_quality_filter_sequences(self):
+        """quality_filter_sequences matches quality_filter_sequence
+        """
+        np.random.seed(0)
+        headers = ['990:2:4:11271:5323#%d/1' % (i % 3) for i in range(200)]
+        sequences = [''.join(np.random.choice(list('ACGTN'), size=length,
+                                              p=[0.24, 0.24, 0.24, 0.24, 0.04]))
+                     for length in np.random.randint(0, 40, size=200)]
+        qualities = [np.random.randint(0, 12, size=len(seq)).astype(np.int8)
+                     for seq in sequences]
+        for max_bad_run_length in [-1, 0, 1, 3, 100]:
+            for phred_quality_threshold in [None, 2, 5]:
+                for filter_bad_illumina_qual_digit in [True, False]:
+                    params = (max_bad_run_length, phred_quality_threshold, 15,
+                              1, filter_bad_illumina_qual_digit)
+                    actual = quality_filter_sequences(headers, sequences,
+                                                      qualities, *params)
+                    self.assertEqual(len(actual), len(sequences))
+                    for i in range(len(sequences)):
+                        expected = quality_filter_sequence(
+                            headers[i], sequences[i], qualities[i], *params)
+                        np.testing.assert_equal(actual[i], expected)
+
     def test_quality_filter_illumina_qual(self):
         """quality_filter_sequence functions as expected with bad illumina qual digit
         """
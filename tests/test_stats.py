@@ -21,7 +21,7 @@ from cogent.util.misc import remove_files
 from unittest import TestCase, main
 from numpy.testing import assert_almost_equal
 from numpy import array, asarray, roll, median, nan
-from numpy.random import permutation, shuffle
+from numpy.random import permutation, shuffle, seed
 import numpy as np
 from itertools import izip
 from types import StringType, ListType, FloatType, TupleType
@@ -31,7 +31,11 @@ from qiime.stats import (all_pairs_t_test, _perform_pairwise_tests,
                          Anosim, Best, CategoryStats, CorrelationStats,
                          DistanceMatrixStats, MantelCorrelogram, Mantel,
                          PartialMantel, Permanova, quantile, _quantile,
-                         paired_difference_analyses)
+                         paired_difference_analyses, _permuted_stats,
+                         _within_group_sums, _get_pair_indices,
+                         _permanova_f_values, _standardize,
+                         _standardized_square, _partial_mantel_r_values)
+from qiime.pycogent_backports.test import mantel_test, pearson, permute_2d
 from qiime.util import MetadataMap, get_qiime_temp_dir
 
 class TestHelper(TestCase):
@@ -790,6 +794,82 @@ class AnosimTests(TestHelper):
         assert_almost_equal(obs['r_value'], exp['r_value'])
         assert_almost_equal(obs['p_value'], exp['p_value'])
 
+    def test_call_matches_anosim(self):
+        """Test the permuted R statistics match _anosim() of each grouping."""
+        calls = []
+
+        def random_fn(grouping):
+            result = permutation(grouping)
+            calls.append(result)
+            return result
+        self.anosim_overview.RandomFunction = random_fn
+        samples = self.overview_dm.ids
+        obs = self.anosim_overview(20)
+
+        exp_stats = []
+        for grouping in calls:
+            group_map = dict(zip(samples, grouping))
+            exp_stats.append(self.anosim_overview._anosim(group_map))
+        assert_almost_equal(obs['r_value'], 0.8125)
+        self.assertEqual(len(calls), 20)
+        exp_p_value = ((array(exp_stats) >= obs['r_value']).sum() + 1) / 21
+        assert_almost_equal(obs['p_value'], exp_p_value)
+
+    def test_call_jobs_to_start(self):
+        """Test the results don't depend on the number of processes."""
+        seed(42)
+        exp = self.anosim_overview(99)
+        self.assertTrue(0 < exp['p_value'] < 0.06)
+        # batches of 10 permutations of the 36 pairs of samples, so that
+        # the batches are spread across the worker processes
+        memory = 40 * 36 * 10
+        seed(42)
+        obs = self.anosim_overview(99, jobs_to_start=2, memory=memory)
+        self.assertEqual(obs, exp)
+        seed(42)
+        obs = self.anosim_overview(99, memory=memory)
+        self.assertEqual(obs, exp)
+
+
+def weighted_sums(batch, weights):
+    """Statistic for testing _permuted_stats in worker processes"""
+    return (batch * weights).sum(axis=1)
+
+
+class PermutedStatsTests(TestCase):
+    """Tests for the permutation test helper functions."""
+
+    def test_permuted_stats(self):
+        """Test the batches of permutations are evaluated in order."""
+        weights = array([1, 10, 100])
+        values = array([1, 2, 3])
+
+        for batch_size in 1, 2, 10:
+            for jobs_to_start in 1, 2:
+                nrs = NonRandomShuffler()
+                obs, obs_stats = _permuted_stats(weighted_sums, (weights,),
+                                                 values, 4, nrs.permutation,
+                                                 batch_size, jobs_to_start)
+                self.assertEqual(obs, 321)
+                assert_almost_equal(obs_stats, [321, 213, 321, 321])
+
+    def test_permuted_stats_no_perms(self):
+        """Test the statistic is computed without permutations."""
+        def stat_f(batch):
+            return batch.sum(axis=1)
+        obs, obs_stats = _permuted_stats(stat_f, (), array([1, 2]), 0,
+                                         permutation, 10)
+        self.assertEqual(obs, 3)
+        self.assertEqual(len(obs_stats), 0)
+
+    def test_within_group_sums(self):
+        """Test summing the condensed values within each group."""
+        rows, cols = _get_pair_indices(4)
+        values = array([1., 5., 4., 3., 2., 3.])
+        groupings = array([[0, 0, 1, 1], [0, 1, 0, 1], [1, 1, 1, 1]])
+        obs = _within_group_sums(values, rows, cols, groupings, 2)
+        assert_almost_equal(obs, [[1, 3], [5, 2], [0, 18]])
+
 
 class PermanovaTests(TestHelper):
 
@@ -942,6 +1022,33 @@ class PermanovaTests(TestHelper):
         assert_almost_equal(obs['f_value'], exp['f_value'])
         self.assertCorrectPValue(0.005, 0.07, self.permanova_overview, 50)
 
+    def test_permanova_f_values(self):
+        """Test the F statistics match _permanova() of each grouping."""
+        samples = self.distmtx_uneven_samples
+        rows, cols = _get_pair_indices(len(samples))
+        distances = self.distmtx_uneven.data[rows, cols]
+        groupings = array([permutation([0, 0, 1, 2, 2]) for i in range(20)])
+
+        obs = _permanova_f_values(groupings, distances * distances, rows,
+                                  cols, 3)
+        exp = [self.permanova_uneven._permanova(dict(zip(samples, grouping)))
+               for grouping in groupings]
+        assert_almost_equal(obs, exp)
+
+    def test_call_jobs_to_start(self):
+        """Test the results don't depend on the number of processes."""
+        seed(42)
+        exp = self.permanova_overview(99)
+        # batches of 10 permutations of the 36 pairs of samples, so that
+        # the batches are spread across the worker processes
+        memory = 40 * 36 * 10
+        seed(42)
+        obs = self.permanova_overview(99, jobs_to_start=2, memory=memory)
+        self.assertEqual(obs, exp)
+        seed(42)
+        obs = self.permanova_overview(99, memory=memory)
+        self.assertEqual(obs, exp)
+
     def test_call_incompatible_data(self):
         """Should fail on incompatible mdmap/dm combo and bad perms."""
         self.assertRaises(ValueError, self.permanova_plain, -1)
@@ -1505,6 +1612,37 @@ class MantelTests(TestHelper):
         self.assertEqual(len(results['perm_stats']), 999)
         self.assertCorrectPValue(0.6, 1.0, self.small_mantel, 999)
 
+    def test_call_matches_mantel_test(self):
+        """Test the results match mantel_test with the same permutations."""
+        sample_ids = ['s1', 's2', 's3', 's4', 's5']
+        m1 = array([[0, 1, 2, 3, 1.4],
+                    [1, 0, 1.5, 1.6, 1.7],
+                    [2, 1.5, 0, 0.8, 1.9],
+                    [3, 1.6, 0.8, 0, 1.0],
+                    [1.4, 1.7, 1.9, 1.0, 0]])
+        m2 = array([[0, 1, 2, 3, 4.1],
+                    [1, 0, 5, 6, 7],
+                    [2, 5, 0, 8, 9],
+                    [3, 6, 8, 0, 10],
+                    [4.1, 7, 9, 10, 0]])
+        mantel = Mantel(DistanceMatrix(m1, sample_ids),
+                        DistanceMatrix(m2, sample_ids))
+
+        for tail_type in 'two sided', 'greater', 'less':
+            mantel.TailType = tail_type
+            seed(0)
+            obs = mantel(99)
+            seed(0)
+            exp_p_value, exp_r_value, exp_perm_stats = mantel_test(
+                m1, m2, 99, alt=tail_type)
+            assert_almost_equal(obs['r_value'], exp_r_value)
+            assert_almost_equal(obs['perm_stats'], exp_perm_stats)
+            assert_almost_equal(obs['p_value'], exp_p_value)
+
+    def test_call_no_perms(self):
+        """Should fail with fewer than one permutation."""
+        self.assertRaises(ValueError, self.small_mantel, 0)
+
 
 class PartialMantelTests(TestHelper):
     """Tests for the PartialMantel class."""
@@ -1588,7 +1726,10 @@ class PartialMantelTests(TestHelper):
 
         exp_mantel_r = 0.99999999999999734
         assert_almost_equal(obs['mantel_r'], exp_mantel_r)
-        self.assertCorrectPValue(0.25, 0.4, self.small_pm_diff,
+        # With three samples every permuted r is 1 or -1, and the three
+        # permutations which give 1 tie with the observed r, so p is about
+        # 0.5 (ties that differ in the last bits used to be missed).
+        self.assertCorrectPValue(0.4, 0.6, self.small_pm_diff,
                                  p_val_key='mantel_p')
 
         obs = self.small_pm_diff2()
@@ -1600,6 +1741,29 @@ class PartialMantelTests(TestHelper):
         self.assertCorrectPValue(0.8, 1.0, self.small_pm_diff2,
                                  p_val_key='mantel_p')
 
+    def test_partial_mantel_r_values(self):
+        """Test the permuted statistics match those of permuted matrices."""
+        dm1, dm2, cdm = self.small_pm_diff2.DistanceMatrices
+        rows, cols = _get_pair_indices(5)
+        dm1_square = _standardized_square(dm1.data[rows, cols], rows, cols, 5)
+        dm2_flat = _standardize(dm2.data[rows, cols])
+        cdm_flat = _standardize(cdm.data[rows, cols])
+        r_yz = pearson(dm2.condensed_form(), cdm.condensed_form())
+        orders = array([permutation(5) for i in range(10)])
+
+        obs = _partial_mantel_r_values(orders, dm1_square,
+                                       array([dm2_flat, cdm_flat]), rows,
+                                       cols, r_yz)
+        exp = []
+        for order in orders:
+            dm1_flat = DistanceMatrix(permute_2d(dm1.data, order),
+                                      dm1.ids).condensed_form()
+            r_xy = pearson(dm1_flat, dm2.condensed_form())
+            r_xz = pearson(dm1_flat, cdm.condensed_form())
+            exp.append((r_xy - r_xz * r_yz) /
+                       (np.sqrt(1 - r_xz ** 2) * np.sqrt(1 - r_yz ** 2)))
+        assert_almost_equal(obs, exp)
+
 
 class TopLevelTests(TestHelper):
 
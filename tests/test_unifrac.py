@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# File created on 16 Oct 2026
+from __future__ import division
+
+__author__ = "agent"
+__copyright__ = "Copyright 2011, The QIIME Project"
+__credits__ = ["agent"]
+__license__ = "GPL"
+__version__ = "1.8.0-dev"
+__maintainer__ = "agent"
+__email__ = "agent@local"
+
+import warnings
+from os import close, stat, utime
+from tempfile import mkstemp
+from unittest import TestCase, main
+
+from numpy import array
+from numpy.testing import assert_almost_equal
+from scipy.sparse import csr_matrix
+from cogent.core.tree import PhyloNode
+import cogent.maths.unifrac.fast_tree as fast_tree
+from cogent.maths.unifrac.fast_unifrac import (fast_unifrac,
+                                               fast_unifrac_one_sample,
+                                               PD_whole_tree)
+from skbio.util.misc import remove_files
+
+from qiime.beta_metrics import (_reorder_unifrac_res,
+                                _reorder_unifrac_res_one_sample)
+from qiime.parse import make_envs_dict, parse_newick
+from qiime.unifrac import (FlatTree, UNIFRAC_METRICS, unifrac_matrix,
+                           unifrac_row, faith_pd, write_flat_tree,
+                           load_flat_tree, get_flat_tree_from_fp,
+                           get_unifrac_row_f, get_unifrac_rows_f)
+
+# qiime.unifrac metric -> cogent fast_unifrac parameters
+cogent_metrics = {
+    'unweighted_unifrac': (False, fast_tree.unifrac, True),
+    'unweighted_unifrac_full_tree': (False, fast_tree.unnormalized_unifrac,
+                                     True),
+    'weighted_unifrac': (True, fast_tree.weighted_unifrac, True),
+    'weighted_normalized_unifrac': ('correct', fast_tree.weighted_unifrac,
+                                    True),
+    'unifrac_g': (False, fast_tree.G, False),
+    'unifrac_g_full_tree': (False, fast_tree.unnormalized_G, False)}
+
+
+class UnifracTests(TestCase):
+
+    def setUp(self):
+        # tax5 is not in the tree, and tax9 is not in the table
+        self.tree = parse_newick(
+            '(((tax1:0.1,tax2:0.3):0.2,(tax3:0.5,tax4:0.05):0.4):0.1,'
+            '((tax6:0.2,tax7:0.1):0.3,(tax8:0.25,tax9:0.6):0.15):0.05);',
+            PhyloNode)
+        self.files_to_remove = []
+        self.taxon_names = ['tax1', 'tax2', 'tax3', 'tax4', 'tax5', 'tax6',
+                            'tax7', 'tax8']
+        self.sample_names = ['s1', 's2', 's3', 's4', 's5', 's6']
+        self.data = array([[3, 1, 0, 0, 0, 2, 0, 0],
+                           [0, 0, 4, 1, 2, 0, 0, 6],
+                           [1, 1, 1, 1, 0, 1, 1, 1],
+                           [0, 0, 0, 0, 5, 0, 0, 0],  # only off the tree
+                           [0, 0, 4, 1, 0, 0, 0, 6],  # same as s2
+                           [0, 7, 0, 0, 0, 0, 3, 0]])
+
+    def tearDown(self):
+        remove_files(self.files_to_remove)
+
+    def cogent_matrix(self, metric, make_subtree):
+        """Return the distance matrix calculated by fast_unifrac"""
+        weighted, metric_f, is_symmetric = cogent_metrics[metric]
+        envs = make_envs_dict(self.data, self.sample_names, self.taxon_names)
+        warnings.filterwarnings('ignore')
+        try:
+            result = _reorder_unifrac_res(
+                fast_unifrac(self.tree, envs, weighted=weighted,
+                             metric=metric_f, is_symmetric=is_symmetric,
+                             modes=['distance_matrix'],
+                             make_subtree=make_subtree)['distance_matrix'],
+                self.sample_names)
+        finally:
+            warnings.resetwarnings()
+        return result
+
+    def test_flat_tree(self):
+        """FlatTree stores the tree as postorder arrays"""
+        tree = parse_newick('((a:1,b:2)c:3,d:4)r;', PhyloNode)
+        flat_tree = FlatTree(tree)
+        self.assertEqual(flat_tree.TipIndices, {'a': 0, 'b': 1, 'd': 3})
+        self.assertEqual(flat_tree.Parents.tolist(), [2, 2, 4, 4, -1])
+        self.assertEqual(flat_tree.Lengths.tolist(), [1, 2, 3, 4, 0])
+        self.assertEqual(flat_tree.TipDistances.tolist(), [4, 5, 0, 4, 0])
+        self.assertEqual(flat_tree.getSubtreeMask(['a']).tolist(),
+                         [True, False, True, False, True])
+
+        counts = array([[1, 0], [2, 1], [0, 0], [0, 5], [0, 0]])
+        self.assertEqual(flat_tree.propagate(counts).tolist(),
+                         [[1, 0], [2, 1], [3, 1], [0, 5], [3, 6]])
+
+    def test_write_flat_tree(self):
+        """load_flat_tree reads back the tree written by write_flat_tree"""
+        fd, flat_tree_fp = mkstemp(prefix='unifrac_tests', suffix='.npz')
+        close(fd)
+        self.files_to_remove.append(flat_tree_fp)
+        expected = FlatTree(self.tree)
+        write_flat_tree(expected, flat_tree_fp)
+        actual = load_flat_tree(flat_tree_fp)
+        self.assertEqual(actual.TipIndices, expected.TipIndices)
+        self.assertEqual(actual.Parents.tolist(), expected.Parents.tolist())
+        self.assertEqual(actual.Lengths.tolist(), expected.Lengths.tolist())
+        self.assertEqual(actual.TipDistances.tolist(),
+                         expected.TipDistances.tolist())
+        self.assertEqual(len(actual.Levels), len(expected.Levels))
+        for actual_level, expected_level in zip(actual.Levels,
+                                                expected.Levels):
+            for a, e in zip(actual_level, expected_level):
+                self.assertEqual(a.tolist(), e.tolist())
+
+    def test_get_flat_tree_from_fp(self):
+        """get_flat_tree_from_fp reads newick and flattened tree files"""
+        fd, tree_fp = mkstemp(prefix='unifrac_tests', suffix='.tre')
+        close(fd)
+        fd, flat_tree_fp = mkstemp(prefix='unifrac_tests', suffix='.npz')
+        close(fd)
+        self.files_to_remove.extend([tree_fp, flat_tree_fp])
+        open(tree_fp, 'w').write(self.tree.getNewick(with_distances=True))
+        flat_tree = get_flat_tree_from_fp(tree_fp)
+        self.assertEqual(flat_tree.TipIndices, FlatTree(self.tree).TipIndices)
+        # the last tree file is cached
+        self.assertTrue(get_flat_tree_from_fp(tree_fp) is flat_tree)
+        # a file rewritten with another tree of the same size, and with the
+        # same modification time, is read again
+        tree_stat = stat(tree_fp)
+        newick = open(tree_fp).read()
+        open(tree_fp, 'w').write(newick.replace('tax1', 'taxA'))
+        utime(tree_fp, (tree_stat.st_atime, tree_stat.st_mtime))
+        self.assertTrue('taxA' in get_flat_tree_from_fp(tree_fp).TipIndices)
+
+        write_flat_tree(flat_tree, flat_tree_fp)
+        actual = get_flat_tree_from_fp(flat_tree_fp)
+        self.assertFalse(actual is flat_tree)
+        self.assertEqual(actual.Parents.tolist(), flat_tree.Parents.tolist())
+
+    def test_faith_pd(self):
+        """faith_pd matches PD_whole_tree"""
+        envs = make_envs_dict(self.data, self.sample_names, self.taxon_names)
+        sample_names, pd = PD_whole_tree(self.tree, envs)
+        expected = dict(zip(sample_names, pd))
+        actual = faith_pd(self.data, self.taxon_names, self.tree,
+                          self.sample_names)
+        for sample_name, value in zip(self.sample_names, actual):
+            # s4 has no counts on the tree
+            assert_almost_equal(value, expected.get(sample_name, 0.0))
+
+        # a sparse matrix or a FlatTree can be passed, and the memory budget
+        # doesn't change the result
+        self.assertEqual(faith_pd(csr_matrix(self.data), self.taxon_names,
+                                  FlatTree(self.tree), self.sample_names,
+                                  block_memory=1).tolist(),
+                         actual.tolist())
+
+    def test_unifrac_matrix(self):
+        """unifrac_matrix matches fast_unifrac for all metrics"""
+        for metric in UNIFRAC_METRICS:
+            for make_subtree in [True, False]:
+                warnings.filterwarnings('ignore')
+                try:
+                    actual = unifrac_matrix(self.data, self.taxon_names,
+                                            self.tree, self.sample_names,
+                                            metric, make_subtree=make_subtree)
+                finally:
+                    warnings.resetwarnings()
+                assert_almost_equal(actual,
+                                    self.cogent_matrix(metric, make_subtree))
+                # identical samples are exactly zero apart, and samples
+                # without counts on the tree are 1.0 from all others
+                self.assertEqual(actual[1, 4], 0.0)
+                self.assertEqual(actual[3].tolist(), [1, 1, 1, 0, 1, 1])
+
+    def test_unifrac_matrix_block_memory(self):
+        """the memory budget doesn't change the distances"""
+        for metric in UNIFRAC_METRICS:
+            expected = unifrac_matrix(self.data[[0, 1, 2, 4, 5]],
+                                      self.taxon_names, self.tree,
+                                      ['s1', 's2', 's3', 's5', 's6'], metric)
+            actual = unifrac_matrix(self.data[[0, 1, 2, 4, 5]],
+                                    self.taxon_names, self.tree,
+                                    ['s1', 's2', 's3', 's5', 's6'], metric,
+                                    block_memory=1)
+            self.assertEqual(actual.tolist(), expected.tolist())
+
+    def test_unifrac_matrix_warns_missing_samples(self):
+        """samples without counts on the tree are warned about"""
+        # new sample names, as warnings that have been ignored by other tests
+        # aren't raised again
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            unifrac_matrix(self.data, self.taxon_names, self.tree,
+                           ['a', 'b', 'c', 'd', 'e', 'f'],
+                           'unweighted_unifrac')
+        self.assertEqual(len(w), 1)
+        self.assertTrue('sample d' in str(w[0].message))
+
+    def test_unifrac_row(self):
+        """unifrac_row matches fast_unifrac_one_sample and unifrac_matrix"""
+        envs = make_envs_dict(self.data, self.sample_names, self.taxon_names)
+        for metric in UNIFRAC_METRICS:
+            weighted, metric_f, _ = cogent_metrics[metric]
+            matrix = unifrac_matrix(self.data[[0, 1, 2, 4, 5]],
+                                    self.taxon_names, self.tree,
+                                    ['s1', 's2', 's3', 's5', 's6'], metric,
+                                    make_subtree=False)
+            for i, sample_name in enumerate(['s1', 's2', 's3', 's5', 's6']):
+                expected = _reorder_unifrac_res_one_sample(
+                    fast_unifrac_one_sample(sample_name, self.tree, envs,
+                                            weighted=weighted,
+                                            metric=metric_f),
+                    self.sample_names)
+                actual = unifrac_row(self.data, self.taxon_names, self.tree,
+                                     self.sample_names, sample_name, metric)
+                assert_almost_equal(actual, expected)
+                # rows are identical to those of the full matrix
+                self.assertEqual(actual[[0, 1, 2, 4, 5]].tolist(),
+                                 matrix[i].tolist())
+
+    def test_unifrac_row_missing_sample(self):
+        """a sample without counts on the tree is 1.0 from all others"""
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            actual = unifrac_row(self.data, self.taxon_names, self.tree,
+                                 self.sample_names, 's4', 'weighted_unifrac')
+        self.assertEqual(actual.tolist(), [1, 1, 1, 0, 1, 1])
+        self.assertEqual(len(w), 1)
+
+    def test_get_unifrac_row_f(self):
+        """get_unifrac_row_f gives the same rows as unifrac_row"""
+        for metric in UNIFRAC_METRICS:
+            row_f = get_unifrac_row_f(self.data, self.taxon_names, self.tree,
+                                      self.sample_names, metric,
+                                      block_memory=8)
+            for sample_name in ['s1', 's2', 's3', 's5', 's6']:
+                expected = unifrac_row(self.data, self.taxon_names,
+                                       self.tree, self.sample_names,
+                                       sample_name, metric)
+                self.assertEqual(row_f(sample_name).tolist(),
+                                 expected.tolist())
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertEqual(row_f('s4').tolist(), [1, 1, 1, 0, 1, 1])
+        self.assertEqual(len(w), 1)
+
+    def test_get_unifrac_rows_f(self):
+        """get_unifrac_rows_f gives the same rows in any blocks"""
+        row_names = ['s6', 's1', 's3', 's2', 's5']
+        for metric in UNIFRAC_METRICS:
+            expected = unifrac_matrix(self.data, self.taxon_names, self.tree,
+                                      self.sample_names, metric,
+                                      make_subtree=False)
+            expected = expected[[self.sample_names.index(name)
+                                 for name in row_names]]
+            for block_memory in [8, 8 * 16 * 5 * 2, 100000]:
+                rows_f = get_unifrac_rows_f(self.data, self.taxon_names,
+                                            self.tree, self.sample_names,
+                                            metric,
+                                            block_memory=block_memory)
+                self.assertEqual(rows_f(row_names).tolist(),
+                                 expected.tolist())
+
+    def test_invalid_input(self):
+        """unknown metrics and mismatched shapes raise ValueError"""
+        self.assertRaises(ValueError, unifrac_matrix, self.data,
+                          self.taxon_names, self.tree, self.sample_names,
+                          'unifrac')
+        self.assertRaises(ValueError, unifrac_matrix, self.data,
+                          self.taxon_names[:-1], self.tree,
+                          self.sample_names, 'unweighted_unifrac')
+        self.assertRaises(ValueError, unifrac_matrix, self.data,
+                          ['x%d' % i for i in range(8)], self.tree,
+                          self.sample_names, 'unweighted_unifrac')
+
+
+if __name__ == "__main__":
+    main()
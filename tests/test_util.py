@@ -50,7 +50,8 @@ from qiime.util import (make_safe_f, FunctionWithParams, qiime_blast_seqs,
                         RExecutor, duplicates_indices, trim_fasta, get_qiime_temp_dir,
                         qiime_blastx_seqs, add_filename_suffix, is_valid_git_refname,
                         is_valid_git_sha1, sync_biom_and_mf,
-                        biom_taxonomy_formatter, invert_dict)
+                        biom_taxonomy_formatter, invert_dict,
+                        ReferenceDbCache, get_blast_db_from_fasta_path)
 
 import numpy
 from numpy import array, asarray
@@ -1306,6 +1307,141 @@ class BlastSeqsTests(TestCase):
         self.assertRaises(AssertionError, qiime_blast_seqs, inseqs)
 
 
+class ReferenceDbCacheTests(TestCase):
+
+    """ Tests of the ReferenceDbCache class and get_blast_db_from_fasta_path
+    """
+
+    def setUp(self):
+        self.cache_dir = mkdtemp(dir=get_qiime_temp_dir(),
+                                 prefix='ReferenceDbCacheTests_')
+        self.inseqs1 = inseqs1.split('\n')
+        fd, self.refseqs1_fp = mkstemp(dir=get_qiime_temp_dir(),
+                                       prefix="ReferenceDbCacheTests_",
+                                       suffix=".fasta")
+        close(fd)
+        fasta_f = open(self.refseqs1_fp, 'w')
+        fasta_f.write(refseqs1)
+        fasta_f.close()
+        self.files_to_remove = [self.refseqs1_fp]
+        self.built = []
+
+    def tearDown(self):
+        remove_files(self.files_to_remove)
+        rmtree(self.cache_dir)
+
+    def _build_f(self, output_dir, size=0):
+        self.built.append(output_dir)
+        f = open(join(output_dir, 'db'), 'w')
+        f.write('x' * size)
+        f.close()
+        return 'db'
+
+    def test_getDb(self):
+        """ReferenceDbCache.getDb builds each database once"""
+        cache = ReferenceDbCache(self.cache_dir)
+        db = cache.getDb('a', self._build_f)
+        self.assertEqual(db, join(self.cache_dir, 'a', 'db'))
+        self.assertTrue(exists(db))
+        self.assertEqual(len(self.built), 1)
+        self.assertEqual(cache.getDb('a', self._build_f), db)
+        self.assertEqual(len(self.built), 1)
+        cache.getDb('b', self._build_f)
+        self.assertEqual(len(self.built), 2)
+        # the databases are built outside of their final directories
+        self.assertFalse(exists(self.built[0]))
+
+    def test_getDb_failed_build(self):
+        """ReferenceDbCache.getDb leaves nothing behind if a build fails"""
+        def build_f(output_dir):
+            raise ValueError
+        cache = ReferenceDbCache(self.cache_dir)
+        self.assertRaises(ValueError, cache.getDb, 'a', build_f)
+        self.assertEqual(glob(join(self.cache_dir, '*', '*')), [])
+        cache.getDb('a', self._build_f)
+        self.assertEqual(len(self.built), 1)
+
+    def test_evict(self):
+        """ReferenceDbCache removes the least recently used databases"""
+        # 1.5 kB
+        cache = ReferenceDbCache(self.cache_dir, max_size=1.5 / 2 ** 10)
+
+        def build_f(output_dir):
+            return self._build_f(output_dir, size=1000)
+        a = cache.getDb('a', build_f)
+        self.assertTrue(exists(a))
+        # a is in use, so it's kept
+        b = cache.getDb('b', build_f)
+        self.assertTrue(exists(a))
+        self.assertTrue(exists(b))
+        # once released, b is kept over the older a
+        cache.release()
+        cache.getDb('b', build_f)
+        c = cache.getDb('c', build_f)
+        self.assertFalse(exists(a))
+        self.assertTrue(exists(b))
+        self.assertTrue(exists(c))
+        # databases used by another cache (or process) are kept too
+        other_cache = ReferenceDbCache(self.cache_dir)
+        other_cache.getDb('b', build_f)
+        cache.release()
+        cache.max_size = 0
+        d = cache.getDb('d', build_f)
+        self.assertTrue(exists(b))
+        self.assertFalse(exists(c))
+        self.assertTrue(exists(d))
+        other_cache.release()
+        cache.release()
+        cache.evict()
+        self.assertFalse(exists(b))
+        self.assertFalse(exists(d))
+
+    def test_getBlastDb(self):
+        """ReferenceDbCache.getBlastDb keys databases on fasta contents"""
+        cache = ReferenceDbCache(self.cache_dir)
+        blast_db = cache.getBlastDb(self.refseqs1_fp)
+        self.assertTrue(blast_db.startswith(self.cache_dir))
+        actual = qiime_blast_seqs(parse_fasta(self.inseqs1),
+                                  blast_db=blast_db)
+        self.assertEqual(len(actual), 5)
+        self.assertEqual(actual['s2_like_seq'][0][0]['SUBJECT ID'], 's2')
+
+        # the same sequences at another path give the same database
+        fd, refseqs1_copy_fp = mkstemp(dir=get_qiime_temp_dir(),
+                                       prefix="ReferenceDbCacheTests_",
+                                       suffix=".fasta")
+        close(fd)
+        self.files_to_remove.append(refseqs1_copy_fp)
+        f = open(refseqs1_copy_fp, 'w')
+        f.write(refseqs1)
+        f.close()
+        self.assertEqual(cache.getBlastDb(refseqs1_copy_fp), blast_db)
+
+        # but changed sequences don't
+        f = open(refseqs1_copy_fp, 'a')
+        f.write('>s4\nACGTACGTACGTACGT\n')
+        f.close()
+        self.assertNotEqual(cache.getBlastDb(refseqs1_copy_fp), blast_db)
+
+    def test_get_blast_db_from_fasta_path(self):
+        """get_blast_db_from_fasta_path uses the cache if it's configured"""
+        qiime_config = {'reference_db_cache_dir': self.cache_dir,
+                        'reference_db_cache_max_size': '100'}
+        blast_db, db_files_to_remove = get_blast_db_from_fasta_path(
+            self.refseqs1_fp, qiime_config=qiime_config)
+        self.assertTrue(blast_db.startswith(self.cache_dir))
+        self.assertEqual(db_files_to_remove, [])
+
+        qiime_config = {'reference_db_cache_dir': None,
+                        'reference_db_cache_max_size': None}
+        blast_db, db_files_to_remove = get_blast_db_from_fasta_path(
+            self.refseqs1_fp, output_dir=get_qiime_temp_dir(),
+            qiime_config=qiime_config)
+        self.files_to_remove.extend(db_files_to_remove)
+        self.assertFalse(blast_db.startswith(self.cache_dir))
+        self.assertTrue(len(db_files_to_remove) > 0)
+
+
 class BlastXSeqsTests(TestCase):
 
     """ Tests of the qiime_blastx_seqs function (will move to PyCogent eventually)
@@ -271,6 +271,37 @@ class DownstreamWorkflowTests(TestCase):
         log_fp = glob(join(self.test_out, 'log*.txt'))[0]
         self.assertTrue(getsize(log_fp) > 0)
 
+    def test_run_alpha_rarefaction_fused(self):
+        """ run_alpha_rarefaction generates expected results when fused """
+
+        run_alpha_rarefaction(
+            self.test_data['biom'][0],
+            self.test_data['map'][0],
+            self.test_out,
+            call_commands_serially,
+            self.params,
+            self.qiime_config,
+            tree_fp=self.test_data['tree'][0],
+            num_steps=5,
+            parallel=False,
+            min_rare_depth=3,
+            max_rare_depth=18,
+            status_update_callback=no_status_updates,
+            fused=True)
+
+        html_fp = join(self.test_out, 'alpha_rarefaction_plots',
+                       'rarefaction_plots.html')
+        pd_collated_fp = join(self.test_out, 'alpha_div_collated',
+                              'PD_whole_tree.txt')
+
+        # no intermediate files are written
+        self.assertFalse(exists(join(self.test_out, 'rarefaction')))
+        self.assertFalse(exists(join(self.test_out, 'alpha_div')))
+
+        # check that final output files have non-zero size
+        self.assertTrue(getsize(pd_collated_fp) > 0)
+        self.assertTrue(getsize(html_fp) > 0)
+
     def test_run_alpha_rarefaction_stderr_and_stddev(self):
         """ run_alpha_rarefaction generates expected results """
 
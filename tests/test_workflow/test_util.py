@@ -12,18 +12,25 @@ __email__ = "gregcaporaso@gmail.com"
 
 from shutil import rmtree
 from glob import glob
+from os import listdir, utime
 from os.path import exists, join, getsize
 from tempfile import mkdtemp
+from time import time
 
 from unittest import TestCase, main
 from cogent.util.misc import remove_files
-from qiime.util import load_qiime_config, get_qiime_temp_dir
+from qiime.util import (load_qiime_config, get_qiime_temp_dir,
+                        create_dir)
 from qiime.parse import parse_qiime_parameters
 from qiime.test import (initiate_timeout,
                         disable_timeout,
                         get_test_data_fps)
 from qiime.workflow.util import (call_commands_serially,
+                                 call_commands_concurrently,
+                                 get_step_dependencies,
                                  no_status_updates,
+                                 WorkflowCache,
+                                 WorkflowLogger,
                                  WorkflowError)
 from qiime.workflow.downstream import run_beta_diversity_through_plots
 
@@ -77,5 +84,152 @@ class WorkflowTests(TestCase):
         log_fp = glob(join(self.test_out, 'log*.txt'))[0]
         self.assertTrue(getsize(log_fp) > 0)
 
+    def test_get_step_dependencies(self):
+        """get_step_dependencies orders steps by the files they use """
+        steps = [('a', 'cmd', ['in.txt'], ['out/']),
+                 ('b', 'cmd', ['in.txt'], ['b.txt']),
+                 ('c', 'cmd', ['out/x.txt'], ['c.txt']),
+                 ('d', 'cmd', [], ['in.txt']),
+                 ('e', 'cmd'),
+                 ('f', 'cmd', ['c.txt'], ['f.txt'])]
+        self.assertEqual(get_step_dependencies(steps),
+                         [[], [], [0], [0, 1], [0, 1, 2, 3], [2, 4]])
+
+    def test_call_commands_concurrently(self):
+        """call_commands_concurrently runs steps after their inputs """
+        a_fp = join(self.test_out, 'a.txt')
+        b_fp = join(self.test_out, 'b.txt')
+        c_fp = join(self.test_out, 'c.txt')
+        log_fp = join(self.test_out, 'concurrent_log.txt')
+        commands = [[('Write a', 'sleep 1; echo a > %s' % a_fp, [], [a_fp])],
+                    [('Write b', 'echo b > %s' % b_fp, [], [b_fp])],
+                    [('Write c', 'cat %s %s > %s' % (a_fp, b_fp, c_fp),
+                      [a_fp, b_fp], [c_fp])]]
+        logger = WorkflowLogger(log_fp)
+        call_commands_concurrently(commands, no_status_updates, logger,
+                                   max_concurrent_steps=2)
+        self.assertEqual(open(c_fp).read(), 'a\nb\n')
+
+        # the steps are logged as they finish
+        log = open(log_fp).read()
+        self.assertTrue(log.index('# Write b command') <
+                        log.index('# Write a command') <
+                        log.index('# Write c command'))
+
+    def test_call_commands_concurrently_failure(self):
+        """call_commands_concurrently stops starting steps on failure """
+        a_fp = join(self.test_out, 'a.txt')
+        commands = [[('Fail', 'exit 1', [], [])],
+                    [('Write a', 'echo a > %s' % a_fp, [], [a_fp])],
+                    [('After', 'echo a > %s' % a_fp)]]
+        logger = WorkflowLogger()
+        self.assertRaises(WorkflowError, call_commands_concurrently,
+                          commands, no_status_updates, logger,
+                          max_concurrent_steps=1)
+        self.assertFalse(exists(a_fp))
+
+        # the running steps are killed rather than waited for
+        start = time()
+        commands = [[('Sleep', 'sleep 30; echo a > %s' % a_fp, [], [])],
+                    [('Fail', 'sleep 1; exit 1', [], [])]]
+        self.assertRaises(WorkflowError, call_commands_concurrently,
+                          commands, no_status_updates, WorkflowLogger(),
+                          max_concurrent_steps=2)
+        self.assertTrue(time() - start < 30)
+        self.assertFalse(exists(a_fp))
+
+    def test_call_commands_serially_cache(self):
+        """call_commands_serially restores cached steps instead of running them
+        """
+        cache = WorkflowCache(join(self.test_out, 'cache'))
+        in_fp = join(self.test_out, 'in.txt')
+        open(in_fp, 'w').write('abc\n')
+
+        def get_commands(out_dir):
+            out_fp = join(out_dir, 'out.txt')
+            count_fp = join(self.test_out, 'count.txt')
+            return [[('Copy', 'mkdir -p %s; cp %s %s; echo 1 >> %s' %
+                      (out_dir, in_fp, out_fp, count_fp),
+                      [in_fp], [out_fp])]]
+
+        # the second run is into another output directory, but is restored
+        # from the cache
+        for i, out_dir in enumerate(['out1', 'out2', 'out2']):
+            log_fp = join(self.test_out, 'log%d.txt' % i)
+            call_commands_serially(
+                get_commands(join(self.test_out, out_dir)),
+                no_status_updates, WorkflowLogger(log_fp), cache=cache)
+            self.assertEqual(
+                open(join(self.test_out, out_dir, 'out.txt')).read(),
+                'abc\n')
+        self.assertEqual(open(join(self.test_out, 'count.txt')).read(),
+                         '1\n')
+        self.assertTrue('Cache miss' in open(join(self.test_out,
+                                                  'log0.txt')).read())
+        for i in [1, 2]:
+            self.assertTrue('Cache hit' in open(join(self.test_out,
+                                                     'log%d.txt' % i)).read())
+
+        # changing the input is a cache miss
+        open(in_fp, 'w').write('def\n')
+        call_commands_serially(
+            get_commands(join(self.test_out, 'out2')),
+            no_status_updates, WorkflowLogger(), cache=cache)
+        self.assertEqual(open(join(self.test_out, 'out2', 'out.txt')).read(),
+                         'def\n')
+        self.assertEqual(open(join(self.test_out, 'count.txt')).read(),
+                         '1\n1\n')
+
+    def test_call_commands_concurrently_cache(self):
+        """call_commands_concurrently restores cached steps """
+        cache = WorkflowCache(join(self.test_out, 'cache'))
+        a_fp = join(self.test_out, 'a.txt')
+        b_fp = join(self.test_out, 'b.txt')
+        commands = [[('Write a', 'echo a > %s' % a_fp, [], [a_fp])],
+                    [('Write b', 'cat %s %s > %s' % (a_fp, a_fp, b_fp),
+                      [a_fp], [b_fp])]]
+        call_commands_concurrently(commands, no_status_updates,
+                                   WorkflowLogger(), cache=cache)
+        remove_files([a_fp, b_fp])
+        log_fp = join(self.test_out, 'concurrent_log.txt')
+        call_commands_concurrently(commands, no_status_updates,
+                                   WorkflowLogger(log_fp), cache=cache)
+        self.assertEqual(open(b_fp).read(), 'a\na\n')
+        self.assertEqual(open(log_fp).read().count('Cache hit'), 2)
+
+    def test_workflow_cache_evict(self):
+        """WorkflowCache removes the least recently used steps """
+        cache_dir = join(self.test_out, 'cache')
+        # room for two of the 1000 byte outputs
+        cache = WorkflowCache(cache_dir, max_size=2500 / 2 ** 20)
+        steps = []
+        for i in range(3):
+            out_fp = join(self.test_out, '%d.txt' % i)
+            open(out_fp, 'w').write('x' * 1000)
+            steps.append(('Step %d' % i, 'step %d' % i, [], [out_fp]))
+        keys = [cache.getKey(step) for step in steps]
+        self.assertEqual(len(set(keys)), 3)
+
+        cache.store(steps[0], keys[0])
+        cache.store(steps[1], keys[1])
+        # step 0 is now the most recently used
+        utime(join(cache_dir, keys[1], 'outputs.txt'), (0, 0))
+        self.assertTrue(cache.fetch(steps[0], keys[0]))
+        cache.store(steps[2], keys[2])
+        self.assertEqual(sorted(listdir(cache_dir)),
+                         sorted([keys[0], keys[2]]))
+        self.assertFalse(cache.fetch(steps[1], keys[1]))
+
+    def test_workflow_cache_evict_incomplete(self):
+        """WorkflowCache keeps recent entries which are being stored """
+        cache_dir = join(self.test_out, 'cache')
+        cache = WorkflowCache(cache_dir, max_size=0)
+        for name in ['tmp_running', 'tmp_interrupted']:
+            create_dir(join(cache_dir, name))
+            open(join(cache_dir, name, '0'), 'w').write('x' * 1000)
+        utime(join(cache_dir, 'tmp_interrupted'), (0, 0))
+        cache.evict()
+        self.assertEqual(listdir(cache_dir), ['tmp_running'])
+
 if __name__ == "__main__":
     main()